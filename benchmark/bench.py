@@ -0,0 +1,269 @@
+"""
+Benchmarks the render pipeline on synthetic gcode files (see gcodegen.py), and compares the results with a
+stored baseline. Exits with status 1 if a result is worse than the baseline by more than the threshold.
+
+The gcodeparser extension must be importable, e.g. installed with the plugin or built in place with
+python setup.py build_ext --inplace. Runs headless: on a machine without a GPU, use --backend software,
+or --backend gl with Mesa's software EGL (EGL_PLATFORM=surfaceless).
+
+python benchmark/bench.py --sizes 1M,10M --output results.json --baseline baseline.json
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# The plugin modules are imported on their own, the plugin package needs OctoPrint. An extension
+# built in place ends up in the repository root.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[1:1] = [ROOT, os.path.join(ROOT, "octoprint_gcoderender")]
+
+import gcodegen
+from renderpool import RenderPool, initialize_parser
+
+import gcodeparser
+
+# The plugin's render settings (see GCodeRenderPlugin._get_render_settings), without throttling
+SETTINGS = dict(width=250,
+                height=250,
+                throttling_interval=0,
+                throttling_duration=0,
+                backend="auto",
+                print_area=dict(x_min=-37, x_max=328, y_min=-33, y_max=317, z_min=0, z_max=205),
+                camera=dict(target="part", distance=[-300, -300, 150]),
+                views=dict(),
+                background_color=(1.0, 1.0, 1.0, 1.0),
+                bed_color=(0.75, 0.75, 0.75, 1.0),
+                part_color=(67.0 / 255.0, 74.0 / 255.0, 84.0 / 255.0, 1.0),
+                draw_mode=dict(mode="lines", tube_width=0.45),
+                decimation=0.5,
+                gpu_memory_budget=16777216,
+                parser_threads=0,
+                image_format=dict(format="png", png_colors="indexed"))
+
+HIGHER = "higher"
+LOWER = "lower"
+
+# Results measured over less than this many seconds are too noisy to fail on
+NOISE_FLOOR = 0.01
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def prepare_files(workdir, sizes, styles, extrusions, logger):
+    """
+    Generates the gcode files of each size, style and extrusion mode, unless they exist already.
+    Returns a list of (case name, path)
+    """
+    cases = []
+
+    for size in sizes:
+        for style in styles:
+            for extrusion in extrusions:
+                name = "{0}_{1}_{2}".format(style, extrusion, size)
+                path = os.path.join(workdir, "{0}.v{1}.gcode".format(name, gcodegen.VERSION))
+
+                if not os.path.exists(path):
+                    logger.info("Generating {0}".format(path))
+                    with open(path + ".part", "w") as out:
+                        gcodegen.generate(out, gcodegen.parse_size(size), style, extrusion)
+                    os.rename(path + ".part", path)
+
+                cases.append((name, path))
+
+    return cases
+
+
+def bench_stages(cases, settings, workdir, repeat, results, logger):
+    """
+    Renders every file repeat times in this process, and records the median time of each pipeline stage
+    """
+    if not initialize_parser(settings, logger):
+        raise RuntimeError("Couldn't initialize gcodeparser")
+
+    imagePath = os.path.join(workdir, "stages.png")
+
+    for name, path in cases:
+        runs = []
+        for _ in range(repeat):
+            stats = gcodeparser.render_gcode(path, imagePath)
+            if not stats:
+                raise RuntimeError("Render of {0} failed".format(path))
+            if not stats["segments"]:
+                # The draw and read back times would measure an empty bed
+                raise RuntimeError("Render of {0} drew no paths, the parser skipped its extrusions".format(path))
+            runs.append(stats)
+
+        parse = median([run["parse_time"] for run in runs])
+        lines, size = runs[0]["lines"], runs[0]["bytes"]
+
+        record(results, "parse.{0}.lines_per_s".format(name), lines / parse if parse > 0 else 0, "lines/s", HIGHER, parse)
+        record(results, "parse.{0}.mb_per_s".format(name), size / parse / 1e6 if parse > 0 else 0, "MB/s", HIGHER, parse)
+
+        for stage in ("upload", "draw", "read_pixels", "encode"):
+            seconds = median([run[stage + "_time"] for run in runs])
+            record(results, "{0}.{1}".format(stage, name), seconds, "s", LOWER, seconds)
+
+        logger.info("{0}: {1}".format(name, ", ".join("{0} {1:.4f} s".format(stage, median([run[stage + "_time"] for run in runs]))
+                                                       for stage in ("parse", "upload", "draw", "read_pixels", "encode"))))
+
+
+def bench_queue(cases, settings, workdir, workers, repeat, results, logger):
+    """
+    Renders every file repeat times through a render pool, from queueing to the finished image, and
+    records the number of jobs per second. The workers get a warm-up job first, so starting the worker
+    processes isn't counted.
+    """
+    jobs = queue.Queue()
+    finished = queue.Queue()
+
+    pool = RenderPool(jobs, settings, logger, lambda job: None,
+                      lambda job, success, duration: finished.put((job, success)), size=workers)
+    pool.start()
+
+    def run(paths):
+        for i, path in enumerate(paths):
+            jobs.put(dict(filename=os.path.basename(path), path=path, imagePath=os.path.join(workdir, "queue{0}.png".format(i))))
+
+        for _ in paths:
+            job, success = finished.get(timeout=3600)
+            if not success:
+                raise RuntimeError("Render of {0} failed".format(job["path"]))
+
+    try:
+        run([cases[0][1]] * workers)
+
+        paths = [path for _, path in cases] * repeat
+        t0 = time.time()
+        run(paths)
+        duration = time.time() - t0
+    finally:
+        pool.stop()
+
+    record(results, "queue.jobs_per_s", len(paths) / duration, "jobs/s", HIGHER, duration)
+    logger.info("queue: {0} jobs in {1:.2f} s with {2} worker(s)".format(len(paths), duration, workers))
+
+
+def record(results, name, value, unit, better, seconds):
+    """
+    Adds a result, seconds is the time it was measured over
+    """
+    results[name] = dict(value=value, unit=unit, better=better, seconds=seconds)
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares the results with those of the baseline. Returns the names of the results that are worse by more
+    than threshold (a fraction)
+    """
+    regressions = []
+
+    for name, base in sorted(baseline.items()):
+        if name not in results or base["value"] <= 0:
+            continue
+
+        value = results[name]["value"]
+        change = (value - base["value"]) / base["value"]
+        worse = -change if base["better"] == HIGHER else change
+
+        if max(results[name]["seconds"], base["seconds"]) < NOISE_FLOOR:
+            worse = 0
+
+        print("{0:<60} {1:>14.4f} {2:>14.4f} {3:>+8.1%}{4}".format(name, base["value"], value, change,
+                                                                   "  REGRESSION" if worse > threshold else ""))
+
+        if worse > threshold:
+            regressions.append(name)
+
+    return regressions
+
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the gcode render pipeline")
+    parser.add_argument("--sizes", default="1M,10M", help="Comma separated file sizes (default 1M,10M), up to e.g. 500M")
+    parser.add_argument("--styles", default=",".join(gcodegen.STYLES), help="Comma separated slicer styles (default all)")
+    parser.add_argument("--extrusions", default=",".join(gcodegen.EXTRUSIONS), help="Comma separated extrusion modes (default both)")
+    parser.add_argument("--backend", default="auto", choices=("auto", "gl", "software"), help="Render backend (default auto)")
+    parser.add_argument("--draw-mode", default="lines", choices=("lines", "tubes"), help="Draw the paths as lines or tubes (default lines)")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of renders per file, the median is used (default 5)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of render workers of the queue benchmark (default 1)")
+    parser.add_argument("--no-queue", action="store_true", help="Skip the queue benchmark")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "gcoderender-bench"),
+                        help="Folder for the generated gcode files and images, kept between runs")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Fail on results worse than the baseline by this fraction (default 0.2)")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results to the baseline file instead of comparing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logger = logging.getLogger("bench")
+
+    if not os.path.exists(args.workdir):
+        os.makedirs(args.workdir)
+
+    settings = dict(SETTINGS, backend=args.backend, draw_mode=dict(SETTINGS["draw_mode"], mode=args.draw_mode))
+    cases = prepare_files(args.workdir, args.sizes.split(","), args.styles.split(","), args.extrusions.split(","), logger)
+    results = dict()
+
+    # The pool forks its workers, so it goes before this process creates a drawing context
+    if not args.no_queue:
+        bench_queue(cases, settings, args.workdir, args.workers, args.repeat, results, logger)
+
+    bench_stages(cases, settings, args.workdir, args.repeat, results, logger)
+
+    output = dict(environment=dict(python=platform.python_version(),
+                                   platform=platform.platform(),
+                                   machine=platform.machine(),
+                                   cpus=cpu_count(),
+                                   backend=args.backend,
+                                   draw_mode=args.draw_mode),
+                  results=results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+        logger.info("Saved baseline to {0}".format(args.baseline))
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline["results"], args.threshold)
+
+        if regressions:
+            logger.error("{0} result(s) regressed by more than {1:.0%}".format(len(regressions), args.threshold))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
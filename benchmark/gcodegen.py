@@ -0,0 +1,252 @@
+"""
+Generates synthetic gcode files of a given size, in the comment style of a slicer, for the benchmarks.
+The part is a cylinder with perimeters and zigzag infill. Larger files get more layers, up to the height of
+the print area, then finer paths. The same arguments always give the same file.
+
+The parser only draws the features marked with the comments it knows (see GcodeParser::includes), which
+are those of Simplify3D, and doesn't follow M83. So every style marks its features the Simplify3D way, the
+style sets the header, layer comments and slicer metadata. Relative files move relative (G91) altogether.
+
+python gcodegen.py --style prusaslicer --extrusion relative --size 10M part.gcode
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import argparse
+import math
+import random
+
+VERSION = 2                 # Changes with the files generated, so the benchmarks don't reuse older files
+
+STYLES = ("cura", "simplify3d", "prusaslicer")
+EXTRUSIONS = ("absolute", "relative")
+
+CENTER = (150.0, 150.0)
+RADIUS = 40.0
+LAYER_HEIGHT = 0.2
+LINE_WIDTH = 0.45
+FILAMENT_PER_MM = 0.033     # mm of filament per mm of path
+PERIMETERS = 3
+BYTES_PER_LINE = 32         # Rough size of an extrusion line, to estimate how fine the paths must be
+MIN_SEGMENT = 0.05          # mm, shortest path segment
+
+# Comments each slicer writes, by what they mark
+COMMENTS = {
+    "cura": dict(header=";FLAVOR:Marlin\n;Generated with Cura_SteamEngine 5.4.0\n",
+                 layer=";LAYER:{index}\n"),
+    "simplify3d": dict(header="; G-Code generated by Simplify3D(R) Version 4.1.2\n",
+                       layer="; layer {number}, Z = {z:.3f}\n"),
+    "prusaslicer": dict(header="; generated by PrusaSlicer 2.6.1\n",
+                        layer=";LAYER_CHANGE\n;Z:{z:.3f}\n;HEIGHT:{height:.3f}\n"),
+}
+
+# Feature comments the parser draws the paths after. Other slicers' feature comments (e.g. Cura's
+# ;TYPE:WALL-OUTER) make it skip the paths.
+FEATURES = dict(outer="; feature outer perimeter\n",
+                inner="; feature inner perimeter\n",
+                infill="; feature solid layer\n",
+                skirt="; feature skirt\n")
+
+SIZE_SUFFIXES = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(value):
+    """
+    Parses a size in bytes, with an optional K, M or G suffix
+    """
+    value = str(value).strip().upper()
+
+    if value and value[-1] in SIZE_SUFFIXES:
+        return int(float(value[:-1]) * SIZE_SUFFIXES[value[-1]])
+
+    return int(value)
+
+
+class GcodeWriter(object):
+    """
+    Writes absolute moves, or relative (G91) moves and extrusion, and counts the bytes written
+    """
+    def __init__(self, out):
+        self.out = out
+        self.relative = False
+        self.e = 0.0
+        self.position = (0.0, 0.0)
+        self.z = 0.0
+        self.size = 0
+
+    def write(self, text):
+        self.out.write(text)
+        self.size += len(text)
+
+    def start_relative(self):
+        self.write("G91\nM83\n")
+        self.relative = True
+
+    def reset_extruder(self):
+        # Absolute extrusion resets E every layer, like the slicers do
+        if not self.relative:
+            self.write("G92 E0\n")
+            self.e = 0.0
+
+    def travel(self, x, y, z=None):
+        self.write("G1 E-1.00000 F2400\n" if self.relative else "G1 E{0:.5f} F2400\n".format(self.e - 1.0))
+
+        # Relative moves are rounded like the absolute ones, the position follows what was written
+        if self.relative:
+            x, y = self.position[0] + round(x - self.position[0], 3), self.position[1] + round(y - self.position[1], 3)
+            z = None if z is None else self.z + round(z - self.z, 3)
+            tx, ty, tz = x - self.position[0], y - self.position[1], None if z is None else z - self.z
+        else:
+            tx, ty, tz = x, y, z
+
+        if z is None:
+            self.write("G0 F6000 X{0:.3f} Y{1:.3f}\n".format(tx, ty))
+        else:
+            self.write("G0 F6000 X{0:.3f} Y{1:.3f} Z{2:.3f}\n".format(tx, ty, tz))
+            self.z = z
+
+        self.write("G1 E1.00000 F2400\n" if self.relative else "G1 E{0:.5f} F2400\n".format(self.e))
+        self.position = (x, y)
+
+    def extrude(self, points):
+        lines = []
+        x0, y0 = self.position
+
+        for x, y in points:
+            if self.relative:
+                dx, dy = round(x - x0, 3), round(y - y0, 3)
+                x, y = x0 + dx, y0 + dy
+
+            e = math.hypot(x - x0, y - y0) * FILAMENT_PER_MM
+            self.e += e
+
+            if self.relative:
+                lines.append("G1 X{0:.3f} Y{1:.3f} E{2:.5f}\n".format(dx, dy, e))
+            else:
+                lines.append("G1 X{0:.3f} Y{1:.3f} E{2:.5f}\n".format(x, y, self.e))
+            x0, y0 = x, y
+
+        self.position = (x0, y0)
+        self.write("".join(lines))
+
+
+def circle(radius, n, phase):
+    return [(CENTER[0] + radius * math.cos(phase + 2 * math.pi * i / n),
+             CENTER[1] + radius * math.sin(phase + 2 * math.pi * i / n)) for i in range(n + 1)]
+
+
+def zigzag(radius, segment, layer, rng):
+    """
+    Infill rows across the circle, alternating direction, at 45 degrees alternating per layer.
+    Rows are split into segments of about the given length, with a little noise, like curved parts.
+    """
+    angle = math.pi / 4 if layer % 2 == 0 else -math.pi / 4
+    ca, sa = math.cos(angle), math.sin(angle)
+    rows = []
+    v = -radius + LINE_WIDTH
+    while v < radius:
+        half = math.sqrt(radius * radius - v * v)
+        n = max(1, int(2 * half / segment))
+        row = []
+        for i in range(n + 1):
+            u = -half + 2 * half * i / n
+            u += rng.uniform(-0.1, 0.1) * segment if 0 < i < n else 0
+            row.append((CENTER[0] + u * ca - v * sa, CENTER[1] + u * sa + v * ca))
+        rows.append(row if len(rows) % 2 == 0 else row[::-1])
+        v += LINE_WIDTH
+    return rows
+
+
+def generate(out, size, style="cura", extrusion="absolute", seed=0):
+    """
+    Writes a gcode file of about size bytes (at least size) to the file object out
+    style: Comment style of cura, simplify3d or prusaslicer
+    extrusion: absolute (M82, with G92 E0 resets every layer) or relative (G91 and M83) moves and extrusion
+    """
+    if style not in STYLES:
+        raise ValueError("Unknown style {0}, use one of {1}".format(style, ", ".join(STYLES)))
+    if extrusion not in EXTRUSIONS:
+        raise ValueError("Unknown extrusion {0}, use one of {1}".format(extrusion, ", ".join(EXTRUSIONS)))
+
+    rng = random.Random(seed)
+    comments = COMMENTS[style]
+    layers = int(max(10, min(1000, size // 65536)))
+    top = layers * LAYER_HEIGHT
+    writer = GcodeWriter(out)
+
+    writer.write(comments["header"])
+    if style == "cura":
+        writer.write(";MINX:{0:.3f}\n;MINY:{1:.3f}\n;MINZ:{2:.3f}\n;MAXX:{3:.3f}\n;MAXY:{4:.3f}\n;MAXZ:{5:.3f}\n;LAYER_COUNT:{6}\n".format(
+            CENTER[0] - RADIUS - 3, CENTER[1] - RADIUS - 3, LAYER_HEIGHT, CENTER[0] + RADIUS + 3, CENTER[1] + RADIUS + 3, top, layers))
+
+    writer.write("G21\nG90\nM82\nG28\nG92 E0\nG1 Z5 F1000\n")
+
+    # Spread the remaining bytes over the remaining layers, so the file ends close to the size
+    for layer in range(layers):
+        z = (layer + 1) * LAYER_HEIGHT
+        target = max(0, size - writer.size) / (layers - layer)
+
+        # Perimeters get 40% of the layer, infill the rest
+        points = max(16, int(0.4 * target / BYTES_PER_LINE / PERIMETERS))
+        infillLength = math.pi * RADIUS * RADIUS / LINE_WIDTH
+        segment = max(MIN_SEGMENT, infillLength / max(1.0, 0.6 * target / BYTES_PER_LINE))
+        phase = rng.uniform(0, 2 * math.pi)
+
+        writer.write(comments["layer"].format(index=layer, number=layer + 1, z=z, height=LAYER_HEIGHT))
+
+        # The reset follows a feature comment, the parser skips the lines after the layer comments of Cura and PrusaSlicer
+        writer.write(FEATURES["skirt" if layer == 0 else "outer"])
+        writer.reset_extruder()
+
+        if layer == 0:
+            skirt = circle(RADIUS + 3, points, phase)
+            writer.travel(skirt[0][0], skirt[0][1], z)
+
+            # Like the reset, the parser only sees moves after a feature comment, the header's are skipped
+            if extrusion == "relative":
+                writer.start_relative()
+
+            writer.extrude(skirt[1:])
+
+        for perimeter in range(PERIMETERS):
+            radius = RADIUS - perimeter * LINE_WIDTH
+            if layer == 0 or perimeter > 0:
+                writer.write(FEATURES["outer" if perimeter == 0 else "inner"])
+            loop = circle(radius, points, phase)
+            writer.travel(loop[0][0], loop[0][1], z if layer > 0 and perimeter == 0 else None)
+            writer.extrude(loop[1:])
+
+        writer.write(FEATURES["infill"])
+        for row in zigzag(RADIUS - PERIMETERS * LINE_WIDTH, segment, layer, rng):
+            writer.travel(row[0][0], row[0][1])
+            writer.extrude(row[1:])
+
+    if style == "prusaslicer":
+        r = RADIUS + 3
+        writer.write('; objects_info = {{"objects":[{{"name":"cylinder","polygon":[[{0:.3f},{1:.3f}],[{2:.3f},{1:.3f}],[{2:.3f},{3:.3f}],[{0:.3f},{3:.3f}]]}}]}}\n'.format(
+            CENTER[0] - r, CENTER[1] - r, CENTER[0] + r, CENTER[1] + r))
+
+    writer.write("M107\nG90\nG1 Z{0:.3f} F600\nM84\n".format(top + 10))
+
+    return writer.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic gcode file for benchmarks")
+    parser.add_argument("output", help="Gcode file to write")
+    parser.add_argument("--size", default="10M", help="Size of the file, e.g. 1M or 500M (default 10M)")
+    parser.add_argument("--style", choices=STYLES, default="cura", help="Slicer comment style (default cura)")
+    parser.add_argument("--extrusion", choices=EXTRUSIONS, default="absolute", help="Extrusion mode (default absolute)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random noise (default 0)")
+    args = parser.parse_args()
+
+    with open(args.output, "w") as out:
+        size = generate(out, parse_size(args.size), args.style, args.extrusion, args.seed)
+
+    print("Wrote {0} bytes to {1}".format(size, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -20,7 +20,7 @@ protected:
 public:
 	RenderContextBase(int width, int height) { this->width = width; this->height = height; };
 	virtual bool activate() = 0;
-	~RenderContextBase() {};
+	virtual ~RenderContextBase() {};
 };
 
 
@@ -0,0 +1,11 @@
+#include "RenderContextSoftware.h"
+
+// Nothing to set up, the images are drawn in memory
+bool RenderContextSoftware::activate()
+{
+	char log[128];
+	sprintf(log, "Software rendering with %u threads", rasterizer.get_threads());
+	log_msg(info, log);
+
+	return true;
+}
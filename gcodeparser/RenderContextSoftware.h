@@ -0,0 +1,29 @@
+/*
+
+RenderContextSoftware.h
+
+Class definition for the software render context. Draws on the CPU, for
+systems where neither EGL nor GLFW can provide a context.
+
+*/
+
+#ifndef RENDERCONTEXTSOFTWARE_H
+#define RENDERCONTEXTSOFTWARE_H 1
+
+#include <stdio.h>
+
+#include "helpers.h"
+#include "RenderContextBase.h"
+#include "softwarerasterizer.h"
+
+class RenderContextSoftware : public RenderContextBase
+{
+	SoftwareRasterizer rasterizer;
+
+public:
+	RenderContextSoftware(int width, int height, unsigned int nThreads = 0) : RenderContextBase(width, height), rasterizer(nThreads) {};
+	bool activate();
+	SoftwareRasterizer * get_rasterizer() { return &rasterizer; };
+};
+
+#endif // !RENDERCONTEXTSOFTWARE_H
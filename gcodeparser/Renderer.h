@@ -11,14 +11,19 @@ Header file with class definition for the main Gcode renderer.
 
 // We need PI
 #define _USE_MATH_DEFINES
-// libpng's setjmp gives compiler errors. We use exception handling without jumps anyways
+// libpng 1.2 gives compiler errors when setjmp.h is included before png.h
 #define PNG_SKIP_SETJMP_CHECK
 
 // Include standard headers
 #include <stdio.h>
 #include <stdlib.h>
+#include <sys/stat.h>
 #include <algorithm>
 #include <math.h>
+#include <string>
+#include <vector>
+#include <thread>
+#include <atomic>
 
 // OpenGL matrix and vector calc helpers
 #include <glm/glm.hpp>
@@ -26,21 +31,118 @@ Header file with class definition for the main Gcode renderer.
 
 #include "helpers.h"
 #include "glinit.h"
+#include "RenderContextSoftware.h"
 
 #include "gcodeparser.h"
-#include "pngwriter.h"
+#include "toolpathcache.h"
+#include "layerindex.h"
+#include "chunkqueue.h"
+#include "imagewriter.h"
+
+#define BACKEND_AUTO 0		// OpenGL, or the software rasterizer if there is no OpenGL context
+#define BACKEND_GL 1		// Only OpenGL
+#define BACKEND_SOFTWARE 2	// Only the software rasterizer
+
+#define STREAM_BUFFERS 3					// Number of buffers the chunks of a part are streamed through
+#define DEFAULT_GPU_MEMORY_BUDGET 16777216	// 16 MB for the stream buffers
+#define MIN_LINES_PER_RUN 1000				// Smallest number of lines parsed per chunk, regardless of the budget
+#define CAMERA_LINES 10000					// Number of lines parsed before the camera is pointed
+#define PIPELINE_CHUNKS 2					// Number of chunks the parser thread fills while the previous ones are drawn
+#define DEFAULT_TUBE_WIDTH 0.4f				// Diameter (in mm) of the paths when drawing tubes
+#define TUBE_VERTEX_FLOATS 8				// Start, end and corner of a path, for each corner of a tube expanded on the CPU
+
+#define FRAMEBUFFER_MAGIC "GLFB"
+
+// Header of a framebuffer file, the RGBA image of the layers rendered so far (see Renderer::renderLayers)
+struct FramebufferHeader {
+	char magic[4];
+	uint32_t width, height;
+	uint32_t layers;		// The image shows the layers before this one
+};
 
 // Name container for an OpenGL vertex+element buffer
 struct BufferInfo {
 	GLuint indexBuffer = 0, vertexBuffer = 0, vertexArray = 0;
-	int nIndices, nVertices;
+	int nIndices, nVertices;					// Without indices, the vertices are drawn in order
+	GLenum indexType = GL_UNSIGNED_SHORT;
+	long vertexCapacity = 0, indexCapacity = 0;	// Size in bytes of a stream buffer
+
+	// The buffers of the software rasterizer
+	std::vector<float> cpuVertices;
+	std::vector<VertexIndex> cpuIndices;
+};
+
+// What the last render did and where its time went, in seconds. With OpenGL, upload and
+// draw are the time to hand the work to the driver, waiting for the GPU to finish drawing
+// counts as readPixels.
+struct RenderStats {
+	double parse = 0;			// Getting the vertices from the gcode parser or the toolpath cache (on the parser thread)
+	double upload = 0;			// Copying the vertices to the stream buffers
+	double draw = 0;			// Drawing the part and the bed in all views
+	double readPixels = 0;		// Reading the images back
+	double encode = 0;			// Encoding the images and writing them to file
+	double throttled = 0;		// The parser was held up by the governor
+	long lines = 0;				// Number of gcode lines (or cached toolpath points) parsed
+	long bytes = 0;				// Size of the gcode file (or of the range of layers), 0 when rendering from the toolpath cache
+	long layers = 0;			// Number of layers drawn, when rendering a range of layers
+	long segments = 0;			// Number of paths turned into vertices
+	long vertices = 0;			// Number of vertices uploaded
+	long bytesUploaded = 0;		// Vertex and index data uploaded
+	long drawCalls = 0;			// Number of draws of the part and the bed, over all views
+	bool toolpathCache = false;	// Whether the part came from the toolpath cache
+	bool cancelled = false;		// Whether the render was cancelled, no images were written
+};
+
+// A single image to render from a part: its resolution, camera and output file
+struct RenderView {
+	unsigned int width = 250, height = 250;
+	bool pointCameraAtPart = true;
+	glm::vec3 cameraDistance = { -300.f, -300.f, 150.f };
+	std::string imageFile;
+
+	GLuint framebuffer = 0, colorBuffer = 0, depthBuffer = 0;	// Framebuffer 0 is the render context's own surface
+	SoftwareTarget * target = NULL;								// The image of the software rasterizer
+	glm::mat4 mvp, model, view;									// Camera matrices, set once the part bounding box is known
+	glm::vec3 cameraPosition;									// Position of the camera in world space
+	float pixelSize = 0.0f;										// Size (in mm) of a pixel at the part point closest to the camera
+	float pixelScale = 0.0f;									// Size (in mm) of a pixel at 1 mm from the camera
+};
+
+// A range of layers to draw, on top of the image of the layers before it
+struct LayerRange {
+	const LayerEntry * start = NULL;	// The first layer, NULL: from the start of the file
+	size_t endOffset = SIZE_MAX;		// Where the range ends in the gcode
+	std::vector<uint8_t> image;			// RGBA image of the layers before the range, empty: start with the bed.
+										// Holds the image of the layers up to the end of the range after the render.
 };
 
 /* 
 OpenGL / OpenGL ES gcode renderer
 
 Relies on gcodeparser to provide vertex arrays. 
-Saves PNG files using libpng.
+Saves the images with ImageWriter, as PNG, or JPEG and WebP when built
+with libjpeg and libwebp.
+
+Multiple views of a part are rendered from a single parse. Every chunk of
+vertices is buffered once and drawn to each view's framebuffer.
+
+The part is parsed on a separate thread, into a fixed number of chunks
+that are handed back and forth with the render thread. The OpenGL context
+is only used on the render thread.
+
+Without an OpenGL context, the same buffers are drawn by the software
+rasterizer instead.
+
+A range of layers is drawn on top of the image of the layers before it,
+which is kept in a framebuffer file. The camera looks down on the part,
+so the layers of the range are never hidden by the layers below them,
+and the depth buffer only needs to hold the range.
+
+The part is drawn as lines or as tubes. Either way only the start and
+end of each path are buffered, the tubes are built on the GPU: a quad per
+path that the tube shaders shade as a round tube. With instancing, the
+quad's corners are shared by all paths. GPUs without it get the quads
+expanded on the CPU instead.
 
 */
 class Renderer
@@ -50,21 +152,43 @@ class Renderer
 	unsigned int width = 250; // Width of image in pixels
 	unsigned int height = 250; // Height of image in pixels
 
-	unsigned int throttlingInterval; // Every N gcode lines sleep for a while
-	unsigned int throttlingDuration; // The while to sleep (in ms)
+	Governor governor;				// Throttles or pauses the parser, may be changed during a render
 
 	RenderContextBase* renderContext;	// The platform-specific rendering context used as drawing buffer
-	GcodeParser* parser;				// The gcode parser that provides the vertex arrays
+	SoftwareRasterizer* rasterizer = NULL;	// Draws instead of OpenGL when using the software render context
+	RenderView* currentView = NULL;		// The view that is drawn to
+	VertexSource* source;				// The gcode parser or toolpath cache that provides the vertex arrays
 	
-	uint8_t drawType = DRAW_LINES;	// DRAW_LINES (fast) or DRAW_TUBES (slow, but cooler)
-	uint16_t linesPerRun = 10000;	// Number of lines to parse before rendering
+	uint8_t drawType = DRAW_LINES;	// DRAW_LINES or DRAW_TUBES (lit, round paths)
+	float tubeWidth = DEFAULT_TUBE_WIDTH;	// Diameter (in mm) of the tubes
+	unsigned int linesPerRun = 10000;	// Number of lines to parse before rendering, follows from the GPU memory budget
+
+	float decimation = 0.0f;		// Max distance (in pixels) between merged paths and the paths they replace, 0: off
+	unsigned int parserThreads = 1;	// Number of threads that decode the gcode file, 0: one per CPU
+	ImageFormat imageFormat;		// How the rendered images are encoded
+	RenderStats stats;				// Of the last render
+
+	// Position in the gcode (or toolpath cache) file of the last chunk drawn, and the size of
+	// the file, in bytes. Read from other threads while a render runs.
+	std::atomic<long> progressOffset{ 0 };
+	std::atomic<long> progressSize{ 0 };
 
 	BufferInfo bedBuffer;			// Name container for the bed vertex buffers
 	bool bedBuffered = false;
 	long memoryUsed = 0;			// The amount of GPU memory used for drawing a part
 
-	float * vertices;				// Points to the current vertex array
-	short * indices;				// Points to the current vertex element array
+	long gpuMemoryBudget = DEFAULT_GPU_MEMORY_BUDGET;	// GPU memory (in bytes) for the stream buffers
+	bool uintIndices = false;							// Whether the GPU can draw with 32 bit indices (OES_element_index_uint)
+	BufferInfo streamBuffers[STREAM_BUFFERS];			// Reused for every chunk, in turns
+	unsigned int streamBuffer_i = 0;					// The stream buffer the next chunk is written to
+
+	VertexChunk chunks[PIPELINE_CHUNKS];	// The vertex arrays passed between the parser thread and the render thread
+	uint16_t * shortIndices;		// The indices converted for GPUs that only draw with 16 bit indices
+
+	DrawArraysInstancedProc drawArraysInstanced = NULL;	// Draws the tubes, NULL if the GPU can't draw instances
+	VertexAttribDivisorProc vertexAttribDivisor = NULL;
+	std::vector<float> tubeVertices;		// The tubes of a chunk expanded on the CPU, for GPUs without instancing
+	std::vector<VertexIndex> tubeIndices;
 	
 	BBox printArea = BBox(-37.0f, 328.0f, -33.0f, 317.0f, 0.0f, 200.0f);
 
@@ -73,39 +197,81 @@ class Renderer
 	float backgroundColor[4] = { 1.0f, 1.0f, 1.0f, 1.0f };						// Background color of the image 
 	
 	bool pointCameraAtPart = true;							// False: point camera at center of bed, true point camera at center of part
+	BBox cameraBbox;										// The part bounding box the camera was last pointed with
+	bool cameraBboxValid = false;
+	bool cameraBboxFixed = false;							// Point the camera with the cameraBbox, instead of that of the source
 	glm::vec3 cameraDistance = { -300.f, -300.f, 150.f };	// Camera distance from the part or center of the bed			
 		
 	GLuint program, vertex_shader, fragment_shader, vertex_array;
 	GLint position_handle,  // Position: the position of the vertices in model space
-		normal_handle,		// Normals: The normals of fragments in model space
 		color_handle,		// Color: the diffuse color of the fragments
-		m_handle,			// The model matrix
-		v_handle,			// The view matrix
-		light_handle,		// Light: The position of the ambient light in the world space
 		camera_handle;		// Camera: the full Model-View-Projection matrix of that transforms the vertice positions to pixel positions 
 
+	// The program that draws the tubes, created at the first render with tubes
+	GLuint tubeProgram = 0, tubeVertexShader, tubeFragmentShader;
+	GLuint cornerBuffer = 0;	// The corners of the quad of a tube, shared by all instances
+	GLint tube_start_handle,	// Start of the path
+		tube_end_handle,		// End of the path
+		tube_corner_handle,		// Corner of the quad around the path
+		tube_color_handle,		// The diffuse color of the tubes
+		tube_camera_handle,		// The Model-View-Projection matrix
+		tube_eye_handle,		// The position of the camera in world space
+		tube_radius_handle,		// Radius of the tubes
+		tube_pixel_handle,		// Size of a pixel at 1 mm from the camera
+		tube_light_handle;		// The position of the light in world space
+
 public:
 	Renderer(unsigned int width, unsigned int height, unsigned int throttlingInterval, unsigned int throttlingDuration);
 	~Renderer();
-	bool initialize();
+	bool initialize(unsigned int backend = BACKEND_AUTO);
 	void configurePrintArea(BBox * printArea);
 	void configureCamera(bool pointAtPart, float cameraDistance[3]);
 	void configureBackgroundColor(float color[4]);
 	void configureBedColor(float color[4]);
 	void configurePartColor(float color[4]);
-	bool renderGcode(const char* gcodeFile, const char* imageFile);
+	void configureGpuMemory(long budget);
+	void configureDecimation(float tolerance);
+	void configureParserThreads(unsigned int threads);
+	void configureImageFormat(const ImageFormat & format);
+	void configureDrawType(uint8_t drawType, float tubeWidth);
+	RenderStats getStats() { return stats; };
+	void getProgress(long * offset, long * size) { *offset = progressOffset; *size = progressSize; };
+	Governor * getGovernor() { return &governor; };
+	RenderView getDefaultView();
+	bool renderGcode(const char* gcodeFile, const char* imageFile, const char* toolpathFile = NULL, const char* layerIndexFile = NULL);
+	bool renderViews(const char* gcodeFile, std::vector<RenderView> & views, const char* toolpathFile = NULL, const char* layerIndexFile = NULL);
+	bool renderLayers(const char* gcodeFile, const char* imageFile, const char* layerIndexFile, const char* framebufferFile, unsigned int startLayer, unsigned int endLayer);
 
 private:
 	
+	bool render(const char* gcodeFile, std::vector<RenderView> & views, const char* toolpathFile, const char* layerIndexFile, LayerRange * range);
+	BBox getBedBbox();
+	bool loadFramebuffer(const char* framebufferFile, RenderView * view, unsigned int layers, std::vector<uint8_t> * image);
+	bool saveFramebuffer(const char* framebufferFile, RenderView * view, unsigned int layers, const std::vector<uint8_t> & image);
 	void createProgram();
-	void buffer(const int nVertices, const float * vertices, const int nIndices, const short * indices, BufferInfo * bufferInfo);
+	void createTubeProgram();
+	void loadInstancing();
+	bool expandsTubes() { return drawType == DRAW_TUBES && rasterizer == NULL && drawArraysInstanced == NULL; };
+	void expandTubes(const int nVertices, const float * vertices);
+	void buffer(const int nVertices, const float * vertices, const int nIndices, const uint16_t * indices, BufferInfo * bufferInfo);
 	void deleteBuffer(BufferInfo * bufferInfo);
+	void configureStreamBuffers(unsigned int verticesSize, unsigned int indicesSize);
+	void createStreamBuffers(long vertexCapacity, long indexCapacity);
+	void deleteStreamBuffers();
+	BufferInfo * streamBuffer(int nVertices, const float * vertices, int nIndices, const VertexIndex * indices);
 	void draw(const float color[4], BufferInfo * bufferInfo, GLenum element_type);
-	void setCamera();
+	void drawTubes(const float color[4], BufferInfo * bufferInfo);
+	void drawPart(BufferInfo * bufferInfo);
+	bool createFramebuffer(RenderView * view);
+	void deleteFramebuffer(RenderView * view);
+	void useView(RenderView * view);
+	void setCamera(RenderView * view);
 	void bufferBed();
 	void renderBed();
-	void renderPart();
-	bool saveRender(const char* imageFile);
+	void renderPart(std::vector<RenderView> & views);
+	void parseChunks(ChunkQueue * emptyChunks, ChunkQueue * parsedChunks);
+	void drawChunk(std::vector<RenderView> & views, VertexChunk * chunk);
+	bool saveRender(RenderView * view, LayerRange * range = NULL);
 
 	bool checkGlError(const char* part);
 };
@@ -0,0 +1,36 @@
+#include "chunkqueue.h"
+
+// Add a chunk at the end of the queue
+void ChunkQueue::push(VertexChunk * chunk)
+{
+	std::lock_guard<std::mutex> lock(mutex);
+
+	chunks.push_back(chunk);
+	changed.notify_one();
+}
+
+// Take the chunk at the front of the queue, waits until there is one. 
+// Returns NULL once the queue is closed.
+VertexChunk * ChunkQueue::pop()
+{
+	std::unique_lock<std::mutex> lock(mutex);
+
+	changed.wait(lock, [this] { return closed || !chunks.empty(); });
+
+	if (closed)
+		return NULL;
+
+	VertexChunk * chunk = chunks.front();
+	chunks.pop_front();
+
+	return chunk;
+}
+
+// Stop the queue, threads waiting for a chunk get NULL
+void ChunkQueue::close()
+{
+	std::lock_guard<std::mutex> lock(mutex);
+
+	closed = true;
+	changed.notify_all();
+}
@@ -0,0 +1,49 @@
+/*
+
+chunkqueue.h
+
+Header file for the queue that passes chunks of vertices from the
+parser thread to the render thread
+
+*/
+
+#ifndef CHUNKQUEUE_H
+#define CHUNKQUEUE_H 1
+
+#include <deque>
+#include <mutex>
+#include <condition_variable>
+
+#include "vertexbuilder.h"
+
+// A chunk of vertices of a part, parsed from a number of lines
+struct VertexChunk {
+	float * vertices = NULL;
+	VertexIndex * indices = NULL;
+	int nVertices = 0, nIndices = 0;
+	int nParsed = 0;	// Number of lines parsed into the chunk, 0 at the end of the part, -1 on errors
+	long offset = 0;	// Position (in bytes) in the source after the chunk
+};
+
+/*
+
+ChunkQueue
+
+A first-in-first-out queue of chunks that threads can wait on. It holds
+pointers only, the number of chunks that exist bounds its size.
+
+*/
+class ChunkQueue
+{
+	std::mutex mutex;
+	std::condition_variable changed;
+	std::deque<VertexChunk *> chunks;
+	bool closed = false;
+
+public:
+	void push(VertexChunk * chunk);
+	VertexChunk * pop();
+	void close();
+};
+
+#endif // !CHUNKQUEUE_H
@@ -0,0 +1,556 @@
+#include "gcodeinput.h"
+
+// The characters MeatPack packs in 4 bits, 0xF marks a character that follows unpacked
+static const char meatPackCharacters[16] = { '0', '1', '2', '3', '4', '5', '6', '7', '8', '9', '.', ' ', '\n', 'G', 'X', 0 };
+
+#define MEATPACK_SIGNAL 0xFF
+#define MEATPACK_UNPACKED 0x0F
+#define MEATPACK_SPACE 0x0B				// Packs an E instead of a space when spaces are left out
+#define MEATPACK_ENABLE_PACKING 251
+#define MEATPACK_DISABLE_PACKING 250
+#define MEATPACK_RESET_ALL 249
+#define MEATPACK_ENABLE_NO_SPACES 247
+#define MEATPACK_DISABLE_NO_SPACES 246
+
+// Binary gcode is little-endian
+static uint16_t read_u16(const uint8_t * p)
+{
+	return (uint16_t)(p[0] | (p[1] << 8));
+}
+
+static uint32_t read_u32(const uint8_t * p)
+{
+	return (uint32_t)p[0] | ((uint32_t)p[1] << 8) | ((uint32_t)p[2] << 16) | ((uint32_t)p[3] << 24);
+}
+
+// Find out how a gcode file is stored from its first bytes: INPUT_TEXT, INPUT_GZIP or INPUT_BGCODE
+int GcodeInput::detect(const char * data, size_t size)
+{
+	if (size >= 2 && (uint8_t)data[0] == 0x1f && (uint8_t)data[1] == 0x8b)
+		return INPUT_GZIP;
+
+	if (size >= 4 && memcmp(data, BGCODE_MAGIC, 4) == 0)
+		return INPUT_BGCODE;
+
+	return INPUT_TEXT;
+}
+
+/* GzipInput */
+
+GzipInput::~GzipInput()
+{
+	if (initialized)
+		inflateEnd(&stream);
+}
+
+bool GzipInput::open()
+{
+	memset(&stream, 0, sizeof stream);
+
+	// 16: expect a gzip header
+	if (inflateInit2(&stream, 16 + MAX_WBITS) != Z_OK)
+		return false;
+
+	initialized = true;
+	stream.next_in = (Bytef *)data;
+	stream.avail_in = (uInt)std::min(size, (size_t)ZLIB_FEED_SIZE);
+
+	return true;
+}
+
+size_t GzipInput::read(char * buffer, size_t bufferSize)
+{
+	bufferSize = std::min(bufferSize, (size_t)ZLIB_FEED_SIZE);
+
+	stream.next_out = (Bytef *)buffer;
+	stream.avail_out = (uInt)bufferSize;
+
+	while (!finished && stream.avail_out > 0)
+	{
+		if (stream.avail_in == 0)
+		{
+			stream.avail_in = (uInt)std::min(size - get_offset(), (size_t)ZLIB_FEED_SIZE);
+
+			// The file ends in the middle of the stream
+			if (stream.avail_in == 0)
+			{
+				failed = finished = true;
+				break;
+			}
+		}
+
+		int status = inflate(&stream, Z_NO_FLUSH);
+
+		if (status == Z_STREAM_END)
+		{
+			// A file may hold more gzip members, anything else after a member is ignored
+			size_t offset = get_offset();
+
+			if (size - offset >= 2 && data[offset] == 0x1f && data[offset + 1] == 0x8b)
+				inflateReset(&stream);
+			else
+				finished = true;
+		}
+		else if (status != Z_OK && status != Z_BUF_ERROR)
+		{
+			failed = finished = true;
+		}
+	}
+
+	return bufferSize - stream.avail_out;
+}
+
+size_t GzipInput::get_offset()
+{
+	return (const uint8_t *)stream.next_in - data;
+}
+
+// Gzip can't be read from the middle, so this decompresses the whole file once more on the side
+void GzipInput::read_tail(std::string * tail, size_t tailSize)
+{
+	GzipInput scan((const char *)data, size);
+	std::vector<char> chunk(tailSize);
+	size_t n;
+
+	tail->clear();
+
+	if (!scan.open())
+		return;
+
+	while ((n = scan.read(chunk.data(), chunk.size())) > 0)
+	{
+		tail->append(chunk.data(), n);
+
+		if (tail->size() > 2 * tailSize)
+			tail->erase(0, tail->size() - tailSize);
+	}
+}
+
+/* BgcodeInput */
+
+// Read the file header and the metadata blocks, up to the first gcode block
+bool BgcodeInput::open()
+{
+	if (size < BGCODE_FILE_HEADER_SIZE || memcmp(data, BGCODE_MAGIC, 4) != 0)
+		return false;
+
+	checksumType = read_u16(data + 8);
+	cursor = BGCODE_FILE_HEADER_SIZE;
+
+	uint16_t type, encoding;
+
+	while (read_block(&type, &decompressed, &encoding))
+	{
+		if (type == BGCODE_BLOCK_GCODE)
+		{
+			decode_gcode(encoding, &block);
+			blockPosition = 0;
+			return true;
+		}
+
+		if (type != BGCODE_BLOCK_THUMBNAIL)
+			add_metadata(decompressed);
+	}
+
+	// A file without gcode blocks is empty, but not invalid
+	return !failed;
+}
+
+size_t BgcodeInput::read(char * buffer, size_t bufferSize)
+{
+	size_t n = 0;
+
+	while (n < bufferSize)
+	{
+		if (blockPosition == block.size())
+		{
+			if (!next_gcode_block())
+				break;
+
+			continue;
+		}
+
+		size_t count = std::min(bufferSize - n, block.size() - blockPosition);
+		memcpy(buffer + n, block.data() + blockPosition, count);
+
+		blockPosition += count;
+		n += count;
+	}
+
+	return n;
+}
+
+// Gcode blocks can be decompressed on their own, so this only decompresses the last ones
+void BgcodeInput::read_tail(std::string * tail, size_t tailSize)
+{
+	size_t position = cursor;
+	bool wasFailed = failed;
+
+	// Find the gcode blocks after the current one, from their headers
+	std::vector<size_t> blocks;
+	uint16_t type, encoding;
+
+	for (size_t offset = cursor; read_block(&type, NULL, &encoding); offset = cursor)
+	{
+		if (type == BGCODE_BLOCK_GCODE)
+			blocks.push_back(offset);
+	}
+
+	tail->clear();
+
+	std::string text;
+
+	for (size_t i = blocks.size(); i > 0 && tail->size() < tailSize; --i)
+	{
+		cursor = blocks[i - 1];
+
+		if (!read_block(&type, &decompressed, &encoding))
+			break;
+
+		decode_gcode(encoding, &text);
+		tail->insert(0, text);
+	}
+
+	// The current block is still to be read
+	if (tail->size() < tailSize)
+		tail->insert(0, block);
+
+	cursor = position;
+	failed = wasFailed;
+}
+
+/* Private Methods */
+
+/*
+Read the block at the cursor and move the cursor past it
+
+type: Receives the type of the block
+content: Receives the decompressed data of the block, thumbnails are skipped and left empty.
+         NULL to skip any block.
+encoding: Receives the encoding of a gcode block
+
+Returns false at the end of the file, or if the block is corrupt (see GcodeInput::has_failed)
+
+*/
+bool BgcodeInput::read_block(uint16_t * type, std::vector<uint8_t> * content, uint16_t * encoding)
+{
+	if (cursor >= size)
+		return false;
+
+	const uint8_t * header = data + cursor;
+	size_t remaining = size - cursor;
+
+	if (remaining < 8)
+	{
+		failed = true;
+		return false;
+	}
+
+	*type = read_u16(header);
+	uint16_t compression = read_u16(header + 2);
+	uint32_t uncompressedSize = read_u32(header + 4);
+
+	// Only compressed blocks store the compressed size
+	size_t headerSize = compression == BGCODE_COMPRESSION_NONE ? 8 : 12;
+	size_t parametersSize = *type == BGCODE_BLOCK_THUMBNAIL ? 6 : 2;	// Format and size of a thumbnail, the encoding of the others
+	size_t checksumSize = checksumType == BGCODE_CHECKSUM_CRC32 ? 4 : 0;
+
+	if (remaining < headerSize)
+	{
+		failed = true;
+		return false;
+	}
+
+	size_t dataSize = compression == BGCODE_COMPRESSION_NONE ? uncompressedSize : read_u32(header + 8);
+
+	if (remaining < headerSize + parametersSize + dataSize + checksumSize)
+	{
+		failed = true;
+		return false;
+	}
+
+	const uint8_t * parameters = header + headerSize;
+	const uint8_t * blockData = parameters + parametersSize;
+
+	cursor += headerSize + parametersSize + dataSize + checksumSize;
+
+	*encoding = *type == BGCODE_BLOCK_THUMBNAIL ? BGCODE_ENCODING_NONE : read_u16(parameters);
+
+	if (content == NULL)
+		return true;
+
+	if (*type == BGCODE_BLOCK_THUMBNAIL)
+	{
+		content->clear();
+		return true;
+	}
+
+	content->resize(uncompressedSize);
+
+	bool valid = false;
+
+	switch (compression)
+	{
+	case BGCODE_COMPRESSION_NONE:
+		memcpy(content->data(), blockData, dataSize);
+		valid = true;
+		break;
+	case BGCODE_COMPRESSION_DEFLATE:
+		valid = inflate_block(blockData, dataSize, content->data(), uncompressedSize);
+		break;
+	case BGCODE_COMPRESSION_HEATSHRINK_11_4:
+		valid = heatshrink_block(blockData, dataSize, content->data(), uncompressedSize, 11, 4);
+		break;
+	case BGCODE_COMPRESSION_HEATSHRINK_12_4:
+		valid = heatshrink_block(blockData, dataSize, content->data(), uncompressedSize, 12, 4);
+		break;
+	}
+
+	if (!valid)
+		failed = true;
+
+	return valid;
+}
+
+// Move on to the next gcode block, skipping any other blocks. Returns false at the end of the file.
+bool BgcodeInput::next_gcode_block()
+{
+	uint16_t type, encoding;
+
+	while (read_block(&type, &decompressed, &encoding))
+	{
+		if (type == BGCODE_BLOCK_GCODE)
+		{
+			decode_gcode(encoding, &block);
+			blockPosition = 0;
+			return true;
+		}
+	}
+
+	return false;
+}
+
+// Get the text of the decompressed gcode block
+void BgcodeInput::decode_gcode(uint16_t encoding, std::string * text)
+{
+	if (encoding == BGCODE_ENCODING_NONE)
+		text->assign(decompressed.begin(), decompressed.end());
+	else
+		unpack(decompressed, text);
+}
+
+// Add the key=value lines of a metadata block to the metadata, as ; key=value comments
+void BgcodeInput::add_metadata(const std::vector<uint8_t> & content)
+{
+	const char * begin = (const char *)content.data();
+	const char * end = begin + content.size();
+
+	while (begin < end)
+	{
+		const char * lineEnd = (const char *)memchr(begin, '\n', end - begin);
+
+		if (lineEnd == NULL)
+			lineEnd = end;
+
+		if (lineEnd > begin)
+		{
+			metadata += "; ";
+			metadata.append(begin, lineEnd);
+			metadata += '\n';
+		}
+
+		begin = lineEnd + 1;
+	}
+}
+
+/*
+Decode a MeatPack encoded gcode block. MeatPack packs the most common gcode
+characters in 4 bits each, the low bits first. Two signal bytes (0xFF 0xFF)
+are followed by a command, which switches packing or the replacement of
+spaces by E on and off. Every block starts with both off.
+
+*/
+void BgcodeInput::unpack(const std::vector<uint8_t> & content, std::string * text)
+{
+	bool packing = false;
+	bool noSpaces = false;
+
+	int signals = 0;		// Number of signal bytes in a row
+	bool command = false;	// Whether the next byte is a command
+	int unpacked = 0;		// Number of characters that follow unpacked
+	char next = 0;			// A packed character that goes after the unpacked one
+
+	text->clear();
+	text->reserve(content.size() * 2);
+
+	for (size_t i = 0; i < content.size(); ++i)
+	{
+		uint8_t c = content[i];
+
+		if (c == MEATPACK_SIGNAL)
+		{
+			if (signals > 0)
+			{
+				command = true;
+				signals = 0;
+			}
+			else
+			{
+				signals++;
+			}
+
+			continue;
+		}
+
+		if (command)
+		{
+			switch (c)
+			{
+			case MEATPACK_ENABLE_PACKING:
+				packing = true;
+				break;
+			case MEATPACK_DISABLE_PACKING:
+				packing = false;
+				break;
+			case MEATPACK_RESET_ALL:
+				packing = noSpaces = false;
+				break;
+			case MEATPACK_ENABLE_NO_SPACES:
+				noSpaces = true;
+				break;
+			case MEATPACK_DISABLE_NO_SPACES:
+				noSpaces = false;
+				break;
+			}
+
+			command = false;
+			continue;
+		}
+
+		// A single signal byte is a byte of two unpacked characters
+		int n = signals > 0 ? 2 : 1;
+		uint8_t bytes[2] = { MEATPACK_SIGNAL, c };
+		signals = 0;
+
+		for (uint8_t * b = bytes + 2 - n; b < bytes + 2; ++b)
+		{
+			if (!packing)
+			{
+				text->push_back((char)*b);
+			}
+			else if (unpacked > 0)
+			{
+				text->push_back((char)*b);
+
+				if (next != 0)
+				{
+					text->push_back(next);
+					next = 0;
+				}
+
+				unpacked--;
+			}
+			else
+			{
+				uint8_t low = *b & 0x0F, high = *b >> 4;
+				char second = high == MEATPACK_SPACE && noSpaces ? 'E' : meatPackCharacters[high];
+
+				if (low == MEATPACK_UNPACKED)
+				{
+					// The unpacked character comes first
+					unpacked += high == MEATPACK_UNPACKED ? 2 : 1;
+					next = high == MEATPACK_UNPACKED ? 0 : second;
+					continue;
+				}
+
+				char first = low == MEATPACK_SPACE && noSpaces ? 'E' : meatPackCharacters[low];
+				text->push_back(first);
+
+				// A line that ends on the first character pads the second
+				if (first == '\n')
+					continue;
+
+				if (high == MEATPACK_UNPACKED)
+					unpacked++;
+				else
+					text->push_back(second);
+			}
+		}
+	}
+}
+
+// Inflate a deflate compressed block, which is a zlib stream (raw deflate is accepted too)
+bool BgcodeInput::inflate_block(const uint8_t * in, size_t inSize, uint8_t * out, size_t outSize)
+{
+	z_stream stream;
+	memset(&stream, 0, sizeof stream);
+
+	bool zlibHeader = inSize >= 2 && (in[0] & 0x0F) == Z_DEFLATED && ((in[0] << 8) | in[1]) % 31 == 0;
+
+	if (inflateInit2(&stream, zlibHeader ? MAX_WBITS : -MAX_WBITS) != Z_OK)
+		return false;
+
+	stream.next_in = (Bytef *)in;
+	stream.avail_in = (uInt)inSize;
+	stream.next_out = (Bytef *)out;
+	stream.avail_out = (uInt)outSize;
+
+	int status = inflate(&stream, Z_FINISH);
+	inflateEnd(&stream);
+
+	return (status == Z_STREAM_END || status == Z_OK || status == Z_BUF_ERROR) && stream.avail_out == 0;
+}
+
+/*
+Decompress a heatshrink compressed block. Heatshrink is LZSS: each token starts
+with a bit, 1 for a literal byte, 0 for a back-reference of windowBits bits of
+distance and lookaheadBits bits of length (both minus 1). Bits are read from the
+most significant bit of each byte.
+
+*/
+bool BgcodeInput::heatshrink_block(const uint8_t * in, size_t inSize, uint8_t * out, size_t outSize, int windowBits, int lookaheadBits)
+{
+	size_t bit = 0;
+	size_t nBits = inSize * 8;
+	size_t o = 0;
+
+	auto read_bits = [&](int count, uint32_t * value) {
+		if (bit + count > nBits)
+			return false;
+
+		*value = 0;
+
+		for (int i = 0; i < count; ++i, ++bit)
+			*value = (*value << 1) | ((in[bit >> 3] >> (7 - (bit & 7))) & 1);
+
+		return true;
+	};
+
+	while (o < outSize)
+	{
+		uint32_t tag, literal, index, count;
+
+		if (!read_bits(1, &tag))
+			break;
+
+		if (tag == 1)
+		{
+			if (!read_bits(8, &literal))
+				break;
+
+			out[o++] = (uint8_t)literal;
+			continue;
+		}
+
+		if (!read_bits(windowBits, &index) || !read_bits(lookaheadBits, &count))
+			break;
+
+		// The window starts out zeroed
+		size_t distance = index + 1;
+
+		for (count++; count > 0 && o < outSize; --count, ++o)
+			out[o] = o >= distance ? out[o - distance] : 0;
+	}
+
+	return o == outSize;
+}
@@ -0,0 +1,148 @@
+/*
+
+gcodeinput.h
+
+Header file for the inputs that decompress gcode files while they are
+parsed: gzip compressed gcode and binary gcode (.bgcode)
+
+*/
+
+#ifndef GCODEINPUT_H
+#define GCODEINPUT_H 1
+
+#include <stdint.h>
+#include <string.h>
+#include <algorithm>
+#include <string>
+#include <vector>
+#include <zlib.h>
+
+#include "helpers.h"
+
+#define INPUT_TEXT 0		// Plain gcode, read straight from the mapped file
+#define INPUT_GZIP 1		// Gzip compressed gcode (.gcode.gz)
+#define INPUT_BGCODE 2		// Binary gcode (.bgcode)
+
+#define ZLIB_FEED_SIZE 1073741824	// zlib counts the input in 32 bits, feed it at most this many bytes at a time
+
+#define BGCODE_MAGIC "GCDE"
+#define BGCODE_FILE_HEADER_SIZE 10	// Magic, version and checksum type
+#define BGCODE_CHECKSUM_CRC32 1
+
+#define BGCODE_BLOCK_FILE_METADATA 0
+#define BGCODE_BLOCK_GCODE 1
+#define BGCODE_BLOCK_SLICER_METADATA 2
+#define BGCODE_BLOCK_PRINTER_METADATA 3
+#define BGCODE_BLOCK_PRINT_METADATA 4
+#define BGCODE_BLOCK_THUMBNAIL 5
+
+#define BGCODE_COMPRESSION_NONE 0
+#define BGCODE_COMPRESSION_DEFLATE 1
+#define BGCODE_COMPRESSION_HEATSHRINK_11_4 2
+#define BGCODE_COMPRESSION_HEATSHRINK_12_4 3
+
+#define BGCODE_ENCODING_NONE 0
+#define BGCODE_ENCODING_MEATPACK 1
+#define BGCODE_ENCODING_MEATPACK_COMMENTS 2
+
+/*
+
+GcodeInput
+
+Provides the text of a compressed gcode file, a chunk at a time. The
+compressed data is read from the memory-mapped file, so only the
+compressed bytes are read from storage and nothing is written to disk.
+
+*/
+class GcodeInput
+{
+protected:
+	const uint8_t * data;	// The compressed file
+	size_t size;
+	bool failed = false;	// Whether the data turned out to be corrupt
+	std::string metadata;	// Metadata found outside the gcode, as gcode comments
+
+public:
+	GcodeInput(const char * data, size_t size) : data((const uint8_t *)data), size(size) {};
+	virtual ~GcodeInput() {};
+
+	// Read the headers of the file, returns false if it isn't valid
+	virtual bool open() = 0;
+
+	// Decompress at most size bytes of gcode into buffer. Returns the number of bytes, 0 at the end of the file.
+	virtual size_t read(char * buffer, size_t size) = 0;
+
+	// Number of bytes of the compressed file consumed so far
+	virtual size_t get_offset() = 0;
+
+	// Decompress (at least) the last size bytes of gcode of the file, without moving on the input
+	virtual void read_tail(std::string * tail, size_t size) = 0;
+
+	bool has_failed() { return failed; };
+	const std::string & get_metadata() { return metadata; };
+
+	static int detect(const char * data, size_t size);
+};
+
+/*
+
+GzipInput
+
+Inflates a gzip compressed gcode file, including files of more
+than one gzip member
+
+*/
+class GzipInput : public GcodeInput
+{
+	z_stream stream;
+	bool initialized = false;
+	bool finished = false;
+
+public:
+	GzipInput(const char * data, size_t size) : GcodeInput(data, size) {};
+	~GzipInput();
+	bool open();
+	size_t read(char * buffer, size_t size);
+	size_t get_offset();
+	void read_tail(std::string * tail, size_t size);
+};
+
+/*
+
+BgcodeInput
+
+Reads the gcode blocks of a binary gcode file, one block at a time.
+Blocks may be deflate or heatshrink compressed and MeatPack encoded.
+The metadata blocks before the gcode are turned into gcode comments,
+so the slicer metadata reader finds them. Checksums are not verified.
+
+*/
+class BgcodeInput : public GcodeInput
+{
+	size_t cursor = 0;			// Start of the next block
+	uint16_t checksumType = 0;
+
+	std::vector<uint8_t> decompressed;	// The current block, decompressed
+	std::string block;					// The text of the current gcode block
+	size_t blockPosition = 0;			// Next byte of the block to read
+
+public:
+	BgcodeInput(const char * data, size_t size) : GcodeInput(data, size) {};
+	bool open();
+	size_t read(char * buffer, size_t size);
+	size_t get_offset() { return cursor; };
+	void read_tail(std::string * tail, size_t size);
+
+private:
+	bool read_block(uint16_t * type, std::vector<uint8_t> * content, uint16_t * encoding);
+	bool next_gcode_block();
+	void decode_gcode(uint16_t encoding, std::string * text);
+	void add_metadata(const std::vector<uint8_t> & content);
+
+	static void unpack(const std::vector<uint8_t> & content, std::string * text);
+
+	static bool inflate_block(const uint8_t * in, size_t inSize, uint8_t * out, size_t outSize);
+	static bool heatshrink_block(const uint8_t * in, size_t inSize, uint8_t * out, size_t outSize, int windowBits, int lookaheadBits);
+};
+
+#endif // !GCODEINPUT_H
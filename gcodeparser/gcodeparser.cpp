@@ -1,32 +1,19 @@
 #include "gcodeparser.h"
 
 /* TODO: This was originally C code, optimize for c++ and make use of GLM */
-#ifdef __linux__ 
-void Sleep(int sleepMs) { usleep(sleepMs * 1000); }
-#endif
 
 /*
 Initialize the GcodeParser class
 
 file: Path to the gcode file
-drawType: Either DRAW_LINES (fast) or DRAW_TUBES (slow)
 bedBbox: Bounding box of the printable area
-throttlingInterval: After n lines, pause
-throttlingDuration: The duration of the pause in milliseconds
+governor: Throttles the parse, the caller keeps ownership
 
 */
-GcodeParser::GcodeParser(const char *file, uint8_t drawType, BBox bedBbox, const unsigned int throttlingInterval, const unsigned int throttlingDuration)
+GcodeParser::GcodeParser(const char *file, BBox bedBbox, Governor * governor)
 {
 	this->file = file;
-
-	this->throttlingDuration = throttlingDuration;
-	this->throttlingInterval = throttlingInterval;
-
-	// We used to need this to estimate our buffer size
-	// now, we read the file in chunks
-	//this->number_of_lines = get_number_of_lines();
-
-	this->draw = drawType;
+	this->governor = governor;
 
 	// Mirror the bounding box of the bed to that of the part, so we know when we have valid
 	// part dimensions or not
@@ -39,53 +26,113 @@ GcodeParser::GcodeParser(const char *file, uint8_t drawType, BBox bedBbox, const
 	this->bbox.zmin = bedBbox.zmax;
 	this->bbox.zmax = bedBbox.zmin;
 
-	float z_estimate = this->find_max_z();
+	// Map the file into memory
+	opened = tokenizer.open(file);
+
+	// Most slicers write (part of) the dimensions of the part in comments, so we 
+	// can point the camera at the whole part before it is parsed
+	SlicerMetadata metadata;
+	const char * data = tokenizer.get_data();
+	const char * end = tokenizer.get_end();
+
+	// Of a large compressed file only the first chunk is known yet, its end is read separately
+	string tail;
+
+	if (tokenizer.read_tail(&tail, FIND_MAX_Z_SCAN_SIZE))
+		end = min(end, data + METADATA_SCAN_SIZE);
+
+	bool found = read_slicer_metadata(data, end, &metadata);
+
+	if (!tail.empty())
+		found = read_slicer_metadata(tail.data(), tail.data() + tail.size(), &metadata) || found;
+
+	// Binary gcode keeps (part of) the metadata in blocks of its own
+	const string & comments = tokenizer.get_metadata();
 
-	if (z_estimate > 0.0f)
-		this->bbox.zmax = z_estimate;
+	if (!comments.empty())
+		found = read_slicer_metadata(comments.data(), comments.data() + comments.size(), &metadata) || found;
 
-	// create a file-reading object
-	fin.open(file);
+	if (found)
+	{
+		use_metadata(&metadata);
+
+		char log[256];
+		sprintf(log, "Part dimensions from %s metadata%s: %.2f:%.2f %.2f:%.2f %.2f:%.2f", metadata.slicer, metadata.complete() ? "" : " (partial)",
+			metadata.bbox.xmin, metadata.bbox.xmax, metadata.bbox.ymin, metadata.bbox.ymax, metadata.bbox.zmin, metadata.bbox.zmax);
+		log_msg(debug, log);
+	}
+
+	if (!metadata.known[BBOX_ZMAX])
+	{
+		float z_estimate = tail.empty() ? this->find_max_z(data, tokenizer.get_end()) : this->find_max_z(tail.data(), tail.data() + tail.size());
+
+		if (z_estimate > 0.0f)
+			this->bbox.zmax = z_estimate;
+	}
 }
 
 GcodeParser::~GcodeParser()
 {
-	fin.close();
 }
 
-float GcodeParser::find_max_z()
+// Start the bounding box of the part with the sides found in the slicer
+// metadata. Parsing still grows it, like any other extrusion would.
+void GcodeParser::use_metadata(SlicerMetadata * metadata)
 {
-	// Estimate the maximum z value of the part by reading the file backwards, 
-	// until we spot a Z. This way, we can determine the camera position after the first layer
+	const float * sides = &metadata->bbox.xmin;
+	const float * bedSides = &bedBbox.xmin;
+	float * partSides = &bbox.xmin;
+
+	for (int i = 0; i < BBOX_SIDES; ++i)
+	{
+		if (!metadata->known[i])
+			continue;
+
+		// The parser ignores anything outside the bed, so the part can't extend beyond it either
+		partSides[i] = i % 2 == 0 ? max(sides[i], bedSides[i]) : min(sides[i], bedSides[i]);
+	}
+}
+
+float GcodeParser::find_max_z(const char * begin, const char * lineEnd)
+{
+	// Estimate the maximum z value of the part by reading the end of the file (begin to lineEnd) backwards, 
+	// until we spot the Z of the last extruding move (moves after it, like parking the
+	// head, don't count). This way, we can determine the camera position after the first layer
 	// has been parsed. This in turn allow to write vertice data straight to the GPU, saving us a lot
 	// of memory.
-	std::ifstream fin_rev(this->file, std::ifstream::binary);
-
-	if (!fin_rev.good())
-		return -1.0f; // exit if file not found
-	
-	fin_rev.seekg(0, std::ios::end);
-	std::streampos size = fin_rev.tellg();
-	char * buf = new char[BUFSIZ];
-	int i = 1;
-	bool z_found = false;
-	float z = -1.0f;
-
-	for(int i=BUFSIZ;i<size;i+=BUFSIZ) {
-		fin_rev.seekg(-i-1, std::ios::end);
-		fin_rev.read(buf, (std::streamsize)BUFSIZ);
-		
-		if (code_seen('Z', buf))
+	if (begin == NULL)
+		return -1.0f; // exit if file not found or empty
+
+	// Bound the cost for files that don't extrude near their end
+	begin = max(begin, lineEnd - FIND_MAX_Z_SCAN_SIZE);
+
+	GcodeCommand command;
+	bool extruded = false;
+
+	while (lineEnd > begin)
+	{
+		const char * line = lineEnd;
+
+		while (line > begin && line[-1] != '\n')
+			line--;
+
+		GcodeTokenizer::decode(line, lineEnd, &command);
+
+		if (command.type == GCODE_G && (command.number == 0 || command.number == 1))
 		{
-			z = code_value(buf);
-			break;
+			extruded = extruded || (command.seen[E] && (command.seen[X] || command.seen[Y]));
+
+			if (extruded && command.seen[Z])
+				return command.values[Z];
 		}
-	}
 
-	fin_rev.close();
-	delete[] buf;
+		if (line == begin)
+			break;
 
-	return z;
+		lineEnd = line - 1;
+	}
+
+	return -1.0f;
 }
 
 /*
@@ -98,45 +145,24 @@ vertices: Pointer to a buffer that stores the vertices (use GcodeParser::get_buf
 nIndices: Pointer to where to store the number of indices
 indices: Pointer to a buffer that stores the indices (use GcodeParser::get_buffer_size)
 
+Returns the number of lines parsed, 0 at the end of the file or -1 if the file couldn't be opened
+
 */
-int GcodeParser::get_vertices(const unsigned int n_lines, int * nVertices, float * vertices, int * nIndices, short * indices)
+int GcodeParser::get_vertices(const unsigned int n_lines, int * nVertices, float * vertices, int * nIndices, VertexIndex * indices)
 {
-	if (!fin.good())
+	if (!opened)
 		return -1; // exit if file not found
 
-	unsigned int n = 0; // a for-loop index
-	char line[MAX_CHARS_PER_LINE]; // line buffer
-
+	// We are starting with a new buffer, the vertex indices start at 0 again
+	builder.begin(vertices, indices);
 
-	// We are starting with a new buffer, override the pointers
-	this->vertices = vertices;
-	this->indices = indices;
-
-	// Reset the vertex index and index of vertex index
-	vertex_i = 0;
-	index_i = 0;
-
-	// Read each line of the file
-	while (!fin.eof())
-	{
-		fin.getline(line, MAX_CHARS_PER_LINE);
+	unsigned int n = nThreads > 1 ? parse_records(n_lines) : parse_lines(n_lines);
 
-		// Parse it and take action (like expand the vertex buffer)
-		parse_line(line);
-
-		n++;
-		total_n++;
-
-		// Throttle every x lines by t milliseconds
-		if (throttlingInterval > 0 && total_n % throttlingInterval == 0)
-			Sleep(throttlingDuration);
-
-		if (n - 1 >= n_lines)
-			break;
-	}
+	// Build the paths that are still being merged
+	builder.flush();
 
-	*nVertices = vertex_i + 1;
-	*nIndices = index_i + 1;
+	*nVertices = builder.vertex_count();
+	*nIndices = builder.index_count();
 
 	return n;
 }
@@ -146,213 +172,224 @@ int GcodeParser::get_vertices(const unsigned int n_lines, int * nVertices, float
 // (n_lines of GcodeParser::get_vertices)
 void GcodeParser::get_buffer_size(unsigned int * vertices_size, unsigned int * indices_size)
 {
-	if (draw == DRAW_LINES)
+	builder.get_buffer_size(vertices_size, indices_size);
+}
+
+// Merge paths that are closer together than the tolerance (in mm), see VertexBuilder
+void GcodeParser::set_decimation(float tolerance)
+{
+	builder.set_tolerance(tolerance);
+}
+
+// Number of paths turned into vertices so far (after decimation)
+long GcodeParser::get_segment_count()
+{
+	return builder.segment_count();
+}
+
+// Position of the next line to interpret and the size of the file, in bytes. When decoding 
+// in parallel, the position within a range is estimated from the lines interpreted.
+void GcodeParser::get_progress(long * offset, long * size)
+{
+	const char * data = tokenizer.get_data();
+	const char * position = tokenizer.get_cursor();
+
+	if (data == NULL)
 	{
-		*vertices_size = 6 * sizeof *vertices;
-		*indices_size = 2 * sizeof *indices;
+		*offset = *size = 0;
+		return;
 	}
-	else
+
+	if (nThreads > 1 && range_i < ranges.size() && ranges[range_i].nLines > 0)
 	{
-		*vertices_size = NUM_VERTICES * 12 * sizeof *vertices;
-		*indices_size = NUM_VERTICES * 12 * sizeof *indices;
+		const GcodeRange & range = ranges[range_i];
+		position = range.begin + (range.end - range.begin) * range_line / range.nLines;
 	}
-}
 
-/* Private Methods */
+	*offset = tokenizer.offset_of(position);
+	*size = tokenizer.get_file_size();
+}
 
-// Returns true if a given character is found in a Gcode line
-// and let's the class remember where
-bool GcodeParser::code_seen(const char code, const char * line)
+// Also write the extrusion paths to a toolpath cache while parsing. The 
+// caller keeps ownership of the writer.
+void GcodeParser::set_toolpath_cache(ToolpathCacheWriter * cacheWriter)
 {
-	strchr_pointer = strchr(line, code);
-
-	return (strchr_pointer != NULL);
+	this->cacheWriter = cacheWriter;
 }
 
-// Returns the value of the closest floating point number to the last seen code
-// Requires code_seen to be ran first
-float GcodeParser::code_value(const char * line)
+// Decode the file with a number of threads, 0: one per CPU the process may run on.
+// Must be set before the first call to GcodeParser::get_vertices
+void GcodeParser::set_threads(unsigned int nThreads)
 {
-	if (strchr_pointer != NULL)
-		return strtof(&line[strchr_pointer - line + 1], NULL);
-	else
-		return 0;
+	this->nThreads = nThreads > 0 ? nThreads : available_cpus();
 }
 
-/*
-Expands the vertex buffer with two new vertices defining
-the start of the line and the end of the line, making up a gcode path. 
-The index buffer is expanded with the indices of the start and end 
-vertex of this line. The indices are only valid within a certain buffer. I.e.
-when creating a new buffer, the indices start at 0 again.
-*/
-void GcodeParser::build_vertices_lines()
+// Also write the start of each layer to a layer index while parsing. The 
+// caller keeps ownership of the writer.
+void GcodeParser::set_layer_index(LayerIndexWriter * layerIndex)
 {
-	// from
-	vertices[vertex_i]	   = absolute[X] + offset[X];
-	vertices[vertex_i + 1] = absolute[Y] + offset[Y];
-	vertices[vertex_i + 2] = absolute[Z] + offset[Z];
-
-	/* normals
-	 for now, normals are out to reduce memory
-	 if you wan't to use the cool lighting features of the tubes
-	 (see the fragment shader of the tubes)
-	 normals may come in handy.*/
-
-	//vertices[vertex_i + 3] = 0;
-	//vertices[vertex_i + 4] = 0;
-	//vertices[vertex_i + 5] = 0;
-
-	// to
-	vertices[vertex_i + 3] = relative[X];
-	vertices[vertex_i + 4] = relative[Y];
-	vertices[vertex_i + 5] = relative[Z];
-
-	// normals
-	//vertices[vertex_i + 9] = 0;
-	//vertices[vertex_i + 10] = 0;
-	//vertices[vertex_i + 11] = 0;
-
-	int vi = vertex_i / 3;
-
-	// Expand the index buffer
-	indices[index_i] = vi;			// Starting vertex
-	indices[index_i + 1] = vi + 1;	// Ending vertex
-
-	vertex_i += 6;
-	index_i += 2;
+	this->layerIndex = layerIndex;
 }
 
-// Cross product of two vectors
-// TODO: Replace with glm::cross
-void GcodeParser::cross(const float v1[3], const float v2[3], float * result)
+// Only parse a range of the file: from the start of a layer (NULL: the start of the file), 
+// with the state the parser had there, up to endOffset in the gcode. Must be set before
+// the first call to GcodeParser::get_vertices. Returns false if the file ends before the layer.
+bool GcodeParser::set_range(const LayerEntry * layer, size_t endOffset)
 {
-	result[0] = v1[Y] * v2[Z] - v2[Y] * v1[Z];
-	result[1] = v1[Z] * v2[X] - v2[Z] * v1[X];
-	result[2] = v1[X] * v2[Y] - v2[X] * v1[Y];
+	if (!opened)
+		return false;
+
+	if (layer != NULL)
+	{
+		memcpy(relative, layer->position, sizeof relative);
+		memcpy(offset, layer->origin, sizeof offset);
+		is_relative = (layer->flags & LAYER_RELATIVE) != 0;
+		skip = (layer->flags & LAYER_SKIP) != 0;
+		after_fly = (layer->flags & LAYER_AFTER_FLY) != 0;
+	}
+
+	return tokenizer.seek(layer != NULL ? layer->offset : 0, endOffset);
 }
 
-// Normalize a vector
-// TODO: Replace with glm::normalize
-void GcodeParser::normalize(const float * v, float * result)
+/* Private Methods */
+
+// Decode and interpret the next n_lines lines of the file. Returns the number of lines parsed
+unsigned int GcodeParser::parse_lines(const unsigned int n_lines)
 {
-	float l = sqrt(v[X] * v[X] + v[Y] * v[Y] + v[Z] * v[Z]);
-	result[0] = v[X] / l;
-	result[1] = v[Y] / l;
-	result[2] = v[Z] / l;
+	unsigned int n = 0; // a for-loop index
+	const char * line, * lineEnd;
+	GcodeCommand command;
+
+	// Read each line of the file
+	while (n < n_lines && tokenizer.next_line(&line, &lineEnd))
+	{
+		// Parse it and take action (like expand the vertex buffer)
+		GcodeTokenizer::decode(line, lineEnd, &command);
+		lineStart = line;
+		parse_line(&command);
+
+		n++;
+		total_n++;
+
+		// Throttle every x lines by t milliseconds, or wait while paused
+		governor->line();
+	}
+
+	return n;
 }
 
-/*
-Expands the vertex and index buffers with the elements that allow to 
-draw 3D tubs/cylinders for each gcode path. 
-*/
-void GcodeParser::build_vertices_tubes()
+// Interpret the records of the next n_lines lines, decoding the next ranges of
+// the file when needed. Returns the number of lines parsed
+unsigned int GcodeParser::parse_records(const unsigned int n_lines)
 {
-	int i = vertex_i;
+	unsigned int n = 0;
 
-	// Find the direction in which to point the cylinder
-	float direction[3] = { absolute[X] + offset[X] - relative[X], absolute[Y] + offset[Y] - relative[Y], absolute[Z] + offset[Z] - relative[Z] };
+	while (n < n_lines)
+	{
+		if (range_i == ranges.size() && !decode_ranges())
+			break;
 
-	if (abs(direction[0]) <= eps && abs(direction[1]) <= eps && abs(direction[2]) <= eps)
-		return;
+		GcodeRange & range = ranges[range_i];
 
-	float temp1[3] = { 0, 0, 0 };
-	float temp2[3] = { 0, 0, 0 };
-	float perp1[3] = { 0, 0, 0 };
-	float perp2[3] = { 0, 0, 0 };
+		if (range_line == range.nLines)
+		{
+			range_i++;
+			record_i = 0;
+			range_line = 0;
+			continue;
+		}
 
-	// Find the plane on which we draw the base circle
-	// this plane is perpendicular to the gcode path direction
+		// Take action on the records of the line, like the serial parse would
+		while (record_i < range.records.size() && range.records[record_i].line == range_line)
+		{
+			lineStart = range.records[record_i].start;
+			parse_line(&range.records[record_i++].command);
+		}
+
+		range_line++;
+		n++;
+		total_n++;
 
-	cross(direction, dirA, temp1);
+		// Throttle every x lines by t milliseconds, or wait while paused
+		governor->line();
+	}
 
-	if (abs(temp1[0]) <= eps && abs(temp1[1]) <= eps && abs(temp1[2]) <= eps)
-		cross(direction, dirB, temp1);
+	return n;
+}
 
-	normalize(temp1, perp1);
-	cross(direction, perp1, temp2);
-	normalize(temp2, perp2);
+// Split the next part of the file in a range per thread, on line boundaries, and
+// decode them in parallel. Returns false at the end of the file.
+bool GcodeParser::decode_ranges()
+{
+	// Compressed files are decompressed a chunk at a time, the ranges of the last chunk have been interpreted
+	if (tokenizer.get_cursor() >= tokenizer.get_end() && !tokenizer.refill())
+		return false;
 
-	// Draw two circles, one at the start of the gcode path 
-	// and one at the end.  A circle is basically a ring of NUM_VERTICES vertices
-	float angle = 0.0;
-	float sina, cosa;
+	const char * begin = tokenizer.get_cursor();
+	const char * end = tokenizer.get_end();
 
-	for (int k = 0; k < NUM_VERTICES; ++k)
+	ranges.resize(nThreads);
+
+	for (auto & range : ranges)
 	{
-		sina = sin(angle);
-		cosa = cos(angle);
+		const char * split = begin + min((ptrdiff_t)PARALLEL_RANGE_SIZE, end - begin);
+		const char * newline = (const char *)memchr(split, '\n', end - split);
 
-		// Calculate normals first
-		vertices[i + 3] = sina * (perp1[0]) + cosa * (perp2[0]);
-		vertices[i + 4] = sina*perp1[1] + cosa*perp2[1];
-		vertices[i + 5] = sina*perp1[2] + cosa*perp2[2];
+		range.begin = begin;
+		range.end = newline != NULL ? newline + 1 : end;
+		begin = range.end;
+	}
 
-		// Copy them for the second ring of vertices
-		vertices[i + 9] = vertices[i + 3];
-		vertices[i + 10] = vertices[i + 4];
-		vertices[i + 11] = vertices[i + 5];
+	tokenizer.set_cursor(begin);
 
-		// Calculate position of first ring of vertices that make up a circle
-		vertices[i] = R * vertices[i + 3] + relative[X];
-		vertices[i + 1] = R * vertices[i + 4] + relative[Y];
-		vertices[i + 2] = R * vertices[i + 5] + relative[Z];
+	// This thread decodes the first range
+	vector<thread> threads;
 
-		// Calculate position of second ring of vertices that make up a circle
-		vertices[i + 6] = R * vertices[i + 3] + absolute[X] + offset[X];
-		vertices[i + 7] = R * vertices[i + 4] + absolute[Y] + offset[Y];
-		vertices[i + 8] = R * vertices[i + 5] + absolute[Z] + offset[Z];
+	for (unsigned int i = 1; i < nThreads; ++i)
+		threads.emplace_back(decode_range, &ranges[i]);
 
-		angle += STEP_SIZE;
+	decode_range(&ranges[0]);
 
-		i += 12;
-	}
+	for (auto & t : threads)
+		t.join();
 
-	// Build the faces of the cylinder
-	int vi = vertex_i / 6;
-	int j = index_i;
-	int tri = 0;
-	for (; tri < (NUM_VERTICES - 1) * 2; tri += 2) {
-		indices[j] = (tri + vi);
-		indices[j + 1] = (tri + vi + 1);
-		indices[j + 2] = (tri + vi + 2);
-		indices[j + 3] = (tri + vi + 1);
-		indices[j + 4] = (tri + vi + 3);
-		indices[j + 5] = (tri + vi + 2);
-		j += 6;
-	}
+	range_i = 0;
+	record_i = 0;
+	range_line = 0;
 
-	// Close the gap (the last face that links the last vertex with the first)
-	indices[j] = (tri + vi);
-	indices[j + 1] = (tri + vi + 1);
-	indices[j + 2] = (vi);
-	indices[j + 3] = (tri + vi + 1);
-	indices[j + 4] = (vi + 1);
-	indices[j + 5] = (vi);
-	j += 6;
+	return true;
+}
 
+// Decode the lines of a range and keep the ones the parser acts on
+void GcodeParser::decode_range(GcodeRange * range)
+{
+	const char * cursor = range->begin;
+	const char * line, * lineEnd;
+	GcodeRecord record;
+
+	range->nLines = 0;
+	range->records.clear();
 
-	// If our previous move was extrusion too, link the tubes
-	if (!after_fly)
+	while (GcodeTokenizer::split_line(&cursor, range->end, &line, &lineEnd))
 	{
-		for (int tri = 0; tri < (NUM_VERTICES - 1); ++tri)
+		GcodeTokenizer::decode(line, lineEnd, &record.command);
+
+		bool relevant = record.command.type == GCODE_COMMENT || (record.command.type == GCODE_G &&
+			(record.command.number <= 1 || (record.command.number >= 90 && record.command.number <= 92)));
+
+		if (relevant)
 		{
-			indices[j] = (tri + vi);
-			indices[j + 1] = (tri + vi + 1);
-			indices[j + 2] = (tri + vi - NUM_VERTICES);
-			indices[j + 3] = (tri + vi - NUM_VERTICES + 1);
-			indices[j + 4] = (tri + vi + 1);
-			indices[j + 5] = (tri + vi - NUM_VERTICES);
-			j += 6;
+			record.line = range->nLines;
+			record.start = line;
+			range->records.push_back(record);
 		}
+
+		range->nLines++;
 	}
-	
-	vertex_i = i;
-	index_i = j;
 }
 
 // Extract a gcode path from a G0/G1 line
-void GcodeParser::parse_g1(const char * line)
+void GcodeParser::parse_g1(const GcodeCommand * command)
 {
 	//TODO: Work with glm vectors here
 
@@ -368,8 +405,8 @@ void GcodeParser::parse_g1(const char * line)
 	// in the G0/G1 line
 	for (int i = 0; i < NUMCOORDS; ++i)
 	{
-		if (code_seen(coords[i], line))
-			absolute[i] = code_value(line) + rel[i];
+		if (command->seen[i])
+			absolute[i] = command->values[i] + rel[i];
 		else
 			absolute[i] = relative[i];
 	}
@@ -381,6 +418,10 @@ void GcodeParser::parse_g1(const char * line)
 	{
 		style = EXTRUDE;
 
+		// The first extrusion at another height starts a layer, the state is still that of before the line
+		if (layerIndex != NULL && layerIndex->is_new_layer(absolute[Z] + offset[Z]))
+			add_layer(absolute[Z] + offset[Z]);
+
 		// Update the part's bounding box if it is within
 		// the bounding box of the bed. (i.e. don't include
 		// wiping sequences etc.)
@@ -404,10 +445,12 @@ void GcodeParser::parse_g1(const char * line)
 			bbox.zmax = max(bbox.zmax, absolute[Z]);
 
 		// Expand the vertex and index buffers with the new coordinates
-		if(draw == DRAW_LINES)
-			build_vertices_lines();
-		else
-			build_vertices_tubes();
+		float from[3] = { absolute[X] + offset[X], absolute[Y] + offset[Y], absolute[Z] + offset[Z] };
+
+		builder.add_segment(from, relative, !after_fly);
+
+		if (cacheWriter != NULL)
+			cacheWriter->add_segment(from, relative);
 
 		after_fly = false;
 	}
@@ -422,76 +465,61 @@ void GcodeParser::parse_g1(const char * line)
 }
 
 
+// Add a layer that starts at the current line to the layer index
+void GcodeParser::add_layer(float z)
+{
+	LayerEntry layer;
+
+	layer.offset = tokenizer.text_offset(lineStart);
+	layer.z = z;
+	memcpy(layer.position, relative, sizeof layer.position);
+	memcpy(layer.origin, offset, sizeof layer.origin);
+	layer.flags = (is_relative ? LAYER_RELATIVE : 0) | (skip ? LAYER_SKIP : 0) | (after_fly ? LAYER_AFTER_FLY : 0);
+
+	layerIndex->add_layer(layer);
+}
+
 // Add the current absolute position to the last position
-void GcodeParser::parse_g92(const char * line)
+void GcodeParser::parse_g92(const GcodeCommand * command)
 {
 	float val;
 	for (int i = 0; i < NUMCOORDS; ++i)
 	{
-		if (code_seen(coords[i], line))
+		if (command->seen[i])
 		{
-			val = code_value(line);
+			val = command->values[i];
 			offset[i] = offset[i] + relative[i] - val;
 			relative[i] = val;
 		}
 	}
 }
 
-// Deprecated: count the number of lines in thegcode file.
-// Not really much use for it anymore
-int GcodeParser::get_number_of_lines()
-{
-	int number_of_lines = 0;
-	const int SZ = 1024 * 1024;
-	char * buff = new char[SZ];
-	ifstream ifs(file);
-	while (int cc = file_read(ifs, buff, SZ)) {
-		number_of_lines += count_lines(buff, cc);
-	}
-	ifs.close();
-	delete buff;
-
-	return number_of_lines;
-}
-
-// Read N bytes from a file into a buffer
-unsigned int GcodeParser::file_read(istream & is, char * buff, int buff_size) {
-	is.read(buff, buff_size);
-	return (unsigned int)is.gcount();
-}
-
-// Count the number of lines in a text buffer
-unsigned int GcodeParser::count_lines(const char * buff, int buff_size) {
-	int newlines = 0;
-	for (int i = 0; i < buff_size; i++) {
-		if (buff[i] == '\n') {
-			newlines++;
-		}
-	}
-	return newlines;
-}
-
-// Finds the gcode in a gcode line, and takes appropriate action
+// Takes appropriate action for a decoded gcode line
 // Also determines whether the current gcode is in a segment that 
 // should be parsed or not
-void GcodeParser::parse_line(const char *line)
+void GcodeParser::parse_line(const GcodeCommand * command)
 {
 	// If we're in a segment (!skip) and we see a G
-	if (!skip && line[0] == 'G')
+	if (!skip && command->type == GCODE_G)
 	{
-		if (line[1] == '1' || line[1] == '0')
-			parse_g1(line);
-		else if (line[1] == '9')
+		switch (command->number)
 		{
-			if (line[2] == '0')
-				is_relative = false;
-			else if (line[2] == '1')
-				is_relative = true;
-			else if (line[2] == '2')
-				parse_g92(line);
+		case 0:
+		case 1:
+			parse_g1(command);
+			break;
+		case 90:
+			is_relative = false;
+			break;
+		case 91:
+			is_relative = true;
+			break;
+		case 92:
+			parse_g92(command);
+			break;
 		}
 	}
-	else if (line[0] == ';')
+	else if (command->type == GCODE_COMMENT)
 	{
 		// After any line that is a full comment, assume we're not in a 
 		// valid segment anymore
@@ -502,7 +530,7 @@ void GcodeParser::parse_line(const char *line)
 		// and continue parsing
 		for (int i = 0; i < nincludes; ++i)
 		{
-			if (strstr(line, includes[i]))
+			if (GcodeTokenizer::contains(command->comment, command->commentEnd, includes[i]))
 			{
 				skip = false;
 				break;
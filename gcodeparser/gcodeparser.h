@@ -13,32 +13,43 @@ Header file for the gcode interpreter that builds the vertex arrays
 
 #include <stdlib.h>
 #include <iostream>
-#include <fstream>
-#include <stdlib.h>
-#include <fstream>
 #include <algorithm>
 #include <math.h>
 #include <string.h>
+#include <vector>
+#include <thread>
 #include <glm/glm.hpp>
 
 #include "helpers.h"
+#include "vertexbuilder.h"
+#include "gcodetokenizer.h"
+#include "slicermetadata.h"
+#include "toolpathcache.h"
+#include "layerindex.h"
+#include "governor.h"
 
 using namespace std;
 
-#define eps 0.0001f
-#define X 0
-#define Y 1
-#define Z 2
-#define E 3
-#define NUMCOORDS 4
-
 #define FLY 0
 #define EXTRUDE 1
 
-#define MAX_CHARS_PER_LINE 512
-#define R 1
-#define NUM_VERTICES 16 // When drawing tubes, number of vertices per circle
-#define STEP_SIZE ((float)M_PI * 2 / NUM_VERTICES) // Distance between vertices for drawing tubes
+#define FIND_MAX_Z_SCAN_SIZE 1048576 // Read at most this many bytes at the end of the file to estimate the part height
+#define PARALLEL_RANGE_SIZE 1048576 // Number of bytes each thread decodes at a time when parsing in parallel
+
+// A decoded line that changes the state of the parser
+struct GcodeRecord {
+	unsigned int line;		// Number of the line within its range
+	const char * start;		// Start of the line
+	GcodeCommand command;
+};
+
+// A part of the file that is decoded by a single thread. The records don't depend
+// on the lines before the range, they are interpreted in order afterwards.
+struct GcodeRange {
+	const char * begin, * end;			// Starts at the beginning of a line, ends after a newline (or at the end of the file)
+	unsigned int nLines = 0;			// Number of lines in the range
+	std::vector<GcodeRecord> records;	// G0, G1, G90, G91 and G92 commands and comment lines
+};
 
 /*
 
@@ -48,18 +59,28 @@ Interprets the coordinates in a given Gcode file and generates
 OpenGL vertex arrays. Vertices may describe either cylinders (tubes)
 or lines . 
 
+With more than one thread, the file is split in ranges that are decoded
+in parallel. Decoding is most of the work, the decoded lines are then
+interpreted in order, which gives the same vertices as a serial parse.
+
+A range of layers can be parsed on its own, starting with the state the
+parser had at the start of the range (see LayerIndexWriter).
+
 */
-class GcodeParser
+class GcodeParser : public VertexSource
 {
 	const char * file;			// Filename of the gcode file to parse
-	ifstream fin;				// Input file stream
-	const char* strchr_pointer; // Pointer to current position in gcode line
+	GcodeTokenizer tokenizer;	// Reads the memory-mapped (or decompressed) file line by line
+	bool opened = false;		// Whether the file could be opened
 
 	unsigned int total_n = 0;    	 // Total number of lines parsed
-	unsigned int throttlingInterval; // Every N gcode lines sleep for a while
-	unsigned int throttlingDuration; // The while to sleep (in ms)
+	Governor * governor;			 // Throttles or pauses the parse
 
-	const char coords[NUMCOORDS] = { 'X', 'Y', 'Z', 'E' }; // We don't care about F
+	unsigned int nThreads = 1;		// Number of threads that decode the file
+	std::vector<GcodeRange> ranges;	// The ranges decoded last, interpreted in order
+	size_t range_i = 0;				// The range being interpreted
+	size_t record_i = 0;			// The next record of that range
+	unsigned int range_line = 0;	// The next line of that range
 
 	// Each gcode line, these coordinates are updated to calculate the distance travelled
 	float relative[NUMCOORDS] = {};
@@ -70,22 +91,17 @@ class GcodeParser
 	// or we are starting from a new position (after fly)
 	bool after_fly = true;
 
-	// Directions to expand lines to tubes
-	const float dirA[3] = { 1, 0, 0 };
-	const float dirB[3] = { 0, 1, 0 };
-
 	// Current movements are relative or absolute
 	bool is_relative = false;
 
 	// Are we curently extruding or flying
 	int style;
 
-	int vertex_i = 0;	// Index of current vertex
-	int index_i = 0;	// Index of current vertex index
-	float * vertices;	// Pointer to the vertex buffer
-	short * indices;	// Pointer to the index buffer
+	VertexBuilder builder;	// Fills the vertex and index buffers
 
-	uint8_t draw = DRAW_LINES; // DRAW_LINES or DRAW_TUBES
+	ToolpathCacheWriter * cacheWriter = NULL; // If set, the extrusion paths are also written to a toolpath cache
+	LayerIndexWriter * layerIndex = NULL;		// If set, the start of each layer is written to a layer index
+	const char * lineStart = NULL;				// Start of the line being interpreted
 
 	BBox bedBbox;		// The bounding box considered valid for printing (input)
 	BBox bbox;			// The bounding box of the part (output)
@@ -101,26 +117,30 @@ class GcodeParser
 	const char * includes[9] = { "CONTOUR", "LAYER_NO", "BRIM", "SKIRT", "layer", "skirt", "solid", "outer", "inner" };
 
 public:
-	GcodeParser(const char *file, uint8_t drawType, BBox bedBbox, const unsigned int throttlingInterval, const unsigned int throttlingDuration);
+	GcodeParser(const char *file, BBox bedBbox, Governor * governor);
 	~GcodeParser();
 	bool get_bbox(BBox * bbox);
-	int get_vertices(const unsigned int n_lines, int * nVertices, float * vertices, int * nIndices, short * indices);
+	int get_vertices(const unsigned int n_lines, int * nVertices, float * vertices, int * nIndices, VertexIndex * indices);
 	void get_buffer_size(unsigned int * vertices_size, unsigned int * indices_size);
+	void set_decimation(float tolerance);
+	long get_segment_count();
+	void get_progress(long * offset, long * size);
+	void set_toolpath_cache(ToolpathCacheWriter * cacheWriter);
+	void set_threads(unsigned int nThreads);
+	void set_layer_index(LayerIndexWriter * layerIndex);
+	bool set_range(const LayerEntry * layer, size_t endOffset);
 
 private:
-	bool code_seen(char code, const char * line);
-	float code_value(const char * line);
-	void build_vertices_lines();
-	void cross(const float v1[3], const float v2[3], float * result);
-	void normalize(const float * v, float * result);
-	void build_vertices_tubes();
-	void parse_g1(const char * line);
-	void parse_g92(const char * line);
-	unsigned int file_read(istream & is, char * buff, int buff_size);
-	int get_number_of_lines();
-	unsigned int count_lines(const char * buff, int buff_size);
-	void parse_line(const char *line);
-	float find_max_z();
+	unsigned int parse_lines(const unsigned int n_lines);
+	unsigned int parse_records(const unsigned int n_lines);
+	bool decode_ranges();
+	static void decode_range(GcodeRange * range);
+	void parse_g1(const GcodeCommand * command);
+	void parse_g92(const GcodeCommand * command);
+	void parse_line(const GcodeCommand * command);
+	void add_layer(float z);
+	void use_metadata(SlicerMetadata * metadata);
+	float find_max_z(const char * begin, const char * lineEnd);
 };
 
 
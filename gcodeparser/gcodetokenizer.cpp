@@ -0,0 +1,336 @@
+#include "gcodetokenizer.h"
+
+// Powers of ten that a double holds exactly
+static const double powersOfTen[] = { 1e0, 1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11,
+	1e12, 1e13, 1e14, 1e15, 1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22 };
+
+GcodeTokenizer::~GcodeTokenizer()
+{
+	delete input;
+}
+
+// Map a gcode file into memory. Returns false if the file doesn't exist, or is compressed and corrupt.
+bool GcodeTokenizer::open(const char * file)
+{
+	if (!mappedFile.open(file))
+		return false;
+
+	const char * mapped = mappedFile.get_data();
+	size_t size = mappedFile.get_size();
+
+	data = cursor = mapped;
+	end = mapped + size;
+
+	switch (GcodeInput::detect(mapped, size))
+	{
+	case INPUT_GZIP:
+		input = new GzipInput(mapped, size);
+		break;
+	case INPUT_BGCODE:
+		input = new BgcodeInput(mapped, size);
+		break;
+	default:
+		return true;
+	}
+
+	if (!input->open())
+		return false;
+
+	buffer.resize(INPUT_CHUNK_SIZE);
+	data = cursor = end = buffer.data();
+
+	return refill() || !input->has_failed();
+}
+
+// Get the next line of the file, without the newline. The line is not
+// zero-terminated, it ends at lineEnd. Returns false at the end of the file.
+bool GcodeTokenizer::next_line(const char ** line, const char ** lineEnd)
+{
+	if (cursor >= end && !refill())
+		return false;
+
+	return split_line(&cursor, end, line, lineEnd);
+}
+
+// Move on to the next chunk of a compressed file, once the lines of the current chunk
+// have been read. Returns false at the end of the file (or range), and always for plain
+// gcode, which is mapped as a whole.
+bool GcodeTokenizer::refill()
+{
+	if (input == NULL || dataOffset + (end - data) >= limit)
+		return false;
+
+	dataOffset += end - data;
+
+	// The start of the next chunk was read ahead
+	size_t readAhead = buffered - (end - data);
+	memmove(buffer.data(), end, readAhead);
+	buffered = readAhead;
+	chunkOffset = nextChunkOffset;
+
+	size_t chunkSize;
+
+	while (true)
+	{
+		if (!inputEnded)
+		{
+			buffered += input->read(buffer.data() + buffered, buffer.size() - buffered);
+			inputEnded = buffered < buffer.size();
+
+			if (inputEnded && input->has_failed())
+				log_msg(error, "Compressed gcode file is corrupt, it is parsed up to the corrupt part");
+		}
+
+		if (inputEnded)
+		{
+			chunkSize = buffered;
+			break;
+		}
+
+		// End the chunk after the last whole line
+		chunkSize = buffered;
+
+		while (chunkSize > 0 && buffer[chunkSize - 1] != '\n')
+			chunkSize--;
+
+		if (chunkSize > 0)
+			break;
+
+		// A line that doesn't fit the buffer
+		buffer.resize(buffer.size() * 2);
+	}
+
+	data = cursor = buffer.data();
+	end = data + std::min(chunkSize, limit - dataOffset);
+	nextChunkOffset = input->get_offset();
+
+	return end > data;
+}
+
+// Limit the lines to a range of the gcode, from beginOffset up to endOffset. Both are offsets
+// in the decompressed gcode at the start of a line, or the end of the file. A compressed file
+// is decompressed up to beginOffset, a plain file is just mapped. Must be called before the
+// first line is read. Returns false if the gcode ends before beginOffset.
+bool GcodeTokenizer::seek(size_t beginOffset, size_t endOffset)
+{
+	if (data == NULL)
+		return false;
+
+	endOffset = std::max(beginOffset, endOffset);
+
+	if (input == NULL)
+	{
+		size_t size = mappedFile.get_size();
+
+		cursor = data + std::min(beginOffset, size);
+		end = data + std::min(endOffset, size);
+
+		return beginOffset <= size;
+	}
+
+	// Skip the chunks before the range
+	while (dataOffset + (end - data) <= beginOffset)
+	{
+		if (!refill())
+			return false;
+	}
+
+	cursor = data + (beginOffset - dataOffset);
+	end = data + std::min((size_t)(end - data), endOffset - dataOffset);
+	limit = endOffset;
+
+	return true;
+}
+
+// Whether the data holds the whole file: always for plain gcode, for a compressed file
+// only if it fits in a single chunk
+bool GcodeTokenizer::is_complete()
+{
+	return input == NULL || (inputEnded && chunkOffset == 0);
+}
+
+// Read about the last size bytes of a compressed file that doesn't fit a single chunk, from
+// the start of a line, to look ahead at the end of the file. Returns false if the data holds
+// the whole file already.
+bool GcodeTokenizer::read_tail(std::string * tail, size_t size)
+{
+	if (is_complete())
+		return false;
+
+	input->read_tail(tail, size);
+
+	if (tail->size() > size)
+		tail->erase(0, tail->size() - size);
+
+	size_t newline = tail->find('\n');
+	tail->erase(0, newline != std::string::npos ? newline + 1 : tail->size());
+
+	return !tail->empty();
+}
+
+// Offset in the file of a position in the data. For a compressed file, it is estimated
+// from the compressed bytes the current chunk was decompressed from.
+size_t GcodeTokenizer::offset_of(const char * position)
+{
+	if (input == NULL)
+		return position - data;
+
+	if (end == data)
+		return nextChunkOffset;
+
+	return chunkOffset + (size_t)((double)(nextChunkOffset - chunkOffset) * (position - data) / (end - data));
+}
+
+// Metadata that is stored outside the gcode, as gcode comments (see BgcodeInput)
+const std::string & GcodeTokenizer::get_metadata()
+{
+	static const std::string none;
+
+	return input != NULL ? input->get_metadata() : none;
+}
+
+// Get the line at cursor, without the newline, and move the cursor to the next line.
+// Returns false if the cursor reached end.
+bool GcodeTokenizer::split_line(const char ** cursor, const char * end, const char ** line, const char ** lineEnd)
+{
+	if (*cursor >= end)
+		return false;
+
+	// memchr compares a word (or a vector register) of characters at a time
+	const char * newline = (const char *)memchr(*cursor, '\n', end - *cursor);
+
+	*line = *cursor;
+	*lineEnd = newline != NULL ? newline : end;
+	*cursor = newline != NULL ? newline + 1 : end;
+
+	return true;
+}
+
+/*
+Decode a gcode line in a single pass. Only G commands and their X, Y, Z and E
+parameters are decoded, anything after a ; is ignored.
+
+line: Start of the line
+lineEnd: End of the line
+command: The decoded command
+
+*/
+void GcodeTokenizer::decode(const char * line, const char * lineEnd, GcodeCommand * command)
+{
+	const char * p = line;
+
+	command->type = GCODE_NONE;
+	command->number = -1;
+	memset(command->seen, 0, sizeof command->seen);
+
+	while (p < lineEnd && (*p == ' ' || *p == '\t'))
+		p++;
+
+	if (p == lineEnd)
+		return;
+
+	if (*p == ';')
+	{
+		command->type = GCODE_COMMENT;
+		command->comment = p + 1;
+		command->commentEnd = lineEnd;
+		return;
+	}
+
+	if (*p != 'G')
+		return;
+
+	// The command number, e.g. 1 in G1 or G01
+	const char * numberStart = ++p;
+	int number = 0;
+
+	while (p < lineEnd && *p >= '0' && *p <= '9')
+		number = number * 10 + (*p++ - '0');
+
+	if (p == numberStart)
+		return;
+
+	command->type = GCODE_G;
+	command->number = number;
+
+	// The parameters. Other parameters (F, S, ...) are passed over, their
+	// digits aren't mistaken for anything we decode
+	while (p < lineEnd && *p != ';')
+	{
+		int axis;
+
+		switch (*p++)
+		{
+		case 'X': axis = X; break;
+		case 'Y': axis = Y; break;
+		case 'Z': axis = Z; break;
+		case 'E': axis = E; break;
+		default: continue;
+		}
+
+		p = parse_float(p, lineEnd, &command->values[axis]);
+		command->seen[axis] = true;
+	}
+}
+
+// Returns true if the text between begin and end contains needle
+bool GcodeTokenizer::contains(const char * begin, const char * end, const char * needle)
+{
+	return std::search(begin, end, needle, needle + strlen(needle)) != end;
+}
+
+// Parse a decimal number like -12.345, without exponent (an E would be the
+// next parameter). Returns a pointer to the first character after the number.
+// Like strtof, there is no error; without digits the value is 0.
+const char * GcodeTokenizer::parse_float(const char * p, const char * end, float * value)
+{
+	while (p < end && (*p == ' ' || *p == '\t'))
+		p++;
+
+	bool negative = false;
+
+	if (p < end && (*p == '-' || *p == '+'))
+		negative = *p++ == '-';
+
+	// Collect the digits as an integer, and count the decimals
+	uint64_t mantissa = 0;
+	int digits = 0, decimals = 0;
+
+	for (; p < end && *p >= '0' && *p <= '9'; ++p)
+	{
+		if (digits < 18)
+		{
+			mantissa = mantissa * 10 + (*p - '0');
+			digits += mantissa > 0;
+		}
+		else
+		{
+			decimals--;
+		}
+	}
+
+	if (p < end && *p == '.')
+	{
+		for (++p; p < end && *p >= '0' && *p <= '9'; ++p)
+		{
+			if (digits < 18)
+			{
+				mantissa = mantissa * 10 + (*p - '0');
+				digits += mantissa > 0;
+				decimals++;
+			}
+		}
+	}
+
+	// Dividing two exact doubles rounds correctly, the conversion to float rounds again
+	double result = (double)mantissa;
+
+	if (decimals > 0)
+		result /= decimals < 23 ? powersOfTen[decimals] : pow(10.0, decimals);
+	else if (decimals < 0)
+		result *= pow(10.0, -decimals);
+
+	*value = (float)(negative ? -result : result);
+
+	return p;
+}
@@ -0,0 +1,100 @@
+/*
+
+gcodetokenizer.h
+
+Header file for the tokenizer that splits a memory-mapped gcode file
+into lines and decodes the commands the parser is interested in
+
+*/
+
+#ifndef GCODETOKENIZER_H
+#define GCODETOKENIZER_H 1
+
+#include <stdint.h>
+#include <string.h>
+#include <math.h>
+#include <algorithm>
+#include <string>
+#include <vector>
+
+#include "helpers.h"
+#include "mappedfile.h"
+#include "gcodeinput.h"
+#include "vertexbuilder.h"
+
+#define GCODE_NONE 0		// Empty line, or a command we don't decode
+#define GCODE_G 1			// A G command, see GcodeCommand::number
+#define GCODE_COMMENT 2		// A line that is a comment as a whole
+
+#define INPUT_CHUNK_SIZE 4194304	// Bytes of a compressed file that are decompressed at a time
+
+// A single decoded gcode line
+struct GcodeCommand {
+	int type = GCODE_NONE;
+	int number = -1;				// The number of a G command, e.g. 1 for G1
+
+	float values[NUMCOORDS];		// X, Y, Z and E parameters
+	bool seen[NUMCOORDS];			// Whether the parameter was on the line
+
+	const char * comment = NULL;	// Text of a comment line
+	const char * commentEnd = NULL;
+};
+
+/*
+
+GcodeTokenizer
+
+Maps a gcode file into memory and walks it line by line. Each line is
+decoded in a single left-to-right pass, parameters in trailing comments
+are ignored.
+
+Compressed files (gzip and binary gcode) are decompressed a chunk at a
+time into a buffer of INPUT_CHUNK_SIZE bytes. A chunk ends after its last
+whole line, the data, cursor and end then refer to the current chunk.
+
+The lines may be limited to a range of the gcode, e.g. a range of layers
+(see LayerIndexReader). Offsets in the gcode are those of the decompressed
+text, which is what a printer is sent.
+
+*/
+class GcodeTokenizer
+{
+	MappedFile mappedFile;
+	const char * data = NULL;	// Start of the file, or of the current chunk
+	const char * cursor = NULL;	// Start of the next line
+	const char * end = NULL;	// End of the file, or of the current chunk
+
+	GcodeInput * input = NULL;	// Decompresses the file, NULL for plain gcode
+	std::vector<char> buffer;	// The current chunk, followed by the start of the next one
+	size_t buffered = 0;		// Number of bytes in the buffer
+	bool inputEnded = false;	// Whether the input has been read to the end
+	size_t chunkOffset = 0;		// Offset in the compressed file where the current chunk starts
+	size_t nextChunkOffset = 0;	// And where the next one starts
+	size_t dataOffset = 0;		// Offset in the decompressed gcode where the current chunk starts
+	size_t limit = SIZE_MAX;	// Offset in the decompressed gcode the lines end at, see GcodeTokenizer::seek
+
+public:
+	~GcodeTokenizer();
+	bool open(const char * file);
+	bool next_line(const char ** line, const char ** lineEnd);
+	bool refill();
+	bool seek(size_t beginOffset, size_t endOffset);
+	const char * get_data() { return data; };
+	const char * get_end() { return end; };
+	const char * get_cursor() { return cursor; };
+	void set_cursor(const char * cursor) { this->cursor = cursor; };
+	bool is_complete();
+	bool read_tail(std::string * tail, size_t size);
+	size_t offset_of(const char * position);
+	size_t text_offset(const char * position) { return dataOffset + (position - data); };
+	size_t get_file_size() { return mappedFile.get_size(); };
+	const std::string & get_metadata();
+
+	static bool split_line(const char ** cursor, const char * end, const char ** line, const char ** lineEnd);
+
+	static void decode(const char * line, const char * lineEnd, GcodeCommand * command);
+	static bool contains(const char * begin, const char * end, const char * needle);
+	static const char * parse_float(const char * p, const char * end, float * value);
+};
+
+#endif // !GCODETOKENIZER_H
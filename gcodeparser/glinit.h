@@ -23,6 +23,11 @@ typedef RenderContextGLFW T_RENDERCONTEXT;
 
 #define USE_GLEW
 #define NEED_VERTEX_ARRAY_OBJECT
+#define RENDERBUFFER_COLOR_FORMAT GL_RGBA8
+
+// Instanced drawing, part of OpenGL 3.3
+typedef PFNGLDRAWARRAYSINSTANCEDPROC DrawArraysInstancedProc;
+typedef PFNGLVERTEXATTRIBDIVISORPROC VertexAttribDivisorProc;
 
 #else
 
@@ -32,6 +37,14 @@ typedef RenderContextGLFW T_RENDERCONTEXT;
 
 typedef RenderContextEGL T_RENDERCONTEXT;
 
+// Requires OES_rgb8_rgba8, which is available on about any GLES2 implementation
+#define RENDERBUFFER_COLOR_FORMAT GL_RGBA8_OES
+
+// Instanced drawing, part of OpenGL ES 3.0 and an extension (ANGLE, EXT or NV_instanced_arrays)
+// of OpenGL ES 2.0. Looked up at runtime, as the GLES2 library doesn't export it.
+typedef void (GL_APIENTRYP DrawArraysInstancedProc)(GLenum mode, GLint first, GLsizei count, GLsizei primcount);
+typedef void (GL_APIENTRYP VertexAttribDivisorProc)(GLuint index, GLuint divisor);
+
 #endif // _WIN32
 
 
@@ -0,0 +1,87 @@
+#include "governor.h"
+
+/*
+Initialize the Governor class
+
+interval: After n lines, pause
+duration: The duration of the pause in milliseconds
+
+*/
+Governor::Governor(unsigned int interval, unsigned int duration) : interval(interval), duration(duration), paused(false), cancelled(false), throttledTime(0)
+{
+}
+
+// Change the throttling, takes effect at the next line
+void Governor::configure(unsigned int interval, unsigned int duration)
+{
+	std::lock_guard<std::mutex> lock(mutex);
+
+	this->interval = interval;
+	this->duration = duration;
+	changed.notify_all();
+}
+
+// Hold the parser at the next line, until resumed
+void Governor::pause()
+{
+	std::lock_guard<std::mutex> lock(mutex);
+
+	paused = true;
+}
+
+void Governor::resume()
+{
+	std::lock_guard<std::mutex> lock(mutex);
+
+	paused = false;
+	changed.notify_all();
+}
+
+// Stop the current render. Also ends a pause or throttling sleep, so the
+// parser gets to the end of its chunk
+void Governor::cancel()
+{
+	std::lock_guard<std::mutex> lock(mutex);
+
+	cancelled = true;
+	changed.notify_all();
+}
+
+/* Private methods */
+
+// Sleep for the throttling duration, or for as long as we're paused. A new
+// throttling ends the sleep early. Logs outside the lock: the thread that
+// resumes us may hold the GIL.
+void Governor::hold()
+{
+	// A cancelled render isn't held up, the renderer stops it at the end of the chunk
+	if (cancelled)
+		return;
+
+	auto start = std::chrono::steady_clock::now();
+
+	if (paused)
+	{
+		log_msg(debug, "Parser paused");
+
+		{
+			std::unique_lock<std::mutex> lock(mutex);
+			changed.wait(lock, [this] { return !paused || cancelled; });
+		}
+
+		log_msg(debug, "Parser resumed");
+	}
+	else
+	{
+		std::unique_lock<std::mutex> lock(mutex);
+		unsigned int interval = this->interval, duration = this->duration;
+
+		changed.wait_for(lock, std::chrono::milliseconds(duration), [this, interval, duration] {
+			return paused || cancelled || this->interval != interval || this->duration != duration;
+		});
+
+		lines = 0;
+	}
+
+	throttledTime += std::chrono::duration_cast<std::chrono::microseconds>(std::chrono::steady_clock::now() - start).count();
+}
@@ -0,0 +1,68 @@
+/*
+
+governor.h
+
+Header file for the governor that slows down or pauses the parser while
+a render runs, as told by the plugin
+
+*/
+
+#ifndef GOVERNOR_H
+#define GOVERNOR_H 1
+
+#include <atomic>
+#include <chrono>
+#include <mutex>
+#include <condition_variable>
+
+#include "helpers.h"
+
+/*
+
+Governor
+
+Sleeps for a while every number of lines the parser reads, and blocks it
+while paused. The throttling can be changed and the parser paused from any
+thread, also during a render. The time the parser was held up is kept, so
+it can be reported per render. A render can be cancelled from any thread,
+the renderer checks for it between chunks.
+
+*/
+class Governor
+{
+	std::atomic<unsigned int> interval;		// Every N lines sleep for a while, 0: don't throttle
+	std::atomic<unsigned int> duration;		// The while to sleep (in ms)
+	std::atomic<bool> paused;
+	std::atomic<bool> cancelled;			// Stop the current render, reset when the next render starts
+
+	std::mutex mutex;
+	std::condition_variable changed;		// Notified on resume, and when the throttling changes
+
+	unsigned int lines = 0;					// Lines since the last sleep, only touched by the parsing thread
+	std::atomic<long long> throttledTime;	// Time held up since the last reset (in µs)
+
+public:
+	Governor(unsigned int interval, unsigned int duration);
+	void configure(unsigned int interval, unsigned int duration);
+	void pause();
+	void resume();
+	bool is_paused() { return paused; };
+	void cancel();
+	bool is_cancelled() { return cancelled; };
+
+	// Called by the parser for every line
+	void line()
+	{
+		if (paused || (interval > 0 && ++lines >= interval))
+			hold();
+	};
+
+	void reset_stats() { throttledTime = 0; };
+	void reset_cancel() { cancelled = false; };
+	double get_throttled_time() { return throttledTime / 1e6; };
+
+private:
+	void hold();
+};
+
+#endif // !GOVERNOR_H
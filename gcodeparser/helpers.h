@@ -12,8 +12,8 @@ a helper method to log messages to Python
 
 #include <stdio.h>
 
-#define DRAW_TUBES 0 // Draw 3D tubes with n faces for every 3D printed path
-#define DRAW_LINES 1 // Draw OpenGL lines without faces (far less memory required)
+#define DRAW_TUBES 0 // Draw lit, round tubes for every 3D printed path, built on the GPU from the same vertices as the lines
+#define DRAW_LINES 1 // Draw OpenGL lines of a pixel wide
 
 // A bounding box structure that defines a given volume in 3D space
 struct BBox {
@@ -49,10 +49,36 @@ void log_msg(int type, const char *msg);
 
 #ifdef __linux__ 
 #include <unistd.h>
+#include <sched.h>
 #else
 #include <windows.h>
 #endif 
 
+#include <thread>
+#include <chrono>
+
+// Returns a monotonic time in seconds, for measuring durations
+inline double now_seconds()
+{
+	return std::chrono::duration<double>(std::chrono::steady_clock::now().time_since_epoch()).count();
+}
+
+// Returns the number of CPUs the process may run on, respecting its CPU affinity
+inline unsigned int available_cpus()
+{
+	unsigned int n = 0;
+
+#ifdef __linux__
+	cpu_set_t cpus;
+	if (sched_getaffinity(0, sizeof cpus, &cpus) == 0)
+		n = CPU_COUNT(&cpus);
+#endif
+	if (n == 0)
+		n = std::thread::hardware_concurrency();
+
+	return n > 0 ? n : 1;
+}
+
 // Returns a nice rgba #AABBCCDDEE color code for a float[4]
 inline void getColorHash(char * out, float color[4])
 {
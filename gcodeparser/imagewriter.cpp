@@ -0,0 +1,405 @@
+/*
+
+imagewriter.cpp
+
+libpng and libjpeg report errors by jumping back to where the encoding
+started. Everything that needs cleaning up is created before that point.
+
+*/
+#include "imagewriter.h"
+
+// libpng calls these with its own struct, the image writer is found through it
+
+// Append the encoded data to the output buffer
+static void pngWriteMemory(png_structp png_ptr, png_bytep data, png_size_t length)
+{
+	std::vector<uint8_t> * out = (std::vector<uint8_t> *)png_get_io_ptr(png_ptr);
+	out->insert(out->end(), data, data + length);
+}
+
+static void pngFlushMemory(png_structp png_ptr)
+{
+}
+
+// Log the message and jump back to encode_png, libpng may not continue
+static void pngError(png_structp png_ptr, png_const_charp error_msg)
+{
+	log_msg(error, error_msg);
+	longjmp(png_jmpbuf(png_ptr), 1);
+}
+
+// Log a warning message using our own log handler
+static void pngWarning(png_structp png_ptr, png_const_charp warning_msg)
+{
+	log_msg(warning, warning_msg);
+}
+
+#ifdef HAVE_JPEG
+// libjpeg's error manager, with the point to jump back to
+struct JpegError {
+	struct jpeg_error_mgr manager;
+	jmp_buf jump;
+};
+
+static void jpegError(j_common_ptr cinfo)
+{
+	char message[JMSG_LENGTH_MAX];
+	(*cinfo->err->format_message)(cinfo, message);
+	log_msg(error, message);
+
+	longjmp(((JpegError *)cinfo->err)->jump, 1);
+}
+#endif
+
+/*
+Initialize the ImageWriter class
+
+format: The file format and its options
+
+*/
+ImageWriter::ImageWriter(const ImageFormat & format)
+{
+	this->format = format;
+}
+
+// Whether the image writer was built with support for a format
+bool ImageWriter::supports(int format)
+{
+	switch (format)
+	{
+	case IMAGE_PNG:
+		return true;
+#ifdef HAVE_JPEG
+	case IMAGE_JPEG:
+		return true;
+#endif
+#ifdef HAVE_WEBP
+	case IMAGE_WEBP:
+		return true;
+#endif
+	default:
+		return false;
+	}
+}
+
+/*
+Encode an image into a buffer
+
+rgba: The pixels, 4 bytes each, the bottom row first
+width, height: Size of the image
+out: Receives the encoded image
+
+*/
+bool ImageWriter::encode(const uint8_t * rgba, unsigned int width, unsigned int height, std::vector<uint8_t> * out)
+{
+	out->clear();
+
+	switch (format.format)
+	{
+	case IMAGE_PNG:
+		return encode_png(rgba, width, height, out);
+	case IMAGE_JPEG:
+		return encode_jpeg(rgba, width, height, out);
+	case IMAGE_WEBP:
+		return encode_webp(rgba, width, height, out);
+	default:
+		log_msg(error, "Unknown image format");
+		return false;
+	}
+}
+
+// Encode an image and write it to a file
+bool ImageWriter::write(const char * imageFile, const uint8_t * rgba, unsigned int width, unsigned int height)
+{
+	std::vector<uint8_t> data;
+
+	if (!encode(rgba, width, height, &data))
+		return false;
+
+	// Open file for writing (binary mode)
+	FILE * file = fopen(imageFile, "wb");
+
+	if (file == NULL)
+	{
+		log_msg(error, "Could not open image file for writing");
+		return false;
+	}
+
+	bool written = fwrite(data.data(), 1, data.size(), file) == data.size();
+	written = fclose(file) == 0 && written;
+
+	if (!written)
+		log_msg(error, "Could not write image file");
+
+	return written;
+}
+
+/* Private methods */
+
+bool ImageWriter::encode_png(const uint8_t * rgba, unsigned int width, unsigned int height, std::vector<uint8_t> * out)
+{
+	std::vector<uint8_t> pixels;
+	std::vector<uint32_t> palette;
+	std::vector<png_bytep> rows(height);
+
+	int colorType, bitDepth = 8, filters = format.filters;
+
+	// Convert the pixels for the color type. The rows are flipped, PNG stores the top row first
+	if (format.pngColors == PNG_COLORS_INDEXED && to_indexed(rgba, width, height, &pixels, &palette))
+	{
+		colorType = PNG_COLOR_TYPE_PALETTE;
+
+		// A handful of colors fit in less than a byte per pixel
+		size_t n = palette.size();
+		bitDepth = n <= 2 ? 1 : n <= 4 ? 2 : n <= 16 ? 4 : 8;
+
+		// Filters only help for continuous tones
+		if (filters < 0)
+			filters = PNG_FILTER_NONE;
+
+		for (unsigned int i = 0; i < height; ++i)
+			rows[i] = &pixels[i * width];
+	}
+	else if (format.pngColors != PNG_COLORS_RGBA)
+	{
+		colorType = PNG_COLOR_TYPE_RGB;
+		to_rgb(rgba, width, height, &pixels);
+
+		for (unsigned int i = 0; i < height; ++i)
+			rows[i] = &pixels[i * width * 3];
+	}
+	else
+	{
+		colorType = PNG_COLOR_TYPE_RGBA;
+
+		for (unsigned int i = 0; i < height; ++i)
+			rows[i] = (png_bytep)&rgba[(height - i - 1) * width * 4];
+	}
+
+	// Initialize write structure
+	png_structp png_ptr = png_create_write_struct(PNG_LIBPNG_VER_STRING, NULL, pngError, pngWarning);
+
+	if (png_ptr == NULL)
+	{
+		log_msg(error, "Could not allocate PNG write struct");
+		return false;
+	}
+
+	// Initialize info structure
+	png_infop info_ptr = png_create_info_struct(png_ptr);
+
+	if (info_ptr == NULL)
+	{
+		log_msg(error, "Could not allocate PNG info struct");
+		png_destroy_write_struct(&png_ptr, NULL);
+		return false;
+	}
+
+	// libpng jumps back here on errors
+	if (setjmp(png_jmpbuf(png_ptr)))
+	{
+		png_destroy_write_struct(&png_ptr, &info_ptr);
+		return false;
+	}
+
+	png_set_write_fn(png_ptr, out, pngWriteMemory, pngFlushMemory);
+
+	png_set_IHDR(png_ptr, info_ptr, width, height,
+		bitDepth, colorType, PNG_INTERLACE_NONE,
+		PNG_COMPRESSION_TYPE_BASE, PNG_FILTER_TYPE_BASE);
+
+	if (colorType == PNG_COLOR_TYPE_PALETTE)
+	{
+		png_color colors[PALETTE_SIZE];
+		png_byte alphas[PALETTE_SIZE];
+		int nAlphas = 0;
+
+		for (size_t i = 0; i < palette.size(); ++i)
+		{
+			uint8_t color[4];
+			memcpy(color, &palette[i], 4);
+
+			colors[i].red = color[0];
+			colors[i].green = color[1];
+			colors[i].blue = color[2];
+			alphas[i] = color[3];
+
+			// Only the colors up to the last translucent one need an alpha value
+			if (color[3] != 255)
+				nAlphas = i + 1;
+		}
+
+		png_set_PLTE(png_ptr, info_ptr, colors, palette.size());
+
+		if (nAlphas > 0)
+			png_set_tRNS(png_ptr, info_ptr, alphas, nAlphas, NULL);
+	}
+
+	if (format.compressionLevel >= 0)
+		png_set_compression_level(png_ptr, format.compressionLevel);
+
+	if (filters >= 0)
+		png_set_filter(png_ptr, PNG_FILTER_TYPE_BASE, filters);
+
+	png_set_rows(png_ptr, info_ptr, rows.data());
+
+	// Encode the PNG image, packing the indices of small palettes
+	png_write_png(png_ptr, info_ptr, bitDepth < 8 ? PNG_TRANSFORM_PACKING : PNG_TRANSFORM_IDENTITY, NULL);
+
+	png_destroy_write_struct(&png_ptr, &info_ptr);
+
+	return true;
+}
+
+bool ImageWriter::encode_jpeg(const uint8_t * rgba, unsigned int width, unsigned int height, std::vector<uint8_t> * out)
+{
+#ifdef HAVE_JPEG
+	std::vector<uint8_t> rgb;
+	to_rgb(rgba, width, height, &rgb);
+
+	struct jpeg_compress_struct cinfo;
+	JpegError jerr;
+	unsigned char * buffer = NULL;
+	unsigned long size = 0;
+
+	cinfo.err = jpeg_std_error(&jerr.manager);
+	jerr.manager.error_exit = jpegError;
+
+	// libjpeg jumps back here on errors
+	if (setjmp(jerr.jump))
+	{
+		jpeg_destroy_compress(&cinfo);
+		free(buffer);
+		return false;
+	}
+
+	jpeg_create_compress(&cinfo);
+	jpeg_mem_dest(&cinfo, &buffer, &size);
+
+	cinfo.image_width = width;
+	cinfo.image_height = height;
+	cinfo.input_components = 3;
+	cinfo.in_color_space = JCS_RGB;
+
+	jpeg_set_defaults(&cinfo);
+	jpeg_set_quality(&cinfo, format.quality, TRUE);
+	jpeg_start_compress(&cinfo, TRUE);
+
+	while (cinfo.next_scanline < height)
+	{
+		JSAMPROW row = &rgb[cinfo.next_scanline * width * 3];
+		jpeg_write_scanlines(&cinfo, &row, 1);
+	}
+
+	jpeg_finish_compress(&cinfo);
+	out->assign(buffer, buffer + size);
+
+	jpeg_destroy_compress(&cinfo);
+	free(buffer);
+
+	return true;
+#else
+	log_msg(error, "JPEG images are not supported, libjpeg wasn't found when building");
+	return false;
+#endif
+}
+
+bool ImageWriter::encode_webp(const uint8_t * rgba, unsigned int width, unsigned int height, std::vector<uint8_t> * out)
+{
+#ifdef HAVE_WEBP
+	std::vector<uint8_t> rgb;
+	to_rgb(rgba, width, height, &rgb);
+
+	uint8_t * buffer = NULL;
+	size_t size = WebPEncodeRGB(rgb.data(), width, height, width * 3, (float)format.quality, &buffer);
+
+	if (size == 0)
+	{
+		log_msg(error, "Could not encode WebP image");
+		return false;
+	}
+
+	out->assign(buffer, buffer + size);
+	free(buffer);
+
+	return true;
+#else
+	log_msg(error, "WebP images are not supported, libwebp wasn't found when building");
+	return false;
+#endif
+}
+
+// Drop the alpha channel, and store the top row first
+void ImageWriter::to_rgb(const uint8_t * rgba, unsigned int width, unsigned int height, std::vector<uint8_t> * rgb)
+{
+	rgb->resize(width * height * 3);
+	uint8_t * p = rgb->data();
+
+	for (unsigned int y = 0; y < height; ++y)
+	{
+		const uint8_t * row = &rgba[(height - y - 1) * width * 4];
+
+		for (unsigned int x = 0; x < width; ++x, p += 3)
+			memcpy(p, &row[x * 4], 3);
+	}
+}
+
+// Convert the pixels to indices in a palette, with the top row first. Returns false
+// if the image has more colors than fit in a palette.
+bool ImageWriter::to_indexed(const uint8_t * rgba, unsigned int width, unsigned int height, std::vector<uint8_t> * indices, std::vector<uint32_t> * palette)
+{
+	// Open addressing hash table of the colors seen so far
+	const unsigned int tableSize = 4 * PALETTE_SIZE;
+	uint32_t colors[tableSize];
+	int slots[tableSize];
+	std::fill(slots, slots + tableSize, -1);
+
+	indices->resize(width * height);
+	palette->clear();
+
+	uint32_t last = 0;
+	uint8_t lastIndex = 0;
+	bool hasLast = false;
+
+	for (unsigned int y = 0; y < height; ++y)
+	{
+		const uint8_t * row = &rgba[(height - y - 1) * width * 4];
+		uint8_t * out = &(*indices)[y * width];
+
+		for (unsigned int x = 0; x < width; ++x)
+		{
+			uint32_t color;
+			memcpy(&color, &row[x * 4], 4);
+
+			// Most pixels have the color of their neighbour
+			if (hasLast && color == last)
+			{
+				out[x] = lastIndex;
+				continue;
+			}
+
+			unsigned int slot = (color * 2654435761u) >> 22;	// Multiplicative hash, 10 bits for 1024 slots
+
+			while (slots[slot] >= 0 && colors[slot] != color)
+				slot = (slot + 1) % tableSize;
+
+			if (slots[slot] < 0)
+			{
+				if (palette->size() == PALETTE_SIZE)
+					return false;
+
+				colors[slot] = color;
+				slots[slot] = palette->size();
+				palette->push_back(color);
+			}
+
+			last = color;
+			lastIndex = (uint8_t)slots[slot];
+			hasLast = true;
+
+			out[x] = lastIndex;
+		}
+	}
+
+	return true;
+}
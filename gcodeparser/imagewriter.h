@@ -0,0 +1,83 @@
+/*
+
+imagewriter.h
+
+Header file for the image writer, which encodes the rendered images as
+PNG, JPEG or WebP, to a file or to memory.
+
+*/
+
+#ifndef IMAGEWRITER_H
+#define IMAGEWRITER_H 1
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <stdint.h>
+#include <string.h>
+#include <vector>
+
+// Include libpng before setjmp.h, libpng 1.2 refuses to compile otherwise
+#include <png.h>
+#include <setjmp.h>
+
+// JPEG and WebP are optional, see setup.py
+#ifdef HAVE_JPEG
+#include <jpeglib.h>
+#endif
+
+#ifdef HAVE_WEBP
+#include <webp/encode.h>
+#endif
+
+#include "helpers.h"
+
+#define IMAGE_PNG 0
+#define IMAGE_JPEG 1
+#define IMAGE_WEBP 2
+
+#define PNG_COLORS_RGBA 0		// 8 bits per channel, with alpha
+#define PNG_COLORS_RGB 1		// 8 bits per channel, the alpha channel is left out
+#define PNG_COLORS_INDEXED 2	// A palette of up to 256 colors. Images with more colors are written as RGB
+
+#define PALETTE_SIZE 256
+
+// How the images are encoded
+struct ImageFormat {
+	int format = IMAGE_PNG;
+	int pngColors = PNG_COLORS_RGBA;
+	int compressionLevel = -1;	// zlib level (0-9) of PNG images, -1: zlib's default
+	int filters = -1;			// PNG_FILTER_ flags, -1: no filtering for indexed images, libpng's choice for others
+	int quality = 90;			// Quality (0-100) of JPEG and WebP images
+};
+
+/*
+
+ImageWriter
+
+Encodes an RGBA image with the rows stored bottom to top (as OpenGL reads
+them). All state is kept per writer, so images may be encoded on several
+threads at once. The encoded image is built in memory, and written to the
+file in one go.
+
+*/
+class ImageWriter
+{
+	ImageFormat format;
+
+public:
+	ImageWriter(const ImageFormat & format);
+	bool encode(const uint8_t * rgba, unsigned int width, unsigned int height, std::vector<uint8_t> * out);
+	bool write(const char * imageFile, const uint8_t * rgba, unsigned int width, unsigned int height);
+
+	static bool supports(int format);
+
+private:
+	bool encode_png(const uint8_t * rgba, unsigned int width, unsigned int height, std::vector<uint8_t> * out);
+	bool encode_jpeg(const uint8_t * rgba, unsigned int width, unsigned int height, std::vector<uint8_t> * out);
+	bool encode_webp(const uint8_t * rgba, unsigned int width, unsigned int height, std::vector<uint8_t> * out);
+
+	static void to_rgb(const uint8_t * rgba, unsigned int width, unsigned int height, std::vector<uint8_t> * rgb);
+	static bool to_indexed(const uint8_t * rgba, unsigned int width, unsigned int height, std::vector<uint8_t> * indices, std::vector<uint32_t> * palette);
+};
+
+#endif // !IMAGEWRITER_H
@@ -10,53 +10,257 @@ of the log function and the main entry point.
 static Renderer * renderer;
 static PyThreadState *_save;
 static PyObject *pyLogger;
+static bool logDebug = true;	// Whether the logger handles debug messages, see update_log_level
+
+// Check whether the logger handles debug messages, so log_msg can skip them without
+// taking the GIL. Called with the GIL held before each render, so a change of the
+// log level takes effect with the next render.
+static void update_log_level()
+{
+	if (pyLogger == NULL)
+		return;
+
+	PyObject *enabled = PyObject_CallMethod(pyLogger, "isEnabledFor", "i", 10); // logging.DEBUG
+
+	if (enabled == NULL)
+	{
+		PyErr_Clear();
+		logDebug = true;
+		return;
+	}
+
+	logDebug = PyObject_IsTrue(enabled) == 1;
+	Py_DECREF(enabled);
+}
+
+// The result of a render: the stats of the render as a dict, or False if it failed
+static PyObject * render_result(bool result)
+{
+	if (!result)
+		return Py_BuildValue("O", Py_False);
+
+	RenderStats stats = renderer->getStats();
+
+	return Py_BuildValue("{s:l,s:l,s:l,s:l,s:l,s:l,s:l,s:d,s:d,s:d,s:d,s:d,s:d,s:O}",
+		"lines", stats.lines,
+		"bytes", stats.bytes,
+		"layers", stats.layers,
+		"segments", stats.segments,
+		"vertices", stats.vertices,
+		"bytes_uploaded", stats.bytesUploaded,
+		"draw_calls", stats.drawCalls,
+		"parse_time", stats.parse,
+		"upload_time", stats.upload,
+		"draw_time", stats.draw,
+		"read_pixels_time", stats.readPixels,
+		"encode_time", stats.encode,
+		"throttled_time", stats.throttled,
+		"toolpath_cache", stats.toolpathCache ? Py_True : Py_False);
+}
 
 extern "C" void initgcodeparser(void)
 {
 	(void)Py_InitModule("gcodeparser", GcodeParserMethods);
+
+	// The renderer parses on a thread of its own, which logs through Python
+	PyEval_InitThreads();
 }
 
 PyObject * render_gcode(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[])
 {
+	update_log_level();
 	log_msg(debug, "Begin rendering file");
 
 	// This is throwing warnings, but PyArg_ParseTupleAndKeywords doesn't
 	// take a const char **
-	char *kwlist[] = { "gcode_file", "image_file", NULL };
+	char *kwlist[] = { "gcode_file", "image_file", "toolpath_file", "layer_index_file", NULL };
 
 	char *gcode_file;
 	char *image_file;
+	char *toolpath_file = NULL;
+	char *layer_index_file = NULL;
 
-	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "ss", kwlist,
-		&gcode_file, &image_file))
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "ss|zz", kwlist,
+		&gcode_file, &image_file, &toolpath_file, &layer_index_file))
 		return NULL;
 
 	bool result;
 
 	//TODO: Input validation
 	_save = PyEval_SaveThread();
-	result = renderer->renderGcode(gcode_file, image_file);
+	result = renderer->renderGcode(gcode_file, image_file, toolpath_file, layer_index_file);
 	PyEval_RestoreThread(_save);
 	_save = NULL;
 
-	return Py_BuildValue("O", result ? Py_True : Py_False);
+	return render_result(result);
+}
+
+// Parse the target and distance of a camera from keyword arguments
+static bool parse_camera(PyObject *args, PyObject *kwargs, bool *pointAtPart, float camDistance[3])
+{
+	char *kwlist[] = { "target", "distance", NULL };
+
+	char *camTarget = NULL;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|z(fff)", kwlist,
+		&camTarget, &camDistance[0], &camDistance[1], &camDistance[2]))
+		return false;
+
+	if (camTarget != NULL)
+		*pointAtPart = strcmp(camTarget, "bed") != 0;
+
+	return true;
+}
+
+// Parse a view dict: image_file, and optionally width, height and camera.
+// Missing values are taken from the configured defaults.
+static bool parse_view(PyObject *dict, RenderView *view)
+{
+	char *kwlist[] = { "image_file", "width", "height", "camera", NULL };
+
+	char *image_file;
+	PyObject *camera = NULL;
+
+	if (!PyDict_Check(dict))
+	{
+		PyErr_SetString(PyExc_TypeError, "A view must be a dict");
+		return false;
+	}
+
+	PyObject *noArgs = PyTuple_New(0);
+	bool result = PyArg_ParseTupleAndKeywords(noArgs, dict, "s|IIO!", kwlist,
+		&image_file, &view->width, &view->height, &PyDict_Type, &camera);
+
+	if (result)
+	{
+		view->imageFile = image_file;
+
+		if (camera != NULL)
+		{
+			float camDistance[3] = { view->cameraDistance[0], view->cameraDistance[1], view->cameraDistance[2] };
+			result = parse_camera(noArgs, camera, &view->pointCameraAtPart, camDistance);
+			view->cameraDistance = glm::vec3(camDistance[0], camDistance[1], camDistance[2]);
+		}
+	}
+
+	Py_DECREF(noArgs);
+
+	if (result && (view->width == 0 || view->height == 0))
+	{
+		PyErr_SetString(PyExc_ValueError, "The width and height of a view must be positive");
+		return false;
+	}
+
+	return result;
+}
+
+PyObject * render_views(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[])
+{
+	update_log_level();
+	log_msg(debug, "Begin rendering views");
+
+	char *kwlist[] = { "gcode_file", "views", "toolpath_file", "layer_index_file", NULL };
+
+	char *gcode_file;
+	PyObject *viewList;
+	char *toolpath_file = NULL;
+	char *layer_index_file = NULL;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "sO|zz", kwlist,
+		&gcode_file, &viewList, &toolpath_file, &layer_index_file))
+		return NULL;
+
+	PyObject *viewSeq = PySequence_Fast(viewList, "views must be a list of dicts");
+	if (viewSeq == NULL)
+		return NULL;
+
+	std::vector<RenderView> views;
+
+	for (Py_ssize_t i = 0; i < PySequence_Fast_GET_SIZE(viewSeq); ++i)
+	{
+		RenderView view = renderer->getDefaultView();
+
+		if (!parse_view(PySequence_Fast_GET_ITEM(viewSeq, i), &view))
+		{
+			Py_DECREF(viewSeq);
+			return NULL;
+		}
+
+		views.push_back(view);
+	}
+
+	Py_DECREF(viewSeq);
+
+	bool result;
+
+	_save = PyEval_SaveThread();
+	result = renderer->renderViews(gcode_file, views, toolpath_file, layer_index_file);
+	PyEval_RestoreThread(_save);
+	_save = NULL;
+
+	return render_result(result);
+}
+
+PyObject * render_layers(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[])
+{
+	update_log_level();
+	log_msg(debug, "Begin rendering layers");
+
+	char *kwlist[] = { "gcode_file", "image_file", "layer_index_file", "framebuffer_file", "start_layer", "end_layer", NULL };
+
+	char *gcode_file;
+	char *image_file;
+	char *layer_index_file;
+	char *framebuffer_file;
+	unsigned int start_layer, end_layer;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "ssssII", kwlist,
+		&gcode_file, &image_file, &layer_index_file, &framebuffer_file, &start_layer, &end_layer))
+		return NULL;
+
+	if (start_layer > end_layer)
+	{
+		PyErr_SetString(PyExc_ValueError, "The start layer must not come after the end layer");
+		return NULL;
+	}
+
+	bool result;
+
+	_save = PyEval_SaveThread();
+	result = renderer->renderLayers(gcode_file, image_file, layer_index_file, framebuffer_file, start_layer, end_layer);
+	PyEval_RestoreThread(_save);
+	_save = NULL;
+
+	return render_result(result);
 }
 
 PyObject * initialize_renderer(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[])
 {
-	char *kwlist[] = { "width", "height", "logger", "throttling_interval", "throttling_duration", NULL };
+	char *kwlist[] = { "width", "height", "logger", "throttling_interval", "throttling_duration", "backend", NULL };
 
 	unsigned int width = 250, height = 250, throttlingInterval = 0, throttlingDuration = 0;
+	const char * backendName = "auto";
+	unsigned int backend = BACKEND_AUTO;
 
 	//TODO: validate throttlingInterval <= Renderer::linesPerRun
 
-	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "IIOII", kwlist,
-		&width, &height, &pyLogger, &throttlingInterval, &throttlingDuration))
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "IIOII|s", kwlist,
+		&width, &height, &pyLogger, &throttlingInterval, &throttlingDuration, &backendName))
 		return NULL;
 
+	if (strcmp(backendName, "gl") == 0)
+		backend = BACKEND_GL;
+	else if (strcmp(backendName, "software") == 0)
+		backend = BACKEND_SOFTWARE;
+	else if (strcmp(backendName, "auto") != 0)
+	{
+		PyErr_SetString(PyExc_ValueError, "The backend must be auto, gl or software");
+		return NULL;
+	}
+
 	renderer = new Renderer(width, height, throttlingInterval, throttlingDuration);
 
-	bool result = renderer->initialize();
+	bool result = renderer->initialize(backend);
 
 	return Py_BuildValue("O", result ? Py_True : Py_False);
 }
@@ -78,16 +282,13 @@ PyObject * set_print_area(PyObject *self, PyObject *args, PyObject *kwargs, char
 
 PyObject * set_camera(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[])
 {
-	char *kwlist[] = { "target", "distance", NULL };
-
-	char camTarget[8];
+	bool pointAtPart = true;
 	float camDistance[3] = { -300.f, -300.f, 150.f };
 
-	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "z(fff)", kwlist,
-		&camTarget, &camDistance[0], &camDistance[1], &camDistance[2]))
+	if (!parse_camera(args, kwargs, &pointAtPart, camDistance))
 		return NULL;
 
-	renderer->configureCamera(strstr(camTarget, "part") == 0, camDistance);
+	renderer->configureCamera(pointAtPart, camDistance);
 
 	return Py_BuildValue("O", Py_True);
 }
@@ -131,6 +332,194 @@ PyObject * set_part_color(PyObject *self, PyObject *args)
 	return Py_BuildValue("O", Py_True);
 }
 
+PyObject * set_gpu_memory_budget(PyObject *self, PyObject *args)
+{
+	long budget = DEFAULT_GPU_MEMORY_BUDGET;
+
+	if (!PyArg_ParseTuple(args, "l", &budget))
+		return NULL;
+
+	renderer->configureGpuMemory(budget);
+
+	return Py_BuildValue("O", Py_True);
+}
+
+PyObject * set_decimation(PyObject *self, PyObject *args)
+{
+	float tolerance = 0.0f;
+
+	if (!PyArg_ParseTuple(args, "f", &tolerance))
+		return NULL;
+
+	renderer->configureDecimation(tolerance);
+
+	return Py_BuildValue("O", Py_True);
+}
+
+PyObject * set_parser_threads(PyObject *self, PyObject *args)
+{
+	unsigned int threads = 1;
+
+	if (!PyArg_ParseTuple(args, "I", &threads))
+		return NULL;
+
+	renderer->configureParserThreads(threads);
+
+	return Py_BuildValue("O", Py_True);
+}
+
+PyObject * set_image_format(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[])
+{
+	char *kwlist[] = { "format", "png_colors", "compression_level", "png_filters", "quality", NULL };
+
+	const char * formatName = "png";
+	const char * colorsName = "rgba";
+	const char * filtersName = "auto";
+	ImageFormat format;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|ssisi", kwlist, &formatName, &colorsName, &format.compressionLevel, &filtersName, &format.quality))
+		return NULL;
+
+	if (strcmp(formatName, "png") == 0)
+		format.format = IMAGE_PNG;
+	else if (strcmp(formatName, "jpeg") == 0 || strcmp(formatName, "jpg") == 0)
+		format.format = IMAGE_JPEG;
+	else if (strcmp(formatName, "webp") == 0)
+		format.format = IMAGE_WEBP;
+	else
+	{
+		PyErr_SetString(PyExc_ValueError, "The image format must be png, jpeg or webp");
+		return NULL;
+	}
+
+	if (!ImageWriter::supports(format.format))
+	{
+		PyErr_SetString(PyExc_ValueError, "The image format isn't supported by this build");
+		return NULL;
+	}
+
+	if (strcmp(colorsName, "rgba") == 0)
+		format.pngColors = PNG_COLORS_RGBA;
+	else if (strcmp(colorsName, "rgb") == 0)
+		format.pngColors = PNG_COLORS_RGB;
+	else if (strcmp(colorsName, "indexed") == 0)
+		format.pngColors = PNG_COLORS_INDEXED;
+	else
+	{
+		PyErr_SetString(PyExc_ValueError, "The PNG colors must be rgba, rgb or indexed");
+		return NULL;
+	}
+
+	if (strcmp(filtersName, "auto") == 0)
+		format.filters = -1;
+	else if (strcmp(filtersName, "none") == 0)
+		format.filters = PNG_FILTER_NONE;
+	else if (strcmp(filtersName, "sub") == 0)
+		format.filters = PNG_FILTER_SUB;
+	else if (strcmp(filtersName, "up") == 0)
+		format.filters = PNG_FILTER_UP;
+	else if (strcmp(filtersName, "paeth") == 0)
+		format.filters = PNG_FILTER_PAETH;
+	else if (strcmp(filtersName, "all") == 0)
+		format.filters = PNG_ALL_FILTERS;
+	else
+	{
+		PyErr_SetString(PyExc_ValueError, "The PNG filters must be auto, none, sub, up, paeth or all");
+		return NULL;
+	}
+
+	if (format.compressionLevel < -1 || format.compressionLevel > 9 || format.quality < 0 || format.quality > 100)
+	{
+		PyErr_SetString(PyExc_ValueError, "The compression level must be -1 to 9, the quality 0 to 100");
+		return NULL;
+	}
+
+	renderer->configureImageFormat(format);
+
+	return Py_BuildValue("O", Py_True);
+}
+
+PyObject * set_draw_mode(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[])
+{
+	char *kwlist[] = { "mode", "tube_width", NULL };
+
+	const char * modeName = "lines";
+	float tubeWidth = DEFAULT_TUBE_WIDTH;
+	uint8_t drawType;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s|f", kwlist, &modeName, &tubeWidth))
+		return NULL;
+
+	if (strcmp(modeName, "lines") == 0)
+		drawType = DRAW_LINES;
+	else if (strcmp(modeName, "tubes") == 0)
+		drawType = DRAW_TUBES;
+	else
+	{
+		PyErr_SetString(PyExc_ValueError, "The draw mode must be lines or tubes");
+		return NULL;
+	}
+
+	if (tubeWidth <= 0)
+	{
+		PyErr_SetString(PyExc_ValueError, "The tube width must be positive");
+		return NULL;
+	}
+
+	renderer->configureDrawType(drawType, tubeWidth);
+
+	return Py_BuildValue("O", Py_True);
+}
+
+// The governor functions may be called from another thread while a render runs
+PyObject * set_throttling(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[])
+{
+	char *kwlist[] = { "interval", "duration", NULL };
+
+	unsigned int interval = 0, duration = 0;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "II", kwlist, &interval, &duration))
+		return NULL;
+
+	renderer->getGovernor()->configure(interval, duration);
+
+	return Py_BuildValue("O", Py_True);
+}
+
+PyObject * pause_render(PyObject *self, PyObject *args)
+{
+	renderer->getGovernor()->pause();
+
+	return Py_BuildValue("O", Py_True);
+}
+
+PyObject * resume_render(PyObject *self, PyObject *args)
+{
+	renderer->getGovernor()->resume();
+
+	return Py_BuildValue("O", Py_True);
+}
+
+PyObject * get_throttled_time(PyObject *self, PyObject *args)
+{
+	return Py_BuildValue("d", renderer->getGovernor()->get_throttled_time());
+}
+
+PyObject * cancel_render(PyObject *self, PyObject *args)
+{
+	renderer->getGovernor()->cancel();
+
+	return Py_BuildValue("O", Py_True);
+}
+
+PyObject * get_render_progress(PyObject *self, PyObject *args)
+{
+	long offset, size;
+	renderer->getProgress(&offset, &size);
+
+	return Py_BuildValue("(ll)", offset, size);
+}
+
 void log_msg(int type, const char *msg)
 {
 	if (pyLogger == NULL)
@@ -139,34 +528,46 @@ void log_msg(int type, const char *msg)
 		return;
 	}
 
-	if(_save != NULL)
-		PyEval_RestoreThread(_save);
+	// Debug messages are most of them, don't take the GIL for ones the logger drops
+	if (type == debug && !logDebug)
+		return;
+
+	// The render thread released the GIL in _save, other threads (the parser
+	// thread) have to acquire it with a thread state of their own
+	bool renderThread = _save == NULL || _save == PyGILState_GetThisThreadState();
+	PyGILState_STATE gilState;
 
-	static PyObject *string = NULL;
+	if (!renderThread)
+		gilState = PyGILState_Ensure();
+	else if (_save != NULL)
+		PyEval_RestoreThread(_save);
 
-	// build msg-string
-	string = Py_BuildValue("s", msg);
+	const char *method = "debug";
 
 	// call function depending on loglevel
 	switch (type)
 	{
 	case info:
-		PyObject_CallMethod(pyLogger, "info", "O", string);
+		method = "info";
 		break;
 	case warning:
-		PyObject_CallMethod(pyLogger, "warn", "O", string);
+		method = "warn";
 		break;
 	case error:
-		PyObject_CallMethod(pyLogger, "error", "O", string);
-		break;
-	case debug:
-		PyObject_CallMethod(pyLogger, "debug", "O", string);
+		method = "error";
 		break;
 	}
 
-	Py_DECREF(string);
+	PyObject *result = PyObject_CallMethod(pyLogger, (char *)method, "s", msg);
+
+	if (result == NULL)
+		PyErr_Clear();
+	else
+		Py_DECREF(result);
 
-	if (_save != NULL)
+	if (!renderThread)
+		PyGILState_Release(gilState);
+	else if (_save != NULL)
 		_save = PyEval_SaveThread();
 }
 
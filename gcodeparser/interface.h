@@ -19,7 +19,20 @@ PyObject * set_camera(PyObject *self, PyObject *args, PyObject *kwargs, char *ke
 PyObject * set_background_color(PyObject *self, PyObject *args);
 PyObject * set_bed_color(PyObject *self, PyObject *args);
 PyObject * set_part_color(PyObject *self, PyObject *args);
+PyObject * set_gpu_memory_budget(PyObject *self, PyObject *args);
+PyObject * set_decimation(PyObject *self, PyObject *args);
+PyObject * set_parser_threads(PyObject *self, PyObject *args);
+PyObject * set_image_format(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[]);
+PyObject * set_draw_mode(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[]);
+PyObject * set_throttling(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[]);
+PyObject * pause_render(PyObject *self, PyObject *args);
+PyObject * resume_render(PyObject *self, PyObject *args);
+PyObject * get_throttled_time(PyObject *self, PyObject *args);
+PyObject * cancel_render(PyObject *self, PyObject *args);
+PyObject * get_render_progress(PyObject *self, PyObject *args);
 PyObject * render_gcode(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[]);
+PyObject * render_views(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[]);
+PyObject * render_layers(PyObject *self, PyObject *args, PyObject *kwargs, char *keywords[]);
 
 extern "C" void initgcodeparser(void);
 
@@ -30,7 +43,20 @@ static PyMethodDef GcodeParserMethods[] = {
 	{ "set_background_color", (PyCFunction)set_background_color, METH_VARARGS, "Set the background color" },
 	{ "set_bed_color", (PyCFunction)set_bed_color, METH_VARARGS, "Set the bed color" },
 	{ "set_part_color", (PyCFunction)set_part_color, METH_VARARGS, "Set the part color" },
-	{ "render_gcode",  (PyCFunction)render_gcode, METH_VARARGS | METH_KEYWORDS, "Render a gcode file to a PNG image file." },
+	{ "set_gpu_memory_budget", (PyCFunction)set_gpu_memory_budget, METH_VARARGS, "Set the GPU memory (in bytes) used while drawing a part" },
+	{ "set_decimation", (PyCFunction)set_decimation, METH_VARARGS, "Set the distance (in pixels) below which paths are merged" },
+	{ "set_parser_threads", (PyCFunction)set_parser_threads, METH_VARARGS, "Set the number of threads that decode a gcode file, 0: one per CPU" },
+	{ "set_image_format", (PyCFunction)set_image_format, METH_VARARGS | METH_KEYWORDS, "Set the file format (png, jpeg or webp) of the rendered images and its options" },
+	{ "set_draw_mode", (PyCFunction)set_draw_mode, METH_VARARGS | METH_KEYWORDS, "Set how the paths are drawn: lines, or tubes of tube_width mm wide" },
+	{ "set_throttling", (PyCFunction)set_throttling, METH_VARARGS | METH_KEYWORDS, "Set the throttling of the parser, also during a render" },
+	{ "pause", (PyCFunction)pause_render, METH_NOARGS, "Hold the parser of the current and later renders until resumed" },
+	{ "resume", (PyCFunction)resume_render, METH_NOARGS, "Continue a paused parser" },
+	{ "get_throttled_time", (PyCFunction)get_throttled_time, METH_NOARGS, "Get the time (in seconds) the parser was throttled or paused during the last render" },
+	{ "cancel", (PyCFunction)cancel_render, METH_NOARGS, "Stop the current render at the next chunk, it returns False and writes no images" },
+	{ "get_progress", (PyCFunction)get_render_progress, METH_NOARGS, "Get the position (in bytes) in the file of the current or last render, and the size of the file" },
+	{ "render_gcode",  (PyCFunction)render_gcode, METH_VARARGS | METH_KEYWORDS, "Render a gcode file to an image file. Returns the stats of the render, or False." },
+	{ "render_views",  (PyCFunction)render_views, METH_VARARGS | METH_KEYWORDS, "Render a gcode file to an image file for each view, parsing it once. Returns the stats of the render, or False." },
+	{ "render_layers",  (PyCFunction)render_layers, METH_VARARGS | METH_KEYWORDS, "Render a range of layers of a gcode file on top of the layers before it. Returns the stats of the render, or False." },
 	{ NULL, NULL, 0, NULL }        /* Sentinel */
 };
 
@@ -0,0 +1,97 @@
+#include "layerindex.h"
+
+/*
+Initialize the LayerIndexWriter class
+
+file: Path of the index file to write
+bedBbox: Bounding box of the printable area the parser uses
+
+*/
+LayerIndexWriter::LayerIndexWriter(const char * file, BBox bedBbox)
+{
+	this->file = file;
+
+	memset(&header, 0, sizeof header);
+	memcpy(header.magic, LAYER_INDEX_MAGIC, 4);
+	header.version = LAYER_INDEX_VERSION;
+	memcpy(header.bedBbox, &bedBbox, sizeof header.bedBbox);
+}
+
+// Write the header and the layers, and give the file its final name
+bool LayerIndexWriter::finish(BBox * bbox, bool bboxValid)
+{
+	memcpy(header.bbox, bbox, sizeof header.bbox);
+	header.bboxValid = bboxValid ? 1 : 0;
+	header.nLayers = (uint32_t)layers.size();
+
+	std::string tempFile = file + ".part";
+	FILE * fout = fopen(tempFile.c_str(), "wb");
+
+	if (fout == NULL)
+	{
+		log_msg(warning, "Could not create layer index file");
+		return false;
+	}
+
+	bool written = fwrite(&header, sizeof header, 1, fout) == 1
+		&& (layers.empty() || fwrite(&layers[0], sizeof(LayerEntry), layers.size(), fout) == layers.size());
+
+	if (fclose(fout) != 0 || !written)
+	{
+		log_msg(warning, "Could not write layer index file");
+		remove(tempFile.c_str());
+		return false;
+	}
+
+	// Windows won't rename onto an existing file
+	remove(file.c_str());
+
+	if (rename(tempFile.c_str(), file.c_str()) != 0)
+	{
+		remove(tempFile.c_str());
+		return false;
+	}
+
+	char log[128];
+	sprintf(log, "Layer index written: %u layers", header.nLayers);
+	log_msg(debug, log);
+
+	return true;
+}
+
+// Open an index file. Returns false if the file doesn't exist, is damaged or
+// was made for a different bed.
+bool LayerIndexReader::open(const char * file, BBox bedBbox)
+{
+	header = NULL;
+	layers = NULL;
+
+	if (!mappedFile.open(file))
+		return false;
+
+	if (mappedFile.get_size() < sizeof(LayerIndexHeader))
+		return false;
+
+	const LayerIndexHeader * mapped = (const LayerIndexHeader *)mappedFile.get_data();
+
+	if (memcmp(mapped->magic, LAYER_INDEX_MAGIC, 4) != 0
+		|| mapped->version != LAYER_INDEX_VERSION
+		|| memcmp(mapped->bedBbox, &bedBbox, sizeof mapped->bedBbox) != 0
+		|| mappedFile.get_size() != sizeof(LayerIndexHeader) + (size_t)mapped->nLayers * sizeof(LayerEntry))
+	{
+		log_msg(debug, "Layer index file is invalid or outdated");
+		return false;
+	}
+
+	header = mapped;
+	layers = (const LayerEntry *)(mappedFile.get_data() + sizeof(LayerIndexHeader));
+
+	return true;
+}
+
+// Get the bounding box of the part, as used for the camera when the index was written
+bool LayerIndexReader::get_bbox(BBox * bbox)
+{
+	memcpy(bbox, header->bbox, sizeof header->bbox);
+	return header->bboxValid != 0;
+}
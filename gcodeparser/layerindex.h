@@ -0,0 +1,97 @@
+/*
+
+layerindex.h
+
+Header file for the layer index of a gcode file. Stores where each layer
+starts in the gcode and the state of the parser there, so a range of
+layers can be parsed without parsing the layers before it.
+
+*/
+
+#ifndef LAYERINDEX_H
+#define LAYERINDEX_H 1
+
+#include <stdio.h>
+#include <stdint.h>
+#include <string.h>
+#include <math.h>
+#include <string>
+#include <vector>
+
+#include "helpers.h"
+#include "mappedfile.h"
+#include "vertexbuilder.h"
+
+#define LAYER_INDEX_MAGIC "GLIX"
+#define LAYER_INDEX_VERSION 1
+#define LAYER_MIN_HEIGHT 0.05f	// An extrusion at least this much higher or lower than the current layer starts the next one
+
+#define LAYER_RELATIVE 1		// Moves are relative (G91)
+#define LAYER_SKIP 2			// The parser skips the lines, until the next segment comment
+#define LAYER_AFTER_FLY 4		// The last move didn't extrude
+
+// Header of a layer index file
+struct LayerIndexHeader {
+	char magic[4];
+	uint32_t version;
+	uint32_t nLayers;		// Number of layers following the header
+	float bedBbox[6];		// The bed the part bounding box was determined for
+	float bbox[6];			// The bounding box of the part the camera is pointed with
+	uint32_t bboxValid;		// Whether the parser found a valid bounding box
+};
+
+// Where a layer starts and the state of the parser before its first line. Fixed
+// size, so the layers form an array in the (memory-mapped) file
+struct LayerEntry {
+	uint64_t offset;				// Of the first line of the layer in the gcode, decompressed
+	float z;						// Height of the layer
+	float position[NUMCOORDS];		// Position of the last move, without the G92 offsets
+	float origin[NUMCOORDS];		// The G92 offsets
+	uint32_t flags;					// LAYER_RELATIVE, LAYER_SKIP and LAYER_AFTER_FLY
+};
+
+/*
+
+LayerIndexWriter
+
+Collects the layers while a gcode file is parsed and writes them to an
+index file once the parse is complete. A layer starts at the first
+extruding move at a new height. The file is written under a temporary
+name and only takes its final name when complete.
+
+*/
+class LayerIndexWriter
+{
+	std::string file;			// Final filename of the index file
+
+	LayerIndexHeader header;
+	std::vector<LayerEntry> layers;
+
+public:
+	LayerIndexWriter(const char * file, BBox bedBbox);
+	bool is_new_layer(float z) { return layers.empty() || fabs(z - layers.back().z) >= LAYER_MIN_HEIGHT; };
+	void add_layer(const LayerEntry & layer) { layers.push_back(layer); };
+	bool finish(BBox * bbox, bool bboxValid);
+};
+
+/*
+
+LayerIndexReader
+
+Provides the layers of a gcode file from a layer index file
+
+*/
+class LayerIndexReader
+{
+	MappedFile mappedFile;
+	const LayerIndexHeader * header = NULL;
+	const LayerEntry * layers = NULL;
+
+public:
+	bool open(const char * file, BBox bedBbox);
+	bool get_bbox(BBox * bbox);
+	unsigned int get_layer_count() { return header != NULL ? header->nLayers : 0; };
+	const LayerEntry * get_layer(unsigned int layer) { return layer < get_layer_count() ? &layers[layer] : NULL; };
+};
+
+#endif // !LAYERINDEX_H
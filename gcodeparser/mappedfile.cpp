@@ -0,0 +1,110 @@
+#include "mappedfile.h"
+
+MappedFile::~MappedFile()
+{
+	close();
+}
+
+// Map a file into memory. Returns false if the file doesn't exist or couldn't be mapped.
+bool MappedFile::open(const char * file)
+{
+	close();
+
+#ifdef __linux__
+	fd = ::open(file, O_RDONLY);
+
+	if (fd == -1)
+		return false;
+
+	struct stat st;
+	if (fstat(fd, &st) != 0)
+	{
+		close();
+		return false;
+	}
+
+	size = (size_t)st.st_size;
+
+	// mmap doesn't accept empty files
+	if (size == 0)
+		return true;
+
+	void * mapped = mmap(NULL, size, PROT_READ, MAP_PRIVATE, fd, 0);
+
+	if (mapped == MAP_FAILED)
+	{
+		close();
+		return false;
+	}
+
+	// We read front to back
+	madvise(mapped, size, MADV_SEQUENTIAL);
+
+	data = (const char *)mapped;
+#else
+	this->file = CreateFileA(file, GENERIC_READ, FILE_SHARE_READ, NULL, OPEN_EXISTING, FILE_FLAG_SEQUENTIAL_SCAN, NULL);
+
+	if (this->file == INVALID_HANDLE_VALUE)
+		return false;
+
+	LARGE_INTEGER fileSize;
+	if (!GetFileSizeEx(this->file, &fileSize))
+	{
+		close();
+		return false;
+	}
+
+	size = (size_t)fileSize.QuadPart;
+
+	// Windows doesn't map empty files either
+	if (size == 0)
+		return true;
+
+	mapping = CreateFileMapping(this->file, NULL, PAGE_READONLY, 0, 0, NULL);
+
+	if (mapping == NULL)
+	{
+		close();
+		return false;
+	}
+
+	data = (const char *)MapViewOfFile(mapping, FILE_MAP_READ, 0, 0, 0);
+
+	if (data == NULL)
+	{
+		close();
+		return false;
+	}
+#endif
+
+	return true;
+}
+
+// Unmap the file and close it
+void MappedFile::close()
+{
+#ifdef __linux__
+	if (data != NULL)
+		munmap((void *)data, size);
+
+	if (fd != -1)
+		::close(fd);
+
+	fd = -1;
+#else
+	if (data != NULL)
+		UnmapViewOfFile(data);
+
+	if (mapping != NULL)
+		CloseHandle(mapping);
+
+	if (file != INVALID_HANDLE_VALUE)
+		CloseHandle(file);
+
+	mapping = NULL;
+	file = INVALID_HANDLE_VALUE;
+#endif
+
+	data = NULL;
+	size = 0;
+}
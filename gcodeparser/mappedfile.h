@@ -0,0 +1,51 @@
+/*
+
+mappedfile.h
+
+Header file for a read-only memory-mapped file
+
+*/
+
+#ifndef MAPPEDFILE_H
+#define MAPPEDFILE_H 1
+
+#include <stddef.h>
+
+#include "helpers.h"
+
+#ifdef __linux__
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#endif
+
+/*
+
+MappedFile
+
+Maps a whole file into memory for reading. The operating system
+pages the file in on demand, so this is cheap even for large files.
+
+*/
+class MappedFile
+{
+	const char * data = NULL;	// Start of the mapped file
+	size_t size = 0;			// Size of the file in bytes
+
+#ifdef __linux__
+	int fd = -1;
+#else
+	HANDLE file = INVALID_HANDLE_VALUE;
+	HANDLE mapping = NULL;
+#endif
+
+public:
+	MappedFile() {};
+	~MappedFile();
+	bool open(const char * file);
+	void close();
+	const char * get_data() { return data; };
+	size_t get_size() { return size; };
+};
+
+#endif // !MAPPEDFILE_H
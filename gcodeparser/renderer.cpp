@@ -5,14 +5,11 @@
 // Renderer constructor
 // Width: width of the images to render
 // Height: height of the images to render
-Renderer::Renderer(unsigned int width, unsigned int height, unsigned int throttlingInterval, unsigned int throttlingDuration)
+Renderer::Renderer(unsigned int width, unsigned int height, unsigned int throttlingInterval, unsigned int throttlingDuration) : governor(throttlingInterval, throttlingDuration)
 {
 	this->width = width;
 	this->height = height;
 
-	this->throttlingDuration = throttlingDuration;
-	this->throttlingInterval = throttlingInterval;
-
 	this->renderContext = new T_RENDERCONTEXT(width, height);
 
 	char log[512];
@@ -28,50 +25,78 @@ Renderer::Renderer(unsigned int width, unsigned int height, unsigned int throttl
 
 Renderer::~Renderer()
 {
-	unloadShaders(this->program, this->vertex_shader, this->fragment_shader);
+	deleteStreamBuffers();
+
+	if (rasterizer == NULL)
+		unloadShaders(this->program, this->vertex_shader, this->fragment_shader);
+
+	if (tubeProgram != 0)
+	{
+		unloadShaders(this->tubeProgram, this->tubeVertexShader, this->tubeFragmentShader);
+		glDeleteBuffers(1, &cornerBuffer);
+	}
 
-	delete[] vertices;
-	delete[] indices;
-	delete parser;
 	delete renderContext;
 }
 
 /* Public methods */
 
-// Initialize the render context and, if used, GLEW
-bool Renderer::initialize()
+// Initialize the render context and, if used, GLEW. With BACKEND_AUTO, the 
+// software rasterizer is used if OpenGL isn't available.
+bool Renderer::initialize(unsigned int backend)
 {
 	// Reset the last error
 	lastGlError = 0;
 
 	log_msg(debug, "Initializing renderer");
 
-	if (!renderContext->activate())
-		return false;
+	if (backend != BACKEND_SOFTWARE && renderContext->activate())
+	{
+#ifdef USE_GLEW
+		if (glewInit() != GLEW_OK) {
+			log_msg(error, "Failed to initialize GLEW");
+			return false;
+		}
+#endif
 
+		// Chunks with more than 65536 vertices need 32 bit indices
 #ifdef USE_GLEW
-	if (glewInit() != GLEW_OK) {
-		log_msg(error, "Failed to initialize GLEW");
-		return false;
-	}
+		uintIndices = true; // Part of desktop OpenGL
+#else
+		const char * extensions = (const char *)glGetString(GL_EXTENSIONS);
+		uintIndices = extensions != NULL && strstr(extensions, "GL_OES_element_index_uint") != NULL;
 #endif
 
-	// Load and compile shaders and get handles to the shader variables
-	log_msg(debug, "Creating program");
-	this->createProgram();
+		// Tubes are drawn as instances of a quad, if the GPU can
+		this->loadInstancing();
 
-	// Before every rendering, clear the buffer with this background color
-	glClearColor(backgroundColor[0], backgroundColor[1], backgroundColor[2], backgroundColor[3]);
-	checkGlError("Set clear color");
+		// Load and compile shaders and get handles to the shader variables
+		log_msg(debug, "Creating program");
+		this->createProgram();
 
-	// For the tubes rendering mode, we need an ambient light position
-	if (drawType == DRAW_TUBES)
-	{
-		glUniform3f(light_handle, (printArea.xmax + printArea.xmin) / 2, -50.0, 300.0);
-		checkGlError("Set light");
+		// Before every rendering, clear the buffer with this background color
+		glClearColor(backgroundColor[0], backgroundColor[1], backgroundColor[2], backgroundColor[3]);
+		checkGlError("Set clear color");
+
+		return lastGlError == 0;
 	}
 
-	return lastGlError == 0;
+	if (backend == BACKEND_GL)
+		return false;
+
+	if (backend == BACKEND_AUTO)
+		log_msg(warning, "No OpenGL context available, falling back to software rendering");
+
+	RenderContextSoftware * softwareContext = new RenderContextSoftware(width, height);
+
+	delete renderContext;
+	renderContext = softwareContext;
+	rasterizer = softwareContext->get_rasterizer();
+
+	// Indices are never uploaded, so there is no limit
+	uintIndices = true;
+
+	return renderContext->activate();
 }
 
 // Set the print area and re-buffer the bed vertices
@@ -104,8 +129,11 @@ void Renderer::configureBackgroundColor(float color[4])
 {
 	memcpy(this->backgroundColor, color, 4 * sizeof(float));
 	
-	glClearColor(backgroundColor[0], backgroundColor[1], backgroundColor[2], backgroundColor[3]);
-	checkGlError("Set clear color");
+	if (rasterizer == NULL)
+	{
+		glClearColor(backgroundColor[0], backgroundColor[1], backgroundColor[2], backgroundColor[3]);
+		checkGlError("Set clear color");
+	}
 
 	char log[64], colorStr[10];
 	getColorHash(colorStr, color);
@@ -135,11 +163,167 @@ void Renderer::configurePartColor(float color[4])
 	log_msg(debug, log);
 }
 
+// Configure how much GPU memory the part may use while it's drawn. The number
+// of lines parsed per chunk follows from it.
+void Renderer::configureGpuMemory(long budget)
+{
+	this->gpuMemoryBudget = budget;
+
+	// Recreated with the new size at the next render
+	this->deleteStreamBuffers();
+
+	char log[128];
+	sprintf(log, "GPU memory budget configured: %ld kb", budget / 1000);
+	log_msg(debug, log);
+}
+
+// Configure the level of detail. Paths of the part that are less than tolerance
+// pixels apart in the image are merged. 0 draws every path.
+void Renderer::configureDecimation(float tolerance)
+{
+	this->decimation = tolerance;
+
+	char log[128];
+	sprintf(log, "Decimation configured: %.2f pixels", tolerance);
+	log_msg(debug, log);
+}
+
+// Configure the number of threads that decode a gcode file. 1 parses
+// serially, 0 uses a thread per CPU
+void Renderer::configureParserThreads(unsigned int threads)
+{
+	this->parserThreads = threads;
+
+	char log[128];
+	sprintf(log, "Parser threads configured: %u", threads);
+	log_msg(debug, log);
+}
+
+void Renderer::configureImageFormat(const ImageFormat & format)
+{
+	this->imageFormat = format;
+
+	static const char * formatNames[] = { "png", "jpeg", "webp" };
+	static const char * colorNames[] = { "rgba", "rgb", "indexed" };
+
+	char log[128];
+	sprintf(log, "Image format configured: %s, colors: %s, compression level: %d, quality: %d", formatNames[format.format], colorNames[format.pngColors], format.compressionLevel, format.quality);
+	log_msg(debug, log);
+}
+
+// Configure how the paths of the part are drawn: DRAW_LINES draws a line of a pixel
+// wide, DRAW_TUBES draws lit tubes of tubeWidth mm (but at least a pixel) wide
+void Renderer::configureDrawType(uint8_t drawType, float tubeWidth)
+{
+	this->drawType = drawType;
+	this->tubeWidth = tubeWidth;
+
+	char log[128];
+	sprintf(log, "Draw type configured: %s, tube width: %.2f mm", drawType == DRAW_TUBES ? "tubes" : "lines", tubeWidth);
+	log_msg(debug, log);
+}
+
+// Gets a view with the configured resolution and camera
+RenderView Renderer::getDefaultView()
+{
+	RenderView view;
+
+	view.width = this->width;
+	view.height = this->height;
+	view.pointCameraAtPart = this->pointCameraAtPart;
+	view.cameraDistance = this->cameraDistance;
+
+	return view;
+}
+
 // Render a gcode from a given gcodeFile in to a PNG imageFile
-bool Renderer::renderGcode(const char * gcodeFile, const char* imageFile)
+// If a toolpathFile is given, the part is read from this toolpath cache
+// instead of the gcode file. If the cache doesn't exist yet, it's written
+// while parsing the gcode. See renderViews for the layerIndexFile.
+bool Renderer::renderGcode(const char * gcodeFile, const char* imageFile, const char* toolpathFile, const char* layerIndexFile)
 {
-	// Reset the last error
+	std::vector<RenderView> views(1, getDefaultView());
+	views[0].imageFile = imageFile;
+
+	return renderViews(gcodeFile, views, toolpathFile, layerIndexFile);
+}
+
+// Render a gcode from a given gcodeFile in to a PNG image for each of the views.
+// The gcode is parsed only once. See renderGcode for the toolpathFile. If a
+// layerIndexFile is given, the start of each layer is written to it, so ranges
+// of layers can be rendered later on (see renderLayers). Without an index,
+// the gcode is parsed even if the toolpath cache has the part.
+bool Renderer::renderViews(const char * gcodeFile, std::vector<RenderView> & views, const char* toolpathFile, const char* layerIndexFile)
+{
+	return render(gcodeFile, views, toolpathFile, layerIndexFile, NULL);
+}
+
+// Render the layers from startLayer up to (not including) endLayer of a gcode in to a PNG
+// imageFile, on top of the layers before startLayer. The image of those is read from
+// the framebufferFile, and the image of the layers up to endLayer is written back to it.
+// If it doesn't hold the layers up to startLayer, the layers are rendered from the first.
+// The layers are those of the layerIndexFile (see renderViews), an endLayer beyond the
+// last layer renders up to the end of the file. The image is framed like the full render.
+bool Renderer::renderLayers(const char * gcodeFile, const char * imageFile, const char * layerIndexFile, const char * framebufferFile, unsigned int startLayer, unsigned int endLayer)
+{
+	std::vector<RenderView> views(1, getDefaultView());
+	views[0].imageFile = imageFile;
+
+	LayerIndexReader index;
+
+	if (!index.open(layerIndexFile, getBedBbox()))
+	{
+		log_msg(error, "Could not read the layer index");
+		return false;
+	}
+
+	endLayer = min(endLayer, index.get_layer_count());
+	startLayer = min(startLayer, endLayer);
+
+	LayerRange range;
+
+	if (startLayer > 0 && !loadFramebuffer(framebufferFile, &views[0], startLayer, &range.image))
+	{
+		log_msg(debug, "No framebuffer of the layers before the range, rendering from the first layer");
+		startLayer = 0;
+	}
+
+	range.start = index.get_layer(startLayer);
+	range.endOffset = endLayer < index.get_layer_count() ? (size_t)index.get_layer(endLayer)->offset : SIZE_MAX;
+
+	// The layers before the range are in the framebuffer, starting at the first layer includes the start of the file
+	if (startLayer == 0)
+		range.start = NULL;
+
+	// Frame the layers like the full render
+	cameraBboxValid = index.get_bbox(&cameraBbox);
+	cameraBboxFixed = true;
+
+	bool rendered = render(gcodeFile, views, NULL, NULL, &range);
+	cameraBboxFixed = false;
+
+	stats.layers = endLayer - startLayer;
+
+	if (rendered)
+		saveFramebuffer(framebufferFile, &views[0], endLayer, range.image);
+
+	return rendered;
+}
+
+// Render the views of a gcode file, or of a range of its layers
+bool Renderer::render(const char * gcodeFile, std::vector<RenderView> & views, const char* toolpathFile, const char* layerIndexFile, LayerRange * range)
+{
+	// Reset the last error, the time the parser was held up and the progress. Cancelling
+	// an earlier render doesn't carry over.
 	lastGlError = 0;
+	governor.reset_stats();
+	governor.reset_cancel();
+	stats = RenderStats();
+	progressOffset = 0;
+	progressSize = 0;
+
+	if (views.empty())
+		return false;
 	
 	// We can re-use the bed vertices, so lazy-load them once
 	if (!bedBuffered)
@@ -148,53 +332,281 @@ bool Renderer::renderGcode(const char * gcodeFile, const char* imageFile)
 		log_msg(debug, "Bed buffered");
 	}
 
+	// The same goes for the program that draws tubes
+	if (drawType == DRAW_TUBES && rasterizer == NULL && tubeProgram == 0)
+	{
+		this->createTubeProgram();
+		log_msg(debug, "Tube program created");
+	}
+
+
+	BBox bedBbox = getBedBbox();
+
+	GcodeParser * parser = NULL;
+	ToolpathCacheWriter * cacheWriter = NULL;
+	ToolpathCacheReader * cacheReader = NULL;
+	LayerIndexWriter * layerWriter = NULL;
 
-	// The origin offset is not included, as it is not considered a valid printing area
-	// and thus should not be rendered.
-	BBox bedBbox = { 0, printArea.xmax + printArea.xmin, 0, printArea.ymax + printArea.ymin, 0, printArea.zmax + printArea.zmin };
-	this->parser = new GcodeParser(gcodeFile, this->drawType, bedBbox, this->throttlingInterval, this->throttlingDuration);
+	// The layer index needs the offsets of the layers in the gcode, which only the parser knows
+	if (layerIndexFile != NULL && !LayerIndexReader().open(layerIndexFile, bedBbox))
+		layerWriter = new LayerIndexWriter(layerIndexFile, bedBbox);
+
+	if (toolpathFile != NULL && layerWriter == NULL)
+	{
+		cacheReader = new ToolpathCacheReader(&this->governor);
+
+		if (cacheReader->open(toolpathFile, bedBbox))
+		{
+			stats.toolpathCache = true;
+			log_msg(debug, "Rendering from toolpath cache");
+		}
+		else
+		{
+			delete cacheReader;
+			cacheReader = NULL;
+		}
+	}
+
+	if (cacheReader != NULL)
+	{
+		this->source = cacheReader;
+	}
+	else
+	{
+		parser = new GcodeParser(gcodeFile, bedBbox, &this->governor);
+		parser->set_threads(this->parserThreads);
+
+		struct stat fileStat;
+		if (stat(gcodeFile, &fileStat) == 0)
+			stats.bytes = fileStat.st_size;
+
+		// Of a range of layers, only the bytes of the range count
+		if (range != NULL)
+		{
+			long begin = range->start != NULL ? (long)range->start->offset : 0;
+			long end = range->endOffset != SIZE_MAX ? (long)range->endOffset : stats.bytes;
+			stats.bytes = max(end - begin, 0L);
+		}
+
+		if (toolpathFile != NULL)
+		{
+			cacheWriter = new ToolpathCacheWriter(toolpathFile, bedBbox);
+			parser->set_toolpath_cache(cacheWriter);
+		}
 
-	// Create buffers for the vertex and index arrays
+		if (layerWriter != NULL)
+			parser->set_layer_index(layerWriter);
+
+		if (range != NULL && !parser->set_range(range->start, range->endOffset))
+			log_msg(warning, "The gcode file ends before the layer, is the layer index outdated?");
+
+		this->source = parser;
+	}
+
+	long offset, size;
+	this->source->get_progress(&offset, &size);
+	progressSize = size;
+
+	// Create buffers for the vertex and index arrays, each chunk fills a stream buffer
 	unsigned int verticesSize, indicesSize;
 
-	this->parser->get_buffer_size(&verticesSize, &indicesSize);
+	this->source->get_buffer_size(&verticesSize, &indicesSize);
+	this->configureStreamBuffers(verticesSize, indicesSize);
+
+	for (auto & chunk : chunks)
+	{
+		chunk.vertices = new float[this->linesPerRun * verticesSize / sizeof(float)];
+		chunk.indices = new VertexIndex[this->linesPerRun * indicesSize / sizeof(VertexIndex)];
+	}
+
+	shortIndices = uintIndices ? NULL : new uint16_t[streamBuffers[0].indexCapacity / sizeof(uint16_t)];
+
+	// The first view with the resolution of the render context draws directly to it,
+	// the others get an offscreen framebuffer
+	bool surfaceUsed = false;
+
+	for (auto & view : views)
+	{
+		if (rasterizer == NULL && !surfaceUsed && view.width == this->width && view.height == this->height)
+			surfaceUsed = true;
+		else
+			this->createFramebuffer(&view);
+
+		// Start with a clean slate and fill the image with the background color. The layers of
+		// a range are drawn on a transparent image, which then goes on top of the layers before.
+		this->useView(&view);
+
+		const float transparent[4] = { 0.0f, 0.0f, 0.0f, 0.0f };
+		bool onTop = range != NULL && !range->image.empty();
 
-	vertices = new float[this->linesPerRun * verticesSize];
-	indices = new short[this->linesPerRun * indicesSize];
+		if (rasterizer != NULL)
+		{
+			rasterizer->clear(view.target, onTop ? transparent : backgroundColor);
+		}
+		else
+		{
+			if (onTop)
+				glClearColor(transparent[0], transparent[1], transparent[2], transparent[3]);
 
-	// Start with a clean slate and fill the image with the background color
-	glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT);
+			glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT);
+			glClearColor(backgroundColor[0], backgroundColor[1], backgroundColor[2], backgroundColor[3]);
+		}
+	}
 
-	// Render the part to the pixel buffer (and set the camera after the first run)
-	this->renderPart();
-	log_msg(debug, "Part rendered");
+	// Render the part to the pixel buffers (and set the cameras after the first run)
+	if (lastGlError == 0)
+	{
+		this->renderPart(views);
+		log_msg(debug, "Part rendered");
 
-	// Render the bed to the pixel buffer
-	this->renderBed();
-	log_msg(debug, "Bed rendered");
+		stats.segments = this->source->get_segment_count();
+		stats.throttled = governor.get_throttled_time();
+		stats.cancelled = governor.is_cancelled();
 
-	// Save the contents of the pixel buffer to a file
-	if(this->saveRender(imageFile))
-		log_msg(debug, "File saved");
+		if (stats.cancelled)
+			log_msg(debug, "Render cancelled");
+
+		if (stats.throttled > 0)
+		{
+			char log[128];
+			sprintf(log, "Parser throttled for %.2f s", stats.throttled);
+			log_msg(debug, log);
+		}
+	}
+
+	// Store the bounding box the camera was pointed with, so a render from
+	// the cache is framed the same
+	if (cacheWriter != NULL && lastGlError == 0 && !stats.cancelled)
+		cacheWriter->finish(&cameraBbox, cameraBboxValid);
+
+	if (layerWriter != NULL && lastGlError == 0 && !stats.cancelled)
+		layerWriter->finish(&cameraBbox, cameraBboxValid);
+
+	for (auto & view : views)
+	{
+		if (lastGlError == 0 && !stats.cancelled)
+		{
+			// Render the bed to the pixel buffer, the image of the layers before a range has it already
+			if (range == NULL || range->image.empty())
+			{
+				this->useView(&view);
+
+				double start = now_seconds();
+				this->renderBed();
+				stats.draw += now_seconds() - start;
+				log_msg(debug, "Bed rendered");
+			}
+
+			// Save the contents of the pixel buffer to a file
+			if (this->saveRender(&view, range))
+				log_msg(debug, "File saved");
+		}
+
+		this->deleteFramebuffer(&view);
+	}
 
 	// Clean up
-	delete[] vertices;
-	delete[] indices;
-	delete this->parser;
+	for (auto & chunk : chunks)
+	{
+		delete[] chunk.vertices;
+		delete[] chunk.indices;
+		chunk.vertices = NULL;
+		chunk.indices = NULL;
+	}
 
-	return lastGlError == 0;
+	delete[] shortIndices;
+	delete cacheWriter;
+	delete layerWriter;
+	delete this->source;
+	this->source = NULL;
+
+	return lastGlError == 0 && !stats.cancelled;
 }
 
 /* Private methods */
 
+// The bounding box the parser considers valid for printing. The origin offset is not included, 
+// as it is not considered a valid printing area and thus should not be rendered.
+BBox Renderer::getBedBbox()
+{
+	return BBox(0, printArea.xmax + printArea.xmin, 0, printArea.ymax + printArea.ymin, 0, printArea.zmax + printArea.zmin);
+}
+
+// Read the image of the layers before a range from a framebuffer file. Returns false if the
+// file doesn't exist, or doesn't hold the layers before the range at the resolution of the view.
+bool Renderer::loadFramebuffer(const char * framebufferFile, RenderView * view, unsigned int layers, std::vector<uint8_t> * image)
+{
+	FILE * fin = fopen(framebufferFile, "rb");
+
+	if (fin == NULL)
+		return false;
+
+	FramebufferHeader header;
+	bool loaded = fread(&header, sizeof header, 1, fin) == 1
+		&& memcmp(header.magic, FRAMEBUFFER_MAGIC, 4) == 0
+		&& header.width == view->width
+		&& header.height == view->height
+		&& header.layers == layers;
+
+	if (loaded)
+	{
+		image->resize(4 * view->width * view->height);
+		loaded = fread(image->data(), 1, image->size(), fin) == image->size();
+	}
+
+	fclose(fin);
+
+	if (!loaded)
+		image->clear();
+
+	return loaded;
+}
+
+// Write the image of the layers up to the end of a range to a framebuffer file
+bool Renderer::saveFramebuffer(const char * framebufferFile, RenderView * view, unsigned int layers, const std::vector<uint8_t> & image)
+{
+	FramebufferHeader header;
+	memcpy(header.magic, FRAMEBUFFER_MAGIC, 4);
+	header.width = view->width;
+	header.height = view->height;
+	header.layers = layers;
+
+	std::string tempFile = std::string(framebufferFile) + ".part";
+	FILE * fout = fopen(tempFile.c_str(), "wb");
+
+	if (fout == NULL)
+	{
+		log_msg(warning, "Could not create framebuffer file");
+		return false;
+	}
+
+	bool written = fwrite(&header, sizeof header, 1, fout) == 1
+		&& fwrite(image.data(), 1, image.size(), fout) == image.size();
+
+	if (fclose(fout) != 0 || !written)
+	{
+		log_msg(warning, "Could not write framebuffer file");
+		remove(tempFile.c_str());
+		return false;
+	}
+
+	// Windows won't rename onto an existing file
+	remove(framebufferFile);
+
+	if (rename(tempFile.c_str(), framebufferFile) != 0)
+	{
+		remove(tempFile.c_str());
+		return false;
+	}
+
+	return true;
+}
+
 // Create a GPU shader program and create handles to the shader's variables
 void Renderer::createProgram()
 {
-	// Compile the shaders
-	if (drawType == DRAW_LINES)
-		loadShaders(line_vertexshader, line_fragmentshader, &(this->program), &(this->vertex_shader), &(this->fragment_shader));
-	else
-		loadShaders(tube_vertexshader, tube_fragmentshader, &(this->program), &(this->vertex_shader), &(this->fragment_shader));
+	// Compile the shaders, they draw the bed and the part as lines
+	loadShaders(line_vertexshader, line_fragmentshader, &(this->program), &(this->vertex_shader), &(this->fragment_shader));
 
 	// Get handles to the shader's variables
 	position_handle = glGetAttribLocation(program, "vertexPosition_modelspace");
@@ -206,23 +618,6 @@ void Renderer::createProgram()
 	camera_handle = glGetUniformLocation(program, "MVP");
 	checkGlError("Get camera handle");
 
-	// For the fragment shader that uses normals to create better lighting 
-	// provide additional handles
-	if (drawType == DRAW_TUBES)
-	{
-		light_handle = glGetUniformLocation(program, "LightPosition_worldspace");
-		checkGlError("Get light handle");
-
-		normal_handle = glGetAttribLocation(program, "vertexNormal_modelspace");
-		checkGlError("Get normal handle");
-
-		m_handle = glGetUniformLocation(program, "M");
-		checkGlError("Get model-matrix handle");
-
-		v_handle = glGetUniformLocation(program, "V");
-		checkGlError("Get view-matrix handle");
-	}
-
 	// Enable the shader program
 	glUseProgram(program);
 	checkGlError("Use program");
@@ -233,12 +628,102 @@ void Renderer::createProgram()
 	checkGlError("Enable depth test");
 }
 
+// Create the program that draws the part as tubes, and the buffer with the corners
+// of the quad of a tube. The line program stays in use, for the bed.
+void Renderer::createTubeProgram()
+{
+	loadShaders(tube_vertexshader, tube_fragmentshader, &(this->tubeProgram), &(this->tubeVertexShader), &(this->tubeFragmentShader));
+
+	tube_start_handle = glGetAttribLocation(tubeProgram, "segmentStart");
+	tube_end_handle = glGetAttribLocation(tubeProgram, "segmentEnd");
+	tube_corner_handle = glGetAttribLocation(tubeProgram, "corner");
+	checkGlError("Get tube attribute handles");
+
+	tube_color_handle = glGetUniformLocation(tubeProgram, "ds_Color");
+	tube_camera_handle = glGetUniformLocation(tubeProgram, "MVP");
+	tube_eye_handle = glGetUniformLocation(tubeProgram, "CameraPosition_worldspace");
+	tube_radius_handle = glGetUniformLocation(tubeProgram, "TubeRadius");
+	tube_pixel_handle = glGetUniformLocation(tubeProgram, "PixelScale");
+	tube_light_handle = glGetUniformLocation(tubeProgram, "LightPosition_worldspace");
+	checkGlError("Get tube uniform handles");
+
+	// Along the path (0: start, 1: end) and across it, in the order of a triangle strip
+	const float corners[8] = { 0, -1, 0, 1, 1, -1, 1, 1 };
+
+	glGenBuffers(1, &cornerBuffer);
+	glBindBuffer(GL_ARRAY_BUFFER, cornerBuffer);
+	glBufferData(GL_ARRAY_BUFFER, sizeof corners, corners, GL_STATIC_DRAW);
+	checkGlError("Corner buffer data");
+}
+
+// Look up the functions that draw instances: part of desktop OpenGL 3.3 and OpenGL ES 3.0,
+// for OpenGL ES 2.0 one of the instanced_arrays extensions is needed. Without them, tubes
+// are expanded on the CPU.
+void Renderer::loadInstancing()
+{
+	drawArraysInstanced = NULL;
+	vertexAttribDivisor = NULL;
+
+#ifdef USE_GLEW
+	drawArraysInstanced = glDrawArraysInstanced;
+	vertexAttribDivisor = glVertexAttribDivisor;
+#else
+	const char * version = (const char *)glGetString(GL_VERSION);
+	const char * extensions = (const char *)glGetString(GL_EXTENSIONS);
+	int major = 0;
+
+	// A context may be of a later version than the 2.0 asked for
+	if (version != NULL && sscanf(version, "OpenGL ES %d", &major) == 1 && major >= 3)
+	{
+		drawArraysInstanced = (DrawArraysInstancedProc)eglGetProcAddress("glDrawArraysInstanced");
+		vertexAttribDivisor = (VertexAttribDivisorProc)eglGetProcAddress("glVertexAttribDivisor");
+	}
+	else if (extensions != NULL)
+	{
+		static const char * suffixes[] = { "ANGLE", "EXT", "NV" };
+
+		for (const char * suffix : suffixes)
+		{
+			char extension[64], drawName[64], divisorName[64];
+			sprintf(extension, "GL_%s_instanced_arrays", suffix);
+			sprintf(drawName, "glDrawArraysInstanced%s", suffix);
+			sprintf(divisorName, "glVertexAttribDivisor%s", suffix);
+
+			if (strstr(extensions, extension) == NULL)
+				continue;
+
+			drawArraysInstanced = (DrawArraysInstancedProc)eglGetProcAddress(drawName);
+			vertexAttribDivisor = (VertexAttribDivisorProc)eglGetProcAddress(divisorName);
+			break;
+		}
+	}
+
+	if (drawArraysInstanced == NULL || vertexAttribDivisor == NULL)
+	{
+		drawArraysInstanced = NULL;
+		vertexAttribDivisor = NULL;
+	}
+#endif
+
+	log_msg(debug, drawArraysInstanced != NULL ? "Tubes are drawn instanced" : "No instanced drawing, tubes are expanded on the CPU");
+}
+
 // Create a vertex buffer object using the given vertices 
 // and indices of the vertices that make up the fragments (lines, triangles etc.)
-void Renderer::buffer(const int nVertices, const float * vertices, const int nIndices, const short * indices, BufferInfo * bufferInfo)
+void Renderer::buffer(const int nVertices, const float * vertices, const int nIndices, const uint16_t * indices, BufferInfo * bufferInfo)
 {
 	int vertexBuffer_size = nVertices * sizeof(float);
-	int indexBuffer_size = nIndices * sizeof(short);
+	int indexBuffer_size = nIndices * sizeof(uint16_t);
+
+	// The software rasterizer draws from memory
+	if (rasterizer != NULL)
+	{
+		(*bufferInfo).cpuVertices.assign(vertices, vertices + nVertices);
+		(*bufferInfo).cpuIndices.assign(indices, indices + nIndices);
+		(*bufferInfo).nVertices = nVertices;
+		(*bufferInfo).nIndices = nIndices;
+		return;
+	}
 
 	GLuint vbo, ivbo, vertexArray;
 
@@ -277,6 +762,7 @@ void Renderer::buffer(const int nVertices, const float * vertices, const int nIn
 	(*bufferInfo).vertexBuffer = vbo;
 	(*bufferInfo).indexBuffer = ivbo;
 	(*bufferInfo).vertexArray = vertexArray;
+	(*bufferInfo).indexType = GL_UNSIGNED_SHORT;
 
 	// Count how much data we're buffering
 	memoryUsed += vertexBuffer_size + indexBuffer_size;
@@ -285,6 +771,13 @@ void Renderer::buffer(const int nVertices, const float * vertices, const int nIn
 // Clear a buffer from the GPU memory
 void Renderer::deleteBuffer(BufferInfo * bufferInfo)
 {
+	if (rasterizer != NULL)
+	{
+		(*bufferInfo).cpuVertices.clear();
+		(*bufferInfo).cpuIndices.clear();
+		return;
+	}
+
 	// Unwire
 	glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0);
 	checkGlError("Unbind element array buffer");
@@ -306,9 +799,232 @@ void Renderer::deleteBuffer(BufferInfo * bufferInfo)
 #endif
 }
 
+// Choose the number of lines parsed per chunk, so that the stream buffers fit in the
+// GPU memory budget. (Re)creates the stream buffers if they need a different size.
+// verticesSize and indicesSize are the buffer sizes per line of the vertex source.
+void Renderer::configureStreamBuffers(unsigned int verticesSize, unsigned int indicesSize)
+{
+	unsigned int vertexSize = 3 * sizeof(float);
+
+	// Tubes expanded on the CPU take a quad of 4 vertices and 6 indices per path
+	if (expandsTubes())
+	{
+		vertexSize = TUBE_VERTEX_FLOATS * sizeof(float);
+		verticesSize = 4 * vertexSize;
+		indicesSize = 6 * sizeof(VertexIndex);
+	}
+
+	// Without 32 bit indices, the indices are uploaded as 16 bit values
+	unsigned int gpuIndicesSize = uintIndices ? indicesSize : indicesSize / 2;
+
+	long lines = gpuMemoryBudget / (STREAM_BUFFERS * (long)(verticesSize + gpuIndicesSize));
+	lines = max(lines, (long)MIN_LINES_PER_RUN);
+
+	// 16 bit indices can't address more than 65536 vertices per chunk
+	if (!uintIndices && indicesSize > 0)
+		lines = min(lines, (long)(65536 / (verticesSize / vertexSize)));
+
+	this->linesPerRun = (unsigned int)lines;
+
+	long vertexCapacity = lines * verticesSize;
+	long indexCapacity = lines * gpuIndicesSize;
+
+	if (streamBuffers[0].vertexCapacity == vertexCapacity && streamBuffers[0].indexCapacity == indexCapacity)
+		return;
+
+	this->deleteStreamBuffers();
+	this->createStreamBuffers(vertexCapacity, indexCapacity);
+
+	char log[256];
+	sprintf(log, "Stream buffers created: %d x %ld kb, %u lines per chunk, %d bit indices", STREAM_BUFFERS, (vertexCapacity + indexCapacity) / 1000, linesPerRun, uintIndices ? 32 : 16);
+	log_msg(debug, log);
+}
+
+// Create the buffers the chunks of a part are streamed through. They are
+// allocated once and refilled for every chunk.
+void Renderer::createStreamBuffers(long vertexCapacity, long indexCapacity)
+{
+	for (auto & buff : streamBuffers)
+	{
+		buff.vertexCapacity = vertexCapacity;
+		buff.indexCapacity = indexCapacity;
+
+		if (rasterizer != NULL)
+		{
+			buff.cpuVertices.reserve(vertexCapacity / sizeof(float));
+			buff.cpuIndices.reserve(indexCapacity / sizeof(VertexIndex));
+			continue;
+		}
+
+#ifdef NEED_VERTEX_ARRAY_OBJECT
+		glGenVertexArrays(1, &buff.vertexArray);
+		checkGlError("gen vertex array");
+
+		glBindVertexArray(buff.vertexArray);
+		checkGlError("bind vertex array");
+#endif
+
+		glGenBuffers(1, &buff.vertexBuffer);
+		glBindBuffer(GL_ARRAY_BUFFER, buff.vertexBuffer);
+		glBufferData(GL_ARRAY_BUFFER, vertexCapacity, NULL, GL_STREAM_DRAW);
+		checkGlError("Create stream vertex buffer");
+
+		// Lines are drawn without indices
+		if (indexCapacity > 0)
+		{
+			glGenBuffers(1, &buff.indexBuffer);
+			glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buff.indexBuffer);
+			glBufferData(GL_ELEMENT_ARRAY_BUFFER, indexCapacity, NULL, GL_STREAM_DRAW);
+			checkGlError("Create stream index buffer");
+		}
+
+		buff.indexType = uintIndices ? GL_UNSIGNED_INT : GL_UNSIGNED_SHORT;
+	}
+
+	streamBuffer_i = 0;
+}
+
+// Clear the stream buffers from the GPU memory
+void Renderer::deleteStreamBuffers()
+{
+	for (auto & buff : streamBuffers)
+	{
+		if (buff.vertexCapacity != 0)
+			this->deleteBuffer(&buff);
+
+		buff = BufferInfo();
+	}
+}
+
+// Write a chunk of vertices and indices to the next stream buffer. The old storage
+// of the buffer is orphaned first, so the driver doesn't have to wait for draws that
+// still read from it.
+BufferInfo * Renderer::streamBuffer(int nVertices, const float * vertices, int nIndices, const VertexIndex * indices)
+{
+	BufferInfo * buff = &streamBuffers[streamBuffer_i];
+	streamBuffer_i = (streamBuffer_i + 1) % STREAM_BUFFERS;
+
+	int vertexFloats = 3;
+
+	// Upload the quads of the tubes instead of the paths
+	if (expandsTubes())
+	{
+		this->expandTubes(nVertices, vertices);
+
+		vertexFloats = TUBE_VERTEX_FLOATS;
+		nVertices = (int)tubeVertices.size();
+		vertices = tubeVertices.data();
+		nIndices = (int)tubeIndices.size();
+		indices = tubeIndices.data();
+	}
+
+	long vertexBuffer_size = nVertices * sizeof(float);
+	long indexBuffer_size = 0;
+
+	stats.vertices += nVertices / vertexFloats;
+	stats.bytesUploaded += vertexBuffer_size + nIndices * sizeof(VertexIndex);
+
+	if (rasterizer != NULL)
+	{
+		buff->cpuVertices.assign(vertices, vertices + nVertices);
+		buff->cpuIndices.assign(indices, indices + nIndices);
+		buff->nVertices = nVertices;
+		buff->nIndices = nIndices;
+		return buff;
+	}
+
+#ifdef NEED_VERTEX_ARRAY_OBJECT
+	glBindVertexArray(buff->vertexArray);
+	checkGlError("bind vertex array");
+#endif
+
+	glBindBuffer(GL_ARRAY_BUFFER, buff->vertexBuffer);
+	glBufferData(GL_ARRAY_BUFFER, buff->vertexCapacity, NULL, GL_STREAM_DRAW);
+	glBufferSubData(GL_ARRAY_BUFFER, 0, vertexBuffer_size, vertices);
+	checkGlError("Stream vertex buffer data");
+
+	if (nIndices > 0)
+	{
+		const void * data = indices;
+		indexBuffer_size = nIndices * sizeof(VertexIndex);
+
+		if (!uintIndices)
+		{
+			for (int i = 0; i < nIndices; ++i)
+				shortIndices[i] = (uint16_t)indices[i];
+
+			data = shortIndices;
+			indexBuffer_size = nIndices * sizeof(uint16_t);
+		}
+
+		glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buff->indexBuffer);
+		glBufferData(GL_ELEMENT_ARRAY_BUFFER, buff->indexCapacity, NULL, GL_STREAM_DRAW);
+		glBufferSubData(GL_ELEMENT_ARRAY_BUFFER, 0, indexBuffer_size, data);
+		checkGlError("Stream index buffer data");
+	}
+
+	buff->nVertices = nVertices;
+	buff->nIndices = nIndices;
+
+	// Count how much data we're buffering
+	memoryUsed += vertexBuffer_size + indexBuffer_size;
+
+	return buff;
+}
+
+// Expand the paths of a chunk to the quads the tube shaders draw, for GPUs that can't draw
+// instances: the start and end of the path are repeated for every corner
+void Renderer::expandTubes(const int nVertices, const float * vertices)
+{
+	static const float corners[4][2] = { { 0, -1 }, { 0, 1 }, { 1, -1 }, { 1, 1 } };
+
+	const int nPaths = nVertices / 6;
+
+	tubeVertices.resize(nPaths * 4 * TUBE_VERTEX_FLOATS);
+	tubeIndices.resize(nPaths * 6);
+
+	float * v = tubeVertices.data();
+	VertexIndex * index = tubeIndices.data();
+
+	for (int i = 0; i < nPaths; ++i, vertices += 6)
+	{
+		for (int k = 0; k < 4; ++k, v += TUBE_VERTEX_FLOATS)
+		{
+			memcpy(v, vertices, 6 * sizeof(float));
+			v[6] = corners[k][0];
+			v[7] = corners[k][1];
+		}
+
+		// The two triangles of the strip
+		VertexIndex base = 4 * i;
+		index[0] = base;
+		index[1] = base + 1;
+		index[2] = base + 2;
+		index[3] = base + 2;
+		index[4] = base + 1;
+		index[5] = base + 3;
+		index += 6;
+	}
+}
+
 // Draws a vertex buffer object to the render buffer
 void Renderer::draw(const float color[4], BufferInfo * bufferInfo, GLenum element_type)
 {
+	stats.drawCalls++;
+
+	if (rasterizer != NULL)
+	{
+		const float * vertices = (*bufferInfo).cpuVertices.data();
+		const VertexIndex * indices = (*bufferInfo).nIndices > 0 ? (*bufferInfo).cpuIndices.data() : NULL;
+
+		if (element_type == GL_LINES)
+			rasterizer->draw_lines(currentView->target, currentView->mvp, color, vertices, (*bufferInfo).nVertices, 3);
+		else
+			rasterizer->draw_triangles(currentView->target, currentView->mvp, color, vertices, (*bufferInfo).nVertices, 3, indices, (*bufferInfo).nIndices);
+
+		return;
+	}
+
 	// Set the base color of the fragments to be drawn
 	glUniform4fv(color_handle, 1, color);
 	checkGlError("Set color");
@@ -322,68 +1038,158 @@ void Renderer::draw(const float color[4], BufferInfo * bufferInfo, GLenum elemen
 	glEnableVertexAttribArray(position_handle);
 	checkGlError("Enable vertex array position");
 
-	if (drawType == DRAW_TUBES)
-	{
-		// Allow the shader's normals variable to accept vertex buffers
-		glEnableVertexAttribArray(normal_handle);
-		checkGlError("Enable vertex array normals");
-	}
-
 	// Bind to the vertex buffer
 	glBindBuffer(GL_ARRAY_BUFFER, (*bufferInfo).vertexBuffer);
 	checkGlError("Bind buffer");
 
-	// Wire the vertex buffer to the position variable, and if needed, to the normals variable
-	if (drawType == DRAW_TUBES)
-	{	
-		glVertexAttribPointer(position_handle, 3, GL_FLOAT, GL_FALSE, sizeof(float) * 6, (void*)0);
-		checkGlError("Position pointer");
+	// Wire the vertex buffer to the position variable
+	glVertexAttribPointer(position_handle, 3, GL_FLOAT, GL_FALSE, sizeof(float) * 3, (void*)0);
+	checkGlError("Position pointer");
 
-		glVertexAttribPointer(normal_handle, 3, GL_FLOAT, GL_FALSE, sizeof(float) * 6, (void*)(3 * sizeof(float)));
-		checkGlError("Normal pointer");
+	if ((*bufferInfo).nIndices == 0)
+	{
+		// Draw the vertices in order
+		glDrawArrays(element_type, 0, (*bufferInfo).nVertices / 3);
+		checkGlError("Draw");
 	}
 	else
 	{
-		glVertexAttribPointer(position_handle, 3, GL_FLOAT, GL_FALSE, sizeof(float) * 3, (void*)0);
-		checkGlError("Position pointer");
+		// Bind to the vertex elements buffer (containing the indices of the vertices to draw) 
+		glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, (*bufferInfo).indexBuffer);
+		checkGlError("Bind elements");
+
+		// Draw the vertices from the given indices
+		// Note: OpenGL ES needs OES_element_index_uint for 32 bit indices
+		glDrawElements(element_type, (*bufferInfo).nIndices, (*bufferInfo).indexType, (void*)0);
+		checkGlError("Draw");
 	}
 
-	// Bind to the vertex elements buffer (containing the indices of the vertices to draw) 
-	glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, (*bufferInfo).indexBuffer);
-	checkGlError("Bind elements");
-
-	// Draw the vertices from the given indices
-	// Note: OpenGL ES is limited to using shorts
-	glDrawElements(element_type, (*bufferInfo).nIndices, GL_UNSIGNED_SHORT, (void*)0);
-	checkGlError("Draw");
-
 	// Unwire buffers
 	glDisableVertexAttribArray(position_handle);
 	checkGlError("Disable position array");
+}
 
-	if (drawType == DRAW_TUBES)
+// Draws the paths of a stream buffer as tubes, with the tube program. With instancing the
+// buffer holds the paths and every path is an instance of the corner buffer, otherwise the
+// buffer holds the quads expanded on the CPU.
+void Renderer::drawTubes(const float color[4], BufferInfo * bufferInfo)
+{
+	stats.drawCalls++;
+
+	// Same light as the tube shader
+	const glm::vec3 light((printArea.xmax + printArea.xmin) / 2, -50.0, 300.0);
+
+	if (rasterizer != NULL)
 	{
-		glDisableVertexAttribArray(normal_handle);
-		checkGlError("Disable normal array");
+		SoftwareLight softwareLight;
+		softwareLight.position = light;
+
+		SoftwareTube tube;
+		tube.camera = currentView->cameraPosition;
+		tube.radius = tubeWidth / 2;
+		tube.pixelScale = currentView->pixelScale;
+
+		rasterizer->draw_tubes(currentView->target, currentView->mvp, color, (*bufferInfo).cpuVertices.data(), (*bufferInfo).nVertices, tube, softwareLight);
+		return;
 	}
+
+	glUseProgram(tubeProgram);
+	checkGlError("Use tube program");
+
+	glUniform4fv(tube_color_handle, 1, color);
+	glUniformMatrix4fv(tube_camera_handle, 1, GL_FALSE, &currentView->mvp[0][0]);
+	glUniform3fv(tube_eye_handle, 1, &currentView->cameraPosition[0]);
+	glUniform1f(tube_radius_handle, tubeWidth / 2);
+	glUniform1f(tube_pixel_handle, currentView->pixelScale);
+	glUniform3fv(tube_light_handle, 1, &light[0]);
+	checkGlError("Set tube uniforms");
+
+#ifdef NEED_VERTEX_ARRAY_OBJECT
+	glBindVertexArray((*bufferInfo).vertexArray);
+	checkGlError("bind vertex array");
+#endif
+
+	glEnableVertexAttribArray(tube_start_handle);
+	glEnableVertexAttribArray(tube_end_handle);
+	glEnableVertexAttribArray(tube_corner_handle);
+	checkGlError("Enable tube arrays");
+
+	if (drawArraysInstanced != NULL)
+	{
+		glBindBuffer(GL_ARRAY_BUFFER, cornerBuffer);
+		glVertexAttribPointer(tube_corner_handle, 2, GL_FLOAT, GL_FALSE, sizeof(float) * 2, (void*)0);
+
+		// Every path (two vertices) is an instance
+		glBindBuffer(GL_ARRAY_BUFFER, (*bufferInfo).vertexBuffer);
+		glVertexAttribPointer(tube_start_handle, 3, GL_FLOAT, GL_FALSE, sizeof(float) * 6, (void*)0);
+		glVertexAttribPointer(tube_end_handle, 3, GL_FLOAT, GL_FALSE, sizeof(float) * 6, (void*)(3 * sizeof(float)));
+		vertexAttribDivisor(tube_start_handle, 1);
+		vertexAttribDivisor(tube_end_handle, 1);
+		checkGlError("Tube pointers");
+
+		drawArraysInstanced(GL_TRIANGLE_STRIP, 0, 4, (*bufferInfo).nVertices / 6);
+		checkGlError("Draw tubes");
+
+		// The line program uses the same attributes
+		vertexAttribDivisor(tube_start_handle, 0);
+		vertexAttribDivisor(tube_end_handle, 0);
+	}
+	else
+	{
+		glBindBuffer(GL_ARRAY_BUFFER, (*bufferInfo).vertexBuffer);
+		glVertexAttribPointer(tube_start_handle, 3, GL_FLOAT, GL_FALSE, sizeof(float) * TUBE_VERTEX_FLOATS, (void*)0);
+		glVertexAttribPointer(tube_end_handle, 3, GL_FLOAT, GL_FALSE, sizeof(float) * TUBE_VERTEX_FLOATS, (void*)(3 * sizeof(float)));
+		glVertexAttribPointer(tube_corner_handle, 2, GL_FLOAT, GL_FALSE, sizeof(float) * TUBE_VERTEX_FLOATS, (void*)(6 * sizeof(float)));
+		checkGlError("Tube pointers");
+
+		glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, (*bufferInfo).indexBuffer);
+		glDrawElements(GL_TRIANGLES, (*bufferInfo).nIndices, (*bufferInfo).indexType, (void*)0);
+		checkGlError("Draw tubes");
+	}
+
+	glDisableVertexAttribArray(tube_start_handle);
+	glDisableVertexAttribArray(tube_end_handle);
+	glDisableVertexAttribArray(tube_corner_handle);
+	checkGlError("Disable tube arrays");
+
+	glUseProgram(program);
+	checkGlError("Use program");
+}
+
+// Draws a stream buffer with paths of the part, as lines or tubes
+void Renderer::drawPart(BufferInfo * bufferInfo)
+{
+	if (drawType == DRAW_TUBES)
+		drawTubes(partColor, bufferInfo);
+	else
+		draw(partColor, bufferInfo, GL_LINES);
 }
 
-// Sets the camera 
-void Renderer::setCamera()
+// Sets the camera of a view
+void Renderer::setCamera(RenderView * view)
 {
-	BBox bbox = BBox();
+	const bool pointCameraAtPart = view->pointCameraAtPart;
+	const glm::vec3 cameraDistance = view->cameraDistance;
+
+	BBox bbox = cameraBbox;
 
 	glm::vec3 cameraPosition, cameraTarget;
 
 	// Start with a field-of-view for the camera of 20 deg
 	float fov_deg = 20.0f;
 	
-	if (parser->get_bbox(&bbox))
+	if (!cameraBboxFixed)
+	{
+		cameraBboxValid = source->get_bbox(&bbox);
+		cameraBbox = bbox;
+	}
+
+	if (cameraBboxValid)
 	{
 		// Never go below this fov
 		float fov_deg_min = 10.0f;
 
-		if (this->pointCameraAtPart)
+		if (pointCameraAtPart)
 		{
 			// Point to the middle of the part
 			cameraTarget = glm::vec3((bbox.xmax + bbox.xmin) / 2, (bbox.ymax + bbox.ymin) / 2, (bbox.zmax + bbox.zmin) / 2);
@@ -435,63 +1241,160 @@ void Renderer::setCamera()
 	cameraPosition = cameraTarget + cameraDistance;
 
 	// Define the matrices that transform vertices to pixels
-	glm::mat4 mvp, projection, view, model;
 	glm::vec3 up = glm::vec3(0, 0, 1); // +Z is pointing upwards
-	model = glm::mat4(1.0f); // We don't need to transform the model
-	view = glm::lookAt(cameraPosition, cameraTarget, up);
-	projection = glm::perspective<float>(glm::radians(fov_deg), width / (float)height, 0.1f, 1000.0f);
 
-	mvp = projection * view * model;
+	// Unless we look straight down, then +Y is pointing upwards in the image
+	if (fabs(cameraDistance.x) <= eps && fabs(cameraDistance.y) <= eps)
+		up = glm::vec3(0, 1, 0);
 
-	// Upload the camera matrix to OpenGL(ES)
-	glUniformMatrix4fv(camera_handle, 1, GL_FALSE, &mvp[0][0]);
-	checkGlError("Set camera matrix");
+	// The near plane is kept well away from the eye, as the depth buffer precision is mostly spent
+	// close to it. Otherwise the bed and the part z-fight, and a view straight down loses the part altogether
+	glm::mat4 projection = glm::perspective<float>(glm::radians(fov_deg), view->width / (float)view->height, 10.0f, 1000.0f);
 
-	// Provide additional matrices for the fragment shader that uses lighting
-	if (drawType == DRAW_TUBES)
+	// Paths are smallest in the image where the part is closest to the camera
+	view->pixelSize = 0.0f;
+
+	if (cameraBboxValid)
 	{
-		glUniformMatrix4fv(m_handle, 1, GL_FALSE, &model[0][0]);
-		checkGlError("Set model matrix");
-		glUniformMatrix4fv(v_handle, 1, GL_FALSE, &view[0][0]);
-		checkGlError("Set view matrix");
+		glm::vec3 closest = glm::clamp(cameraPosition, glm::vec3(bbox.xmin, bbox.ymin, bbox.zmin), glm::vec3(bbox.xmax, bbox.ymax, bbox.zmax));
+		float distance = max(glm::length(closest - cameraPosition), 10.0f);
+
+		view->pixelSize = 2.0f * distance * tan(glm::radians(fov_deg) / 2) / view->height;
 	}
+
+	// Tubes are at least a pixel wide
+	view->pixelScale = 2.0f * tan(glm::radians(fov_deg) / 2) / view->height;
+	view->cameraPosition = cameraPosition;
+
+	view->model = glm::mat4(1.0f); // We don't need to transform the model
+	view->view = glm::lookAt(cameraPosition, cameraTarget, up);
+	view->mvp = projection * view->view * view->model;
+
+	// Upload the camera matrices to OpenGL(ES)
+	this->useView(view);
 }
 
-// Create vertex buffer for the bed
-void Renderer::bufferBed()
+// Direct the drawing to the framebuffer of a view, and use its camera
+void Renderer::useView(RenderView * view)
 {
-	int bedvertices_n;
-	float * bedvertices;
+	this->currentView = view;
 
-	// X, y, z, nx, ny, nz
-	if (drawType == DRAW_TUBES)
+	// The software rasterizer takes the matrices when drawing
+	if (rasterizer != NULL)
+		return;
+
+	glBindFramebuffer(GL_FRAMEBUFFER, view->framebuffer);
+	checkGlError("Bind framebuffer");
+
+	glViewport(0, 0, view->width, view->height);
+	checkGlError("Set viewport");
+
+	// Upload the camera matrix to OpenGL(ES)
+	glUniformMatrix4fv(camera_handle, 1, GL_FALSE, &view->mvp[0][0]);
+	checkGlError("Set camera matrix");
+}
+
+// Create an offscreen framebuffer with a color and depth buffer for a view
+bool Renderer::createFramebuffer(RenderView * view)
+{
+	if (rasterizer != NULL)
 	{
-		bedvertices_n = 24;
-		bedvertices = new float[bedvertices_n] {
-			printArea.xmin, printArea.ymin, 0, 0, 0, 1.0f,
-			printArea.xmin, printArea.ymax, 0, 0, 0, 1.0f,
-			printArea.xmax, printArea.ymax, 0, 0, 0, 1.0f,
-			printArea.xmax, printArea.ymin, 0, 0, 0, 1.0f
-		};
+		view->target = new SoftwareTarget(view->width, view->height);
+		return true;
 	}
-	else
+
+	GLint maxSize;
+	glGetIntegerv(GL_MAX_RENDERBUFFER_SIZE, &maxSize);
+
+	if (view->width > (unsigned int)maxSize || view->height > (unsigned int)maxSize)
 	{
-		bedvertices_n = 12;
-		bedvertices = new float[bedvertices_n] {
-			printArea.xmin, printArea.ymin, 0,
-			printArea.xmin, printArea.ymax, 0,
-			printArea.xmax, printArea.ymax, 0,
-			printArea.xmax, printArea.ymin, 0,
-		};
+		char log[128];
+		sprintf(log, "Image resolution %dx%d exceeds the maximum of %dx%d", view->width, view->height, maxSize, maxSize);
+		log_msg(error, log);
+
+		lastGlError = GL_INVALID_VALUE;
+		return false;
 	}
 
+	glGenFramebuffers(1, &view->framebuffer);
+	checkGlError("Generate framebuffer");
+	glBindFramebuffer(GL_FRAMEBUFFER, view->framebuffer);
+	checkGlError("Bind framebuffer");
+
+	// Color buffer
+	glGenRenderbuffers(1, &view->colorBuffer);
+	checkGlError("Generate color buffer");
+	glBindRenderbuffer(GL_RENDERBUFFER, view->colorBuffer);
+	checkGlError("Bind color buffer");
+	glRenderbufferStorage(GL_RENDERBUFFER, RENDERBUFFER_COLOR_FORMAT, view->width, view->height);
+	checkGlError("Color buffer storage");
+	glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, view->colorBuffer);
+	checkGlError("Attach color buffer");
+
+	// Depth buffer, prevents the bed from colliding with the part
+	glGenRenderbuffers(1, &view->depthBuffer);
+	checkGlError("Generate depth buffer");
+	glBindRenderbuffer(GL_RENDERBUFFER, view->depthBuffer);
+	checkGlError("Bind depth buffer");
+	glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT16, view->width, view->height);
+	checkGlError("Depth buffer storage");
+	glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, view->depthBuffer);
+	checkGlError("Attach depth buffer");
+
+	if (glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE)
+	{
+		log_msg(error, "Could not create a complete framebuffer");
+		lastGlError = GL_INVALID_FRAMEBUFFER_OPERATION;
+		return false;
+	}
+
+	return lastGlError == 0;
+}
+
+// Clear the offscreen framebuffer of a view from the GPU memory
+void Renderer::deleteFramebuffer(RenderView * view)
+{
+	if (rasterizer != NULL)
+	{
+		delete view->target;
+		view->target = NULL;
+		return;
+	}
+
+	// Back to the render context's own surface
+	glBindFramebuffer(GL_FRAMEBUFFER, 0);
+	checkGlError("Unbind framebuffer");
+
+	if (view->framebuffer == 0)
+		return;
+
+	glDeleteFramebuffers(1, &view->framebuffer);
+	checkGlError("Delete framebuffer");
+
+	GLuint toDelete[] = { view->colorBuffer, view->depthBuffer };
+	glDeleteRenderbuffers(2, toDelete);
+	checkGlError("Delete renderbuffers");
+
+	view->framebuffer = view->colorBuffer = view->depthBuffer = 0;
+}
+
+// Create vertex buffer for the bed
+void Renderer::bufferBed()
+{
+	// X, y, z
+	const int bedvertices_n = 12;
+	float bedvertices[bedvertices_n] = {
+		printArea.xmin, printArea.ymin, 0,
+		printArea.xmin, printArea.ymax, 0,
+		printArea.xmax, printArea.ymax, 0,
+		printArea.xmax, printArea.ymin, 0,
+	};
+
 	const int bedindices_n = 6;
-	short bedindices[bedindices_n] = { 0, 1, 2, 2, 3, 0 };
+	uint16_t bedindices[bedindices_n] = { 0, 1, 2, 2, 3, 0 };
 
 	buffer(bedvertices_n, bedvertices, bedindices_n, bedindices, &bedBuffer);
 	bedBuffered = true;
-
-	delete[] bedvertices;
 }
 
 // (Buffer and) render the bed to the pixel buffer
@@ -500,82 +1403,177 @@ void Renderer::renderBed()
 	draw(bedColor, &bedBuffer, GL_TRIANGLES);
 }
 
-// Read the part vertices from the gcode and render it to the pixel buffer
-void Renderer::renderPart()
+// Read the part vertices from the gcode and render it to the pixel buffer of each view
+void Renderer::renderPart(std::vector<RenderView> & views)
 {
 	log_msg(debug, "Begin rendering part");
 
 	// Reset the amount of memory we have used
 	memoryUsed = 0;
 
-	// Keep pointers to what we need to render
-	int nVertices, nIndices;
-	BufferInfo buff;
-
 	// Extract vertices from the first n lines of gcode
-	int nParsed = parser->get_vertices(linesPerRun, &nVertices, vertices, &nIndices, indices);
+	VertexChunk * chunk = &chunks[0];
+	double start = now_seconds();
+	chunk->nParsed = source->get_vertices(min(linesPerRun, (unsigned int)CAMERA_LINES), &chunk->nVertices, chunk->vertices, &chunk->nIndices, chunk->indices);
+	stats.parse += now_seconds() - start;
 
-	if (nParsed == -1)
+	long size;
+	source->get_progress(&chunk->offset, &size);
+
+	if (chunk->nParsed == -1)
 	{
 		log_msg(error, "Could not parse gcode file. Does the file exist?");
 		return;
 	}
 
-	if (nParsed == 0)
+	if (chunk->nParsed == 0)
 	{
 		log_msg(debug, "Nothing to parse");
 		return;
 	}
 		
+	stats.lines += chunk->nParsed;
+
 	// Store them in the GPU
-	buffer(nVertices, vertices, nIndices, indices, &buff);
+	start = now_seconds();
+	BufferInfo * buff = streamBuffer(chunk->nVertices, chunk->vertices, chunk->nIndices, chunk->indices);
+	stats.upload += now_seconds() - start;
 
-	// The bounding box of the first layer is sufficient for our needs (set the camera FOV)
-	// so at this point (before we rendered anything) we can point the camera
-	// in the right direction
-	this->setCamera();
+	for (auto & view : views)
+	{
+		// The bounding box of the first layer is sufficient for our needs (set the camera FOV)
+		// so at this point (before we rendered anything) we can point the camera
+		// in the right direction
+		this->useView(&view);
+		this->setCamera(&view);
+
+		// With the camera in place we can start drawing
+		start = now_seconds();
+		this->drawPart(buff);
+		stats.draw += now_seconds() - start;
+	}
 
-	// With the camera in place we can start drawing
-	if (drawType == DRAW_LINES)
-		draw(partColor, &buff, GL_LINES);
-	else
-		draw(partColor, &buff, GL_TRIANGLES);
-	
-	// Free some space
-	deleteBuffer(&buff);
+	progressOffset = chunk->offset;
 
-	// Continue to read, buffer and draw the rest of the gcode file
-	while (parser->get_vertices(linesPerRun, &nVertices, vertices, &nIndices, indices) > 0)
+	// With the cameras in place, we know how small the paths get in the images. Merge
+	// the paths that the largest image can't tell apart.
+	if (decimation > 0.0f)
 	{
-		buffer(nVertices, vertices, nIndices, indices, &buff);
+		float pixelSize = views[0].pixelSize;
 
-		if (drawType == DRAW_LINES)
-			draw(partColor, &buff, GL_LINES);
-		else
-			draw(partColor, &buff, GL_TRIANGLES);
+		for (auto & view : views)
+			pixelSize = min(pixelSize, view.pixelSize);
+
+		source->set_decimation(decimation * pixelSize);
 
-		deleteBuffer(&buff);
+		char log[128];
+		sprintf(log, "Decimation tolerance: %.3f mm", decimation * pixelSize);
+		log_msg(debug, log);
 	}
 
+	// Parse the rest of the gcode file on another thread, while the chunks it
+	// parsed are buffered and drawn here. The progress is known at chunk boundaries.
+	ChunkQueue emptyChunks, parsedChunks;
+
+	for (auto & empty : chunks)
+		emptyChunks.push(&empty);
+
+	std::thread parser(&Renderer::parseChunks, this, &emptyChunks, &parsedChunks);
+
+	while ((chunk = parsedChunks.pop())->nParsed > 0)
+	{
+		if (!governor.is_cancelled())
+			this->drawChunk(views, chunk);
+
+		progressOffset = chunk->offset;
+		emptyChunks.push(chunk);
+	}
+
+	// The parser thread stopped at the end of the part
+	parser.join();
+
 	// Log how much GPU memory we used to draw this part
 	char resp[512];
 	sprintf(resp, "Total data processed: %ld kb", memoryUsed / 1000);
 	log_msg(debug, resp);
 }
 
-// Reads the pixel buffer and encodes the data into a PNG file
-bool Renderer::saveRender(const char* imageFile)
+// Parser thread: fill the empty chunks with the vertices of the next lines, until
+// the end of the part or until the render is cancelled. The number of chunks bounds
+// how far it runs ahead.
+void Renderer::parseChunks(ChunkQueue * emptyChunks, ChunkQueue * parsedChunks)
+{
+	VertexChunk * chunk;
+	long size;
+
+	while ((chunk = emptyChunks->pop()) != NULL)
+	{
+		if (governor.is_cancelled())
+		{
+			chunk->nParsed = 0;
+			parsedChunks->push(chunk);
+			break;
+		}
+
+		double start = now_seconds();
+		chunk->nParsed = source->get_vertices(linesPerRun, &chunk->nVertices, chunk->vertices, &chunk->nIndices, chunk->indices);
+		stats.parse += now_seconds() - start;
+
+		source->get_progress(&chunk->offset, &size);
+
+		if (chunk->nParsed > 0)
+			stats.lines += chunk->nParsed;
+
+		parsedChunks->push(chunk);
+
+		if (chunk->nParsed <= 0)
+			break;
+	}
+}
+
+// Buffer a chunk once and draw it in all views
+void Renderer::drawChunk(std::vector<RenderView> & views, VertexChunk * chunk)
 {
-	// Wait for all commands to complete before we read the buffer
-	glFlush();
-	glFinish();
+	double start = now_seconds();
+	BufferInfo * buff = streamBuffer(chunk->nVertices, chunk->vertices, chunk->nIndices, chunk->indices);
+	stats.upload += now_seconds() - start;
+
+	start = now_seconds();
+
+	for (auto & view : views)
+	{
+		this->useView(&view);
+		this->drawPart(buff);
+	}
+
+	stats.draw += now_seconds() - start;
+}
+
+// Reads the pixel buffer of a view and encodes the data into a PNG file. The layers of
+// a range go on top of the image of the layers before, which is replaced by the result.
+bool Renderer::saveRender(RenderView * view, LayerRange * range)
+{
+	const unsigned int width = view->width, height = view->height;
 
 	// Create a buffer for the pixel data
 	const int n = 4 * width*height;
 	uint8_t *imgData = new uint8_t[n];
+	double start = now_seconds();
+
+	if (rasterizer != NULL)
+	{
+		memcpy(imgData, view->target->color.data(), n);
+	}
+	else
+	{
+		// Wait for all commands to complete before we read the buffer
+		glFlush();
+		glFinish();
+
+		// Read the pixels from the buffer
+		glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE, imgData);
+	}
 
-	// Read the pixels from the buffer
-	glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE, imgData);
 	if (checkGlError("glReadPixels"))
 	{
 		log_msg(error, "Couldn't read pixels from Open GL pixel buffer");
@@ -583,9 +1581,31 @@ bool Renderer::saveRender(const char* imageFile)
 		return false;
 	}
 
-	if (!writePng(imageFile, imgData, width, height))
+	if (range != NULL)
+	{
+		// Anything drawn covers the image of the layers before
+		if (range->image.size() == (size_t)n)
+		{
+			for (int i = 0; i < n; i += 4)
+			{
+				if (imgData[i + 3] == 0)
+					memcpy(&imgData[i], &range->image[i], 4);
+			}
+		}
+
+		range->image.assign(imgData, imgData + n);
+	}
+
+	stats.readPixels += now_seconds() - start;
+
+	ImageWriter writer(imageFormat);
+	start = now_seconds();
+	bool written = writer.write(view->imageFile.c_str(), imgData, width, height);
+	stats.encode += now_seconds() - start;
+
+	if (!written)
 	{
-		log_msg(error, "Couldn't save image data to PNG file");
+		log_msg(error, "Couldn't save image data to file");
 		delete[] imgData;
 		return false;
 	}
@@ -598,6 +1618,10 @@ bool Renderer::saveRender(const char* imageFile)
 // Returns true if an error occured
 bool Renderer::checkGlError(const char* part)
 {
+	// Without a context there is nothing to check
+	if (rasterizer != NULL)
+		return false;
+
 	GLenum error = glGetError();
 
 	if (error != 0)
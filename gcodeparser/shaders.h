@@ -63,124 +63,166 @@ void main()
 )";
 
 
-// A vertex shader that transforms a given vertex vertexPosition_modelspace using 
-// Model-View-Projection matrix MVP
-// Provides helpers for the fragment shader to calculate the light amount and direction
+// A vertex shader that draws every gcode path as a tube, without building the tube
+// on the CPU. The path is drawn as a quad (a triangle strip of corner 0 to 3) that faces
+// the camera and is as wide as the tube, with the ends extended by the radius for round
+// caps. The corners are shared by all paths, the start and end of the path are per instance
+// (or repeated for every corner, if the GPU can't draw instances).
+// Tubes are at least a pixel wide, so thin paths don't fall apart in small images.
+// Compatible with both OpenGL and OpenGL ES
 static const char * tube_vertexshader = R"(
 #ifndef GL_ES
 #version 330
-#endif
 
-// Input vertex data, different for all executions of this shader.
-layout(location = 0) in vec4 vertexPosition_modelspace;
-//layout(location = 1) in vec2 vertexUV; // We don't need textures
-layout(location = 2) in vec3 vertexNormal_modelspace;
+layout(location = 0) in vec3 segmentStart;
+layout(location = 1) in vec3 segmentEnd;
+layout(location = 2) in vec2 corner;	// x: 0 at the start, 1 at the end. y: -1 or 1, the side of the tube
 
-// Output data ; will be interpolated for each fragment.
-out vec2 UV;
+out vec2 TubeCoordinate;
+out float TubeLength;
+out vec3 TubeSide;
+out vec3 TubeFacing;
+out vec3 TubeDirection;
 out vec3 Position_worldspace;
-out vec3 Normal_cameraspace;
-out vec3 EyeDirection_cameraspace;
-out vec3 LightDirection_cameraspace;
+#else
+attribute vec3 segmentStart;
+attribute vec3 segmentEnd;
+attribute vec2 corner;
+
+varying vec2 TubeCoordinate;
+varying float TubeLength;
+varying vec3 TubeSide;
+varying vec3 TubeFacing;
+varying vec3 TubeDirection;
+varying vec3 Position_worldspace;
+#endif
 
-// Values that stay constant for the whole mesh.
 uniform mat4 MVP;
-uniform mat4 V;
-uniform mat4 M;
-uniform vec3 LightPosition_worldspace;
+uniform vec3 CameraPosition_worldspace;
+uniform float TubeRadius;	// In mm
+uniform float PixelScale;	// Size (in mm) of a pixel at 1 mm from the camera
 
-void main(){
-
-	// Output position of the vertex, in clip space : MVP * position
-	gl_Position =  MVP * vertexPosition_modelspace;
-	
-	// Position of the vertex, in worldspace : M * position
-	Position_worldspace = (M * vertexPosition_modelspace).xyz;
-	
-	// Vector that goes from the vertex to the camera, in camera space.
-	// In camera space, the camera is at the origin (0,0,0).
-	vec3 vertexPosition_cameraspace = ( V * M * vertexPosition_modelspace).xyz;
-	EyeDirection_cameraspace = vec3(0,0,0) - vertexPosition_cameraspace;
-
-	// Vector that goes from the vertex to the light, in camera space. M is ommited because it's identity.
-	vec3 LightPosition_cameraspace = ( V * vec4(LightPosition_worldspace,1)).xyz;
-	LightDirection_cameraspace = LightPosition_cameraspace + EyeDirection_cameraspace;
-	
-	// Normal of the the vertex, in camera space
-	Normal_cameraspace = ( V * M * vec4(vertexNormal_modelspace,0)).xyz; // Only correct if ModelMatrix does not scale the model ! Use its inverse transpose if not.
-	
-	// UV of the vertex. No special space for this one.
-	//UV = vertexUV;
+void main()
+{
+	vec3 axis = segmentEnd - segmentStart;
+	float len = length(axis);
+	vec3 direction = len > 0.0001 ? axis / len : vec3(1.0, 0.0, 0.0);
+
+	vec3 center = mix(segmentStart, segmentEnd, corner.x);
+	vec3 toEye = CameraPosition_worldspace - center;
+	float radius = max(TubeRadius, 0.5 * PixelScale * length(toEye));
+
+	// Across the path, as seen from the camera. Looking along the path, any side will do
+	vec3 side = cross(direction, toEye);
+	if (dot(side, side) < 1e-8)
+		side = cross(direction, abs(direction.z) < 0.99 ? vec3(0.0, 0.0, 1.0) : vec3(1.0, 0.0, 0.0));
+	side = normalize(side);
+
+	// Perpendicular to the path, towards the camera
+	vec3 facing = cross(side, direction);
+
+	// The quad is moved to the front of the tube, so the depth test sees its surface
+	float along = corner.x * 2.0 - 1.0;
+	vec3 position = center + radius * (corner.y * side + along * direction + facing);
+
+	TubeCoordinate = vec2(corner.x * len / radius + along, corner.y);
+	TubeLength = len / radius;
+	TubeSide = side;
+	TubeFacing = facing;
+	TubeDirection = direction;
+	Position_worldspace = position;
+
+	gl_Position = MVP * vec4(position, 1.0);
 }
 )";
 
-// A fragment shader that uses ds_Color as material diffuse color
-// and applies ambient lighting and a specular effect based on
-// a vertex' normals and a light position, both provided by the vertex shader
+// A fragment shader that shades the quads of the tube vertex shader as round tubes. The normal
+// follows from where the fragment is across the tube, the caps are half spheres. Uses ds_Color
+// as material diffuse color and applies ambient lighting and a specular effect based on the
+// normal and a light position.
+// Compatible with both OpenGL and OpenGL ES
 static const char * tube_fragmentshader = R"(
 #ifndef GL_ES
 #version 330
-#endif
-
-// Interpolated values from the vertex shaders
-//in vec2 UV;
 
+in vec2 TubeCoordinate;
+in float TubeLength;
+in vec3 TubeSide;
+in vec3 TubeFacing;
+in vec3 TubeDirection;
 in vec3 Position_worldspace;
-in vec3 Normal_cameraspace;
-in vec3 EyeDirection_cameraspace;
-in vec3 LightDirection_cameraspace;
 
-// Ouput data
 out vec4 color;
+#else
+#ifdef GL_FRAGMENT_PRECISION_HIGH
+precision highp float;
+#else
+precision mediump float;
+#endif
+
+varying vec2 TubeCoordinate;
+varying float TubeLength;
+varying vec3 TubeSide;
+varying vec3 TubeFacing;
+varying vec3 TubeDirection;
+varying vec3 Position_worldspace;
+#endif
 
-// Values that stay constant for the whole mesh.
 uniform vec4 ds_Color;
 uniform vec3 LightPosition_worldspace;
+uniform vec3 CameraPosition_worldspace;
+
+void main()
+{
+	// Distance (in radii) past the ends of the path, and across it
+	float along = TubeCoordinate.x < 0.0 ? TubeCoordinate.x : max(TubeCoordinate.x - TubeLength, 0.0);
+	float across = TubeCoordinate.y;
+	float d = along * along + across * across;
+
+	// The corners of the quad around the caps
+	if (d > 1.0)
+		discard;
 
-void main(){
+	vec3 n = normalize(across * TubeSide + along * TubeDirection + sqrt(1.0 - d) * TubeFacing);
 
 	// Light emission properties
-	// You probably want to put them as uniforms
-	vec3 LightColor = vec3(1,1,1);
-	float LightPower = 200000.0f;
-	
+	vec3 LightColor = vec3(1.0, 1.0, 1.0);
+	float LightPower = 200000.0;
+
 	// Material properties
 	vec3 MaterialDiffuseColor = ds_Color.xyz;
-	vec3 MaterialAmbientColor = vec3(0.1,0.1,0.1) * MaterialDiffuseColor;
-	vec3 MaterialSpecularColor = vec3(0.3,0.3,0.3);
+	vec3 MaterialAmbientColor = vec3(0.1, 0.1, 0.1) * MaterialDiffuseColor;
+	vec3 MaterialSpecularColor = vec3(0.3, 0.3, 0.3);
 
 	// Distance to the light
-	float distance = length( LightPosition_worldspace - Position_worldspace );
+	float distance = length(LightPosition_worldspace - Position_worldspace);
 
-	// Normal of the computed fragment, in camera space
-	vec3 n = normalize( Normal_cameraspace );
 	// Direction of the light (from the fragment to the light)
-	vec3 l = normalize( LightDirection_cameraspace );
-	// Cosine of the angle between the normal and the light direction, 
-	// clamped above 0
-	//  - light is at the vertical of the triangle -> 1
-	//  - light is perpendicular to the triangle -> 0
-	//  - light is behind the triangle -> 0
-	float cosTheta = clamp( dot( n,l ), 0,1 );
-	
+	vec3 l = normalize(LightPosition_worldspace - Position_worldspace);
+	// Cosine of the angle between the normal and the light direction, clamped above 0
+	float cosTheta = clamp(dot(n, l), 0.0, 1.0);
+
 	// Eye vector (towards the camera)
-	vec3 E = normalize(EyeDirection_cameraspace);
-	// Direction in which the triangle reflects the light
-	vec3 R = reflect(-l,n);
-	// Cosine of the angle between the Eye vector and the Reflect vector,
-	// clamped to 0
-	//  - Looking into the reflection -> 1
-	//  - Looking elsewhere -> < 1
-	float cosAlpha = clamp( dot( E,R ), 0,1 );
-	
-	color = vec4(
+	vec3 E = normalize(CameraPosition_worldspace - Position_worldspace);
+	// Direction in which the tube reflects the light
+	vec3 R = reflect(-l, n);
+	// Cosine of the angle between the Eye vector and the Reflect vector, clamped to 0
+	float cosAlpha = clamp(dot(E, R), 0.0, 1.0);
+
+	vec4 shaded = vec4(
 		// Ambient : simulates indirect lighting
 		MaterialAmbientColor +
 		// Diffuse : "color" of the object
-		MaterialDiffuseColor * LightColor * LightPower * cosTheta / (distance*distance) +
+		MaterialDiffuseColor * LightColor * LightPower * cosTheta / (distance * distance) +
 		// Specular : reflective highlight, like a mirror
-		MaterialSpecularColor * LightColor * LightPower * pow(cosAlpha,5) / (distance*distance)
+		MaterialSpecularColor * LightColor * LightPower * pow(cosAlpha, 5.0) / (distance * distance)
 		, 1.0);
+
+#ifndef GL_ES
+	color = shaded;
+#else
+	gl_FragColor = shaded;
+#endif
 }
 )";
 #endif /* SHADERS_H */
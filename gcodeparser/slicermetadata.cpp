@@ -0,0 +1,191 @@
+#include "slicermetadata.h"
+
+static void read_value(const char * value, const char * end, int side, SlicerMetadata * metadata);
+static void read_polygons(const char * value, const char * end, int side, SlicerMetadata * metadata);
+
+// The slicer conventions we know. To support another slicer, add its tags here.
+static const SlicerTag slicerTags[] = {
+	// Cura writes the extents of everything it prints in the header: ;MINX:10.5
+	{ "Cura", "MINX:", NULL, BBOX_XMIN, read_value },
+	{ "Cura", "MAXX:", NULL, BBOX_XMAX, read_value },
+	{ "Cura", "MINY:", NULL, BBOX_YMIN, read_value },
+	{ "Cura", "MAXY:", NULL, BBOX_YMAX, read_value },
+	{ "Cura", "MINZ:", NULL, BBOX_ZMIN, read_value },
+	{ "Cura", "MAXZ:", NULL, BBOX_ZMAX, read_value },
+
+	// PrusaSlicer and SuperSlicer write the footprint of each object when labelling objects:
+	// ; objects_info = {"objects":[{"name":"...","polygon":[[95.0,95.0],[105.0,95.0],...]}]}
+	// and mark every layer change with ;Z:0.2, the last one in the file is the top layer.
+	// Binary gcode has the height in the printer metadata: max_layer_z=20.2
+	{ "PrusaSlicer", "objects_info", "=", BBOX_XMIN, read_polygons },
+	{ "PrusaSlicer", "Z:", NULL, BBOX_ZMAX, read_value },
+	{ "PrusaSlicer", "max_layer_z", "=", BBOX_ZMAX, read_value },
+
+	// Simplify3D marks every layer with ; layer 12, Z = 2.400
+	{ "Simplify3D", "layer ", "Z = ", BBOX_ZMAX, read_value },
+};
+
+static const int nSlicerTags = sizeof(slicerTags) / sizeof(slicerTags[0]);
+
+// Add a value for a side of the bounding box. If the side is already
+// known, the bounding box grows to include the value.
+void SlicerMetadata::add(int side, float value)
+{
+	float * sides = &bbox.xmin; // BBox is six floats in BBOX_* order
+
+	if (!known[side])
+		sides[side] = value;
+	else if (side % 2 == 0)
+		sides[side] = std::min(sides[side], value);
+	else
+		sides[side] = std::max(sides[side], value);
+
+	known[side] = true;
+}
+
+// Returns true if all sides of the bounding box are known
+bool SlicerMetadata::complete()
+{
+	for (int i = 0; i < BBOX_SIDES; ++i)
+	{
+		if (!known[i])
+			return false;
+	}
+
+	return true;
+}
+
+// A tag followed by a single number
+static void read_value(const char * value, const char * end, int side, SlicerMetadata * metadata)
+{
+	float v;
+	const char * p = GcodeTokenizer::parse_float(value, end, &v);
+
+	if (p != value)
+		metadata->add(side, v);
+}
+
+// A JSON list of objects with a "polygon" of [x, y] points each
+static void read_polygons(const char * value, const char * end, int side, SlicerMetadata * metadata)
+{
+	const char * key = "\"polygon\"";
+	const char * p = value;
+
+	while ((p = std::search(p, end, key, key + strlen(key))) != end)
+	{
+		p += strlen(key);
+
+		// The points are the numbers up to the closing ]]
+		const char * polygonEnd = std::search(p, end, "]]", "]]" + 2);
+		int axis = 0;
+
+		while (p < polygonEnd)
+		{
+			if ((*p >= '0' && *p <= '9') || *p == '-')
+			{
+				float v;
+				p = GcodeTokenizer::parse_float(p, polygonEnd, &v);
+
+				metadata->add(axis == 0 ? BBOX_XMIN : BBOX_YMIN, v);
+				metadata->add(axis == 0 ? BBOX_XMAX : BBOX_YMAX, v);
+				axis = 1 - axis;
+			}
+			else
+			{
+				p++;
+			}
+		}
+	}
+}
+
+// Match a comment line against the slicer tags
+static void read_comment(const char * line, const char * lineEnd, SlicerMetadata * metadata)
+{
+	const char * p = line + 1;
+
+	while (p < lineEnd && *p == ' ')
+		p++;
+
+	for (int i = 0; i < nSlicerTags; ++i)
+	{
+		const SlicerTag & tag = slicerTags[i];
+		size_t tagLength = strlen(tag.tag);
+
+		if ((size_t)(lineEnd - p) < tagLength || strncmp(p, tag.tag, tagLength) != 0)
+			continue;
+
+		const char * value = p + tagLength;
+
+		if (tag.valuePrefix != NULL)
+		{
+			value = std::search(value, lineEnd, tag.valuePrefix, tag.valuePrefix + strlen(tag.valuePrefix));
+
+			if (value == lineEnd)
+				continue;
+
+			value += strlen(tag.valuePrefix);
+		}
+
+		tag.handler(value, lineEnd, tag.side, metadata);
+
+		if (metadata->slicer == NULL)
+			metadata->slicer = tag.slicer;
+	}
+}
+
+// Match the comments of the lines that start between begin and end. Begin must be the start of a line.
+static void read_comments(const char * begin, const char * end, const char * fileEnd, SlicerMetadata * metadata)
+{
+	while (begin < end)
+	{
+		const char * lineEnd = (const char *)memchr(begin, '\n', fileEnd - begin);
+
+		if (lineEnd == NULL)
+			lineEnd = fileEnd;
+
+		if (*begin == ';')
+			read_comment(begin, lineEnd, metadata);
+
+		begin = lineEnd + 1;
+	}
+}
+
+/*
+Find the part dimensions in the comments of a gcode file. Only the first
+and last METADATA_SCAN_SIZE bytes are read, where slicers write their
+headers, footers and the top layers.
+
+begin: Start of the file contents
+end: End of the file contents
+metadata: Receives the sides of the bounding box that were found
+
+Returns true if any side of the bounding box was found
+
+*/
+bool read_slicer_metadata(const char * begin, const char * end, SlicerMetadata * metadata)
+{
+	if (begin == NULL)
+		return false;
+
+	const char * headEnd = std::min(end, begin + METADATA_SCAN_SIZE);
+	read_comments(begin, headEnd, end, metadata);
+
+	// Start the tail at a whole line
+	const char * tail = std::max(headEnd, end - METADATA_SCAN_SIZE);
+
+	if (tail > begin && tail[-1] != '\n')
+	{
+		tail = (const char *)memchr(tail, '\n', end - tail);
+		tail = tail != NULL ? tail + 1 : end;
+	}
+
+	read_comments(tail, end, end, metadata);
+
+	for (int i = 0; i < BBOX_SIDES; ++i)
+	{
+		if (metadata->known[i])
+			return true;
+	}
+
+	return false;
+}
@@ -0,0 +1,54 @@
+/*
+
+slicermetadata.h
+
+Header file for the extractor of the part dimensions that slicers
+write in the comments of a gcode file
+
+*/
+
+#ifndef SLICERMETADATA_H
+#define SLICERMETADATA_H 1
+
+#include <string.h>
+#include <algorithm>
+
+#include "helpers.h"
+#include "gcodetokenizer.h"
+
+#define METADATA_SCAN_SIZE 65536	// Number of bytes read at the start and at the end of the file
+
+// The sides of a bounding box, in the order of the BBox members
+#define BBOX_XMIN 0
+#define BBOX_XMAX 1
+#define BBOX_YMIN 2
+#define BBOX_YMAX 3
+#define BBOX_ZMIN 4
+#define BBOX_ZMAX 5
+#define BBOX_SIDES 6
+
+// The part dimensions found in the metadata
+struct SlicerMetadata {
+	BBox bbox;
+	bool known[BBOX_SIDES] = {};	// Which sides of the bounding box were found
+	const char * slicer = NULL;		// The slicer whose conventions matched
+
+	void add(int side, float value);
+	bool complete();
+};
+
+// Reads the value of a tag and adds it to the metadata
+typedef void (*SlicerTagHandler)(const char * value, const char * end, int side, SlicerMetadata * metadata);
+
+// A comment a slicer writes, with the part dimension it provides
+struct SlicerTag {
+	const char * slicer;		// Name of the slicer, for logging
+	const char * tag;			// Text the comment starts with (after the ; and any spaces)
+	const char * valuePrefix;	// Text that precedes the value in the comment, NULL if it follows the tag
+	int side;					// The side of the bounding box the value is for
+	SlicerTagHandler handler;
+};
+
+bool read_slicer_metadata(const char * begin, const char * end, SlicerMetadata * metadata);
+
+#endif // !SLICERMETADATA_H
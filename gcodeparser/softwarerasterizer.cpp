@@ -0,0 +1,675 @@
+#include "softwarerasterizer.h"
+
+/*
+Initialize the SoftwareRasterizer class
+
+nThreads: Number of threads to draw with, 0: one per CPU the process may run on
+
+*/
+SoftwareRasterizer::SoftwareRasterizer(unsigned int nThreads)
+{
+	// Respect the CPU affinity of the render worker
+	this->nThreads = nThreads > 0 ? nThreads : available_cpus();
+}
+
+// Fill the target with a color and reset the depth buffer
+void SoftwareRasterizer::clear(SoftwareTarget * target, const float color[4])
+{
+	uint8_t rgba[4];
+	for (int i = 0; i < 4; ++i)
+		rgba[i] = (uint8_t)(std::min(std::max(color[i], 0.0f), 1.0f) * 255.0f + 0.5f);
+
+	for (size_t i = 0; i < target->color.size(); i += 4)
+		memcpy(&target->color[i], rgba, 4);
+
+	std::fill(target->depth.begin(), target->depth.end(), 1.0f);
+}
+
+/*
+Draw every two vertices as a line (like GL_LINES)
+
+mvp: The Model-View-Projection matrix of the camera
+color: Color of the lines
+vertices: Positions, the first 3 of every stride floats
+nVertices: Number of floats in vertices
+
+*/
+void SoftwareRasterizer::draw_lines(SoftwareTarget * target, const glm::mat4 & mvp, const float color[4], const float * vertices, int nVertices, int stride)
+{
+	const unsigned int nLines = nVertices / stride / 2;
+	const unsigned int nChunks = (nLines + SETUP_CHUNK - 1) / SETUP_CHUNK;
+
+	lines.resize(nChunks * SETUP_CHUNK);
+	chunkSizes.assign(nChunks, 0);
+
+	// Transform the lines to window coordinates
+	parallel(nChunks, [&](unsigned int chunk)
+	{
+		unsigned int first = chunk * SETUP_CHUNK, last = std::min(first + SETUP_CHUNK, nLines);
+		unsigned int n = 0;
+
+		for (unsigned int i = first; i < last; ++i)
+		{
+			const float * p = &vertices[2 * i * stride];
+			const float * q = p + stride;
+
+			glm::vec4 a = mvp * glm::vec4(p[X], p[Y], p[Z], 1.0f);
+			glm::vec4 b = mvp * glm::vec4(q[X], q[Y], q[Z], 1.0f);
+
+			// Clip at the near plane
+			float da = a.z + a.w, db = b.z + b.w;
+
+			if (da < 0 && db < 0)
+				continue;
+
+			if (da < 0)
+				a = glm::mix(a, b, da / (da - db));
+			else if (db < 0)
+				b = glm::mix(b, a, db / (db - da));
+
+			ScreenLine & line = lines[first + n++];
+			line.a = to_window(a, target);
+			line.b = to_window(b, target);
+		}
+
+		chunkSizes[chunk] = n;
+	});
+
+	uint8_t rgba[4];
+	for (int i = 0; i < 4; ++i)
+		rgba[i] = (uint8_t)(std::min(std::max(color[i], 0.0f), 1.0f) * 255.0f + 0.5f);
+
+	// Draw them band by band
+	const unsigned int nBands = (target->height + TILE_ROWS - 1) / TILE_ROWS;
+
+	parallel(nBands, [&](unsigned int band)
+	{
+		int rowBegin = band * TILE_ROWS, rowEnd = std::min(rowBegin + TILE_ROWS, (int)target->height);
+
+		for (unsigned int chunk = 0; chunk < nChunks; ++chunk)
+		{
+			const ScreenLine * line = &lines[chunk * SETUP_CHUNK];
+
+			for (unsigned int i = 0; i < chunkSizes[chunk]; ++i, ++line)
+			{
+				if (std::max(line->a.y, line->b.y) < rowBegin || std::min(line->a.y, line->b.y) >= rowEnd)
+					continue;
+
+				raster_line(*line, rgba, target, rowBegin, rowEnd);
+			}
+		}
+	});
+}
+
+/*
+Draw triangles (like GL_TRIANGLES)
+
+mvp: The Model-View-Projection matrix of the camera
+color: Base color of the triangles
+vertices: Positions, the first 3 of every stride floats
+nVertices: Number of floats in vertices
+indices: The corners of the triangles, NULL to take the vertices in order
+nIndices: Number of indices
+
+*/
+void SoftwareRasterizer::draw_triangles(SoftwareTarget * target, const glm::mat4 & mvp, const float color[4], const float * vertices, int nVertices, int stride,
+	const VertexIndex * indices, int nIndices)
+{
+	transform(mvp, color, vertices, nVertices, stride);
+
+	const unsigned int nTriangles = (indices != NULL ? nIndices : nVertices / stride) / 3;
+	const unsigned int nChunks = (nTriangles + SETUP_CHUNK - 1) / SETUP_CHUNK;
+
+	triangles.resize(nChunks * 2 * SETUP_CHUNK);
+	chunkSizes.assign(nChunks, 0);
+
+	parallel(nChunks, [&](unsigned int chunk)
+	{
+		unsigned int first = chunk * SETUP_CHUNK, last = std::min(first + SETUP_CHUNK, nTriangles);
+		unsigned int n = 0;
+
+		for (unsigned int i = first; i < last; ++i)
+		{
+			glm::vec4 v[3];
+			glm::vec3 c[3];
+
+			for (int k = 0; k < 3; ++k)
+			{
+				unsigned int vi = indices != NULL ? indices[3 * i + k] : 3 * i + k;
+				v[k] = clip[vi];
+				c[k] = colors[vi];
+			}
+
+			n += setup_triangle(v, c, target, &triangles[2 * first + n]);
+		}
+
+		chunkSizes[chunk] = n;
+	});
+
+	const unsigned int nBands = (target->height + TILE_ROWS - 1) / TILE_ROWS;
+
+	parallel(nBands, [&](unsigned int band)
+	{
+		int rowBegin = band * TILE_ROWS, rowEnd = std::min(rowBegin + TILE_ROWS, (int)target->height);
+
+		for (unsigned int chunk = 0; chunk < nChunks; ++chunk)
+		{
+			const ScreenTriangle * triangle = &triangles[2 * chunk * SETUP_CHUNK];
+
+			for (unsigned int i = 0; i < chunkSizes[chunk]; ++i, ++triangle)
+			{
+				const glm::vec3 * v = triangle->v;
+
+				if (std::max(std::max(v[0].y, v[1].y), v[2].y) < rowBegin || std::min(std::min(v[0].y, v[1].y), v[2].y) >= rowEnd)
+					continue;
+
+				raster_triangle(*triangle, color[3], target, rowBegin, rowEnd);
+			}
+		}
+	});
+}
+
+/*
+Draw paths as tubes, like the tube shaders do on the GPU. Every path is drawn as a
+quad that faces the camera, in front of the tube, with the ends extended by the radius.
+Each pixel is shaded with the normal of the tube where it is, the caps are half spheres.
+
+vertices: The start and end of every path, 3 floats each
+nVertices: Number of floats in vertices
+tube: The camera and the size of the tubes
+light: The light to shade the tubes with
+
+*/
+void SoftwareRasterizer::draw_tubes(SoftwareTarget * target, const glm::mat4 & mvp, const float color[4], const float * vertices, int nVertices,
+	const SoftwareTube & tube, const SoftwareLight & light)
+{
+	const unsigned int nPaths = nVertices / 6;
+	const unsigned int nChunks = (nPaths + SETUP_CHUNK - 1) / SETUP_CHUNK;
+
+	tubeFrames.resize(nPaths);
+	tubeTriangles.resize(nChunks * 2 * TUBE_TRIANGLES * SETUP_CHUNK);
+	chunkSizes.assign(nChunks, 0);
+
+	// The quad as a triangle strip of corners 0 to 3
+	static const int strip[TUBE_TRIANGLES][3] = { { 0, 1, 2 }, { 2, 1, 3 } };
+
+	parallel(nChunks, [&](unsigned int chunk)
+	{
+		unsigned int first = chunk * SETUP_CHUNK, last = std::min(first + SETUP_CHUNK, nPaths);
+		unsigned int n = 0;
+
+		for (unsigned int i = first; i < last; ++i)
+		{
+			const float * p = &vertices[6 * i];
+			glm::vec3 a(p[0], p[1], p[2]), b(p[3], p[4], p[5]);
+
+			glm::vec3 axis = b - a;
+			float length = glm::length(axis);
+			glm::vec3 direction = length > eps ? axis / length : glm::vec3(1.0f, 0.0f, 0.0f);
+
+			// Same as the tube vertex shader, for each corner. x: 0 at the start, 1 at the end. y: the side of the tube
+			glm::vec4 clip[4];
+			glm::vec2 coordinate[4];
+			glm::vec3 position[4];
+
+			for (int corner = 0; corner < 4; ++corner)
+			{
+				float x = (float)(corner / 2), y = corner % 2 == 0 ? -1.0f : 1.0f;
+				float along = x * 2.0f - 1.0f;
+
+				glm::vec3 center = glm::mix(a, b, x);
+				glm::vec3 toEye = tube.camera - center;
+				float radius = std::max(tube.radius, 0.5f * tube.pixelScale * glm::length(toEye));
+
+				// Across the path, as seen from the camera. Looking along the path, any side will do
+				glm::vec3 side = glm::cross(direction, toEye);
+				if (glm::dot(side, side) < 1e-8f)
+					side = glm::cross(direction, fabs(direction.z) < 0.99f ? glm::vec3(0.0f, 0.0f, 1.0f) : glm::vec3(1.0f, 0.0f, 0.0f));
+				side = glm::normalize(side);
+
+				// The quad is moved to the front of the tube, so the depth test sees its surface
+				position[corner] = center + radius * (y * side + along * direction + glm::cross(side, direction));
+				coordinate[corner] = glm::vec2(x * length / radius + along, y);
+				clip[corner] = mvp * glm::vec4(position[corner], 1.0f);
+
+				// The shader interpolates the directions between the ends, they hardly differ. Those at the start are used.
+				if (corner == 0)
+				{
+					TubeFrame & frame = tubeFrames[i];
+					frame.side = side;
+					frame.facing = glm::cross(side, direction);
+					frame.direction = direction;
+					frame.length = length / radius;
+				}
+			}
+
+			for (int t = 0; t < TUBE_TRIANGLES; ++t)
+			{
+				const glm::vec4 v[3] = { clip[strip[t][0]], clip[strip[t][1]], clip[strip[t][2]] };
+				const glm::vec2 c[3] = { coordinate[strip[t][0]], coordinate[strip[t][1]], coordinate[strip[t][2]] };
+				const glm::vec3 w[3] = { position[strip[t][0]], position[strip[t][1]], position[strip[t][2]] };
+
+				n += setup_tube_triangle(v, c, w, i, target, &tubeTriangles[2 * TUBE_TRIANGLES * first + n]);
+			}
+		}
+
+		chunkSizes[chunk] = n;
+	});
+
+	const unsigned int nBands = (target->height + TILE_ROWS - 1) / TILE_ROWS;
+
+	parallel(nBands, [&](unsigned int band)
+	{
+		int rowBegin = band * TILE_ROWS, rowEnd = std::min(rowBegin + TILE_ROWS, (int)target->height);
+
+		for (unsigned int chunk = 0; chunk < nChunks; ++chunk)
+		{
+			const ScreenTubeTriangle * triangle = &tubeTriangles[2 * TUBE_TRIANGLES * chunk * SETUP_CHUNK];
+
+			for (unsigned int i = 0; i < chunkSizes[chunk]; ++i, ++triangle)
+			{
+				const glm::vec3 * v = triangle->v;
+
+				if (std::max(std::max(v[0].y, v[1].y), v[2].y) < rowBegin || std::min(std::min(v[0].y, v[1].y), v[2].y) >= rowEnd)
+					continue;
+
+				raster_tube(*triangle, color, tube, light, target, rowBegin, rowEnd);
+			}
+		}
+	});
+}
+
+/* Private methods */
+
+// Run task(i) for every i in [0, n). Each thread takes the next i when it's done with the last.
+template<typename Task> void SoftwareRasterizer::parallel(unsigned int n, Task task)
+{
+	std::atomic<unsigned int> next(0);
+
+	auto worker = [&]()
+	{
+		for (unsigned int i = next++; i < n; i = next++)
+			task(i);
+	};
+
+	std::vector<std::thread> threads;
+
+	for (unsigned int t = 1; t < std::min(nThreads, n); ++t)
+		threads.emplace_back(worker);
+
+	worker();
+
+	for (auto & thread : threads)
+		thread.join();
+}
+
+// Transform the vertices to clip space, and find their colors
+void SoftwareRasterizer::transform(const glm::mat4 & mvp, const float color[4], const float * vertices, int nVertices, int stride)
+{
+	const unsigned int n = nVertices / stride;
+	const unsigned int nChunks = (n + SETUP_CHUNK - 1) / SETUP_CHUNK;
+
+	clip.resize(n);
+	colors.resize(n);
+
+	const glm::vec3 diffuse(color[0], color[1], color[2]);
+
+	parallel(nChunks, [&](unsigned int chunk)
+	{
+		unsigned int first = chunk * SETUP_CHUNK, last = std::min(first + SETUP_CHUNK, n);
+
+		for (unsigned int i = first; i < last; ++i)
+		{
+			const float * p = &vertices[i * stride];
+
+			clip[i] = mvp * glm::vec4(p[X], p[Y], p[Z], 1.0f);
+			colors[i] = diffuse;
+		}
+	});
+}
+
+// Clip space to window coordinates
+glm::vec3 SoftwareRasterizer::to_window(const glm::vec4 & v, SoftwareTarget * target)
+{
+	return glm::vec3((v.x / v.w * 0.5f + 0.5f) * target->width, (v.y / v.w * 0.5f + 0.5f) * target->height, v.z / v.w * 0.5f + 0.5f);
+}
+
+// Clip a triangle at the near plane, and transform it to window coordinates.
+// Returns the number of triangles written to out (0, 1 or 2).
+unsigned int SoftwareRasterizer::setup_triangle(const glm::vec4 * v, const glm::vec3 * c, SoftwareTarget * target, ScreenTriangle * out)
+{
+	glm::vec4 polygon[4];
+	glm::vec3 polygonColors[4];
+	int n = 0;
+
+	for (int k = 0; k < 3; ++k)
+	{
+		const int next = (k + 1) % 3;
+		float d = v[k].z + v[k].w, dNext = v[next].z + v[next].w;
+
+		if (d >= 0)
+		{
+			polygon[n] = v[k];
+			polygonColors[n++] = c[k];
+		}
+
+		if ((d >= 0) != (dNext >= 0))
+		{
+			float t = d / (d - dNext);
+			polygon[n] = glm::mix(v[k], v[next], t);
+			polygonColors[n++] = glm::mix(c[k], c[next], t);
+		}
+	}
+
+	if (n < 3)
+		return 0;
+
+	for (int t = 0; t < n - 2; ++t)
+	{
+		const int corners[3] = { 0, t + 1, t + 2 };
+
+		for (int k = 0; k < 3; ++k)
+		{
+			out[t].v[k] = to_window(polygon[corners[k]], target);
+			out[t].color[k] = polygonColors[corners[k]];
+		}
+	}
+
+	return n - 2;
+}
+
+// Clip a triangle of a tube at the near plane, and transform it to window coordinates.
+// Returns the number of triangles written to out (0, 1 or 2).
+unsigned int SoftwareRasterizer::setup_tube_triangle(const glm::vec4 * v, const glm::vec2 * coordinate, const glm::vec3 * position, unsigned int path,
+	SoftwareTarget * target, ScreenTubeTriangle * out)
+{
+	glm::vec4 polygon[4];
+	glm::vec2 polygonCoordinates[4];
+	glm::vec3 polygonPositions[4];
+	int n = 0;
+
+	for (int k = 0; k < 3; ++k)
+	{
+		const int next = (k + 1) % 3;
+		float d = v[k].z + v[k].w, dNext = v[next].z + v[next].w;
+
+		if (d >= 0)
+		{
+			polygon[n] = v[k];
+			polygonCoordinates[n] = coordinate[k];
+			polygonPositions[n++] = position[k];
+		}
+
+		if ((d >= 0) != (dNext >= 0))
+		{
+			float t = d / (d - dNext);
+			polygon[n] = glm::mix(v[k], v[next], t);
+			polygonCoordinates[n] = glm::mix(coordinate[k], coordinate[next], t);
+			polygonPositions[n++] = glm::mix(position[k], position[next], t);
+		}
+	}
+
+	if (n < 3)
+		return 0;
+
+	for (int t = 0; t < n - 2; ++t)
+	{
+		const int corners[3] = { 0, t + 1, t + 2 };
+
+		for (int k = 0; k < 3; ++k)
+		{
+			// Snapped to the subpixel grid of a GPU, so the edges of tubes that touch (like the rows of infill)
+			// meet exactly. Otherwise the float error leaves gaps between them, through which the layer below shows.
+			out[t].v[k] = to_window(polygon[corners[k]], target);
+			out[t].v[k].x = roundf(out[t].v[k].x * SUBPIXELS) / SUBPIXELS;
+			out[t].v[k].y = roundf(out[t].v[k].y * SUBPIXELS) / SUBPIXELS;
+			out[t].invW[k] = 1.0f / polygon[corners[k]].w;
+			out[t].coordinate[k] = polygonCoordinates[corners[k]];
+			out[t].position[k] = polygonPositions[corners[k]];
+		}
+
+		out[t].path = path;
+	}
+
+	return n - 2;
+}
+
+// Draw the pixels of a line within a band of rows. Like OpenGL, a pixel is drawn when
+// the line passes its center along the major axis, the last pixel is left out.
+void SoftwareRasterizer::raster_line(const ScreenLine & line, const uint8_t color[4], SoftwareTarget * target, int rowBegin, int rowEnd)
+{
+	glm::vec3 a = line.a, b = line.b;
+	const int width = target->width;
+
+	float dx = b.x - a.x, dy = b.y - a.y;
+
+	if (fabs(dx) >= fabs(dy))
+	{
+		if (dx == 0)
+			return;
+
+		if (dx < 0)
+		{
+			std::swap(a, b);
+			dx = -dx;
+			dy = -dy;
+		}
+
+		float slope = dy / dx, dz = (b.z - a.z) / dx;
+
+		int first = std::max((int)ceilf(a.x - 0.5f), 0);
+		int last = std::min((int)ceilf(b.x - 0.5f), width);
+
+		// Only the columns where the line crosses the band
+		if (slope != 0)
+		{
+			float xBegin = a.x + (rowBegin - a.y) / slope, xEnd = a.x + (rowEnd - a.y) / slope;
+			first = std::max(first, (int)floorf(std::min(xBegin, xEnd)) - 1);
+			last = std::min(last, (int)ceilf(std::max(xBegin, xEnd)) + 1);
+		}
+
+		for (int col = first; col < last; ++col)
+		{
+			float t = col + 0.5f - a.x;
+			int row = (int)floorf(a.y + t * slope);
+
+			if (row < rowBegin || row >= rowEnd)
+				continue;
+
+			float z = a.z + t * dz;
+			size_t pixel = (size_t)row * width + col;
+
+			if (z < 0.0f || z > 1.0f || z >= target->depth[pixel])
+				continue;
+
+			target->depth[pixel] = z;
+			memcpy(&target->color[4 * pixel], color, 4);
+		}
+	}
+	else
+	{
+		if (dy < 0)
+		{
+			std::swap(a, b);
+			dx = -dx;
+			dy = -dy;
+		}
+
+		float slope = dx / dy, dz = (b.z - a.z) / dy;
+
+		int first = std::max((int)ceilf(a.y - 0.5f), rowBegin);
+		int last = std::min((int)ceilf(b.y - 0.5f), rowEnd);
+
+		for (int row = first; row < last; ++row)
+		{
+			float t = row + 0.5f - a.y;
+			int col = (int)floorf(a.x + t * slope);
+
+			if (col < 0 || col >= width)
+				continue;
+
+			float z = a.z + t * dz;
+			size_t pixel = (size_t)row * width + col;
+
+			if (z < 0.0f || z > 1.0f || z >= target->depth[pixel])
+				continue;
+
+			target->depth[pixel] = z;
+			memcpy(&target->color[4 * pixel], color, 4);
+		}
+	}
+}
+
+// Draw the pixels of a triangle within a band of rows. A pixel is drawn when its center is
+// inside the triangle. Depth and color are interpolated between the corners.
+void SoftwareRasterizer::raster_triangle(const ScreenTriangle & triangle, float alpha, SoftwareTarget * target, int rowBegin, int rowEnd)
+{
+	const glm::vec3 * v = triangle.v;
+	const int width = target->width;
+
+	float area = (v[1].x - v[0].x) * (v[2].y - v[0].y) - (v[1].y - v[0].y) * (v[2].x - v[0].x);
+
+	if (fabs(area) < 1e-12f)
+		return;
+
+	// Either winding is drawn
+	float sign = area < 0 ? -1.0f : 1.0f;
+	float invArea = 1.0f / fabs(area);
+
+	int colFirst = std::max((int)floorf(std::min(std::min(v[0].x, v[1].x), v[2].x)), 0);
+	int colLast = std::min((int)ceilf(std::max(std::max(v[0].x, v[1].x), v[2].x)), width - 1);
+	int rowFirst = std::max((int)floorf(std::min(std::min(v[0].y, v[1].y), v[2].y)), rowBegin);
+	int rowLast = std::min((int)ceilf(std::max(std::max(v[0].y, v[1].y), v[2].y)), rowEnd - 1);
+
+	uint8_t alphaByte = (uint8_t)(std::min(std::max(alpha, 0.0f), 1.0f) * 255.0f + 0.5f);
+
+	// Edge functions, w[k] is the (scaled) distance to the edge opposite of corner k
+	auto edge = [&](const glm::vec3 & a, const glm::vec3 & b, float px, float py)
+	{
+		return sign * ((b.x - a.x) * (py - a.y) - (b.y - a.y) * (px - a.x));
+	};
+
+	const float stepX[3] = { -sign * (v[2].y - v[1].y), -sign * (v[0].y - v[2].y), -sign * (v[1].y - v[0].y) };
+
+	for (int row = rowFirst; row <= rowLast; ++row)
+	{
+		float px = colFirst + 0.5f, py = row + 0.5f;
+		float w[3] = { edge(v[1], v[2], px, py), edge(v[2], v[0], px, py), edge(v[0], v[1], px, py) };
+
+		for (int col = colFirst; col <= colLast; ++col, w[0] += stepX[0], w[1] += stepX[1], w[2] += stepX[2])
+		{
+			if (w[0] < 0 || w[1] < 0 || w[2] < 0)
+				continue;
+
+			float b0 = w[0] * invArea, b1 = w[1] * invArea, b2 = w[2] * invArea;
+			float z = b0 * v[0].z + b1 * v[1].z + b2 * v[2].z;
+			size_t pixel = (size_t)row * width + col;
+
+			if (z < 0.0f || z > 1.0f || z >= target->depth[pixel])
+				continue;
+
+			glm::vec3 color = glm::clamp(b0 * triangle.color[0] + b1 * triangle.color[1] + b2 * triangle.color[2], 0.0f, 1.0f);
+
+			target->depth[pixel] = z;
+			target->color[4 * pixel] = (uint8_t)(color.r * 255.0f + 0.5f);
+			target->color[4 * pixel + 1] = (uint8_t)(color.g * 255.0f + 0.5f);
+			target->color[4 * pixel + 2] = (uint8_t)(color.b * 255.0f + 0.5f);
+			target->color[4 * pixel + 3] = alphaByte;
+		}
+	}
+}
+
+// Draw the pixels of a triangle of a tube within a band of rows, shaded like the tube fragment shader
+// does. The place on the tube and the position are interpolated with perspective between the corners.
+void SoftwareRasterizer::raster_tube(const ScreenTubeTriangle & triangle, const float color[4], const SoftwareTube & tube, const SoftwareLight & light,
+	SoftwareTarget * target, int rowBegin, int rowEnd)
+{
+	const glm::vec3 * v = triangle.v;
+	const TubeFrame & frame = tubeFrames[triangle.path];
+	const int width = target->width;
+
+	float area = (v[1].x - v[0].x) * (v[2].y - v[0].y) - (v[1].y - v[0].y) * (v[2].x - v[0].x);
+
+	if (fabs(area) < 1e-12f)
+		return;
+
+	// Either winding is drawn
+	float sign = area < 0 ? -1.0f : 1.0f;
+	float invArea = 1.0f / fabs(area);
+
+	int colFirst = std::max((int)floorf(std::min(std::min(v[0].x, v[1].x), v[2].x)), 0);
+	int colLast = std::min((int)ceilf(std::max(std::max(v[0].x, v[1].x), v[2].x)), width - 1);
+	int rowFirst = std::max((int)floorf(std::min(std::min(v[0].y, v[1].y), v[2].y)), rowBegin);
+	int rowLast = std::min((int)ceilf(std::max(std::max(v[0].y, v[1].y), v[2].y)), rowEnd - 1);
+
+	uint8_t alphaByte = (uint8_t)(std::min(std::max(color[3], 0.0f), 1.0f) * 255.0f + 0.5f);
+
+	// Material and light of the tube shader
+	const float lightPower = 200000.0f;
+	const glm::vec3 diffuse(color[0], color[1], color[2]);
+	const glm::vec3 ambient = 0.1f * diffuse;
+	const glm::vec3 specular(0.3f, 0.3f, 0.3f);
+
+	auto edge = [&](const glm::vec3 & a, const glm::vec3 & b, float px, float py)
+	{
+		return sign * ((b.x - a.x) * (py - a.y) - (b.y - a.y) * (px - a.x));
+	};
+
+	const float stepX[3] = { -sign * (v[2].y - v[1].y), -sign * (v[0].y - v[2].y), -sign * (v[1].y - v[0].y) };
+
+	for (int row = rowFirst; row <= rowLast; ++row)
+	{
+		float px = colFirst + 0.5f, py = row + 0.5f;
+		float w[3] = { edge(v[1], v[2], px, py), edge(v[2], v[0], px, py), edge(v[0], v[1], px, py) };
+
+		for (int col = colFirst; col <= colLast; ++col, w[0] += stepX[0], w[1] += stepX[1], w[2] += stepX[2])
+		{
+			if (w[0] < 0 || w[1] < 0 || w[2] < 0)
+				continue;
+
+			float b0 = w[0] * invArea, b1 = w[1] * invArea, b2 = w[2] * invArea;
+			float z = b0 * v[0].z + b1 * v[1].z + b2 * v[2].z;
+			size_t pixel = (size_t)row * width + col;
+
+			if (z < 0.0f || z > 1.0f || z >= target->depth[pixel])
+				continue;
+
+			// Perspective correct weights of the corners
+			float p0 = b0 * triangle.invW[0], p1 = b1 * triangle.invW[1], p2 = b2 * triangle.invW[2];
+			float invSum = 1.0f / (p0 + p1 + p2);
+			p0 *= invSum;
+			p1 *= invSum;
+			p2 *= invSum;
+
+			glm::vec2 coordinate = p0 * triangle.coordinate[0] + p1 * triangle.coordinate[1] + p2 * triangle.coordinate[2];
+
+			// Distance (in radii) past the ends of the path, and across it. The corners of the quad around the caps are left out.
+			float along = coordinate.x < 0.0f ? coordinate.x : std::max(coordinate.x - frame.length, 0.0f);
+			float across = coordinate.y;
+			float d = along * along + across * across;
+
+			if (d > 1.0f)
+				continue;
+
+			glm::vec3 position = p0 * triangle.position[0] + p1 * triangle.position[1] + p2 * triangle.position[2];
+			glm::vec3 n = glm::normalize(across * frame.side + along * frame.direction + sqrtf(1.0f - d) * frame.facing);
+
+			float distance = glm::length(light.position - position);
+			glm::vec3 l = glm::normalize(light.position - position);
+			float cosTheta = glm::clamp(glm::dot(n, l), 0.0f, 1.0f);
+
+			glm::vec3 eye = glm::normalize(tube.camera - position);
+			float cosAlpha = glm::clamp(glm::dot(eye, glm::reflect(-l, n)), 0.0f, 1.0f);
+
+			glm::vec3 shaded = glm::clamp(ambient
+				+ diffuse * lightPower * cosTheta / (distance * distance)
+				+ specular * lightPower * powf(cosAlpha, 5) / (distance * distance), 0.0f, 1.0f);
+
+			target->depth[pixel] = z;
+			target->color[4 * pixel] = (uint8_t)(shaded.r * 255.0f + 0.5f);
+			target->color[4 * pixel + 1] = (uint8_t)(shaded.g * 255.0f + 0.5f);
+			target->color[4 * pixel + 2] = (uint8_t)(shaded.b * 255.0f + 0.5f);
+			target->color[4 * pixel + 3] = alphaByte;
+		}
+	}
+}
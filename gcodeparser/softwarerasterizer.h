@@ -0,0 +1,129 @@
+/*
+
+softwarerasterizer.h
+
+Header file for the rasterizer that draws lines and triangles on the CPU,
+for systems without a (working) GPU
+
+*/
+
+#ifndef SOFTWARERASTERIZER_H
+#define SOFTWARERASTERIZER_H 1
+
+#include <stdint.h>
+#include <string.h>
+#include <math.h>
+#include <algorithm>
+#include <atomic>
+#include <thread>
+#include <vector>
+
+#include <glm/glm.hpp>
+
+#include "helpers.h"
+#include "vertexbuilder.h"
+
+#define TILE_ROWS 16		// Height of the bands of pixels an image is split into, each band is drawn by a single thread
+#define SETUP_CHUNK 4096	// Number of primitives a thread transforms at once
+#define TUBE_TRIANGLES 2	// Triangles of the quad a path is drawn as when drawing tubes
+#define SUBPIXELS 256.0f	// Tube corners are snapped to 1/SUBPIXELS of a pixel, like a GPU with 8 bits of subpixel precision
+
+// Color and depth buffer to draw in. Rows are stored bottom to top, like OpenGL does
+struct SoftwareTarget {
+	unsigned int width, height;
+	std::vector<uint8_t> color;		// RGBA
+	std::vector<float> depth;		// 0 (near plane) to 1 (far plane)
+
+	SoftwareTarget(unsigned int width, unsigned int height) : width(width), height(height), color(4 * width * height), depth(width * height) {};
+};
+
+// The light of the tube shader (see shaders.h)
+struct SoftwareLight {
+	glm::vec3 position;		// Position of the light in world space
+};
+
+// How paths are expanded to tubes, like the tube shader (see shaders.h)
+struct SoftwareTube {
+	glm::vec3 camera;		// Position of the camera in world space
+	float radius;			// Radius of the tubes in mm
+	float pixelScale;		// Size (in mm) of a pixel at 1 mm from the camera, tubes are at least a pixel wide
+};
+
+// A line in window coordinates: x and y in pixels, z is the depth
+struct ScreenLine {
+	glm::vec3 a, b;
+};
+
+// A triangle in window coordinates, with the color of each corner
+struct ScreenTriangle {
+	glm::vec3 v[3];
+	glm::vec3 color[3];
+};
+
+// The directions of a tube, as the tube shader shades it
+struct TubeFrame {
+	glm::vec3 side;			// Across the path, as seen from the camera
+	glm::vec3 facing;		// Perpendicular to the path, towards the camera
+	glm::vec3 direction;	// Along the path
+	float length;			// Length of the path in radii
+};
+
+// A triangle of the quad of a tube in window coordinates. Like the tube shader's
+// varyings, each corner has its place on the tube (along and across, in radii)
+// and its position in world space.
+struct ScreenTubeTriangle {
+	glm::vec3 v[3];
+	float invW[3];			// To interpolate with perspective, like the GPU
+	glm::vec2 coordinate[3];
+	glm::vec3 position[3];
+	unsigned int path;		// The path's TubeFrame
+};
+
+/*
+
+SoftwareRasterizer
+
+Draws the same vertex buffers as the OpenGL renderer, with the same camera
+matrices, into a SoftwareTarget. Vertices are transformed by all threads,
+after which each thread draws the primitives that fall in a band of rows
+of the image, so no two threads write the same pixel.
+
+*/
+class SoftwareRasterizer
+{
+	unsigned int nThreads;
+
+	std::vector<glm::vec4> clip;			// Vertices of the current draw in clip space
+	std::vector<glm::vec3> colors;			// Color of each vertex of the current draw
+
+	std::vector<ScreenLine> lines;			// Lines of the current draw, SETUP_CHUNK per chunk
+	std::vector<ScreenTriangle> triangles;	// Triangles of the current draw, 2 * SETUP_CHUNK per chunk (near plane clipping may split one)
+	std::vector<unsigned int> chunkSizes;	// Number of primitives each chunk produced
+
+	std::vector<TubeFrame> tubeFrames;					// Tube of each path of the current draw
+	std::vector<ScreenTubeTriangle> tubeTriangles;		// Their quads, 2 * TUBE_TRIANGLES * SETUP_CHUNK per chunk
+
+public:
+	SoftwareRasterizer(unsigned int nThreads);
+	unsigned int get_threads() { return nThreads; };
+	void clear(SoftwareTarget * target, const float color[4]);
+	void draw_lines(SoftwareTarget * target, const glm::mat4 & mvp, const float color[4], const float * vertices, int nVertices, int stride);
+	void draw_triangles(SoftwareTarget * target, const glm::mat4 & mvp, const float color[4], const float * vertices, int nVertices, int stride,
+		const VertexIndex * indices, int nIndices);
+	void draw_tubes(SoftwareTarget * target, const glm::mat4 & mvp, const float color[4], const float * vertices, int nVertices,
+		const SoftwareTube & tube, const SoftwareLight & light);
+
+private:
+	template<typename Task> void parallel(unsigned int n, Task task);
+	void transform(const glm::mat4 & mvp, const float color[4], const float * vertices, int nVertices, int stride);
+	glm::vec3 to_window(const glm::vec4 & v, SoftwareTarget * target);
+	unsigned int setup_triangle(const glm::vec4 * v, const glm::vec3 * c, SoftwareTarget * target, ScreenTriangle * out);
+	unsigned int setup_tube_triangle(const glm::vec4 * v, const glm::vec2 * coordinate, const glm::vec3 * position, unsigned int path,
+		SoftwareTarget * target, ScreenTubeTriangle * out);
+	void raster_line(const ScreenLine & line, const uint8_t color[4], SoftwareTarget * target, int rowBegin, int rowEnd);
+	void raster_triangle(const ScreenTriangle & triangle, float alpha, SoftwareTarget * target, int rowBegin, int rowEnd);
+	void raster_tube(const ScreenTubeTriangle & triangle, const float color[4], const SoftwareTube & tube, const SoftwareLight & light,
+		SoftwareTarget * target, int rowBegin, int rowEnd);
+};
+
+#endif // !SOFTWARERASTERIZER_H
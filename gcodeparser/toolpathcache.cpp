@@ -0,0 +1,293 @@
+#include "toolpathcache.h"
+
+#define TOOLPATH_FLUSH_POINTS 65536	// Write the points to disk in chunks of this size
+
+/*
+Initialize the ToolpathCacheWriter class
+
+file: Path of the cache file to write
+bedBbox: Bounding box of the printable area the parser uses
+
+*/
+ToolpathCacheWriter::ToolpathCacheWriter(const char * file, BBox bedBbox)
+{
+	this->file = file;
+	this->tempFile = this->file + ".part";
+
+	memset(&header, 0, sizeof header);
+	memcpy(header.magic, TOOLPATH_MAGIC, 4);
+	header.version = TOOLPATH_VERSION;
+	header.quantum = TOOLPATH_QUANTUM;
+	memcpy(header.bedBbox, &bedBbox, sizeof header.bedBbox);
+
+	fout = fopen(tempFile.c_str(), "wb");
+
+	// Reserve space for the header, it is written once we know the number of points
+	if (fout == NULL || fwrite(&header, sizeof header, 1, fout) != 1)
+	{
+		log_msg(warning, "Could not create toolpath cache file");
+		failed = true;
+	}
+
+	points.reserve(TOOLPATH_FLUSH_POINTS);
+}
+
+ToolpathCacheWriter::~ToolpathCacheWriter()
+{
+	// Not finished, don't leave a partial file behind
+	if (fout != NULL)
+		discard();
+}
+
+/*
+Add an extrusion path to the cache
+
+from: Position the path ends at
+to: Position the path starts at
+
+*/
+void ToolpathCacheWriter::add_segment(const float from[3], const float to[3])
+{
+	if (failed)
+		return;
+
+	// Only move if we don't continue from where the last path ended
+	int32_t start[3];
+	for (int i = 0; i < 3; ++i)
+		start[i] = (int32_t)floor(to[i] / TOOLPATH_QUANTUM + 0.5f);
+
+	if (!hasLast || memcmp(start, last, sizeof start) != 0)
+		add_point(to, TOOLPATH_MOVE);
+
+	add_point(from, TOOLPATH_LINE);
+}
+
+// Write the header and the remaining points, and give the file its final name
+bool ToolpathCacheWriter::finish(BBox * bbox, bool bboxValid)
+{
+	if (failed)
+	{
+		discard();
+		return false;
+	}
+
+	memcpy(header.bbox, bbox, sizeof header.bbox);
+	header.bboxValid = bboxValid ? 1 : 0;
+
+	flush();
+
+	if (failed || fseek(fout, 0, SEEK_SET) != 0 || fwrite(&header, sizeof header, 1, fout) != 1)
+	{
+		discard();
+		return false;
+	}
+
+	fclose(fout);
+	fout = NULL;
+
+	// Windows won't rename onto an existing file
+	remove(file.c_str());
+
+	if (rename(tempFile.c_str(), file.c_str()) != 0)
+	{
+		remove(tempFile.c_str());
+		return false;
+	}
+
+	char log[128];
+	sprintf(log, "Toolpath cache written: %u points", header.nPoints);
+	log_msg(debug, log);
+
+	return true;
+}
+
+/* Private methods */
+
+// Add a point relative to the previous point. Distances that don't fit
+// in the point's delta are split over multiple points.
+void ToolpathCacheWriter::add_point(const float p[3], uint16_t type)
+{
+	int32_t q[3];
+	for (int i = 0; i < 3; ++i)
+		q[i] = (int32_t)floor(p[i] / TOOLPATH_QUANTUM + 0.5f);
+
+	// Split in equal steps, so the points stay on the path
+	int32_t distance[3], start[3];
+	int32_t steps = 1;
+
+	for (int i = 0; i < 3; ++i)
+	{
+		start[i] = last[i];
+		distance[i] = q[i] - last[i];
+		steps = std::max(steps, (abs(distance[i]) + 32766) / 32767);
+	}
+
+	ToolpathPoint point;
+	point.type = type;
+
+	for (int32_t step = 1; step <= steps; ++step)
+	{
+		for (int i = 0; i < 3; ++i)
+		{
+			int32_t next = start[i] + (int32_t)((int64_t)distance[i] * step / steps);
+			point.delta[i] = (int16_t)(next - last[i]);
+			last[i] = next;
+		}
+
+		points.push_back(point);
+		header.nPoints++;
+	}
+
+	hasLast = true;
+
+	if (points.size() >= TOOLPATH_FLUSH_POINTS)
+		flush();
+}
+
+// Write the collected points to the file
+void ToolpathCacheWriter::flush()
+{
+	if (!failed && !points.empty() && fwrite(&points[0], sizeof(ToolpathPoint), points.size(), fout) != points.size())
+	{
+		log_msg(warning, "Could not write toolpath cache file");
+		failed = true;
+	}
+
+	points.clear();
+}
+
+// Remove the partial file
+void ToolpathCacheWriter::discard()
+{
+	if (fout != NULL)
+		fclose(fout);
+
+	fout = NULL;
+	failed = true;
+	remove(tempFile.c_str());
+}
+
+/*
+Initialize the ToolpathCacheReader class
+
+governor: Throttles the reading, the caller keeps ownership
+
+*/
+ToolpathCacheReader::ToolpathCacheReader(Governor * governor) : governor(governor)
+{
+}
+
+// Open a cache file. Returns false if the file doesn't exist, is damaged or
+// was made for a different bed.
+bool ToolpathCacheReader::open(const char * file, BBox bedBbox)
+{
+	if (!mappedFile.open(file))
+		return false;
+
+	if (mappedFile.get_size() < sizeof(ToolpathHeader))
+		return false;
+
+	header = (const ToolpathHeader *)mappedFile.get_data();
+
+	if (memcmp(header->magic, TOOLPATH_MAGIC, 4) != 0
+		|| header->version != TOOLPATH_VERSION
+		|| header->quantum != TOOLPATH_QUANTUM
+		|| memcmp(header->bedBbox, &bedBbox, sizeof header->bedBbox) != 0
+		|| mappedFile.get_size() != sizeof(ToolpathHeader) + (size_t)header->nPoints * sizeof(ToolpathPoint))
+	{
+		log_msg(debug, "Toolpath cache file is invalid or outdated");
+		return false;
+	}
+
+	points = (const ToolpathPoint *)(mappedFile.get_data() + sizeof(ToolpathHeader));
+
+	return true;
+}
+
+// Get the bounding box of the part, as used for the camera when the cache was written
+bool ToolpathCacheReader::get_bbox(BBox * bbox)
+{
+	memcpy(bbox, header->bbox, sizeof header->bbox);
+	return header->bboxValid != 0;
+}
+
+/*
+Read up to n_lines points from the cache, and buffer the vertices and indices of the vertices
+that make up the model. Same contract as GcodeParser::get_vertices.
+*/
+int ToolpathCacheReader::get_vertices(const unsigned int n_lines, int * nVertices, float * vertices, int * nIndices, VertexIndex * indices)
+{
+	if (points == NULL)
+		return -1;
+
+	builder.begin(vertices, indices);
+
+	// Tubes can only be linked within the same buffer
+	connected = false;
+
+	unsigned int n = 0;
+	float from[3], to[3];
+
+	while (point_i < header->nPoints && n < n_lines)
+	{
+		const ToolpathPoint & point = points[point_i];
+
+		for (int i = 0; i < 3; ++i)
+		{
+			to[i] = position[i] * TOOLPATH_QUANTUM;
+			position[i] += point.delta[i];
+			from[i] = position[i] * TOOLPATH_QUANTUM;
+		}
+
+		if (point.type == TOOLPATH_LINE)
+		{
+			builder.add_segment(from, to, connected);
+			connected = true;
+		}
+		else
+		{
+			connected = false;
+		}
+
+		point_i++;
+		n++;
+
+		// Throttle like the parser, or wait while paused
+		governor->line();
+	}
+
+	// Build the paths that are still being merged
+	builder.flush();
+
+	*nVertices = builder.vertex_count();
+	*nIndices = builder.index_count();
+
+	return n;
+}
+
+void ToolpathCacheReader::get_buffer_size(unsigned int * vertices_size, unsigned int * indices_size)
+{
+	builder.get_buffer_size(vertices_size, indices_size);
+}
+
+void ToolpathCacheReader::set_decimation(float tolerance)
+{
+	builder.set_tolerance(tolerance);
+}
+
+long ToolpathCacheReader::get_segment_count()
+{
+	return builder.segment_count();
+}
+
+void ToolpathCacheReader::get_progress(long * offset, long * size)
+{
+	if (header == NULL)
+	{
+		*offset = *size = 0;
+		return;
+	}
+
+	*offset = sizeof(ToolpathHeader) + (long)point_i * sizeof(ToolpathPoint);
+	*size = sizeof(ToolpathHeader) + (long)header->nPoints * sizeof(ToolpathPoint);
+}
@@ -0,0 +1,116 @@
+/*
+
+toolpathcache.h
+
+Header file for the on-disk toolpath cache. Stores the extrusion paths of a
+parsed gcode file, so it can be rendered again without parsing.
+
+*/
+
+#ifndef TOOLPATHCACHE_H
+#define TOOLPATHCACHE_H 1
+
+#include <stdio.h>
+#include <stdint.h>
+#include <string.h>
+#include <math.h>
+#include <algorithm>
+#include <string>
+#include <vector>
+
+#include "helpers.h"
+#include "mappedfile.h"
+#include "vertexbuilder.h"
+#include "governor.h"
+
+#define TOOLPATH_MAGIC "GTPC"
+#define TOOLPATH_VERSION 1
+#define TOOLPATH_QUANTUM 0.01f	// Positions are stored in steps of 10 micron
+
+#define TOOLPATH_LINE 0	// Extrude from the previous point to this point
+#define TOOLPATH_MOVE 1	// Move to this point without extruding
+
+// Header of a toolpath cache file
+struct ToolpathHeader {
+	char magic[4];
+	uint32_t version;
+	float quantum;			// Size of a position step in mm
+	uint32_t nPoints;		// Number of points following the header
+	float bedBbox[6];		// The bed the part bounding box was determined for
+	float bbox[6];			// The bounding box of the part the camera is pointed with
+	uint32_t bboxValid;		// Whether the parser found a valid bounding box
+};
+
+// A point in a toolpath, relative to the previous point. Fixed size, so
+// the points form an array in the (memory-mapped) file
+struct ToolpathPoint {
+	int16_t delta[3];		// Distance from the previous point in quanta
+	uint16_t type;			// TOOLPATH_LINE or TOOLPATH_MOVE
+};
+
+/*
+
+ToolpathCacheWriter
+
+Collects the extrusion paths while a gcode file is parsed and writes them
+to a cache file. The file is written under a temporary name and only
+takes its final name when complete.
+
+*/
+class ToolpathCacheWriter
+{
+	std::string file;			// Final filename of the cache file
+	std::string tempFile;		// Filename while writing
+	FILE * fout = NULL;
+
+	ToolpathHeader header;
+	std::vector<ToolpathPoint> points;	// Points not yet written
+
+	int32_t last[3] = { 0, 0, 0 };	// Last position in quanta
+	bool hasLast = false;
+	bool failed = false;
+
+public:
+	ToolpathCacheWriter(const char * file, BBox bedBbox);
+	~ToolpathCacheWriter();
+	void add_segment(const float from[3], const float to[3]);
+	bool finish(BBox * bbox, bool bboxValid);
+
+private:
+	void add_point(const float p[3], uint16_t type);
+	void flush();
+	void discard();
+};
+
+/*
+
+ToolpathCacheReader
+
+Provides the vertices of a part from a toolpath cache file
+
+*/
+class ToolpathCacheReader : public VertexSource
+{
+	MappedFile mappedFile;
+	const ToolpathHeader * header = NULL;
+	const ToolpathPoint * points = NULL;
+	uint32_t point_i = 0;
+
+	VertexBuilder builder;
+	Governor * governor;
+
+	int32_t position[3] = { 0, 0, 0 };	// Current position in quanta
+	bool connected = false;				// Whether the previous point ended a line
+
+public:
+	ToolpathCacheReader(Governor * governor);
+	bool open(const char * file, BBox bedBbox);
+	bool get_bbox(BBox * bbox);
+	int get_vertices(const unsigned int n_lines, int * nVertices, float * vertices, int * nIndices, VertexIndex * indices);
+	void get_buffer_size(unsigned int * vertices_size, unsigned int * indices_size);
+	void set_decimation(float tolerance);
+	long get_segment_count();
+	void get_progress(long * offset, long * size);
+};
+
+#endif // !TOOLPATHCACHE_H
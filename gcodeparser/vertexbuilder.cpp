@@ -0,0 +1,147 @@
+#include "vertexbuilder.h"
+
+// Initialize the VertexBuilder class
+VertexBuilder::VertexBuilder()
+{
+}
+
+// Start filling a new buffer, the indices start at 0 again
+void VertexBuilder::begin(float * vertices, VertexIndex * indices)
+{
+	this->vertices = vertices;
+	this->indices = indices;
+
+	vertex_i = 0;
+	index_i = 0;
+}
+
+/*
+Add the vertices of a single gcode path to the buffer
+
+from: Position the path ends at
+to: Position the path starts at
+connected: Whether the previous path ended where this one starts (i.e. we didn't fly),
+           only then paths are merged
+
+*/
+void VertexBuilder::add_segment(const float from[3], const float to[3], bool connected)
+{
+	if (tolerance <= 0.0f)
+	{
+		build_segment(from, to);
+		return;
+	}
+
+	// Try to merge the path with the previous ones
+	if (pending && connected)
+	{
+		if (extend(from))
+			return;
+
+		// Start a new merged path where the last one ended
+		flush();
+		connected = true;
+	}
+	else
+	{
+		flush();
+	}
+
+	memcpy(pendingStart, to, sizeof pendingStart);
+	memcpy(pendingEnd, to, sizeof pendingEnd);
+	pendingConnected = connected;
+	pendingDirected = false;
+	pendingReach = 0.0f;
+	pending = true;
+
+	extend(from);
+}
+
+// Set the decimation tolerance (in mm), 0 to build every path as is
+void VertexBuilder::set_tolerance(float tolerance)
+{
+	flush();
+	this->tolerance = tolerance;
+}
+
+// Build the merged path that is waiting, must be called before the buffer is used
+void VertexBuilder::flush()
+{
+	if (!pending)
+		return;
+
+	pending = false;
+
+	// A lone path too short to show
+	if (!pendingConnected && !pendingDirected)
+		return;
+
+	build_segment(pendingEnd, pendingStart);
+}
+
+// Provides the recommended buffer size for vertices and indices. These
+// values need to be multiplied by the number of lines parsed per run.
+// (n_lines of VertexSource::get_vertices)
+void VertexBuilder::get_buffer_size(unsigned int * vertices_size, unsigned int * indices_size)
+{
+	*vertices_size = 6 * sizeof *vertices;
+	*indices_size = 0;
+}
+
+/* Private Methods */
+
+// Expands the vertex buffer with the start and the end of a gcode path
+void VertexBuilder::build_segment(const float from[3], const float to[3])
+{
+	// from
+	vertices[vertex_i]	   = from[X];
+	vertices[vertex_i + 1] = from[Y];
+	vertices[vertex_i + 2] = from[Z];
+
+	// to
+	vertices[vertex_i + 3] = to[X];
+	vertices[vertex_i + 4] = to[Y];
+	vertices[vertex_i + 5] = to[Z];
+
+	vertex_i += 6;
+	segments++;
+}
+
+// Move the end of the merged path to a point, if the path then stays within the tolerance 
+// of the points it replaces. Returns false if the point needs a path of its own.
+bool VertexBuilder::extend(const float point[3])
+{
+	float v[3] = { point[X] - pendingStart[X], point[Y] - pendingStart[Y], point[Z] - pendingStart[Z] };
+
+	if (!pendingDirected)
+	{
+		// Everything so far is within the tolerance of the start, so any direction will do
+		float length = sqrt(v[X] * v[X] + v[Y] * v[Y] + v[Z] * v[Z]);
+
+		if (length >= tolerance)
+		{
+			for (int i = 0; i < 3; ++i)
+				pendingDirection[i] = v[i] / length;
+
+			pendingReach = length;
+			pendingDirected = true;
+		}
+
+		memcpy(pendingEnd, point, sizeof pendingEnd);
+		return true;
+	}
+
+	// The point has to move forward along the direction, within a strip of half the tolerance wide.
+	// Then every replaced point is within the tolerance of the merged path
+	float along = v[X] * pendingDirection[X] + v[Y] * pendingDirection[Y] + v[Z] * pendingDirection[Z];
+	float across[3] = { v[X] - along * pendingDirection[X], v[Y] - along * pendingDirection[Y], v[Z] - along * pendingDirection[Z] };
+	float distance = sqrt(across[X] * across[X] + across[Y] * across[Y] + across[Z] * across[Z]);
+
+	if (along < pendingReach || distance > tolerance / 2)
+		return false;
+
+	pendingReach = along;
+	memcpy(pendingEnd, point, sizeof pendingEnd);
+
+	return true;
+}
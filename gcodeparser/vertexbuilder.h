@@ -0,0 +1,99 @@
+/*
+
+vertexbuilder.h
+
+Header file for the builder that turns gcode paths into vertex arrays,
+and for the interface of the classes that provide vertex arrays to the renderer.
+
+*/
+
+#ifndef VERTEXBUILDER_H
+#define VERTEXBUILDER_H 1
+
+#define _USE_MATH_DEFINES
+
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+#include <math.h>
+
+#include "helpers.h"
+
+#define eps 0.0001f
+#define X 0
+#define Y 1
+#define Z 2
+#define E 3
+#define NUMCOORDS 4
+
+typedef uint32_t VertexIndex; // Index of a vertex in a vertex buffer
+
+/*
+
+VertexSource
+
+Interface for anything that provides the renderer with vertex arrays
+of a part, in chunks.
+
+*/
+class VertexSource
+{
+public:
+	virtual ~VertexSource() {};
+	virtual bool get_bbox(BBox * bbox) = 0;
+	virtual int get_vertices(const unsigned int n_lines, int * nVertices, float * vertices, int * nIndices, VertexIndex * indices) = 0;
+	virtual void get_buffer_size(unsigned int * vertices_size, unsigned int * indices_size) = 0;
+	virtual void set_decimation(float tolerance) = 0;
+	virtual long get_segment_count() = 0;
+	virtual void get_progress(long * offset, long * size) = 0;
+};
+
+/*
+
+VertexBuilder
+
+Expands a vertex buffer with the vertices of gcode paths. Every two
+vertices make up a path, there are no indices. The renderer draws the
+paths as lines, or expands them to tubes on the GPU.
+
+With a decimation tolerance, consecutive paths that are (nearly) in line
+are merged into one, as long as no point is further than the tolerance
+from the merged path. Paths shorter than the tolerance are merged with
+the next or, if on their own, left out.
+
+*/
+class VertexBuilder
+{
+	int vertex_i = 0;	// Index of current vertex
+	int index_i = 0;	// Index of current vertex index
+	long segments = 0;	// Number of paths built, over all buffers
+	float * vertices;	// Pointer to the vertex buffer
+	VertexIndex * indices;	// Pointer to the index buffer
+
+	// Decimation
+	float tolerance = 0.0f;			// Max distance between a merged path and the points it replaces, 0: off
+	bool pending = false;			// Whether a merged path is waiting to be built
+	bool pendingConnected = false;	// Whether the merged path continues the previous path
+	float pendingStart[3];			// Start of the merged path
+	float pendingEnd[3];			// End of the merged path (so far)
+	float pendingDirection[3];		// Unit direction of the first path that was longer than the tolerance
+	float pendingReach = 0.0f;		// Distance covered along the direction
+	bool pendingDirected = false;	// Whether the direction has been determined
+
+public:
+	VertexBuilder();
+	void begin(float * vertices, VertexIndex * indices);
+	void add_segment(const float from[3], const float to[3], bool connected);
+	void set_tolerance(float tolerance);
+	void flush();
+	int vertex_count() { return vertex_i; };
+	int index_count() { return index_i; };
+	long segment_count() { return segments; };
+	void get_buffer_size(unsigned int * vertices_size, unsigned int * indices_size);
+
+private:
+	void build_segment(const float from[3], const float to[3]);
+	bool extend(const float point[3]);
+};
+
+#endif // !VERTEXBUILDER_H
@@ -0,0 +1,135 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import os, stat, time
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # OctoPrint depends on the backport on Python 2
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+def list_folder(path):
+    """
+    Lists a folder in a single pass. Returns a dict of file name to (size, mtime) and a list of subfolder names.
+    With scandir, the entry types come with the listing and only the files are stat'ed.
+    """
+    files = dict()
+    folders = []
+
+    if scandir:
+        for entry in scandir(path):
+            try:
+                if entry.is_dir():
+                    folders.append(entry.name)
+                elif entry.is_file():
+                    st = entry.stat()
+                    files[entry.name] = (st.st_size, int(st.st_mtime))
+            except OSError:
+                # Removed while listing
+                continue
+    else:
+        for name in os.listdir(path):
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+
+            if stat.S_ISDIR(st.st_mode):
+                folders.append(name)
+            elif stat.S_ISREG(st.st_mode):
+                files[name] = (st.st_size, int(st.st_mtime))
+
+    return files, folders
+
+class FolderScanner(object):
+    """
+    Walks the uploads folder to find the gcode files, using the manifest of each folder from the previous
+    scan. A folder's manifest holds its mtime, its gcode files and its subfolders. If the mtime of a folder
+    didn't change, no file was added, removed or renamed in it, so it isn't listed again.
+
+    root: The uploads folder
+    store: The PreviewStore that keeps the manifests
+    is_gcode: Called with the path of a file relative to root, returns whether it is a gcode file
+    on_file: Called with the path, the path relative to root and the mtime of every gcode file found
+    """
+    def __init__(self, root, store, is_gcode, on_file, logger):
+        self._root = root
+        self._store = store
+        self._is_gcode = is_gcode
+        self._on_file = on_file
+        self._logger = logger
+
+    def scan(self, start=""):
+        """
+        Scans a folder (relative to root) and its subfolders. Returns the set of paths of the gcode files found.
+        """
+        started = time.time()
+        manifests = self._store.get_folders()
+        changed = dict()
+        scanned = set()
+        found = set()
+        listed = 0
+
+        pending = [start]
+        while pending:
+            folder = pending.pop()
+            path = os.path.join(self._root, folder)
+            scanned.add(folder)
+
+            try:
+                mtime = int(os.stat(path).st_mtime)
+            except OSError:
+                continue
+
+            manifest = manifests.get(folder)
+
+            if manifest is None or manifest["mtime"] != mtime:
+                try:
+                    files, folders = list_folder(path)
+                except OSError:
+                    continue
+
+                manifest = self._update_manifest(folder, mtime, files, folders, manifest)
+                listed += 1
+
+                # A folder changed within the mtime resolution may still change unnoticed, list it again next time
+                if mtime < int(started) - 1:
+                    changed[folder] = manifest
+
+            for name, (size, fileMtime) in manifest["files"].iteritems():
+                filePath = os.path.join(path, name)
+                found.add(filePath)
+                self._on_file(filePath, self._join(folder, name), fileMtime)
+
+            pending.extend(self._join(folder, name) for name in manifest["folders"])
+
+        self._store.set_folders(changed)
+
+        # Forget the folders that are gone
+        prefix = self._join(start, "")
+        self._store.remove_folders([path for path in manifests if path not in scanned and path.startswith(prefix)])
+
+        self._logger.debug("Scanned {0} folders ({1} listed) in {2:.2f} s, {3} gcode files".format(len(scanned), listed, time.time() - started, len(found)))
+
+        return found
+
+    def _update_manifest(self, folder, mtime, files, folders, manifest):
+        """
+        Builds the manifest of a listed folder. Only files that are new or changed are checked for their type.
+        """
+        known = manifest["files"] if manifest else dict()
+        gcodeFiles = dict()
+
+        for name, fileStat in files.iteritems():
+            if name in known or self._is_gcode(self._join(folder, name)):
+                gcodeFiles[name] = fileStat
+
+        return dict(mtime=mtime, files=gcodeFiles, folders=sorted(folders))
+
+    def _join(self, folder, name):
+        return folder + "/" + name if folder else name
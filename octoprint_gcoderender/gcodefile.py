@@ -0,0 +1,134 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import os, struct, zlib
+
+# How a gcode file is stored, the renderer decompresses gzip and binary gcode while it parses
+FORMAT_TEXT = "gcode"
+FORMAT_GZIP = "gzip"
+FORMAT_BGCODE = "bgcode"
+
+GZIP_MAGIC = b"\x1f\x8b"
+GZIP_FEED_SIZE = 1024 * 1024 # Bytes of a gzip file decompressed at a time, and the most they decompress to
+BGCODE_MAGIC = b"GCDE"
+
+BGCODE_FILE_HEADER = struct.Struct("<4sIH")     # Magic, version, checksum type
+BGCODE_BLOCK_HEADER = struct.Struct("<HHI")     # Type, compression, uncompressed size
+BGCODE_BLOCK_GCODE = 1
+BGCODE_BLOCK_THUMBNAIL = 5
+BGCODE_CHECKSUM_CRC32 = 1
+BGCODE_ENCODING_NONE = 0
+MEATPACK_RATIO = 2  # MeatPack packs at most two characters in a byte
+
+def input_format(path):
+    """
+    Returns how a gcode file is stored, from its first bytes: FORMAT_TEXT, FORMAT_GZIP or FORMAT_BGCODE
+    """
+    with open(path, "rb") as f:
+        magic = f.read(4)
+
+    if magic.startswith(GZIP_MAGIC):
+        return FORMAT_GZIP
+    if magic == BGCODE_MAGIC:
+        return FORMAT_BGCODE
+    return FORMAT_TEXT
+
+def gcode_size(path, limit=None):
+    """
+    Returns the size of the gcode in a file in bytes, decompressed for compressed files. Gzip only stores the size
+    of its last member, modulo 4 GB, so gzip files are decompressed (all members, like the renderer) and the bytes
+    counted, until there are more than limit. Of binary gcode only the headers are read, each block stores its
+    size. MeatPack encoded gcode counts at its largest, twice the encoded size. Raises ValueError for corrupt
+    compressed files.
+    """
+    fileSize = os.path.getsize(path)
+    fileFormat = input_format(path)
+
+    if fileFormat == FORMAT_GZIP:
+        return _gzip_size(path, limit)
+    if fileFormat == FORMAT_BGCODE:
+        return _bgcode_size(path, fileSize)
+    return fileSize
+
+def _gzip_size(path, limit):
+    size = 0
+
+    with open(path, "rb") as f:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = b""
+
+        while limit is None or size <= limit:
+            if not data:
+                data = f.read(GZIP_FEED_SIZE)
+
+                # A truncated file counts up to where it ends, as far as the renderer gets
+                if not data:
+                    break
+
+            try:
+                size += len(decompressor.decompress(data, GZIP_FEED_SIZE))
+            except zlib.error as e:
+                raise ValueError("Gzip data is corrupt: {0}".format(e))
+
+            data = decompressor.unconsumed_tail
+
+            # The end of a member, a file may hold more. Anything else after a member is ignored.
+            if decompressor.unused_data:
+                data = decompressor.unused_data
+                if len(data) < len(GZIP_MAGIC):
+                    data += f.read(len(GZIP_MAGIC))
+
+                if not data.startswith(GZIP_MAGIC):
+                    break
+
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    return size
+
+def _bgcode_size(path, fileSize):
+    size = 0
+
+    with open(path, "rb") as f:
+        header = f.read(BGCODE_FILE_HEADER.size)
+        if len(header) < BGCODE_FILE_HEADER.size:
+            raise ValueError("Binary gcode file header is incomplete")
+
+        _, _, checksumType = BGCODE_FILE_HEADER.unpack(header)
+        checksumSize = 4 if checksumType == BGCODE_CHECKSUM_CRC32 else 0
+        offset = BGCODE_FILE_HEADER.size
+
+        while offset < fileSize:
+            header = f.read(BGCODE_BLOCK_HEADER.size)
+            if len(header) < BGCODE_BLOCK_HEADER.size:
+                raise ValueError("Binary gcode block header is incomplete at {0}".format(offset))
+
+            blockType, compression, uncompressedSize = BGCODE_BLOCK_HEADER.unpack(header)
+            dataSize = uncompressedSize
+            headerSize = BGCODE_BLOCK_HEADER.size
+
+            # Compressed blocks also store their compressed size
+            if compression != 0:
+                compressedSize = f.read(4)
+                if len(compressedSize) < 4:
+                    raise ValueError("Binary gcode block header is incomplete at {0}".format(offset))
+                dataSize, = struct.unpack("<I", compressedSize)
+                headerSize += 4
+
+            # Thumbnails have a format and dimensions, the other blocks an encoding
+            parameters = f.read(6 if blockType == BGCODE_BLOCK_THUMBNAIL else 2)
+
+            if blockType == BGCODE_BLOCK_GCODE:
+                if len(parameters) < 2:
+                    raise ValueError("Binary gcode block header is incomplete at {0}".format(offset))
+
+                encoding, = struct.unpack("<H", parameters)
+                size += uncompressedSize if encoding == BGCODE_ENCODING_NONE else uncompressedSize * MEATPACK_RATIO
+
+            offset += headerSize + len(parameters) + dataSize + checksumSize
+            f.seek(offset)
+
+        if offset > fileSize:
+            raise ValueError("Binary gcode file is truncated")
+
+    return size
@@ -3,196 +3,646 @@ from __future__ import absolute_import, division
 __author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
 
 import os, sys, time
-import threading, subprocess
+import threading, subprocess, multiprocessing
 import Queue
-import gcodeparser
 
 from flask import request, make_response, send_file, url_for, jsonify
-from tinydb import TinyDB, Query 
 from random import randint
 
 import octoprint.plugin
 import octoprint.filemanager
 import octoprint.filemanager.util
-from octoprint.server.util import noCachingResponseHandler
 from octoprint.events import Events
 
+from octoprint_gcoderender.renderpool import RenderPool, parse_cpu_list
+from octoprint_gcoderender.governor import RenderGovernor
+from octoprint_gcoderender.renderqueue import RenderQueue, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from octoprint_gcoderender.previewcache import PreviewCache, hash_file, settings_fingerprint, TOOLPATH_SETTINGS_KEYS, IMAGE_EXTENSIONS
+from octoprint_gcoderender.previewstore import PreviewStore
+from octoprint_gcoderender.folderscan import FolderScanner
+from octoprint_gcoderender.metrics import RenderMetrics
+from octoprint_gcoderender.gcodefile import gcode_size
+from octoprint_gcoderender.layerindex import LayerIndex
+
+# Preview images never change under their name, browsers may keep them for a year
+PREVIEW_MAX_AGE = 31536000
+
 class GCodeRenderPlugin(octoprint.plugin.StartupPlugin, 
+                        octoprint.plugin.ShutdownPlugin,
                         octoprint.plugin.SettingsPlugin,
                         octoprint.plugin.EventHandlerPlugin,
+                        octoprint.plugin.ProgressPlugin,
                         octoprint.plugin.BlueprintPlugin
 ):
     def initialize(self):
         # Because we use last modified, make sure we only get integers
         os.stat_float_times(False)
 
-        # The actual render jobs
-        self.renderJobs = Queue.Queue()
-
-        # Prepare loks for render queue and database accessget_settings_defaults
-        self.dbLock = threading.Lock()
-
-        self.preview_extension = "png"
-
-        # Initialize tinydb
+        # Files waiting to be hashed, and the actual render jobs
+        self.hashJobs = RenderQueue(is_stale=self._is_stale_job)
+        self.renderJobs = RenderQueue(is_stale=self._is_stale_job)
+        self.renderPool = None
+        self.renderGovernor = None
+
+        # Average render duration, to estimate when a queued preview will be ready
+        self.renderDuration = None
+
+        # Render stats and cache hit rates for /metrics
+        self.metrics = RenderMetrics()
+
+
+        # Previews are identified by the gcode content and the renderer settings
+        self.renderSettings = self._get_render_settings()
+        self.settingsFingerprint = settings_fingerprint(self.renderSettings)
+        self.preview_extension = IMAGE_EXTENSIONS.get(self.renderSettings["image_format"]["format"], "png")
+        self.previewCache = PreviewCache(self._get_image_folder(), 
+                                         self.preview_extension, 
+                                         self._settings.get_int(["previewCacheSize"]), 
+                                         self._logger,
+                                         scan_extensions=IMAGE_EXTENSIONS.values())
+
+        # Parsed toolpaths, so a preview can be rendered again (e.g. with other settings) without parsing
+        self.toolpathFingerprint = settings_fingerprint(self.renderSettings, TOOLPATH_SETTINGS_KEYS)
+        self.toolpathCache = None
+        if self._settings.get_boolean(["toolpathCache"]):
+            self.toolpathCache = PreviewCache(self._get_toolpath_folder(), 
+                                              "gtp", 
+                                              self._settings.get_int(["toolpathCacheSize"]), 
+                                              self._logger)
+
+        # Where each layer starts in the gcode, so the part printed so far can be rendered a few layers at a time
+        self.layerIndexCache = None
+        if self._settings.get_boolean(["progressPreview"]):
+            self.layerIndexCache = PreviewCache(self._get_progress_folder(), 
+                                                "glx", 
+                                                self._settings.get_int(["layerIndexCacheSize"]), 
+                                                self._logger)
+
+        # The print the progress previews are rendered for
+        self.printProgress = None
+        self.printProgressLock = threading.Lock()
+
+        # Open the preview database
         self._prepareDatabase()
 
-        # Cleanup the database and previews folder
-        self.cleanup()
+        # Evicted previews are listed as removed by /allpreviews
+        self.previewCache.on_evict = self.previews_database.touch
 
         # Begin watching for render jobs
-        self._start_render_thread()
-
-        # Fill the queue with any jobs we may have missed
-        self._updateAllPreviews()
+        self._start_hash_thread()
+        self._start_render_pool()
+
+        # Find the files that were added, changed or removed while we weren't running, without holding up the startup
+        self.folderScanner = FolderScanner(self._settings.global_get_basefolder('uploads'), 
+                                           self.previews_database, 
+                                           self._is_gcode_file, 
+                                           self._updatePreview, 
+                                           self._logger)
+        self.scanJobs = Queue.Queue()
+        self._start_scan_thread()
+        self.scanJobs.put("")
 
     def _prepareDatabase(self):
-        self.dbLock.acquire()
-        self.previews_database_path = os.path.join(self.get_plugin_data_folder(), "previews.json")
-        self.previews_database = TinyDB(self.previews_database_path)
-        self._previews_query = Query() # underscore for blueprintapi compatability
-        self.dbLock.release()
+        self.previews_database_path = os.path.join(self.get_plugin_data_folder(), "previews.db")
+        self.previews_database = PreviewStore(self.previews_database_path, self._logger)
+
+        # Earlier versions kept the previews in a TinyDB json file
+        self.previews_database.migrate(os.path.join(self.get_plugin_data_folder(), "previews.json"))
     
-    def _updateAllPreviews(self, subFolder = None):
+    def _start_scan_thread(self):
+        """
+        Start the daemon thread that scans the upload folders in the scan queue
         """
-        Reads the entire preview database, checks if there are any outdated previews (last modified of preview
-        is before last modified of gcode file) and updates these.
-        """ 
-        current_folder = self._settings.global_get_basefolder('uploads')
+        t = threading.Thread(target=self._scan_watch)
+        t.setDaemon(True)
+        t.start()
 
-        if subFolder:
-            current_folder = os.path.join(current_folder, subFolder)
+    def _scan_watch(self):
+        """
+        Scans upload folders (relative to the uploads folder) for gcode files without an up to date preview. 
+        A scan of the whole uploads folder also cleans up the previews of files that are gone.
+        """
+        while True:
+            folder = self.scanJobs.get() # Will block until a folder becomes available
 
-        self._logger.debug('Scanning folder {0} for render jobs'.format(current_folder))
+            if folder is None:
+                break
 
-        for entry in os.listdir(current_folder):
-            entry_path = os.path.join(current_folder, entry)
-            entry_rel_path = entry
+            try:
+                found = self.folderScanner.scan(folder)
 
-            if subFolder:
-                entry_rel_path = subFolder + '/' + entry
+                if not folder:
+                    self.cleanup(found)
+            except Exception:
+                self._logger.exception("Error while scanning {0}".format(folder or "the uploads folder"))
 
-            if os.path.isfile(entry_path):
-                file_type = octoprint.filemanager.get_file_type(entry_rel_path)
-                if(file_type):
-                    if file_type[0] is "machinecode":
-                        self._updatePreview(entry_path, entry_rel_path)
-            else:
-                self._updateAllPreviews(entry_rel_path)
+    def _is_gcode_file(self, filename):
+        # Compressed gcode can be previewed, but isn't machine code to OctoPrint, as it can't be printed as it is
+        name = filename.lower()
+        if name.endswith(".bgcode"):
+            return True
+        if name.endswith(".gz"):
+            filename = filename[:-3]
+
+        file_type = octoprint.filemanager.get_file_type(filename)
+        return bool(file_type) and file_type[0] == "machinecode"
    
-    def _updatePreview(self, path, filename):
+    def _updatePreview(self, path, filename, modtime):
         """
-        Checks if the preview is up to date with the gcode file (based on last modified) and re-renders if neceserry.
+        Re-renders the preview of a gcode file if there is none, or if it is older than the gcode file. Evicted 
+        preview images are rendered again when they're asked for.
         """
-        self.dbLock.acquire()
-        db_entry = self.previews_database.get(self._previews_query.path == path)
-        self.dbLock.release()
+        db_entry = self.previews_database.get_by_path(path)
 
-        
-        modtime = os.path.getmtime(path)
-        if db_entry is None or db_entry["modtime"] != modtime or not os.path.exists(db_entry["previewPath"]):
-            self.render_gcode(path, filename, modtime)
+        if db_entry is None or db_entry["modtime"] != modtime:
+            self.render_gcode(path, filename, modtime, priority=PRIORITY_LOW)
 
-    def cleanup(self):
+    def cleanup(self, found=None):
         """
-        Loop through database, remove items not found in upload or preview folder
+        Remove the database records of gcode files that no longer exist. The preview images themselves
+        are kept by the preview cache, so a file with the same content gets its preview right away.
+        found: Paths of gcode files known to exist
         """
-        self.dbLock.acquire()
-        db_entries = self.previews_database.all()
-        for db_entry in db_entries:
-            if not os.path.exists(db_entry["previewPath"]) or not os.path.exists(db_entry["path"]):
-                self.previews_database.remove(eids=[db_entry.eid])
+        removed = []
+        for db_entry in self.previews_database.all():
+            if (found is None or db_entry["path"] not in found) and not os.path.exists(db_entry["path"]):
+                removed.append(db_entry["path"])
                 self._logger.debug("Removed from preview database: %s" % db_entry["filename"])
-        
 
-        #Loop through images, remove items not found in db
-        image_folder = self._get_image_folder()
-        for entry in os.listdir(image_folder):
-            entry_path = os.path.join(image_folder, entry)
+        self.previews_database.remove(removed)
+
+    def on_shutdown(self):
+        self.scanJobs.put(None)
 
-            if entry_path.endswith(self.preview_extension) and \
-                not self.previews_database.contains(self._previews_query.previewPath == entry_path):
-                try:
-                    os.remove(entry_path)
-                    self._logger.debug("Removed preview %s" % entry_path)
-                except Exception:
-                    self._logger.debug("Could not remove preview %s" % entry_path)
-        self.dbLock.release()
+        if self.renderGovernor:
+            self.renderGovernor.stop()
+
+        if self.renderPool:
+            self.renderPool.stop()
+
+        self.previews_database.close()
 
     def on_event(self, event, payload, *args, **kwargs):
         if event == Events.UPLOAD:
-            if "path" in payload:
+            # Where OctoPrint has the file added event, an upload fires both and that one renders it
+            if getattr(Events, "FILE_ADDED", None) is not None:
+                pass
+            elif "path" in payload:
                 gcodePath = os.path.join(self._settings.global_get_basefolder('uploads'), payload["path"])
-                self.render_gcode(gcodePath, payload["name"])
+                self.render_gcode(gcodePath, payload["path"])
             else:
                 self._logger.debug("File uploaded, but no metadata found to create the gcode preview")
+        elif event in (Events.PRINT_STARTED, Events.PRINT_RESUMED):
+            if self.renderGovernor:
+                self.renderGovernor.set_printing(True)
+
+            # The renders start over after the print starts, throttled or paused like the other jobs
+            if event == Events.PRINT_STARTED and self.renderPool and self._settings.get_boolean(["cancelRendersOnPrint"]):
+                self.renderPool.cancel(lambda job: True, "printing")
+
+            if event == Events.PRINT_STARTED and self.layerIndexCache:
+                self._start_progress_preview(payload)
+        elif event in (Events.PRINT_DONE, Events.PRINT_FAILED, Events.PRINT_CANCELLED):
+            if self.renderGovernor:
+                self.renderGovernor.set_printing(False)
+
+            # The last progress preview shows the whole part
+            if event == Events.PRINT_DONE:
+                self._update_progress_preview(done=True)
+        elif event in (getattr(Events, "FILE_ADDED", None), getattr(Events, "FOLDER_ADDED", None), 
+                       getattr(Events, "FILE_REMOVED", None), getattr(Events, "FOLDER_REMOVED", None)):
+            # Not available in older OctoPrint versions, which only have the upload event. 
+            # OctoPrint reports a move as a removal followed by an addition.
+            if payload.get("storage") == "local" and "path" in payload:
+                self._on_file_event(event, payload["path"])
+
+    def on_print_progress(self, storage, path, progress):
+        if storage == "local":
+            self._update_progress_preview()
+
+    def _start_progress_preview(self, payload):
+        """
+        Starts rendering progress previews for the print that started, if it prints a file of the uploads folder
+        """
+        filename = payload.get("path")
+
+        if payload.get("origin") != "local" or not filename:
+            with self.printProgressLock:
+                self.printProgress = None
+            return
+
+        # The progress previews of the previous print are no longer needed
+        self._clear_progress_folder()
+
+        with self.printProgressLock:
+            self.printProgress = { "started": time.time(),
+                                   "filename": filename,
+                                   "path": os.path.join(self._settings.global_get_basefolder('uploads'), filename),
+                                   "index": None,         # The layer index, once it is loaded
+                                   "requested": False,    # Whether the preview was requested for the layer index
+                                   "layers": 0,           # Number of layers in the last progress preview
+                                   "rendering": False,    # Whether a progress preview is queued or being rendered
+                                   "done": False,         # Whether the print is done
+                                   "previewUrl": None }   # Url of the last progress preview
+
+        self._update_progress_preview()
+
+    def _update_progress_preview(self, done=False):
+        """
+        Queues a render of the layers the printer finished since the last progress preview, on top of the image 
+        of that preview. A single progress preview is queued or rendered at a time, the next one picks up the 
+        layers that were finished in the meantime.
+        done: The print is done, render up to the end of the file
+        """
+        with self.printProgressLock:
+            progress = self.printProgress
+
+            if progress is None:
+                return
+
+            progress["done"] = progress["done"] or done
+
+            if progress["rendering"]:
+                return
+
+            index = self._load_print_layer_index(progress)
+
+            if index is None:
+                return
+
+            if progress["done"]:
+                layers = len(index) # The last layer ends with the file
+            else:
+                filepos = (self._printer.get_current_data().get("progress") or dict()).get("filepos")
+
+                if filepos is None:
+                    return
+
+                layers = index.layers_done(filepos)
+
+            if layers <= progress["layers"]:
+                return
+
+            imageFilename = "{0}_{1}_layer{2}.{3}".format(progress["hash"], self.settingsFingerprint, layers, self.preview_extension)
+
+            job = { "printStarted": progress["started"],
+                    "path": progress["path"],
+                    "filename": progress["filename"],
+                    "modtime": progress["modtime"],
+                    "queueKey": progress["path"] + "#layers",
+                    "priority": PRIORITY_HIGH,
+                    "imageFilename": imageFilename,
+                    "imagePath": os.path.join(self._get_progress_folder(), imageFilename),
+                    "layerIndexPath": progress["layerIndexPath"],
+                    "framebufferPath": os.path.join(self._get_progress_folder(), "{0}_{1}.rgba".format(progress["hash"], self.settingsFingerprint)),
+                    "startLayer": progress["layers"],
+                    "endLayer": layers }
+
+            progress["rendering"] = True
+
+        self.renderJobs.put(job, PRIORITY_HIGH)
+
+    def _load_print_layer_index(self, progress):
+        """
+        Gets the layer index of the file being printed. If there is none, the preview is rendered (once), which 
+        writes the layer index. Returns None until the layer index is available.
+        """
+        if progress["index"] is not None:
+            return progress["index"]
+
+        try:
+            modtime = os.path.getmtime(progress["path"])
+        except OSError:
+            return None
+
+        db_entry = self.previews_database.get_by_filename(progress["filename"])
+        layerIndexFilename = None
+
+        if db_entry and db_entry["modtime"] == modtime:
+            layerIndexFilename = self.layerIndexCache.filename(db_entry["hash"], self.toolpathFingerprint)
+
+        if layerIndexFilename is None or not self.layerIndexCache.contains(layerIndexFilename):
+            if not progress["requested"]:
+                progress["requested"] = True
+                self.render_gcode(progress["path"], progress["filename"], priority=PRIORITY_HIGH)
+            return None
+
+        layerIndexPath = self.layerIndexCache.path(layerIndexFilename)
+
+        try:
+            index = LayerIndex.load(layerIndexPath)
+        except (IOError, OSError, ValueError) as e:
+            self._logger.debug("Could not read layer index of {0}: {1}".format(progress["filename"], e))
+            return None
+
+        progress.update({ "index": index, "hash": db_entry["hash"], "modtime": modtime, "layerIndexPath": layerIndexPath })
+        return index
+
+    def _on_progress_preview_finished(self, job, success):
+        """
+        Called when a progress preview is rendered. Replaces the previous progress preview and notifies the client.
+        """
+        with self.printProgressLock:
+            progress = self.printProgress
+
+            # A preview of an earlier print
+            if progress is None or progress["started"] != job["printStarted"]:
+                progress = None
+            else:
+                progress["rendering"] = False
+
+            if progress is not None and success:
+                previous = progress["previewUrl"]
+                progress["layers"] = job["endLayer"]
+                progress["previewUrl"] = "/plugin/gcoderender/progresspreview/%s" % job["imageFilename"]
+
+        if progress is None or not success:
+            return
+
+        if previous:
+            self._clear_progress_folder(keep=[job["imageFilename"], os.path.basename(job["framebufferPath"])])
+
+        self._send_client_message("gcode_progress_preview_ready", { 
+                                                            "filename": job["filename"],
+                                                            "layer": job["endLayer"],
+                                                            "layers": len(progress["index"]),
+                                                            "previewUrl": progress["previewUrl"]
+                                                            })
+
+        # The printer may have finished more layers in the meantime
+        self._update_progress_preview()
+
+    def _clear_progress_folder(self, keep=()):
+        """
+        Removes the progress previews and their framebuffers, except the files in keep. The layer indexes stay.
+        """
+        folder = self._get_progress_folder()
+
+        for filename in os.listdir(folder):
+            if filename in keep or filename.endswith("." + self.layerIndexCache.extension):
+                continue
+
+            try:
+                os.remove(os.path.join(folder, filename))
+            except OSError as e:
+                self._logger.debug("Could not remove progress preview {0}: {1}".format(filename, e))
+
+    def _on_file_event(self, event, filename):
+        """
+        Keeps the previews up to date with files and folders being added and removed, without rescanning
+        """
+        path = os.path.join(self._settings.global_get_basefolder('uploads'), filename)
+
+        if event == getattr(Events, "FILE_ADDED", None):
+            if self._is_gcode_file(filename):
+                self.render_gcode(path, filename)
+        elif event == getattr(Events, "FOLDER_ADDED", None):
+            # E.g. a folder that was moved here, with files in it
+            self.scanJobs.put(filename)
+        elif event == getattr(Events, "FILE_REMOVED", None):
+            # A file can be queued for hashing and rendering at once
+            hashCancelled = self.hashJobs.cancel(path)
+            renderCancelled = self.renderJobs.cancel(path)
+            if hashCancelled or renderCancelled:
+                self._logger.debug("Render job cancelled: %s" % filename)
+            if self.renderPool:
+                self.renderPool.cancel(lambda job: job["path"] == path, "removed")
+            self.previews_database.remove([path])
+        else:
+            # Queued jobs of files in the folder are dropped as stale
+            if self.renderPool:
+                self.renderPool.cancel(lambda job: job["path"].startswith(path + os.sep), "removed")
+            self.previews_database.remove([db_entry["path"] for db_entry in self.previews_database.all() 
+                                           if db_entry["path"].startswith(path + os.sep)])
 
     def is_blueprint_protected(self):
         return False
 
     def get_settings_defaults(self):
         return dict(
-            maxPreviewFileSize=52428800 # 50 MB
+            maxPreviewFileSize=52428800, # 50 MB
+            renderWorkers=0, # Number of render processes, 0: one per available CPU, minus one for OctoPrint
+            renderWorkerAffinity=None, # CPUs the render processes may run on, e.g. "1-3". None: no restriction
+            previewCacheSize=104857600, # 100 MB of preview images, least recently used are removed first. 0: no limit
+            toolpathCache=True, # Keep the parsed toolpaths, so previews can be rendered again without parsing the gcode
+            toolpathCacheSize=524288000, # 500 MB of toolpaths, least recently used are removed first. 0: no limit
+            progressPreview=True, # While printing, render the part printed so far, adding the layers finished since the last progress preview
+            layerIndexCacheSize=10485760, # 10 MB of layer indexes (48 bytes per layer), least recently used are removed first. 0: no limit
+            renderBackend="auto", # "gl", "software" (draws on the CPU) or "auto": software if there is no OpenGL context
+            previewStyle="lines", # "lines" or "tubes": lit, round tubes of previewTubeWidth (at least a pixel) wide, built on the GPU
+            previewTubeWidth=0.45, # Width of the tubes in mm
+            previewDecimation=0.5, # Merge paths that are less than this many pixels apart in the preview. 0: draw every path
+            gpuMemoryBudget=16777216, # 16 MB of GPU memory per render worker for streaming the part to the GPU, larger means fewer, bigger draw calls
+            parserThreads=0, # Number of threads that decode a gcode file, 0: one per CPU the render worker may use, 1: parse serially
+            pauseWhilePrinting=False, # Pause renders during prints, instead of throttling them
+            cancelRendersOnPrint=True, # Stop the renders in progress when a print starts, they start over throttled (or paused)
+            printLatencyLimit=0.05, # Throttle renders harder during a print while OctoPrint responds more than 50 ms late
+            previewFormat="png", # "png", "jpeg" or "webp". JPEG and WebP are available if the libraries were found when building
+            previewPngColors="indexed", # "indexed" (a palette, RGB if there are more than 256 colors), "rgb" or "rgba"
+            previewPngCompression=-1, # zlib level 0 (fastest) to 9 (smallest), -1: zlib's default
+            previewQuality=90, # Quality (0-100) of JPEG and WebP previews
+            previewViews=dict( # Additional images rendered along with the preview. Width, height and camera default to those of the preview
+                small=dict(width=100, height=100),
+                large=dict(width=600, height=600),
+                top=dict(camera=dict(target="part", distance=[0, 0, 450]))
+            )
         )
 
-    def render_gcode(self, path, filename, modtime = None):
+    def render_gcode(self, path, filename, modtime = None, priority = PRIORITY_NORMAL):
         """
-        Adds a render job to the render queue
+        Adds a render job to the queue. The file is hashed first, if a preview of the same content 
+        is cached, it is used right away. If the file is already queued, the jobs are merged.
         """
         if not os.path.exists(path):
             self._logger.debug("Could not find file to render: {0}".format(path))
             return
 
+        if not self._is_gcode_file(path):
+            self._logger.debug('Not a valid file type: %s' % path)
+            return
+
+        if filename.startswith("."): #TODO: Perform a more comprehensive hidden file check
+            self._logger.debug('Hidden file: %s' % path)
+            return
+
         if not modtime:
              modtime = os.path.getmtime(path)
+
+        # A render of an older version of the file is of no use
+        if self.renderPool:
+            self.renderPool.cancel(lambda job: job["path"] == path and job["modtime"] != modtime, "modified")
         
         #TODO: Some error handling; or return a dummy preview
+        # Compressed files count with their decompressed size, that's what the renderer parses
         maxFileSize = self._settings.get_int(["maxPreviewFileSize"])
-        if maxFileSize > 0 and os.path.getsize(path) > maxFileSize:
-            self._logger.warn("GCode file exceeds max preview file size: %s" % filename)
-            return
+        if maxFileSize > 0:
+            try:
+                size = gcode_size(path, maxFileSize)
+            except (IOError, OSError, ValueError) as e:
+                self._logger.warn("Could not read the size of GCode file %s: %s" % (filename, e))
+                return
+
+            if size > maxFileSize:
+                self._logger.warn("GCode file exceeds max preview file size: %s" % filename)
+                return
+
+        # Add the job to the hash queue, from there it goes to the render queue
+        enqueued = self.hashJobs.put({ "path": path, 
+                                       "filename": filename, 
+                                       "modtime": modtime, 
+                                       "priority": priority
+                                       }, priority)
+
+        if enqueued:
+            self._logger.debug("Render job enqueued: %s" % filename)
+        else:
+            self._logger.debug("Render job already enqueued: %s" % filename)
+
+    def _is_stale_job(self, job):
+        """
+        A job is stale if its gcode file was deleted or replaced after the job was enqueued
+        """
+        try:
+            stale = os.path.getmtime(job["path"]) != job["modtime"]
+        except OSError:
+            stale = True
+
+        if stale:
+            self._logger.debug("Dropped stale render job: %s" % job["filename"])
+
+        return stale
+
+    def _start_hash_thread(self):
+        """
+        Start the daemon thread that hashes the files in the hash queue
+        """
+        t = threading.Thread(target=self._hash_watch)
+        t.setDaemon(True)
+        t.start()
+
+    def _hash_watch(self):
+        """
+        Hashes the gcode files to find their preview. Cached previews are used right away, 
+        others are sent to the render queue.
+        """
+        while True:
+            job = self.hashJobs.get() # Will block until a job becomes available
+
+            if job is None:
+                break
+
+            try:
+                content_hash = hash_file(job["path"])
+            except (IOError, OSError):
+                self._logger.debug("Could not hash file: %s" % job["path"])
+                continue
+
+            # The preview filename is content-addressed, so the previews may be cached by the browser
+            imageFilename = self.previewCache.filename(content_hash, self.settingsFingerprint)
+
+            job.update({ "hash": content_hash, 
+                         "imageFilename": imageFilename, 
+                         "imagePath": self.previewCache.path(imageFilename),
+                         "views": dict() })
+
+            for view in self.renderSettings["views"]:
+                viewFilename = self.previewCache.filename(content_hash, self.settingsFingerprint, view)
+                job["views"][view] = { "imageFilename": viewFilename, 
+                                       "imagePath": self.previewCache.path(viewFilename) }
+
+            if self.toolpathCache:
+                toolpathFilename = self.toolpathCache.filename(content_hash, self.toolpathFingerprint)
+                self.toolpathCache.touch(toolpathFilename)
+                job["toolpathFilename"] = toolpathFilename
+                job["toolpathPath"] = self.toolpathCache.path(toolpathFilename)
+
+            if self.layerIndexCache:
+                layerIndexFilename = self.layerIndexCache.filename(content_hash, self.toolpathFingerprint)
+                job["layerIndexFilename"] = layerIndexFilename
+                job["layerIndexPath"] = self.layerIndexCache.path(layerIndexFilename)
+
+            # Files rendered before the layer index was kept are rendered again for it
+            if (all(self.previewCache.contains(filename) for filename in self._get_preview_filenames(job)) 
+                    and (not self.layerIndexCache or self.layerIndexCache.contains(job["layerIndexFilename"]))):
+                self._logger.debug("Found cached preview for %s" % job["filename"])
+                self.metrics.add_cache_lookup(True)
+                self._store_preview(job)
+            else:
+                self.metrics.add_cache_lookup(False)
+                self.renderJobs.put(job, job["priority"])
 
-        # Add the job to the render queue
-        self.renderJobs.put({ "path": path, "filename": filename, "modtime": modtime})
-        self._logger.debug("Render job enqueued: %s" % filename)
-        
 
     @octoprint.plugin.BlueprintPlugin.route("/previewstatus/<path:filename>", methods=["GET"])
     def previewstatus(self, filename):
         """
-        Allows to check whether a preview is available for a gcode file. 
+        Allows to check whether a preview is available for a gcode file. If the file is still 
+        waiting in the render queue, it is moved to the front of the queue.
         Query string arguments:
         filename: The gcode file to get the preview status for
-        make: Whether or not to start rendering the preview, if there's no preview ready
 
         GET /previewstatus/<filename>
         """
 
-        #TODO: Add support for other statusses, such as 'rendering failed', 'gcode too big', 'queued for rendering' etc
+        #TODO: Add support for other statusses, such as 'rendering failed', 'gcode too big' etc
         
         if not filename:
             response = make_response('Invalid filename', 400)
         else:
             # First check in the database whether a preview is available
             self._logger.debug("Retrieving preview status for %s" % filename)
-            self.dbLock.acquire()
-            db_entry = self.previews_database.get(self._previews_query.filename == filename)
-            self.dbLock.release()
-
-            if not db_entry:
-                response = make_response(jsonify({ 'status': 'notfound'}), 200)
-            elif os.path.exists(db_entry["previewPath"]):
-                response = make_response(jsonify({ 'status': 'ready', 'previewUrl' : db_entry["previewUrl"] }), 200)
+            db_entry = self.previews_database.get_by_filename(filename)
+
+            if db_entry and self.previewCache.contains(db_entry["previewFilename"]):
+                response = make_response(jsonify({ 'status': 'ready', 
+                                                   'previewUrl' : db_entry["previewUrl"], 
+                                                   'previewViews': self._get_view_urls(db_entry),
+                                                   'progressPreviewUrl': self._get_progress_preview_url(filename) }), 200)
             else:
-                self._logger.debug("Preview file not found: %s" % db_entry["previewPath"])
-                response = make_response(jsonify({ 'status': 'notfound'}), 200)
+                if db_entry:
+                    # The preview may have been evicted from the cache, render it again
+                    self._logger.debug("Preview not in the cache: %s" % db_entry["previewFilename"])
+                    self.render_gcode(db_entry["path"], filename, priority=PRIORITY_HIGH)
+
+                response = make_response(jsonify(self._get_queue_status(filename)), 200)
 
-        return self._make_no_cache(response)
+        return self._make_conditional(response)
+
+    def _get_queue_status(self, filename):
+        """
+        Finds a gcode file in the render queue and moves it to the front. Returns the status, the 
+        position in the queue and the estimated number of seconds until the preview is ready.
+        """
+        path = os.path.join(self._settings.global_get_basefolder('uploads'), filename)
+
+        if self.renderPool and self.renderPool.is_rendering(path):
+            progress = self.renderPool.progress(path)
+            return { 'status': 'rendering', 'progress': int(progress * 100) if progress is not None else None }
+
+        if self.hashJobs.prioritize(path):
+            return { 'status': 'queued', 'position': None, 'queueDepth': self.renderJobs.depth(), 'eta': None }
+
+        if not self.renderJobs.prioritize(path):
+            return { 'status': 'notfound' }
+
+        position = self.renderJobs.position(path)
+        workers = self.renderPool.available() if self.renderPool else 0
+        eta = None
+
+        if self.renderDuration is not None and position is not None and workers:
+            eta = (position + 1) * self.renderDuration / workers
+
+        return { 'status': 'queued', 'position': position, 'queueDepth': self.renderJobs.depth(), 'eta': eta }
 
     @octoprint.plugin.BlueprintPlugin.route("/preview/<path:previewFilename>", methods=["GET"])
     def preview(self, previewFilename):
         """
-        Retrieves a preview for a gcode file. Returns 404 if preview was not found
+        Retrieves a preview for a gcode file. Returns 404 if preview was not found. The preview filenames
+        follow from the gcode content and the render settings, so the images are served as immutable,
+        with the filename of the image as ETag.
+        Query string arguments:
+        view: Name of an additional view to get instead, e.g. small, large or top
+        width, height: Get the smallest view of the preview's camera that is at least this size
+
         GET /preview/file.gcode
         """
         if not previewFilename:
@@ -201,15 +651,96 @@ class GCodeRenderPlugin(octoprint.plugin.StartupPlugin,
             self._logger.debug("Retrieving preview %s" % previewFilename)
 
             # Check the database for existing previews
-            self.dbLock.acquire()
-            db_entry = self.previews_database.get(self._previews_query.previewFilename == previewFilename)
-            self.dbLock.release()
+            db_entry = self.previews_database.get_by_preview_filename(previewFilename)
 
             # Return the preview file if it is found, otherwise 404
-            if not db_entry or not os.path.exists(db_entry["previewPath"]):
+            if db_entry:
+                previewFilename = self._select_view(db_entry, request.args)
+
+            if not db_entry or not self.previewCache.contains(previewFilename):
                 response = make_response('No preview ready', 404)
             else:
-                response = send_file(db_entry["previewPath"])
+                # The browser may have this image already
+                if previewFilename in request.if_none_match:
+                    response = make_response('', 304)
+                else:
+                    response = send_file(self.previewCache.path(previewFilename), add_etags=False)
+
+                response.set_etag(previewFilename)
+                response.headers["Cache-Control"] = "public, max-age={0}, immutable".format(PREVIEW_MAX_AGE)
+
+        return response
+
+    def _select_view(self, db_entry, args):
+        """
+        Gets the preview filename of the view requested by name or by size. Falls back to the preview itself.
+        """
+        views = db_entry["previewViews"]
+        view = args.get("view")
+
+        if view:
+            return views.get(view, db_entry["previewFilename"])
+
+        width = args.get("width", type=int)
+        height = args.get("height", type=int)
+
+        if not width and not height:
+            return db_entry["previewFilename"]
+
+        # Only views that show the same as the preview, at another resolution
+        candidates = [(self.renderSettings["width"], self.renderSettings["height"], db_entry["previewFilename"])]
+        for name, settings in self.renderSettings["views"].iteritems():
+            if name in views and settings.get("camera", self.renderSettings["camera"]) == self.renderSettings["camera"]:
+                candidates.append((settings.get("width", self.renderSettings["width"]), 
+                                   settings.get("height", self.renderSettings["height"]), 
+                                   views[name]))
+
+        candidates.sort()
+
+        for candidateWidth, candidateHeight, filename in candidates:
+            if candidateWidth >= (width or 0) and candidateHeight >= (height or 0):
+                return filename
+
+        # Nothing is large enough, use the largest
+        return candidates[-1][2]
+
+    def _get_view_urls(self, db_entry):
+        """
+        Gets the urls of the additional views of a preview
+        """
+        return dict((view, "{0}?view={1}".format(db_entry["previewUrl"], view)) for view in db_entry["previewViews"])
+
+    def _get_progress_preview_url(self, filename):
+        """
+        Gets the url of the last progress preview, if the gcode file is being printed
+        """
+        with self.printProgressLock:
+            if self.printProgress and self.printProgress["filename"] == filename:
+                return self.printProgress["previewUrl"]
+
+        return None
+
+    @octoprint.plugin.BlueprintPlugin.route("/progresspreview/<path:previewFilename>", methods=["GET"])
+    def progresspreview(self, previewFilename):
+        """
+        Retrieves a progress preview: the part printed so far. Returns 404 if it was not found. Each progress 
+        preview has a filename of its own, so they're served as immutable, like the previews.
+
+        GET /progresspreview/<previewFilename>
+        """
+        path = os.path.join(self._get_progress_folder(), os.path.basename(previewFilename))
+
+        # The framebuffers and layer indexes in the folder aren't served
+        if not previewFilename.endswith("." + self.preview_extension) or not os.path.isfile(path):
+            response = make_response('No progress preview ready', 404)
+        else:
+            if previewFilename in request.if_none_match:
+                response = make_response('', 304)
+            else:
+                response = send_file(path, add_etags=False)
+
+            response.set_etag(previewFilename)
+            response.headers["Cache-Control"] = "public, max-age={0}, immutable".format(PREVIEW_MAX_AGE)
 
         return response
 
@@ -218,31 +749,133 @@ class GCodeRenderPlugin(octoprint.plugin.StartupPlugin,
         """
         Gets a list of all gcode files for which a preview is available. Useful for initial display 
         of a gcode file list. Removes the need for calling previewstatus a lot of times.
+        The response has a change token, pass it as since to get only the previews that were added and 
+        the files whose preview was removed since then. If the token is too old (or from before a restart), 
+        the full list is returned with full set to true.
+        Query string arguments:
+        since: Change token of an earlier response
+        limit: Maximum number of previews and removals, more is true if there are more. Pass the token as
+               since to get the next page
+        folder: Only the gcode files in this folder (relative to the uploads folder) and its subfolders
+
+        GET /allpreviews?since=<token>
         """
-        self.dbLock.acquire()
-        db_entries = self.previews_database.all()
-        self.dbLock.release()
+        since = self._parse_change_token(request.args.get("since"))
+        limit = request.args.get("limit", type=int)
+        folder = request.args.get("folder")
+
+        changes = self.previews_database.changes(since, limit, folder) if since else None
+        full = changes is None
+        if full:
+            changes = self.previews_database.changes(0, limit, folder)
+
+        db_entries, removed, sequence, more = changes
 
         previews = []
         for db_entry in db_entries:
-            if os.path.exists(db_entry["previewPath"]):
-                previews.append({ "filename": db_entry["filename"], "previewUrl" : db_entry["previewUrl"] })
+            if self.previewCache.has(db_entry["previewFilename"]):
+                previews.append({ "filename": db_entry["filename"], 
+                                  "previewUrl" : db_entry["previewUrl"], 
+                                  "previewViews": self._get_view_urls(db_entry) })
+            elif not full:
+                # The preview was evicted
+                removed.append(db_entry["filename"])
+
+        response = make_response(jsonify({ "previews" : previews, 
+                                           "removed": removed, 
+                                           "token": "{0}-{1}".format(self.previews_database.epoch, sequence),
+                                           "full": full,
+                                           "more": more }))
+
+        return self._make_conditional(response)
+
+    @octoprint.plugin.BlueprintPlugin.route("/metrics", methods=["GET"])
+    def getMetrics(self):
+        """
+        Gets the render stats since OctoPrint started: the number of renders, the time spent in each stage 
+        of the render pipeline, the lines, paths and vertices processed, the hit rates of the preview and 
+        toolpath caches, and the current queue depths. As JSON, or in the Prometheus text format with 
+        format=prometheus or if the client accepts text/plain but not JSON.
+        Query string arguments:
+        format: json or prometheus
+
+        GET /metrics?format=prometheus
+        """
+        cachedPreviews, cacheSize = self.previewCache.usage()
+
+        metrics = self.metrics.snapshot(queue_depth=self.renderJobs.depth(),
+                                        hash_queue_depth=self.hashJobs.depth(),
+                                        rendering=self.renderPool.rendering() if self.renderPool else 0,
+                                        workers=len(self.renderPool.workers) if self.renderPool else 0,
+                                        cached_previews=cachedPreviews,
+                                        preview_cache_bytes=cacheSize)
+
+        outputFormat = request.args.get("format")
+        if not outputFormat:
+            best = request.accept_mimetypes.best_match(["application/json", "text/plain"])
+            outputFormat = "prometheus" if best == "text/plain" else "json"
+
+        if outputFormat == "prometheus":
+            response = make_response(RenderMetrics.prometheus(metrics), 200)
+            response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            response = make_response(jsonify(metrics), 200)
+
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    def _parse_change_token(self, token):
+        """
+        Gets the sequence number of a change token of /allpreviews. Returns None if the token is missing, 
+        invalid or from an earlier run.
+        """
+        if not token:
+            return None
 
-        response = make_response(jsonify({ "previews" : previews }))
+        epoch, _, sequence = token.partition("-")
 
-        return self._make_no_cache(response)
+        if epoch != self.previews_database.epoch or not sequence.isdigit():
+            return None
+
+        return int(sequence)
         
 
-    def _start_render_thread(self):
-        """"
-        Start the daemon thread that watches the render job queue
+    def _start_render_pool(self):
         """
-        t = threading.Thread(target=self._render_gcode_watch)
-        t.setDaemon(True)
-        t.start()
+        Start the render worker processes that take their jobs from the render job queue
+        """
+        cpus = parse_cpu_list(self._settings.get(["renderWorkerAffinity"]))
+        workers = self._settings.get_int(["renderWorkers"])
+
+        if not workers:
+            # Leave a core for OctoPrint and the printer communication
+            workers = len(cpus) if cpus else multiprocessing.cpu_count() - 1
+
+        self.renderPool = RenderPool(self.renderJobs, 
+                                     self.renderSettings, 
+                                     self._logger, 
+                                     on_started=self._on_render_started, 
+                                     on_finished=self._on_render_finished, 
+                                     size=max(1, workers), 
+                                     cpus=cpus,
+                                     on_progress=self._on_render_progress)
+
+        # Full speed while idle, throttled (with OctoPrint's analysis throttling) while printing
+        self.renderGovernor = RenderGovernor(self.renderPool.set_throttling,
+                                             self.renderSettings["throttling_interval"],
+                                             self.renderSettings["throttling_duration"],
+                                             self._logger,
+                                             pause_while_printing=self._settings.get_boolean(["pauseWhilePrinting"]),
+                                             latency_limit=self._settings.get_float(["printLatencyLimit"]),
+                                             busy=self.renderPool.rendering)
+        self.renderGovernor.start(printing=self._printer.is_printing())
+        self.renderPool.start()
         
-    def _initialize_parser(self):
-         # Read throttling settings from OctoPrint
+    def _get_render_settings(self):
+        """
+        Collects the settings each render worker initializes its gcodeparser with
+        """
+        # Read throttling settings from OctoPrint
         throttling_duration = 0
         throttling_interval = 0
 
@@ -265,129 +898,128 @@ class GCodeRenderPlugin(octoprint.plugin.StartupPlugin,
 
             # OctoPrint default 100, multiply by 50 because we're at C speed, and we're crunching more efficiently
             throttling_interval = 50 * default_throttle_lines
-        
-        initialized = False
-
-        try:
-            initialized = gcodeparser.initialize(width=250, 
-                                   height=250, 
-                                   throttling_interval=throttling_interval, 
-                                   throttling_duration=throttling_duration, 
-                                   logger=self._logger)
-        except Exception as e:
-            self._logger.exception("Exception while initializing gcodeparser")
-            return False
-
-        if initialized:
 
-            try:
-                gcodeparser.set_print_area(x_min=-37, x_max=328, y_min=-33, y_max=317, z_min=0, z_max=205)
-                gcodeparser.set_camera(target="part", distance=(-300, -300, 150))
-                gcodeparser.set_background_color((1.0, 1.0, 1.0, 1.0))
-                gcodeparser.set_bed_color((0.75, 0.75, 0.75, 1.0))
-                gcodeparser.set_part_color((67.0 / 255.0, 74.0 / 255.0, 84.0 / 255.0, 1.0))
-
-            except Exception as e:
-                self._logger.exception("Exception while configuring gcodeparser")
-                return False
-
-            return True
-
-
-    def _render_gcode_watch(self):
-        """"
-        The actual rendering thread. Monitors the render queue, and initiates the render job.
+        return dict(width=250,
+                    height=250,
+                    throttling_interval=throttling_interval,
+                    throttling_duration=throttling_duration,
+                    backend=self._settings.get(["renderBackend"]),
+                    print_area=dict(x_min=-37, x_max=328, y_min=-33, y_max=317, z_min=0, z_max=205),
+                    camera=dict(target="part", distance=[-300, -300, 150]),
+                    views=self._settings.get(["previewViews"]) or dict(),
+                    background_color=(1.0, 1.0, 1.0, 1.0),
+                    bed_color=(0.75, 0.75, 0.75, 1.0),
+                    part_color=(67.0 / 255.0, 74.0 / 255.0, 84.0 / 255.0, 1.0),
+                    draw_mode=dict(mode=self._settings.get(["previewStyle"]),
+                                   tube_width=self._settings.get_float(["previewTubeWidth"])),
+                    decimation=self._settings.get_float(["previewDecimation"]),
+                    gpu_memory_budget=self._settings.get_int(["gpuMemoryBudget"]),
+                    parser_threads=self._settings.get_int(["parserThreads"]),
+                    image_format=dict(format=self._settings.get(["previewFormat"]),
+                                      png_colors=self._settings.get(["previewPngColors"]),
+                                      compression_level=self._settings.get_int(["previewPngCompression"]),
+                                      quality=self._settings.get_int(["previewQuality"])))
+
+    def _on_render_started(self, job):
+        """
+        Called by the render pool when a worker picks up a job
         """
+        if "startLayer" in job:
+            return
 
-        # It is important we initialize the gcoderender on this thread (for the drawing context)
-        initialized = self._initialize_parser()
+        # Notify the client about the render
+        self._send_client_message("gcode_preview_rendering", { 
+                                            "filename":  job["filename"]
+                                            })
 
-        if not initialized:
-            self._logger.error("Couldn't initialize gcodeparser")
+    def _on_render_progress(self, job, progress):
+        """
+        Called by the render pool while a job is rendered, with the fraction of the gcode file done
+        """
+        if "startLayer" in job:
             return
 
-        while True:
-            job = self.renderJobs.get() # Will block until a job becomes available
-            self._logger.debug("Job found: {0}".format(job['filename']))
-            t0 = time.time()
-            self._render_gcode_worker(job['path'], job['filename'], job['modtime'])
-            t1 = time.time()
-            self._logger.info("Rendered preview for {filename} in {t:0.0f} s".format(filename=job['filename'], t=(t1-t0)))
-            self.renderJobs.task_done()
+        self._send_client_message("gcode_preview_progress", { 
+                                            "filename":  job["filename"],
+                                            "progress": int(progress * 100)
+                                            })
 
-    def _render_gcode_worker(self, path, filename, modtime):
+    def _on_render_finished(self, job, success, duration):
         """
-        Renders a preview for a gcode file and inserts a record into the preview database.
+        Called by the render pool when a job is done. Adds the preview to the cache and the database.
         """
-        if not octoprint.filemanager.valid_file_type(path, type="gcode"):
-             self._logger.debug('Not a valid file type: %s' % path)
-             return
+        filename = job["filename"]
 
-        if not os.path.exists(path):
-            self._logger.debug('File doesn\'t exist: %s' % path)
-            return 
+        if "startLayer" in job:
+            if job.get("cancelled"):
+                self.metrics.add_cancelled()
+            else:
+                self.metrics.add_render(success, duration, job.get("stats"))
 
-        if filename.startswith("."): #TODO: Perform a more comprehensive hidden file check
-            self._logger.debug('Hidden file: %s' % path)
+            self._on_progress_preview_finished(job, success and not job.get("cancelled"))
             return
 
-        # Notify the client about the render
-        self._send_client_message("gcode_preview_rendering", { 
-                                            "filename":  filename
-                                            })
+        if job.get("cancelled"):
+            self._logger.info("Render of {0} cancelled: {1}".format(filename, job["cancelled"]))
+            self.metrics.add_cancelled()
 
-        # Get a filename for the preview. By including modtime, the previews may be cached by the browser
-        imageDest = self._get_imagepath(filename, modtime)
-       
-        self._logger.debug("Image path: {}".format(imageDest["path"]))
-       
-        # This is where the magic happens
-        self._logger.debug("Begin rendering");
-        returncode = 1
-        try:
-            success = gcodeparser.render_gcode(path, imageDest["path"])
-        except Exception as e:
-            self._logger.debug("Error in Gcodeparser: %s" % e.message)
+            # Render it again, at the pace of the print
+            if job["cancelled"] == "printing":
+                self.renderJobs.put(dict((key, value) for key, value in job.iteritems() 
+                                         if key not in ("cancelled", "stats", "throttled")), job["priority"])
+            return
+
+        self.metrics.add_render(success, duration, job.get("stats"), "toolpathPath" in job)
 
         if success:
             # Rendering succeeded
-            self._logger.debug("Render complete: %s" % filename)
-            url = '/plugin/gcoderender/preview/%s' % imageDest["filename"]
+            self._logger.info("Rendered preview for {filename} in {t:0.0f} s (throttled {throttled:0.0f} s)".format(filename=filename, 
+                                                                                                               t=duration, 
+                                                                                                               throttled=job.get("throttled", 0)))
+
+            # Exponential moving average of the render durations
+            if self.renderDuration is None:
+                self.renderDuration = duration
+            else:
+                self.renderDuration = 0.8 * self.renderDuration + 0.2 * duration
+
         else:
             # Rendering failed.
             # TODO: set url and path to a failed-preview-image
             self._logger.warn("Render failed: %s" % filename)
             return
 
-        # Query the database for any existing records of the gcode file. 
-        # Then, update or insert record
-        self.dbLock.acquire()
-        db_entry = self.previews_database.get(self._previews_query.path == path)
-      
-        if not db_entry:
-            self.previews_database.insert({ 
-                    "filename" : filename, 
-                    "path": path, 
-                    "modtime" : modtime, 
-                    "previewUrl" : url,
-                    "previewFilename" : imageDest["filename"],
-                    "previewPath" : imageDest["path"]
-                })
-        else:
-            try:
-                os.remove(db_entry["previewPath"])
-            except Exception:
-                self._logger.debug("Could not delete preview %s" % db_entry["previewPath"])
-
-            self.previews_database.update({ 
-                    "modtime" : modtime, 
-                    "previewUrl" : url,
-                    "previewPath" : imageDest["path"], 
-                    "previewFilename" : imageDest["filename"]
-                }
-                , self._previews_query.path == path)
-         
-        self.dbLock.release()  
+        for filename in self._get_preview_filenames(job):
+            self.previewCache.add(filename)
+
+        if self.toolpathCache and "toolpathFilename" in job:
+            self.toolpathCache.add(job["toolpathFilename"])
+
+        if self.layerIndexCache and "layerIndexFilename" in job:
+            self.layerIndexCache.add(job["layerIndexFilename"])
+
+        self._store_preview(job)
+
+    def _store_preview(self, job):
+        """
+        Inserts or updates the preview database record of a gcode file, and notifies the client
+        """
+        path = job["path"]
+        filename = job["filename"]
+        url = '/plugin/gcoderender/preview/%s' % job["imageFilename"]
+
+        # Update or insert the record of the gcode file. If there was an older preview, it stays in 
+        # the preview cache, as other files may share it
+        self.previews_database.upsert([{ 
+                "filename" : filename, 
+                "path": path, 
+                "modtime" : job["modtime"], 
+                "hash" : job["hash"],
+                "previewUrl" : url,
+                "previewFilename" : job["imageFilename"],
+                "previewPath" : job["imagePath"],
+                "previewViews" : dict((view, images["imageFilename"]) for view, images in job["views"].iteritems())
+            }])
 
         # Notify client the preview is ready
         self._send_client_message("gcode_preview_ready", { 
@@ -395,16 +1027,20 @@ class GCodeRenderPlugin(octoprint.plugin.StartupPlugin,
                                                             "previewUrl": url
                                                             })
 
-   
+    def _get_preview_filenames(self, job):
+        """
+        Gets the filenames of the preview and its additional views
+        """
+        return [job["imageFilename"]] + [images["imageFilename"] for images in job["views"].itervalues()]
 
-    def _make_no_cache(self, response):
+    def _make_conditional(self, response):
         """
-        Helper method to set no-cache headers. Not used anymore, as including modtime in filename allows browser caching
+        Lets the browser keep a response, but revalidate it before each use. Answers with 304 Not Modified
+        and no body if the browser has the same response already.
         """
-        response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0"
-        response.headers["Pragma"] = "no-cache"
-        response.headers["Expires"] = "-1"
-        return response
+        response.add_etag()
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
 
     def _get_image_folder(self):
         """
@@ -412,26 +1048,24 @@ class GCodeRenderPlugin(octoprint.plugin.StartupPlugin,
         """
         return self._settings.get_plugin_data_folder()
 
-    def _get_imagepath(self, filename, modtime = None):
+    def _get_toolpath_folder(self):
         """
-        Creates a filename for the preview. Returns both filename and (full) path
+        Gets the folder to save the parsed toolpaths to
         """
+        folder = os.path.join(self._settings.get_plugin_data_folder(), "toolpaths")
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        return folder
 
-        # Strip any subfolders and find the basename of the file
-        _, tail = os.path.split(filename)
-        name, _ = os.path.splitext(tail)
-
-        images_folder = self._get_image_folder()
-        
-        if not modtime:
-            modtime = time.clock()
-
-        new_filename = "{0}_{1}.{2}".format(name, modtime, self.preview_extension)
-
-        image_path = os.path.join(images_folder, new_filename)
+    def _get_progress_folder(self):
+        """
+        Gets the folder to save the layer indexes and the progress previews to
+        """
+        folder = os.path.join(self._settings.get_plugin_data_folder(), "progress")
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        return folder
 
-        return dict(path = image_path, filename = new_filename)
-    
     def _send_client_message(self, message_type, data=None):
         """
         Notify the client
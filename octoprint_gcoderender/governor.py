@@ -0,0 +1,122 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import os, math, time, threading, multiprocessing
+
+class RenderGovernor(object):
+    """
+    Decides how much the render workers are throttled. Renders run at full speed while the printer is idle.
+    During a print they're throttled, and the throttling is doubled for as long as OctoPrint responds slowly
+    or the CPUs are overloaded, until the renders are paused.
+
+    OctoPrint's responsiveness is measured as the delay with which a thread in its process wakes up, which
+    is also what the serial communication thread suffers from. The CPU load doesn't count the render workers,
+    otherwise the renders would back off from themselves.
+
+    apply: Called with interval, duration and paused whenever the throttling changes
+    interval: Throttle every this many lines while printing
+    duration: The time (in ms) to sleep while printing
+    pause_while_printing: Pause renders during prints, instead of throttling them
+    latency_limit: Back off when the delay exceeds this (in seconds)
+    busy: Returns the number of render workers that are rendering
+    """
+    PERIOD = 0.5 # Time between measurements, in seconds
+    LOAD_PERIOD = 60.0 # The period of the load average that is compared, in seconds
+    BACKOFF_STEPS = 4 # The number of times the throttling is doubled before renders are paused
+
+    def __init__(self, apply, interval, duration, logger, pause_while_printing=False, latency_limit=0.05, busy=None):
+        self._apply = apply
+        self._interval = interval
+        self._duration = duration
+        self._logger = logger
+        self._pause_while_printing = pause_while_printing
+        self._latency_limit = latency_limit
+        self._busy = busy
+
+        self._lock = threading.Lock()
+        self._printing = False
+        self._backoff = 0
+        self._state = None
+        self._running = False
+        self._busyAverage = 0.0
+
+        try:
+            self._cpus = multiprocessing.cpu_count()
+        except NotImplementedError:
+            self._cpus = 1
+
+    def start(self, printing=False):
+        self._running = True
+        self.set_printing(printing)
+
+        t = threading.Thread(target=self._monitor)
+        t.setDaemon(True)
+        t.start()
+
+    def stop(self):
+        self._running = False
+
+    def set_printing(self, printing):
+        """
+        Called when a print starts or ends
+        """
+        with self._lock:
+            self._printing = printing
+            self._backoff = 0
+
+        self._update(0.0, 0.0)
+
+    def _monitor(self):
+        while self._running:
+            t0 = time.time()
+            time.sleep(self.PERIOD)
+            elapsed = time.time() - t0
+            latency = elapsed - self.PERIOD
+
+            self._update(latency, self._get_load(elapsed))
+
+    def _get_load(self, elapsed):
+        """
+        Returns the number of processes waiting for a CPU, per CPU (1-minute average), besides the render
+        workers. 0 where unavailable.
+        """
+        # Average the busy workers like the kernel averages the load, so they can be subtracted from it
+        if self._busy is not None:
+            decay = math.exp(-elapsed / self.LOAD_PERIOD)
+            self._busyAverage = self._busyAverage * decay + self._busy() * (1.0 - decay)
+
+        try:
+            return max(os.getloadavg()[0] - self._busyAverage, 0.0) / self._cpus
+        except (AttributeError, OSError):
+            return 0.0
+
+    def _update(self, latency, load):
+        with self._lock:
+            if not self._printing:
+                state = (0, 0, False)
+            elif self._pause_while_printing:
+                state = (self._interval, self._duration, True)
+            else:
+                if latency > self._latency_limit or load > 1.0:
+                    self._backoff = min(self._backoff + 1, self.BACKOFF_STEPS)
+                elif latency < self._latency_limit / 2 and load < 0.75:
+                    self._backoff = max(self._backoff - 1, 0)
+
+                state = (self._interval, self._duration << self._backoff, self._backoff == self.BACKOFF_STEPS)
+
+            if state == self._state:
+                return
+
+            self._state = state
+
+        interval, duration, paused = state
+
+        if paused:
+            self._logger.debug("Renders paused (latency {0:.0f} ms, load {1:.2f})".format(1000 * latency, load))
+        elif interval:
+            self._logger.debug("Renders throttled {0} ms every {1} lines (latency {2:.0f} ms, load {3:.2f})".format(duration, interval, 1000 * latency, load))
+        else:
+            self._logger.debug("Renders at full speed")
+
+        self._apply(interval, duration, paused)
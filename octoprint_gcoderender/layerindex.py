@@ -0,0 +1,61 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import struct
+from bisect import bisect_right
+
+# Layer index files written by the renderer (see gcodeparser/layerindex.h)
+LAYER_INDEX_MAGIC = b"GLIX"
+LAYER_INDEX_VERSION = 1
+LAYER_INDEX_HEADER = struct.Struct("<4sII6f6fI")    # Magic, version, number of layers, bed and part bounding boxes, bounding box valid
+LAYER_ENTRY = struct.Struct("<Qf4f4fI")             # Offset in the gcode, height, parser state
+
+class LayerIndex(object):
+    """
+    Where each layer of a gcode file starts, in bytes from the start of the (decompressed) gcode. Tells
+    which layers a print has finished from the position in the file being printed.
+    """
+    def __init__(self, offsets, heights):
+        self.offsets = offsets
+        self.heights = heights
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a layer index file. Raises IOError if it can't be read, ValueError if it is damaged
+        or of another version
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+
+        if len(data) < LAYER_INDEX_HEADER.size:
+            raise ValueError("Layer index file header is incomplete")
+
+        header = LAYER_INDEX_HEADER.unpack_from(data)
+        magic, version, layers = header[:3]
+
+        if magic != LAYER_INDEX_MAGIC or version != LAYER_INDEX_VERSION:
+            raise ValueError("Not a layer index file of version {0}".format(LAYER_INDEX_VERSION))
+
+        if len(data) != LAYER_INDEX_HEADER.size + layers * LAYER_ENTRY.size:
+            raise ValueError("Layer index file is truncated")
+
+        offsets = []
+        heights = []
+        for i in range(layers):
+            entry = LAYER_ENTRY.unpack_from(data, LAYER_INDEX_HEADER.size + i * LAYER_ENTRY.size)
+            offsets.append(entry[0])
+            heights.append(entry[1])
+
+        return cls(offsets, heights)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def layers_done(self, filepos):
+        """
+        Returns the number of layers finished once the printer got to filepos: the layers before the
+        one that is being printed
+        """
+        return max(0, bisect_right(self.offsets, filepos) - 1)
@@ -0,0 +1,157 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import threading
+
+# Stats of a render (see gcodeparser.render_views) that are summed over all renders: name -> description
+RENDER_COUNTERS = [
+    ("lines", "Gcode lines (or cached toolpath points) parsed"),
+    ("bytes", "Bytes of gcode parsed"),
+    ("segments", "Paths turned into vertices"),
+    ("vertices", "Vertices uploaded to the renderer"),
+    ("bytes_uploaded", "Bytes of vertex and index data uploaded to the renderer"),
+    ("draw_calls", "Draw calls, over all views"),
+    ("layers", "Layers drawn by progress previews"),
+]
+
+# Seconds spent in each stage of the render pipeline, summed over all renders: stage -> description
+RENDER_STAGES = [
+    ("parse", "Parsing the gcode or reading the toolpath cache"),
+    ("upload", "Uploading the vertices"),
+    ("draw", "Drawing the part and the bed"),
+    ("read_pixels", "Reading the images back"),
+    ("encode", "Encoding and writing the images"),
+    ("throttled", "Parser held up by the render governor"),
+]
+
+# Numbers of a snapshot that are counters, the others are gauges
+SNAPSHOT_COUNTERS = set(["renders", "renders_failed", "renders_cancelled", "render_seconds"] + [name for name, _ in RENDER_COUNTERS])
+
+PROMETHEUS_PREFIX = "gcoderender_"
+
+class RenderMetrics(object):
+    """
+    Aggregates the stats of the renders and the preview cache lookups since the start of the plugin.
+    Updated by the render pool and the hash thread, read by the metrics endpoint.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        self.renders = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.duration = 0.0 # Seconds from the start to the end of the renders, as seen by the workers
+        self.counters = dict((name, 0) for name, _ in RENDER_COUNTERS)
+        self.stages = dict((stage, 0.0) for stage, _ in RENDER_STAGES)
+
+        self.cacheHits = 0 # Files whose previews were all cached
+        self.cacheMisses = 0 # Files sent to the render queue
+        self.toolpathHits = 0 # Renders from the toolpath cache
+        self.toolpathMisses = 0 # Renders that parsed the gcode
+
+    def add_render(self, success, duration, stats, toolpath=False):
+        """
+        Adds a finished render. stats is the result of gcodeparser.render_views, None if unknown.
+        toolpath: Whether the render looked for a toolpath cache file
+        """
+        with self._lock:
+            if not success:
+                self.failed += 1
+                return
+
+            self.renders += 1
+            self.duration += duration
+
+            if not stats:
+                return
+
+            for name in self.counters:
+                self.counters[name] += stats.get(name, 0)
+
+            for stage in self.stages:
+                self.stages[stage] += stats.get(stage + "_time", 0.0)
+
+            if toolpath and stats.get("toolpath_cache"):
+                self.toolpathHits += 1
+            elif toolpath:
+                self.toolpathMisses += 1
+
+    def add_cancelled(self):
+        """
+        Adds a render that was cancelled
+        """
+        with self._lock:
+            self.cancelled += 1
+
+    def add_cache_lookup(self, hit):
+        """
+        Adds a lookup of the previews of a gcode file in the preview cache
+        """
+        with self._lock:
+            if hit:
+                self.cacheHits += 1
+            else:
+                self.cacheMisses += 1
+
+    def snapshot(self, **gauges):
+        """
+        Gets the metrics as a dict, with the current values of the gauges (e.g. queue depths) added to it
+        """
+        with self._lock:
+            lookups = self.cacheHits + self.cacheMisses
+            toolpathLookups = self.toolpathHits + self.toolpathMisses
+
+            metrics = { "renders": self.renders,
+                        "renders_failed": self.failed,
+                        "renders_cancelled": self.cancelled,
+                        "render_seconds": self.duration,
+                        "stage_seconds": dict(self.stages),
+                        "preview_cache": { "hits": self.cacheHits,
+                                           "misses": self.cacheMisses,
+                                           "hit_rate": self.cacheHits / lookups if lookups else None },
+                        "toolpath_cache": { "hits": self.toolpathHits,
+                                            "misses": self.toolpathMisses,
+                                            "hit_rate": self.toolpathHits / toolpathLookups if toolpathLookups else None } }
+            metrics.update(self.counters)
+
+        metrics.update(gauges)
+        return metrics
+
+    @staticmethod
+    def prometheus(metrics):
+        """
+        Formats a snapshot in the Prometheus text exposition format
+        """
+        lines = []
+
+        def add(name, kind, description, samples):
+            name = PROMETHEUS_PREFIX + name
+            lines.append("# HELP {0} {1}".format(name, description))
+            lines.append("# TYPE {0} {1}".format(name, kind))
+            for labels, value in samples:
+                if value is None:
+                    continue
+                labels = ",".join('{0}="{1}"'.format(key, label) for key, label in labels)
+                lines.append("{0}{1} {2}".format(name, "{" + labels + "}" if labels else "", repr(float(value))))
+
+        add("renders_total", "counter", "Finished renders",
+            [((("result", "success"),), metrics["renders"]), 
+             ((("result", "failed"),), metrics["renders_failed"]), 
+             ((("result", "cancelled"),), metrics["renders_cancelled"])])
+        add("render_seconds_total", "counter", "Time spent rendering", [((), metrics["render_seconds"])])
+        add("stage_seconds_total", "counter", "Time spent in each stage of the render pipeline",
+            [((("stage", stage),), metrics["stage_seconds"][stage]) for stage, _ in RENDER_STAGES])
+
+        for name, description in RENDER_COUNTERS:
+            add(name + "_total", "counter", description, [((), metrics[name])])
+
+        for cache in ("preview_cache", "toolpath_cache"):
+            add(cache + "_lookups_total", "counter", "Lookups in the {0}".format(cache.replace("_", " ")),
+                [((("result", "hit"),), metrics[cache]["hits"]), ((("result", "miss"),), metrics[cache]["misses"])])
+
+        for name, value in sorted(metrics.items()):
+            if isinstance(value, (int, long, float)) and not isinstance(value, bool) and name not in SNAPSHOT_COUNTERS:
+                add(name, "gauge", name.replace("_", " ").capitalize(), [((), value)])
+
+        return "\n".join(lines) + "\n"
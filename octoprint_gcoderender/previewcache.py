@@ -0,0 +1,164 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import os, json, hashlib
+import threading
+from collections import OrderedDict
+
+# The renderer settings that change the way a preview looks
+RENDER_SETTINGS_KEYS = ("width", "height", "print_area", "camera", "views", "background_color", "bed_color", "part_color", "draw_mode", "decimation", "image_format")
+
+# File extension of the previews in each image format
+IMAGE_EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+# The renderer settings that change the parsed toolpaths
+TOOLPATH_SETTINGS_KEYS = ("print_area",)
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    Returns the SHA-1 hex digest of a file's content. Reads the file in chunks, hashlib releases the GIL
+    while it crunches each chunk.
+    """
+    sha = hashlib.sha1()
+
+    with open(path, "rb") as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            sha.update(chunk)
+            chunk = f.read(chunk_size)
+
+    return sha.hexdigest()
+
+def settings_fingerprint(settings, keys=RENDER_SETTINGS_KEYS):
+    """
+    Returns a short hash of the renderer settings that determine what a preview (or toolpath) looks like
+    """
+    relevant = dict((key, settings.get(key)) for key in keys)
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True)).hexdigest()[:8]
+
+class PreviewCache(object):
+    """
+    Content-addressed store of preview images. Previews are named after the hash of their gcode and
+    the renderer settings, so identical files share one preview. Keeps the folder within max_size bytes
+    by removing the least recently used previews. Also used for the parsed toolpath files.
+    Files with any of the scan_extensions count towards the budget, so previews of an earlier
+    image format are removed in turn.
+    """
+    def __init__(self, folder, extension, max_size, logger, scan_extensions=None):
+        self.folder = folder
+        self.extension = extension
+        self.scan_extensions = tuple("." + ext for ext in (scan_extensions or [extension]))
+        self.max_size = max_size
+
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._files = OrderedDict() # filename -> size, least recently used first
+        self._size = 0
+
+        self.on_evict = None # Called with the filenames of the evicted previews
+
+        self._scan()
+
+    def filename(self, content_hash, fingerprint, view=None):
+        """
+        Gets the preview filename for a gcode hash and a settings fingerprint, optionally of an additional view
+        """
+        if view:
+            return "{0}_{1}_{2}.{3}".format(content_hash, fingerprint, view, self.extension)
+
+        return "{0}_{1}.{2}".format(content_hash, fingerprint, self.extension)
+
+    def path(self, filename):
+        return os.path.join(self.folder, filename)
+
+    def contains(self, filename):
+        """
+        Returns True if the preview is cached, and marks it as recently used
+        """
+        with self._lock:
+            if filename not in self._files:
+                return False
+
+            self._files[filename] = self._files.pop(filename)
+            return True
+
+    def has(self, filename):
+        """
+        Returns True if the preview is cached, without marking it as recently used
+        """
+        with self._lock:
+            return filename in self._files
+
+    def touch(self, filename):
+        self.contains(filename)
+
+    def usage(self):
+        """
+        Returns the number of cached files and their size in bytes
+        """
+        with self._lock:
+            return len(self._files), self._size
+
+    def add(self, filename):
+        """
+        Adds a freshly rendered preview to the cache. Evicts old previews if the cache is full.
+        """
+        try:
+            size = os.path.getsize(self.path(filename))
+        except OSError:
+            self._logger.debug("Could not add preview to cache, file not found: %s" % filename)
+            return
+
+        with self._lock:
+            self._size += size - self._files.pop(filename, 0)
+            self._files[filename] = size
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used previews until the cache fits its disk budget
+        """
+        if self.max_size <= 0:
+            return
+
+        evicted = []
+
+        with self._lock:
+            # Always keep the most recent preview
+            while self._size > self.max_size and len(self._files) > 1:
+                filename, size = self._files.popitem(last=False)
+                self._size -= size
+                evicted.append(filename)
+
+                try:
+                    os.remove(self.path(filename))
+                    self._logger.debug("Evicted preview %s" % filename)
+                except OSError:
+                    self._logger.debug("Could not remove preview %s" % filename)
+
+        if evicted and self.on_evict:
+            self.on_evict(evicted)
+
+    def _scan(self):
+        """
+        Indexes the previews in the cache folder, assuming the most recently modified were used most recently
+        """
+        entries = []
+        for entry in os.listdir(self.folder):
+            if not entry.endswith(self.scan_extensions):
+                continue
+
+            try:
+                stat = os.stat(self.path(entry))
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime, entry, stat.st_size))
+
+        for _, filename, size in sorted(entries):
+            self._files[filename] = size
+            self._size += size
+
+        self.evict()
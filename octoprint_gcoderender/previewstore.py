@@ -0,0 +1,302 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import os, json
+import sqlite3
+import threading
+import binascii
+from collections import OrderedDict
+
+# The fields of a preview record, path is the primary key
+FIELDS = ("path", "filename", "modtime", "hash", "previewUrl", "previewFilename", "previewPath", "previewViews")
+
+# Fields stored as JSON
+JSON_FIELDS = ("previewViews",)
+
+# Number of removed records remembered for listing changes. Clients that are further behind get a full listing
+MAX_REMOVED = 10000
+
+class PreviewStore(object):
+    """
+    Database of the rendered previews, backed by SQLite with indexes on path, filename and previewFilename.
+    All records are kept in memory as well, so readers are served without touching the disk and
+    without waiting for writes. Writes are batched into a single transaction.
+
+    Each change to a record gets the next sequence number, so clients can ask for the changes since the
+    last listing they got (see changes). Sequence numbers are kept in memory only, epoch tells them apart
+    from those of an earlier run.
+
+    Also keeps the manifests of the upload folders (see FolderScanner), which are only read by the scan.
+    """
+    def __init__(self, path, logger):
+        self.path = path
+        self.epoch = binascii.hexlify(os.urandom(4))
+
+        self._logger = logger
+        self._writeLock = threading.Lock() # Serializes writes to the database
+        self._readLock = threading.Lock()  # Guards the in-memory indexes, only held briefly
+
+        self._byPath = dict()
+        self._byFilename = dict()
+        self._byPreviewFilename = dict()
+
+        self._sequence = 0              # Sequence number of the last change
+        self._changed = dict()          # path -> sequence number of the last change of the record
+        self._removed = OrderedDict()   # path -> (filename, sequence number) of removed records, oldest first
+        self._horizon = 0               # Changes after this sequence number are complete, older removals were forgotten
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+
+        self._prepare()
+        self._load()
+
+    def get_by_path(self, path):
+        with self._readLock:
+            return self._copy(self._byPath.get(path))
+
+    def get_by_filename(self, filename):
+        with self._readLock:
+            return self._copy(self._byFilename.get(filename))
+
+    def get_by_preview_filename(self, previewFilename):
+        # Identical gcode files share a preview, any of their records will do
+        with self._readLock:
+            paths = self._byPreviewFilename.get(previewFilename)
+            return self._copy(self._byPath[next(iter(paths))] if paths else None)
+
+    def all(self):
+        with self._readLock:
+            return [dict(entry) for entry in self._byPath.itervalues()]
+
+    def changes(self, since=0, limit=None, folder=None):
+        """
+        Gets the records changed and the records removed after sequence number since, oldest change first.
+        Returns a tuple of the records, the filenames of the removed records, the sequence number to pass
+        as since for the next changes, and whether more changes follow than limit allowed. Returns None if
+        the removals since then are no longer known.
+        since: 0 for all records, without removals
+        limit: Maximum number of records and removals, None: no limit
+        folder: Only changes of files in this folder (relative to the uploads folder) and its subfolders
+        """
+        prefix = folder.strip("/") + "/" if folder else ""
+
+        with self._readLock:
+            if since < self._horizon and since > 0:
+                return None
+
+            changes = [(sequence, path, None) for path, sequence in self._changed.iteritems() if sequence > since]
+            if since > 0:
+                changes.extend((sequence, path, filename) for path, (filename, sequence) in self._removed.iteritems() if sequence > since)
+
+            if prefix:
+                changes = [change for change in changes 
+                           if (change[2] or self._byPath[change[1]]["filename"]).startswith(prefix)]
+
+            changes.sort()
+
+            more = limit is not None and len(changes) > limit
+            if more:
+                changes = changes[:limit]
+
+            entries = [dict(self._byPath[path]) for _, path, removed in changes if removed is None]
+            removed = [filename for _, _, filename in changes if filename is not None]
+            sequence = changes[-1][0] if more else max(since, self._sequence)
+
+            return entries, removed, sequence, more
+
+    def touch(self, previewFilenames):
+        """
+        Counts the records of a list of preview images as changed, e.g. when an image was evicted
+        """
+        with self._readLock:
+            for previewFilename in previewFilenames:
+                for path in self._byPreviewFilename.get(previewFilename, ()):
+                    self._sequence += 1
+                    self._changed[path] = self._sequence
+
+    def upsert(self, entries):
+        """
+        Inserts or replaces a list of records in one transaction
+        """
+        if not entries:
+            return
+
+        rows = [tuple(self._encode(field, entry.get(field)) for field in FIELDS) for entry in entries]
+
+        with self._writeLock:
+            with self._connection:
+                self._connection.executemany("INSERT OR REPLACE INTO previews ({0}) VALUES ({1})"
+                                             .format(", ".join(FIELDS), ", ".join("?" * len(FIELDS))), rows)
+
+            with self._readLock:
+                for row in rows:
+                    self._index(self._decode(row))
+
+    def remove(self, paths):
+        """
+        Removes the records of a list of gcode paths in one transaction
+        """
+        if not paths:
+            return
+
+        with self._writeLock:
+            with self._connection:
+                self._connection.executemany("DELETE FROM previews WHERE path = ?", [(path,) for path in paths])
+
+            with self._readLock:
+                for path in paths:
+                    entry = self._byPath.get(path)
+                    self._unindex(path)
+
+                    if entry:
+                        self._sequence += 1
+                        self._removed.pop(path, None)
+                        self._removed[path] = (entry["filename"], self._sequence)
+
+                # Forget the oldest removals, clients that didn't see them need a full listing
+                while len(self._removed) > MAX_REMOVED:
+                    _, (_, sequence) = self._removed.popitem(last=False)
+                    self._horizon = sequence
+
+    def get_folders(self):
+        """
+        Gets the manifests of all scanned folders: a dict of folder (relative to the uploads folder) to its
+        mtime, its gcode files (name to (size, mtime)) and its subfolders
+        """
+        with self._writeLock:
+            rows = self._connection.execute("SELECT path, mtime, files, folders FROM folders").fetchall()
+
+        return dict((path, dict(mtime=mtime, 
+                                files=dict((name, tuple(stat)) for name, stat in json.loads(files).iteritems()), 
+                                folders=json.loads(folders)))
+                    for path, mtime, files, folders in rows)
+
+    def set_folders(self, manifests):
+        """
+        Inserts or replaces the manifests of a dict of folders in one transaction
+        """
+        if not manifests:
+            return
+
+        rows = [(path, manifest["mtime"], json.dumps(manifest["files"]), json.dumps(manifest["folders"])) 
+                for path, manifest in manifests.iteritems()]
+
+        with self._writeLock:
+            with self._connection:
+                self._connection.executemany("INSERT OR REPLACE INTO folders (path, mtime, files, folders) VALUES (?, ?, ?, ?)", rows)
+
+    def remove_folders(self, paths):
+        """
+        Removes the manifests of a list of folders in one transaction
+        """
+        if not paths:
+            return
+
+        with self._writeLock:
+            with self._connection:
+                self._connection.executemany("DELETE FROM folders WHERE path = ?", [(path,) for path in paths])
+
+    def migrate(self, json_path):
+        """
+        One-time import of the previews.json TinyDB database used by earlier versions. The file is renamed
+        afterwards, so it is not imported again.
+        """
+        if not os.path.exists(json_path):
+            return
+
+        try:
+            with open(json_path) as f:
+                tables = json.load(f)
+
+            entries = [entry for table in tables.itervalues() for entry in table.itervalues()]
+            self.upsert([entry for entry in entries if "path" in entry])
+            self._logger.info("Migrated {0} previews from {1}".format(len(entries), json_path))
+        except Exception:
+            self._logger.exception("Could not migrate previews from {0}".format(json_path))
+
+        try:
+            os.rename(json_path, json_path + ".migrated")
+        except OSError:
+            self._logger.warn("Could not rename {0}".format(json_path))
+
+    def close(self):
+        with self._writeLock:
+            self._connection.close()
+
+    def _prepare(self):
+        with self._connection:
+            # Write-ahead logging makes each commit a lot cheaper on SD cards
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS previews (
+                                            path TEXT PRIMARY KEY,
+                                            filename TEXT,
+                                            modtime INTEGER,
+                                            hash TEXT,
+                                            previewUrl TEXT,
+                                            previewFilename TEXT,
+                                            previewPath TEXT,
+                                            previewViews TEXT)""")
+
+            # Databases of earlier versions lack the additional views
+            columns = [row[1] for row in self._connection.execute("PRAGMA table_info(previews)")]
+            if "previewViews" not in columns:
+                self._connection.execute("ALTER TABLE previews ADD COLUMN previewViews TEXT")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS previews_filename ON previews (filename)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS previews_previewFilename ON previews (previewFilename)")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS folders (
+                                            path TEXT PRIMARY KEY,
+                                            mtime INTEGER,
+                                            files TEXT,
+                                            folders TEXT)""")
+
+    def _load(self):
+        for row in self._connection.execute("SELECT {0} FROM previews".format(", ".join(FIELDS))):
+            self._index(self._decode(row))
+
+    def _encode(self, field, value):
+        if field in JSON_FIELDS and value is not None:
+            return json.dumps(value)
+
+        return value
+
+    def _decode(self, row):
+        entry = dict(zip(FIELDS, row))
+
+        for field in JSON_FIELDS:
+            entry[field] = json.loads(entry[field]) if entry[field] else dict()
+
+        return entry
+
+    def _index(self, entry):
+        self._unindex(entry["path"])
+        self._sequence += 1
+        self._changed[entry["path"]] = self._sequence
+        self._removed.pop(entry["path"], None)
+        self._byPath[entry["path"]] = entry
+        self._byFilename[entry["filename"]] = entry
+        self._byPreviewFilename.setdefault(entry["previewFilename"], set()).add(entry["path"])
+
+    def _unindex(self, path):
+        entry = self._byPath.pop(path, None)
+
+        if not entry:
+            return
+
+        del self._changed[path]
+
+        if self._byFilename.get(entry["filename"]) is entry:
+            del self._byFilename[entry["filename"]]
+
+        paths = self._byPreviewFilename.get(entry["previewFilename"])
+        if paths:
+            paths.discard(path)
+            if not paths:
+                del self._byPreviewFilename[entry["previewFilename"]]
+
+    def _copy(self, entry):
+        if entry is None:
+            return None
+
+        return dict(entry)
@@ -0,0 +1,543 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import os, logging, time
+import threading, multiprocessing
+import Queue
+
+import gcodeparser
+
+PROGRESS_INTERVAL = 1.0 # Seconds between the progress reports of a render
+WORKER_CHECK_INTERVAL = 1.0 # Seconds between the checks for crashed workers
+
+def initialize_parser(settings, logger):
+    """
+    Initializes and configures the gcodeparser of the current process. Must be called from the thread
+    that does the rendering, as it creates the drawing context.
+    """
+    try:
+        initialized = gcodeparser.initialize(width=settings["width"],
+                               height=settings["height"],
+                               throttling_interval=settings["throttling_interval"],
+                               throttling_duration=settings["throttling_duration"],
+                               backend=settings["backend"],
+                               logger=logger)
+    except Exception as e:
+        logger.exception("Exception while initializing gcodeparser")
+        return False
+
+    if not initialized:
+        return False
+
+    try:
+        gcodeparser.set_print_area(**settings["print_area"])
+        gcodeparser.set_camera(**settings["camera"])
+        gcodeparser.set_background_color(settings["background_color"])
+        gcodeparser.set_bed_color(settings["bed_color"])
+        gcodeparser.set_part_color(settings["part_color"])
+        gcodeparser.set_gpu_memory_budget(settings["gpu_memory_budget"])
+        gcodeparser.set_draw_mode(**settings["draw_mode"])
+        gcodeparser.set_decimation(settings["decimation"])
+        gcodeparser.set_parser_threads(settings["parser_threads"])
+        gcodeparser.set_image_format(**settings["image_format"])
+    except Exception as e:
+        logger.exception("Exception while configuring gcodeparser")
+        return False
+
+    return True
+
+def parse_cpu_list(value):
+    """
+    Parses a CPU affinity setting. Accepts a list of CPU numbers or a string such as "1,2" or "1-3".
+    Returns a sorted list of CPU numbers, or None if no affinity is set
+    """
+    if not value:
+        return None
+
+    if isinstance(value, (list, tuple)):
+        return sorted(set(int(cpu) for cpu in value))
+
+    cpus = set()
+    for part in str(value).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+
+    return sorted(cpus) or None
+
+def _set_affinity(cpus, logger):
+    """
+    Pins the current process to the given CPUs. Relies on psutil, which is an OctoPrint dependency
+    """
+    if not cpus:
+        return
+
+    try:
+        import psutil
+        psutil.Process().cpu_affinity(cpus)
+        logger.debug("Render worker pinned to CPUs {0}".format(cpus))
+    except Exception:
+        logger.warn("Could not set CPU affinity of render worker to {0}".format(cpus))
+
+class _CurrentJob(object):
+    """
+    The job a worker process is rendering, shared by its render and control threads
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.assignment = 0 # Number of the job taken last, see RenderWorker.assign
+        self.path = None # The path of the job while it's being rendered
+        self.cancelled = None # Why the render was cancelled
+        self.progress = None # The last progress reported
+        self.cancels = dict() # Number -> reason of the jobs cancelled before the worker took them
+
+def _control_worker(control, current, index, results, logger):
+    """
+    Applies the throttling and cancels the renders the plugin sends, also while a job is being rendered.
+    Reports the progress of the render in between.
+    """
+    while True:
+        try:
+            message = control.get(timeout=PROGRESS_INTERVAL)
+        except Queue.Empty:
+            _report_progress(current, index, results)
+            continue
+
+        if message is None:
+            break
+
+        command, args = message
+
+        try:
+            if command == "throttling":
+                interval, duration, paused = args
+                gcodeparser.set_throttling(interval=interval, duration=duration)
+
+                if paused:
+                    gcodeparser.pause()
+                else:
+                    gcodeparser.resume()
+            elif command == "cancel":
+                assignment, reason = args
+
+                with current.lock:
+                    if assignment == current.assignment:
+                        # The render may have finished already, its images are then dropped
+                        current.cancelled = reason
+                        if current.path is not None:
+                            gcodeparser.cancel()
+                    elif assignment > current.assignment:
+                        # The job is still waiting in the queue of the worker
+                        current.cancels[assignment] = reason
+        except Exception:
+            logger.exception("Exception while controlling gcodeparser")
+
+def _report_progress(current, index, results):
+    """
+    Sends the fraction of the file the current render got through, if it changed
+    """
+    with current.lock:
+        if current.path is None:
+            return
+
+        offset, size = gcodeparser.get_progress()
+
+        # Until the render starts, the progress is that of the last render
+        if not 0 < offset < size or offset / size == current.progress:
+            return
+
+        current.progress = offset / size
+
+    results.put(("progress", index, None, False, current.progress))
+
+def _render_worker_main(index, settings, cpus, logger_name, jobs, control, results):
+    """
+    Entry point of a render worker process. Creates its own drawing context and renders jobs until
+    it receives None
+    """
+    logger = logging.getLogger("{0}.worker{1}".format(logger_name, index))
+
+    _set_affinity(cpus, logger)
+
+    # It is important we initialize the gcodeparser in this process (for the drawing context)
+    if not initialize_parser(settings, logger):
+        results.put(("initfailed", index, None, False, 0))
+        return
+
+    results.put(("ready", index, None, False, 0))
+
+    # The renders release the GIL, so the throttling can change and the render can be cancelled halfway
+    current = _CurrentJob()
+    t = threading.Thread(target=_control_worker, args=(control, current, index, results, logger))
+    t.setDaemon(True)
+    t.start()
+
+    while True:
+        message = jobs.get() # Will block until a job becomes available
+
+        if message is None:
+            break
+
+        assignment, job = message
+
+        logger.debug("Job found: {0}".format(job["filename"]))
+
+        # All views of the file are rendered from a single parse
+        images = [(job["imagePath"], None)] + [(view["imagePath"], settings["views"].get(name)) 
+                                               for name, view in job.get("views", dict()).iteritems()]
+        imagePaths = [imagePath for imagePath, _ in images]
+        views = [_render_view(settings, imagePath, view) for imagePath, view in images]
+        layers = "startLayer" in job
+
+        with current.lock:
+            current.assignment = assignment
+            current.path = job["path"]
+            current.progress = None
+            current.cancelled = current.cancels.pop(assignment, None)
+            current.cancels = dict((number, reason) for number, reason in current.cancels.iteritems() if number > assignment)
+            cancelled = current.cancelled
+
+        t0 = time.time()
+        success = False
+        stats = None
+        try:
+            # The stats of the render, or False if it failed. A job cancelled while queued isn't rendered.
+            if cancelled:
+                pass
+            elif layers:
+                # A range of layers, on top of the image of the layers before it
+                stats = gcodeparser.render_layers(job["path"], views[0]["image_file"], job["layerIndexPath"], 
+                                                  job["framebufferPath"], job["startLayer"], job["endLayer"])
+            else:
+                stats = gcodeparser.render_views(job["path"], views, job.get("toolpathPath"), job.get("layerIndexPath"))
+            success = bool(stats)
+        except Exception as e:
+            logger.debug("Error in Gcodeparser: %s" % e)
+        t1 = time.time()
+
+        with current.lock:
+            current.path = None
+
+        job["throttled"] = 0.0 if cancelled else gcodeparser.get_throttled_time()
+        job["stats"] = stats or None
+
+        # A cancel that came in just before the render started doesn't stop it (the renderer resets the cancel when
+        # it starts), nor one that came in after it finished. The images are dropped instead.
+        with current.lock:
+            cancelled = current.cancelled
+
+        if cancelled:
+            logger.debug("Render of {0} cancelled: {1}".format(job["filename"], cancelled))
+            job["cancelled"] = cancelled
+            success = False
+
+        try:
+            for imagePath in imagePaths:
+                if success:
+                    _replace(imagePath + ".part", imagePath)
+                elif os.path.exists(imagePath + ".part"):
+                    os.remove(imagePath + ".part")
+        except OSError as e:
+            logger.debug("Error while moving the images of {0}: {1}".format(job["filename"], e))
+            success = False
+
+        results.put(("done", index, job, success, t1 - t0))
+
+def _render_view(settings, imagePath, view=None):
+    """
+    Gets the gcodeparser view spec of an image. Renders to a temporary file first, so a preview is never 
+    served half-written. Resolution and camera default to those of the main preview.
+    """
+    view = view or dict()
+
+    return dict(image_file=imagePath + ".part",
+                width=view.get("width", settings["width"]),
+                height=view.get("height", settings["height"]),
+                camera=view.get("camera", settings["camera"]))
+
+def _replace(src, dst):
+    """
+    Moves src to dst, overwriting dst. Windows won't rename onto an existing file.
+    """
+    if os.name == "nt" and os.path.exists(dst):
+        os.remove(dst)
+
+    os.rename(src, dst)
+
+class RenderWorker(object):
+    """
+    Handle to a single render process, which has its own drawing context and renderer
+    """
+    def __init__(self, index, settings, cpus, logger_name, results):
+        self.index = index
+        self.job = None # The job the worker is currently rendering
+        self.assignment = 0 # Number of the last job assigned, cancels refer to it
+        self.idle = False # Whether the worker waits in the pool's idle queue
+        self.progress = None # Fraction of the job's file rendered, as last reported
+        self.disabled = False # Set when the worker can't initialize its drawing context
+        self.restarts = 0
+        self.throttling = None # The last (interval, duration, paused) sent to the worker
+
+        self._settings = settings
+        self._cpus = cpus
+        self._logger_name = logger_name
+        self._results = results
+        self._jobs = None
+        self._control = None
+        self._process = None
+
+    def start(self):
+        # Use a fresh queue for every process, as a crashed reader may leave the old one locked
+        self._jobs = multiprocessing.Queue()
+        self._control = multiprocessing.Queue()
+        self.job = None
+        self._process = multiprocessing.Process(target=_render_worker_main,
+                                                name="gcoderender-worker-{0}".format(self.index),
+                                                args=(self.index, self._settings, self._cpus, self._logger_name, self._jobs, self._control, self._results))
+        self._process.daemon = True
+        self._process.start()
+
+        # A restarted worker continues with the current throttling
+        if self.throttling:
+            self._control.put(("throttling", self.throttling))
+
+    def set_throttling(self, throttling):
+        self.throttling = throttling
+
+        if self._control:
+            self._control.put(("throttling", throttling))
+
+    def cancel(self, reason):
+        if self._control and self.job:
+            self._control.put(("cancel", (self.assignment, reason)))
+
+    def assign(self, job):
+        # Numbered, so a cancel stops this job even if the worker didn't take it yet, and never a later one
+        self.assignment += 1
+        self.job = job
+        self.progress = None
+        self._jobs.put((self.assignment, job))
+
+    def is_alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def exitcode(self):
+        return self._process.exitcode if self._process else None
+
+    def stop(self, timeout=5):
+        if not self.is_alive():
+            return
+
+        self._jobs.put(None)
+        self._process.join(timeout)
+
+        if self._process.is_alive():
+            self._process.terminate()
+
+class RenderPool(object):
+    """
+    Distributes render jobs over a number of worker processes. Each worker has its own drawing context,
+    so renders run in parallel. Crashed workers are restarted, their job is reported as failed.
+    A job with a layerIndexPath also writes the layer index of its file. A job with a startLayer renders
+    the layers up to endLayer on top of the layers before, kept in its framebufferPath.
+
+    jobs: Queue-like object to take the render jobs from. A None job stops the pool
+    settings: Renderer settings (see initialize_parser)
+    on_started: Called with the job when a worker starts rendering it
+    on_finished: Called with the job, whether it succeeded and the render duration. The job's "throttled" is the
+                 time (in seconds) the render was throttled or paused, "stats" the stats of the render and
+                 "cancelled" the reason if it was cancelled
+    on_progress: Called with the job and the fraction of its file rendered, about every PROGRESS_INTERVAL seconds
+    """
+    def __init__(self, jobs, settings, logger, on_started, on_finished, size=1, cpus=None, on_progress=None):
+        self._jobs = jobs
+        self._logger = logger
+        self._on_started = on_started
+        self._on_finished = on_finished
+        self._on_progress = on_progress
+        self._results = multiprocessing.Queue()
+        self._idle = Queue.Queue()
+        self._lock = threading.Lock()
+        self._running = False
+
+        self.workers = [RenderWorker(i, settings, cpus, logger.name, self._results) for i in range(max(1, size))]
+
+    def start(self):
+        self._running = True
+
+        for worker in self.workers:
+            worker.start()
+
+        self._logger.info("Started {0} render worker(s)".format(len(self.workers)))
+
+        for target in (self._dispatch, self._collect):
+            t = threading.Thread(target=target)
+            t.setDaemon(True)
+            t.start()
+
+    def stop(self):
+        self._running = False
+        self._idle.put(None)
+        self._jobs.put(None)
+
+        for worker in self.workers:
+            worker.stop()
+
+    def set_throttling(self, interval, duration, paused=False):
+        """
+        Changes the throttling of the workers, including the renders in progress
+        """
+        with self._lock:
+            for worker in self.workers:
+                worker.set_throttling((interval, duration, paused))
+
+    def is_rendering(self, path):
+        """
+        Returns True if one of the workers is rendering the gcode file at path
+        """
+        with self._lock:
+            return any(worker.job and worker.job["path"] == path for worker in self.workers)
+
+    def progress(self, path):
+        """
+        Returns the fraction of the gcode file at path rendered, None if it isn't being rendered or no progress
+        was reported yet
+        """
+        with self._lock:
+            return next((worker.progress for worker in self.workers if worker.job and worker.job["path"] == path), None)
+
+    def cancel(self, match, reason):
+        """
+        Stops the renders of the jobs for which match(job) returns True. They finish as failed, with the 
+        reason in the job's "cancelled". Returns the number of renders cancelled.
+        """
+        with self._lock:
+            workers = [worker for worker in self.workers if worker.job and match(worker.job)]
+
+            for worker in workers:
+                self._logger.debug("Cancelling render of {0}: {1}".format(worker.job["filename"], reason))
+                worker.cancel(reason)
+
+        return len(workers)
+
+    def rendering(self):
+        """
+        Returns the number of workers that are rendering
+        """
+        with self._lock:
+            return sum(1 for worker in self.workers if worker.job)
+
+    def available(self):
+        """
+        Returns the number of workers that can render, those that initialized their drawing context
+        """
+        with self._lock:
+            return sum(1 for worker in self.workers if not worker.disabled)
+
+    def _dispatch(self):
+        """
+        Hands out jobs to workers as soon as they become idle
+        """
+        while self._running:
+            worker = self._idle.get() # Will block until a worker becomes available
+
+            if worker is None:
+                break
+
+            job = self._jobs.get() # Will block until a job becomes available
+
+            if job is None:
+                break
+
+            with self._lock:
+                worker.idle = False
+
+                if not worker.is_alive() or worker.disabled:
+                    # The worker died while idle, give the job to the next one. It'll be back once restarted.
+                    self._jobs.put(job)
+                    continue
+
+                worker.assign(job)
+
+            self._on_started(job)
+
+    def _collect(self):
+        """
+        Receives the results from the workers and keeps an eye on crashed workers
+        """
+        lastCheck = time.time()
+
+        while self._running:
+            # Also while results keep coming in, the workers report progress about every second
+            if time.time() - lastCheck >= WORKER_CHECK_INTERVAL:
+                self._check_workers()
+                lastCheck = time.time()
+
+            try:
+                # For progress messages, duration is the fraction rendered
+                message, index, job, success, duration = self._results.get(timeout=WORKER_CHECK_INTERVAL)
+            except Queue.Empty:
+                continue
+
+            worker = self.workers[index]
+
+            if message == "progress":
+                with self._lock:
+                    job = worker.job
+                    worker.progress = duration
+
+                if job and self._on_progress:
+                    try:
+                        self._on_progress(job, duration)
+                    except Exception:
+                        self._logger.exception("Error while handling render progress for {0}".format(job["filename"]))
+                continue
+
+            if message == "initfailed":
+                self._logger.error("Couldn't initialize gcodeparser in render worker {0}".format(index))
+                worker.disabled = True
+                if all(w.disabled for w in self.workers):
+                    self._logger.error("No render workers available, previews will not be rendered")
+                continue
+
+            if message == "done":
+                with self._lock:
+                    worker.job = None
+                self._finish(job, success, duration)
+
+            # A worker restarted after it died while idle is still queued, it must not get two jobs at once
+            with self._lock:
+                if worker.idle:
+                    continue
+                worker.idle = True
+
+            self._idle.put(worker)
+
+    def _check_workers(self):
+        """
+        Restarts any worker that has died, and fails the job it was rendering
+        """
+        for worker in self.workers:
+            if worker.disabled or worker.is_alive() or not self._running:
+                continue
+
+            with self._lock:
+                job = worker.job
+                self._logger.error("Render worker {0} died with exit code {1}, restarting".format(worker.index, worker.exitcode()))
+                worker.restarts += 1
+                worker.start()
+
+            if job:
+                self._finish(job, False, 0)
+
+    def _finish(self, job, success, duration):
+        try:
+            self._on_finished(job, success, duration)
+        except Exception:
+            self._logger.exception("Error while handling render result for {0}".format(job["filename"]))
@@ -0,0 +1,149 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import heapq, itertools
+import threading
+
+# Lower values are rendered first
+PRIORITY_HIGH = 0 # Previews the user is waiting for
+PRIORITY_NORMAL = 1 # Fresh uploads
+PRIORITY_LOW = 2 # Background backfill of the uploads folder
+
+def _key(job):
+    """
+    Gets the key a job is queued under, its gcode path unless it has a queueKey
+    """
+    return job.get("queueKey", job["path"])
+
+class RenderQueue(object):
+    """
+    Render job queue keyed by gcode path. Enqueueing a path that is already queued coalesces both jobs,
+    keeping the job with the newest modtime and the highest priority. Jobs for which is_stale(job) returns
+    True when they reach the front of the queue are dropped. Jobs with a queueKey are keyed by that
+    instead, so they're queued alongside the preview of their gcode file.
+
+    Can be used as a drop-in for Queue.Queue by the render pool: put(None) stops the consumers.
+    """
+    def __init__(self, is_stale=None):
+        self._heap = []
+        self._entries = dict() # path -> heap entry [priority, sequence, job, valid]
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._is_stale = is_stale
+
+    def put(self, job, priority=PRIORITY_NORMAL):
+        """
+        Adds a job to the queue, or merges it with the queued job for the same path.
+        Returns True if the job was added or updated the queued job
+        """
+        with self._condition:
+            if job is None:
+                self._stopped = True
+                self._condition.notify_all()
+                return True
+
+            entry = self._entries.get(_key(job))
+
+            if entry:
+                queued_job = entry[2]
+
+                if job["modtime"] < queued_job["modtime"]:
+                    # We already have a newer version of this file queued
+                    return False
+
+                if job["modtime"] == queued_job["modtime"] and priority >= entry[0]:
+                    # Nothing new
+                    return False
+
+                priority = min(priority, entry[0])
+                entry[3] = False
+
+            self._push(job, priority)
+            return True
+
+    def get(self):
+        """
+        Removes and returns the next job that is not stale. Blocks until a job becomes available.
+        Returns None once the queue is stopped.
+        """
+        while True:
+            with self._condition:
+                while not self._stopped and not self._entries:
+                    self._condition.wait()
+
+                if self._stopped:
+                    return None
+
+                job = self._pop()
+
+            # Check outside of the lock, as it may need to hit the disk
+            if not self._is_stale or not self._is_stale(job):
+                return job
+
+    def prioritize(self, path):
+        """
+        Moves a queued job to the front of the queue. Returns False if the path is not queued
+        """
+        with self._condition:
+            entry = self._entries.get(path)
+
+            if not entry:
+                return False
+
+            if entry[0] != PRIORITY_HIGH:
+                entry[3] = False
+                self._push(entry[2], PRIORITY_HIGH)
+
+            return True
+
+    def cancel(self, path):
+        """
+        Removes the job of a path from the queue. Returns False if the path is not queued
+        """
+        with self._condition:
+            entry = self._entries.pop(path, None)
+
+            if not entry:
+                return False
+
+            entry[3] = False
+            return True
+
+    def position(self, path):
+        """
+        Returns the number of jobs that will be rendered before the job of a given path,
+        or None if the path is not queued
+        """
+        with self._condition:
+            entry = self._entries.get(path)
+
+            if not entry:
+                return None
+
+            return sum(1 for other in self._entries.itervalues() if other[:2] < entry[:2])
+
+    def depth(self):
+        """
+        Returns the number of queued jobs
+        """
+        with self._condition:
+            return len(self._entries)
+
+    def __len__(self):
+        return self.depth()
+
+    def _push(self, job, priority):
+        entry = [priority, next(self._sequence), job, True]
+        self._entries[_key(job)] = entry
+        heapq.heappush(self._heap, entry)
+        self._condition.notify()
+
+    def _pop(self):
+        while True:
+            entry = heapq.heappop(self._heap)
+
+            if entry[3]:
+                del self._entries[_key(entry[2])]
+                return entry[2]
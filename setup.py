@@ -33,7 +33,7 @@ plugin_url = "https://github.com/Leapfrog3DPrinters/OctoPrint-gcodeRender"
 plugin_license = "AGPLv3"
 
 # Any additional requirements besides OctoPrint should be listed here
-plugin_requires = ["tinydb>=3.2.1"]
+plugin_requires = []
 
 ### --------------------------------------------------------------------------------------------------------------------
 ### More advanced options that you usually shouldn't have to touch follow after this point
@@ -58,10 +58,13 @@ plugin_ignored_packages = []
 #     plugin_requires = ["someDependency==dev"]
 #     additional_setup_parameters = {"dependency_links": ["https://github.com/someUser/someRepo/archive/master.zip#egg=someDependency-dev"]}
 from setuptools import setup, Extension
+import glob
+import os
 import sys
 
+define_macros = []
+
 if sys.platform == "win32":
-    import os
     # We can't build with the default VS2008 compiler, 
     # therefore we rely on the Windows SDK with >=VS2015
     # see http://pywavelets.readthedocs.io/en/latest/dev/preparing_windows_build_environment.html
@@ -75,16 +78,29 @@ if sys.platform == "win32":
     ]
 
 else:
-    libraries = [ 'EGL', 'GLESv2', 'png', 'z']
+    libraries = [ 'EGL', 'GLESv2', 'png', 'z', 'pthread']
     data_files = []
 
+    # JPEG and WebP previews are optional, they are built in when the library headers are found
+    def has_header(header):
+        return any(glob.glob(os.path.join(path, header)) for path in ['/usr/include', '/usr/local/include', '/usr/include/*'])
+
+    if has_header('jpeglib.h'):
+        libraries.append('jpeg')
+        define_macros.append(('HAVE_JPEG', None))
+
+    if has_header('webp/encode.h'):
+        libraries.append('webp')
+        define_macros.append(('HAVE_WEBP', None))
+
 gcodeparser_module = Extension('gcodeparser',
                     include_dirs = ['/usr/include', '/usr/include/libpng12', 'include'],
                     libraries = libraries,
+                    define_macros = define_macros,
                     library_dirs = ['/opt/vc/lib', '/usr/local/lib', 'lib'],
                     language = "c++",
                     extra_compile_args=['-std=c++11'],
-                    sources = ['gcodeparser/renderer.cpp', 'gcodeparser/gcodeparser.cpp', 'gcodeparser/RenderContextEGL.cpp', 'gcodeparser/RenderContextGLFW.cpp', 'gcodeparser/shader.cpp', 'gcodeparser/pngwriter.cpp', 'gcodeparser/interface.cpp' ])
+                    sources = ['gcodeparser/renderer.cpp', 'gcodeparser/gcodeparser.cpp', 'gcodeparser/gcodetokenizer.cpp', 'gcodeparser/gcodeinput.cpp', 'gcodeparser/slicermetadata.cpp', 'gcodeparser/vertexbuilder.cpp', 'gcodeparser/toolpathcache.cpp', 'gcodeparser/layerindex.cpp', 'gcodeparser/mappedfile.cpp', 'gcodeparser/RenderContextEGL.cpp', 'gcodeparser/RenderContextGLFW.cpp', 'gcodeparser/RenderContextSoftware.cpp', 'gcodeparser/softwarerasterizer.cpp', 'gcodeparser/chunkqueue.cpp', 'gcodeparser/governor.cpp', 'gcodeparser/shader.cpp', 'gcodeparser/imagewriter.cpp', 'gcodeparser/interface.cpp' ])
 
 additional_setup_parameters = { "ext_modules": [gcodeparser_module], "data_files": data_files }
 
@@ -0,0 +1,99 @@
+"""
+Renders with the gcodeparser extension for the tests, each render in a process of its own, like the render
+workers, so every render gets a fresh drawing context. The tests using it are skipped when the extension
+isn't built; build it in place with python setup.py build_ext --inplace. On a machine without a GPU, the
+GL renders use Mesa's software EGL with EGL_PLATFORM=surfaceless, or are skipped.
+"""
+
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import logging
+import multiprocessing
+import os
+import sys
+import unittest
+
+# Like the benchmarks, the plugin modules are imported on their own, the plugin package needs OctoPrint
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[1:1] = [ROOT, os.path.join(ROOT, "octoprint_gcoderender"), os.path.join(ROOT, "benchmark")]
+
+try:
+    import gcodeparser
+except ImportError:
+    gcodeparser = None
+
+# Without the built extension, Python 3 imports the gcodeparser source directory as a namespace package
+if not hasattr(gcodeparser, "render_views"):
+    gcodeparser = None
+
+import gcodegen
+
+# The plugin's default render settings (see GCodeRenderPlugin._get_render_settings), without throttling. The
+# previews are written as RGB, so pngimage reads them.
+SETTINGS = dict(width=250,
+                height=250,
+                throttling_interval=0,
+                throttling_duration=0,
+                backend="software",
+                print_area=dict(x_min=-37, x_max=328, y_min=-33, y_max=317, z_min=0, z_max=205),
+                camera=dict(target="part", distance=[-300, -300, 150]),
+                views=dict(),
+                background_color=(1.0, 1.0, 1.0, 1.0),
+                bed_color=(0.75, 0.75, 0.75, 1.0),
+                part_color=(67.0 / 255.0, 74.0 / 255.0, 84.0 / 255.0, 1.0),
+                draw_mode=dict(mode="lines", tube_width=0.45),
+                decimation=0.0,
+                gpu_memory_budget=16777216,
+                parser_threads=1,
+                image_format=dict(format="png", png_colors="rgb", compression_level=1, quality=90))
+
+requires_gcodeparser = unittest.skipIf(gcodeparser is None, "The gcodeparser extension isn't built")
+
+
+class InitializeError(Exception):
+    pass
+
+
+def generate(path, size, style, extrusion):
+    """
+    Writes a gcode file in the style of a slicer (see gcodegen), unless it exists already
+    """
+    if not os.path.exists(path):
+        with open(path, "w") as out:
+            gcodegen.generate(out, size, style, extrusion)
+    return path
+
+
+def render(gcodePath, views, toolpathPath=None, **settings):
+    """
+    Renders views (dicts of render_views) of a gcode file in a new process with the given settings. Returns
+    the stats of the render, raises InitializeError if the backend isn't available.
+    """
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_render_main, args=(dict(SETTINGS, **settings), gcodePath, views, toolpathPath, results))
+    process.start()
+
+    try:
+        initialized, stats = results.get(timeout=600)
+    finally:
+        process.join()
+
+    if not initialized:
+        raise InitializeError("Couldn't initialize the {0} backend".format(settings.get("backend", SETTINGS["backend"])))
+
+    if not stats:
+        raise RuntimeError("Render of {0} failed".format(gcodePath))
+
+    return stats
+
+
+def _render_main(settings, gcodePath, views, toolpathPath, results):
+    from renderpool import initialize_parser
+
+    if not initialize_parser(settings, logging.getLogger("gcoderender.tests")):
+        results.put((False, None))
+        return
+
+    results.put((True, gcodeparser.render_views(gcodePath, views, toolpathPath)))
@@ -0,0 +1,20 @@
+"""
+Imports the plugin modules for their tests on their own, the plugin package needs OctoPrint. The plugin runs on
+OctoPrint's Python 2, its tests are skipped on Python 3.
+"""
+
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import logging
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.join(ROOT, "octoprint_gcoderender"))
+
+logger = logging.getLogger("gcoderender.tests")
+
+requires_python2 = unittest.skipIf(sys.version_info[0] > 2, "The plugin runs on Python 2")
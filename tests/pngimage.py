@@ -0,0 +1,106 @@
+"""
+Reads the PNG images the renderer writes, to compare them pixel by pixel. Only the formats the image
+writer produces are read: 8 bit RGB, RGBA and indexed color, without interlacing.
+"""
+
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import struct
+import zlib
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+CHANNELS = {2: 3, 3: 1, 6: 4}   # By color type: RGB, indexed, RGBA
+
+
+class PngImage(object):
+    """
+    The pixels of a PNG image as RGB tuples, row by row. Alpha is dropped.
+    """
+    def __init__(self, width, height, pixels):
+        self.width = width
+        self.height = height
+        self.pixels = pixels
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+
+        if not data.startswith(PNG_SIGNATURE):
+            raise ValueError("{0} is not a PNG image".format(path))
+
+        offset = len(PNG_SIGNATURE)
+        idat = []
+        palette = None
+
+        while offset < len(data):
+            length, chunkType = struct.unpack(">I4s", data[offset:offset + 8])
+            chunk = data[offset + 8:offset + 8 + length]
+            offset += 12 + length
+
+            if chunkType == b"IHDR":
+                width, height, bitDepth, colorType, _, _, interlace = struct.unpack(">IIBBBBB", chunk)
+                if bitDepth != 8 or colorType not in CHANNELS or interlace:
+                    raise ValueError("Unsupported PNG format in {0}".format(path))
+            elif chunkType == b"PLTE":
+                palette = [tuple(bytearray(chunk[i:i + 3])) for i in range(0, len(chunk), 3)]
+            elif chunkType == b"IDAT":
+                idat.append(chunk)
+
+        channels = CHANNELS[colorType]
+        rows = _unfilter(bytearray(zlib.decompress(b"".join(idat))), width * channels, height, channels)
+        pixels = []
+
+        for row in rows:
+            if palette is not None:
+                pixels.extend(palette[index] for index in row)
+            else:
+                pixels.extend(tuple(row[x:x + 3]) for x in range(0, len(row), channels))
+
+        return cls(width, height, pixels)
+
+    def diff(self, other, tolerance=0):
+        """
+        Returns the fraction of the pixels that differ from those of another image of the same size by
+        more than tolerance, in any channel (0-255)
+        """
+        if (self.width, self.height) != (other.width, other.height):
+            raise ValueError("The images differ in size")
+
+        differing = sum(1 for a, b in zip(self.pixels, other.pixels)
+                        if max(abs(a[0] - b[0]), abs(a[1] - b[1]), abs(a[2] - b[2])) > tolerance)
+
+        return differing / len(self.pixels)
+
+
+def _unfilter(raw, stride, height, bpp):
+    rows = []
+    previous = bytearray(stride)
+    offset = 0
+
+    for _ in range(height):
+        filterType = raw[offset]
+        row = raw[offset + 1:offset + 1 + stride]
+        offset += 1 + stride
+
+        for x in range(stride):
+            a = row[x - bpp] if x >= bpp else 0
+            b = previous[x]
+
+            if filterType == 1:
+                row[x] = (row[x] + a) & 0xFF
+            elif filterType == 2:
+                row[x] = (row[x] + b) & 0xFF
+            elif filterType == 3:
+                row[x] = (row[x] + (a + b) // 2) & 0xFF
+            elif filterType == 4:
+                c = previous[x - bpp] if x >= bpp else 0
+                pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2 * c)
+                row[x] = (row[x] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 0xFF
+
+        rows.append(row)
+        previous = row
+
+    return rows
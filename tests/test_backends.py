@@ -0,0 +1,73 @@
+"""
+The software backend renders the previews on machines without a GPU. They must look like the GL ones, checked
+pixel by pixel for each slicer style and both preview styles. Skipped when GL can't be initialized.
+"""
+
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import native
+from pngimage import PngImage
+
+# A pixel differs when a channel is more than TOLERANCE (of 255) off, at most MAX_DIFFERING of the pixels may differ.
+# The backends round the edges of the paths differently and GL's 16 bit depth buffer lets the overlapping
+# perimeters fight, so up to 0.5% of the line pixels and 2.7% of the tube pixels differ. From the top, the
+# perimeters lie about a pixel apart and the rounding moves a line to the neighbouring pixel, about 4.3% differ.
+TOLERANCE = 16
+MAX_DIFFERING = {"lines": 0.01, "tubes": 0.04}
+MAX_DIFFERING_TOP = {"lines": 0.06, "tubes": 0.04}
+
+# The small, default and large preview, and the top view
+VIEWS = [("100", dict(width=100, height=100), MAX_DIFFERING),
+         ("250", dict(width=250, height=250), MAX_DIFFERING),
+         ("600", dict(width=600, height=600), MAX_DIFFERING),
+         ("top", dict(camera=dict(distance=[0, -0.001, 300])), MAX_DIFFERING_TOP)]
+
+
+@native.requires_gcodeparser
+class BackendTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        cls.files = [native.generate(os.path.join(cls.workdir, "{0}_{1}.gcode".format(style, extrusion)), 1048576, style, extrusion)
+                     for style in native.gcodegen.STYLES for extrusion in native.gcodegen.EXTRUSIONS]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir)
+
+    def render(self, path, backend, mode):
+        views = [dict(view, image_file="{0}_{1}_{2}_{3}.png".format(path, mode, backend, name)) for name, view, _ in VIEWS]
+        try:
+            stats = native.render(path, views, backend=backend, decimation=0.5, draw_mode=dict(mode=mode, tube_width=0.45))
+        except native.InitializeError as e:
+            self.skipTest(str(e))
+        return stats, [PngImage.load(view["image_file"]) for view in views]
+
+    def check(self, mode):
+        for path in self.files:
+            glStats, gl = self.render(path, "gl", mode)
+            softwareStats, software = self.render(path, "software", mode)
+
+            self.assertEqual(glStats["segments"], softwareStats["segments"])
+
+            for (name, _, maxDiffering), a, b in zip(VIEWS, gl, software):
+                self.assertLessEqual(a.diff(b, TOLERANCE), maxDiffering[mode],
+                                     "{0} ({1}, {2} view) differs between the backends".format(os.path.basename(path), mode, name))
+
+    def test_lines(self):
+        self.check("lines")
+
+    def test_tubes(self):
+        self.check("tubes")
+
+
+if __name__ == "__main__":
+    unittest.main()
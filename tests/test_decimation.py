@@ -0,0 +1,67 @@
+"""
+Decimation merges the paths below the preview resolution. The previews with and without it must look the
+same, checked pixel by pixel for each slicer style and both preview styles.
+"""
+
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import native
+from pngimage import PngImage
+
+DEFAULT_DECIMATION = 0.5    # The previewDecimation setting's default
+
+# A pixel differs when a channel is more than TOLERANCE (of 255) off, at most MAX_DIFFERING of the pixels may differ.
+# Merged tubes are lit along the merged path, which shifts the shading of curves a little, most on the small preview
+# (about 1% of its pixels, the larger previews about 0.3%).
+TOLERANCE = 32
+MAX_DIFFERING = {"lines": 0.002, "tubes": 0.02}
+
+SIZES = (100, 250, 600)     # The small, default and large preview
+
+
+@native.requires_gcodeparser
+class DecimationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        cls.files = [native.generate(os.path.join(cls.workdir, "{0}_{1}.gcode".format(style, extrusion)), 1048576, style, extrusion)
+                     for style in native.gcodegen.STYLES for extrusion in native.gcodegen.EXTRUSIONS]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir)
+
+    def render(self, path, decimation, mode):
+        views = [dict(image_file="{0}_{1}_{2}_{3}.png".format(path, mode, decimation, size), width=size, height=size) for size in SIZES]
+        stats = native.render(path, views, decimation=decimation, draw_mode=dict(mode=mode, tube_width=0.45))
+        return stats, [PngImage.load(view["image_file"]) for view in views]
+
+    def check(self, mode):
+        for path in self.files:
+            fullStats, full = self.render(path, 0.0, mode)
+            decimatedStats, decimated = self.render(path, DEFAULT_DECIMATION, mode)
+
+            # Otherwise there's nothing to compare
+            self.assertLess(decimatedStats["segments"], fullStats["segments"])
+
+            for size, a, b in zip(SIZES, full, decimated):
+                self.assertLessEqual(a.diff(b, TOLERANCE), MAX_DIFFERING[mode],
+                                     "{0} ({1}, {2}x{2}) differs with decimation".format(os.path.basename(path), mode, size))
+
+    def test_lines(self):
+        self.check("lines")
+
+    def test_tubes(self):
+        self.check("tubes")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import plugin
+import folderscan
+from folderscan import FolderScanner
+from previewstore import PreviewStore
+
+OLD = int(time.time()) - 3600 # Folder mtimes the scan trusts start here
+
+
+@plugin.requires_python2
+class FolderScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.root = os.path.join(self.folder, "uploads")
+        self.store = PreviewStore(os.path.join(self.folder, "previews.db"), plugin.logger)
+
+        self.checked = []   # Files checked for their type
+        self.found = []     # Files reported to on_file
+        self.listed = []    # Folders listed
+        self.mtime = OLD
+
+        self.list_folder = folderscan.list_folder
+        folderscan.list_folder = self.count_listing
+
+        for path in ("a.gcode", "notes.txt", "sub/b.gcode", "sub/deeper/c.gcode"):
+            self.write(path)
+
+        for folder in ("", "sub", "sub/deeper"):
+            self.change(folder)
+
+    def tearDown(self):
+        folderscan.list_folder = self.list_folder
+        self.store.close()
+        shutil.rmtree(self.folder)
+
+    def count_listing(self, path):
+        self.listed.append(os.path.relpath(path, self.root))
+        return self.list_folder(path)
+
+    def write(self, path):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write("G1 X1\n")
+
+    def change(self, folder):
+        # Moves the mtime of a folder on, like a change an hour ago would
+        self.mtime += 1
+        os.utime(os.path.join(self.root, folder), (self.mtime, self.mtime))
+
+    def is_gcode(self, path):
+        self.checked.append(path)
+        return path.endswith(".gcode")
+
+    def on_file(self, path, relative, mtime):
+        self.found.append(relative)
+
+    def scan(self, start=""):
+        del self.checked[:], self.found[:], self.listed[:]
+        scanner = FolderScanner(self.root, self.store, self.is_gcode, self.on_file, plugin.logger)
+        return scanner.scan(start)
+
+    def test_scan(self):
+        found = self.scan()
+
+        self.assertEqual(sorted(self.found), ["a.gcode", "sub/b.gcode", "sub/deeper/c.gcode"])
+        self.assertEqual(found, set(os.path.join(self.root, path) for path in self.found))
+        self.assertEqual(sorted(self.checked), ["a.gcode", "notes.txt", "sub/b.gcode", "sub/deeper/c.gcode"])
+        self.assertEqual(sorted(self.store.get_folders()), ["", "sub", "sub/deeper"])
+
+    def test_manifest_skip(self):
+        self.scan()
+
+        # Unchanged folders aren't listed, nor their files checked
+        self.scan()
+        self.assertEqual(self.listed, [])
+        self.assertEqual(self.checked, [])
+        self.assertEqual(sorted(self.found), ["a.gcode", "sub/b.gcode", "sub/deeper/c.gcode"])
+
+        # Only the folder with a new file is listed, and only the new file checked
+        self.write("sub/d.gcode")
+        self.change("sub")
+        self.scan()
+        self.assertEqual(self.listed, ["sub"])
+        self.assertEqual(self.checked, ["sub/d.gcode"])
+        self.assertIn("sub/d.gcode", self.found)
+
+    def test_recent_folder(self):
+        # A folder changed within the mtime resolution may still change, it's listed again next time
+        self.scan()
+        os.utime(os.path.join(self.root, "sub"), None)
+        self.scan()
+        self.scan()
+        self.assertEqual(self.listed, ["sub"])
+
+    def test_removed_folder(self):
+        self.scan()
+        shutil.rmtree(os.path.join(self.root, "sub", "deeper"))
+        self.change("sub")
+
+        self.scan()
+        self.assertEqual(sorted(self.found), ["a.gcode", "sub/b.gcode"])
+        self.assertEqual(sorted(self.store.get_folders()), ["", "sub"])
+
+    def test_start(self):
+        # A scan of a subfolder leaves the manifests of the others
+        self.scan()
+        self.scan("sub")
+        self.assertEqual(sorted(self.found), ["sub/b.gcode", "sub/deeper/c.gcode"])
+        self.assertEqual(sorted(self.store.get_folders()), ["", "sub", "sub/deeper"])
+
+    def test_list_folder(self):
+        # Without scandir, the listing is the same
+        files, folders = self.list_folder(self.root)
+        self.assertEqual(sorted(files), ["a.gcode", "notes.txt"])
+        self.assertEqual(folders, ["sub"])
+
+        scandir = folderscan.scandir
+        folderscan.scandir = None
+        try:
+            self.assertEqual(self.list_folder(self.root), (files, folders))
+        finally:
+            folderscan.scandir = scandir
+
+
+if __name__ == "__main__":
+    unittest.main()
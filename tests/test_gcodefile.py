@@ -0,0 +1,83 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import plugin # Puts the plugin modules on the path
+import gcodefile
+from gcodefile import gcode_size, GZIP_FEED_SIZE
+
+GCODE = b"G1 X10.000 Y20.000 E0.12345\n" * 10000
+
+
+def compress(data):
+    out = io.BytesIO()
+    f = gzip.GzipFile(fileobj=out, mode="wb")
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+
+class GcodeSizeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, data):
+        path = os.path.join(self.folder, "part.gcode")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_text(self):
+        self.assertEqual(gcode_size(self.write(GCODE)), len(GCODE))
+
+    def test_gzip(self):
+        self.assertEqual(gcode_size(self.write(compress(GCODE))), len(GCODE))
+
+    def test_members(self):
+        # Like cat a.gz b.gz, the renderer reads all members. Anything else after a member is ignored.
+        path = self.write(compress(GCODE) + compress(GCODE[:1000]) + b"\x00" * 100)
+        self.assertEqual(gcode_size(path), len(GCODE) + 1000)
+
+    def test_small_feeds(self):
+        # The members end anywhere in the data read
+        path = self.write(compress(GCODE[:5000]) + compress(GCODE[:3000]) + compress(b""))
+
+        for feedSize in (1, 2, 3, 7, 64):
+            gcodefile.GZIP_FEED_SIZE = feedSize
+            try:
+                self.assertEqual(gcode_size(path), 8000)
+            finally:
+                gcodefile.GZIP_FEED_SIZE = GZIP_FEED_SIZE
+
+    def test_limit(self):
+        # The size stored at the end of a gzip file wraps at 4 GB, the file is decompressed instead. Up to the limit.
+        data = GCODE * 100
+        path = self.write(compress(data))
+
+        self.assertEqual(gcode_size(path, len(data)), len(data))
+        self.assertGreater(gcode_size(path, 1000), 1000)
+        self.assertLessEqual(gcode_size(path, 1000), 1000 + GZIP_FEED_SIZE)
+
+    def test_truncated(self):
+        data = compress(GCODE)
+        self.assertLess(gcode_size(self.write(data[:len(data) // 2])), len(GCODE))
+
+    def test_corrupt(self):
+        data = bytearray(compress(GCODE))
+        data[20:40] = b"\xff" * 20
+        self.assertRaises(ValueError, gcode_size, self.write(bytes(data)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Parsing with several threads splits the file in ranges of PARALLEL_RANGE_SIZE bytes, decoded in parallel and
+interpreted in order. The paths must be the same as those of a single thread, checked with the toolpath cache
+file (the parsed paths) and the previews of the generated Cura, Simplify3D and PrusaSlicer style files. The
+ranges split the layers, and a G92 reset is put at the start of the second range.
+"""
+
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import native
+from pngimage import PngImage
+
+PARALLEL_RANGE_SIZE = 1048576   # See gcodeparser.h
+THREADS = 4
+SIZE = 5 * 1048576              # Two rounds of ranges with four threads
+
+
+def ranges(data):
+    """
+    Returns the offsets the ranges of a plain gcode file start at, like GcodeParser::decode_ranges splits it. The
+    ranges are the same for any number of threads, a thread decodes one range of each round.
+    """
+    starts = []
+    begin = 0
+
+    while begin < len(data):
+        starts.append(begin)
+        newline = data.find(b"\n", min(begin + PARALLEL_RANGE_SIZE, len(data)))
+        begin = newline + 1 if newline >= 0 else len(data)
+
+    return starts
+
+
+def reset_at_range(data):
+    """
+    Puts a G92 E0 as the first line of the second range, after a padding line that ends at the split
+    """
+    lineStart = data.rindex(b"\n", 0, PARALLEL_RANGE_SIZE - 5) + 1
+    padding = b"M117 " + b"x" * (PARALLEL_RANGE_SIZE - lineStart - 5) + b"\n"
+    return data[:lineStart] + padding + b"G92 E0\n" + data[lineStart:]
+
+
+@native.requires_gcodeparser
+class ParallelParseTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        cls.files = []
+
+        for style in native.gcodegen.STYLES:
+            for extrusion in native.gcodegen.EXTRUSIONS:
+                path = native.generate(os.path.join(cls.workdir, "{0}_{1}.gcode".format(style, extrusion)), SIZE, style, extrusion)
+
+                with open(path, "rb") as f:
+                    data = reset_at_range(f.read())
+                with open(path, "wb") as f:
+                    f.write(data)
+
+                cls.files.append(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir)
+
+    def render(self, path, threads):
+        prefix = "{0}_{1}".format(path, threads)
+        views = [dict(image_file=prefix + "_250.png", width=250, height=250),
+                 dict(image_file=prefix + "_top.png", width=250, height=250, camera=dict(distance=[0, -0.001, 300]))]
+
+        # An existing toolpath file is loaded instead of parsing the gcode
+        if os.path.exists(prefix + ".toolpath"):
+            os.remove(prefix + ".toolpath")
+
+        stats = native.render(path, views, prefix + ".toolpath", parser_threads=threads, decimation=0.5)
+        self.assertFalse(stats["toolpath_cache"])
+
+        with open(prefix + ".toolpath", "rb") as f:
+            toolpath = f.read()
+
+        return stats, toolpath, [PngImage.load(view["image_file"]) for view in views]
+
+    def check(self, path, single, parallel):
+        name = os.path.basename(path)
+        singleStats, singleToolpath, singleImages = single
+        parallelStats, parallelToolpath, parallelImages = parallel
+
+        self.assertGreater(singleStats["segments"], 0, name)
+        for key in ("lines", "segments", "vertices"):
+            self.assertEqual(singleStats[key], parallelStats[key], "{0}: {1} differ".format(name, key))
+
+        self.assertTrue(singleToolpath == parallelToolpath, "{0}: toolpaths differ".format(name))
+        for a, b in zip(singleImages, parallelImages):
+            self.assertEqual(a.diff(b), 0, "{0}: previews differ".format(name))
+
+    def test_ranges(self):
+        # The file is split in the middle of layers, the second range starts with the reset
+        with open(self.files[0], "rb") as f:
+            data = f.read()
+
+        starts = ranges(data)
+        self.assertGreater(len(starts), THREADS)
+        self.assertTrue(data[starts[1]:].startswith(b"G92 E0\n"))
+
+        for start in starts[2:]:
+            self.assertFalse(data[start:].startswith(b";"))
+
+    def test_plain(self):
+        for path in self.files:
+            self.check(path, self.render(path, 1), self.render(path, THREADS))
+
+    def test_gzip(self):
+        # Compressed files are split in ranges per decompressed chunk (of 4 MB), the second chunk starts mid-layer
+        for path in self.files:
+            compressed = path + ".gz"
+            with open(path, "rb") as f:
+                out = gzip.open(compressed, "wb")
+                out.write(f.read())
+                out.close()
+
+            self.check(compressed, self.render(compressed, 1), self.render(compressed, THREADS))
+
+
+if __name__ == "__main__":
+    unittest.main()
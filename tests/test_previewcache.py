@@ -0,0 +1,106 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import plugin
+from previewcache import PreviewCache, settings_fingerprint
+
+
+@plugin.requires_python2
+class PreviewCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.evicted = []
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, filename, size=100, mtime=None):
+        path = os.path.join(self.folder, filename)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return filename
+
+    def cache(self, max_size, **kwargs):
+        cache = PreviewCache(self.folder, "png", max_size, plugin.logger, **kwargs)
+        cache.on_evict = self.evicted.extend
+        return cache
+
+    def test_lru_eviction(self):
+        cache = self.cache(300)
+        for name in ("a.png", "b.png", "c.png"):
+            cache.add(self.write(name))
+
+        # Used recently, unlike b
+        self.assertTrue(cache.contains("a.png"))
+        self.assertTrue(cache.has("b.png"))
+
+        cache.add(self.write("d.png"))
+
+        self.assertEqual(self.evicted, ["b.png"])
+        self.assertFalse(os.path.exists(os.path.join(self.folder, "b.png")))
+        self.assertFalse(cache.has("b.png"))
+        self.assertEqual(cache.usage(), (3, 300))
+
+    def test_keeps_newest(self):
+        # A preview larger than the budget is kept, until the next one
+        cache = self.cache(100)
+        cache.add(self.write("a.png", 500))
+        self.assertEqual(self.evicted, [])
+
+        cache.add(self.write("b.png", 500))
+        self.assertEqual(self.evicted, ["a.png"])
+        self.assertEqual(cache.usage(), (1, 500))
+
+    def test_replace(self):
+        # A rerendered preview counts with its new size
+        cache = self.cache(1000)
+        cache.add(self.write("a.png", 100))
+        cache.add(self.write("a.png", 300))
+        self.assertEqual(cache.usage(), (1, 300))
+
+    def test_scan(self):
+        # The least recently modified previews go first, also those of an earlier image format
+        self.write("old.jpg", mtime=1000)
+        self.write("older.png", mtime=500)
+        self.write("new.png", mtime=2000)
+        self.write("other.txt", mtime=0)
+
+        cache = PreviewCache(self.folder, "png", 200, plugin.logger, scan_extensions=["png", "jpg"])
+
+        self.assertEqual(cache.usage(), (2, 200))
+        self.assertFalse(cache.has("older.png"))
+        self.assertTrue(cache.has("old.jpg"))
+        self.assertTrue(os.path.exists(os.path.join(self.folder, "other.txt")))
+
+    def test_unlimited(self):
+        cache = self.cache(0)
+        for name in ("a.png", "b.png"):
+            cache.add(self.write(name))
+
+        self.assertEqual(cache.usage(), (2, 200))
+        self.assertEqual(self.evicted, [])
+
+    def test_filename(self):
+        cache = self.cache(0)
+        self.assertEqual(cache.filename("abc", "1234"), "abc_1234.png")
+        self.assertEqual(cache.filename("abc", "1234", "top"), "abc_1234_top.png")
+
+    def test_fingerprint(self):
+        settings = dict(width=250, height=250, throttling_interval=100)
+
+        # Settings that don't change the preview don't change its name
+        self.assertEqual(settings_fingerprint(settings), settings_fingerprint(dict(settings, throttling_interval=0)))
+        self.assertNotEqual(settings_fingerprint(settings), settings_fingerprint(dict(settings, width=100)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import plugin
+import previewstore
+from previewstore import PreviewStore
+
+
+def entry(filename, preview=None):
+    return dict(path="/uploads/" + filename, filename=filename, modtime=1, hash="h", previewUrl="url",
+                previewFilename=preview or filename + ".png", previewPath="/previews/" + (preview or filename + ".png"))
+
+
+@plugin.requires_python2
+class PreviewStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "previews.db")
+        self.store = PreviewStore(self.path, plugin.logger)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.folder)
+
+    def reopen(self):
+        self.store.close()
+        self.store = PreviewStore(self.path, plugin.logger)
+
+    def test_lookups(self):
+        self.store.upsert([entry("a.gcode", "shared.png"), entry("b.gcode", "shared.png"), dict(entry("c.gcode"), previewViews=dict(top="c_top.png"))])
+
+        self.assertEqual(self.store.get_by_path("/uploads/a.gcode")["filename"], "a.gcode")
+        self.assertEqual(self.store.get_by_filename("b.gcode")["path"], "/uploads/b.gcode")
+        self.assertIn(self.store.get_by_preview_filename("shared.png")["filename"], ("a.gcode", "b.gcode"))
+        self.assertIsNone(self.store.get_by_filename("d.gcode"))
+
+        # The records survive a restart
+        self.reopen()
+        self.assertEqual(len(self.store.all()), 3)
+        self.assertEqual(self.store.get_by_filename("c.gcode")["previewViews"], dict(top="c_top.png"))
+        self.assertEqual(self.store.get_by_filename("a.gcode")["previewViews"], dict())
+
+    def test_copies(self):
+        self.store.upsert([entry("a.gcode")])
+        self.store.get_by_filename("a.gcode")["filename"] = "changed"
+        self.assertEqual(self.store.get_by_filename("a.gcode")["filename"], "a.gcode")
+
+    def test_changes(self):
+        self.store.upsert([entry("a.gcode"), entry("b.gcode")])
+
+        entries, removed, sequence, more = self.store.changes()
+        self.assertEqual(sorted(e["filename"] for e in entries), ["a.gcode", "b.gcode"])
+        self.assertEqual((removed, more), ([], False))
+
+        # Nothing changed since
+        self.assertEqual(self.store.changes(sequence), ([], [], sequence, False))
+
+        self.store.upsert([entry("c.gcode"), entry("a.gcode")])
+        self.store.remove(["/uploads/b.gcode", "/uploads/unknown.gcode"])
+
+        entries, removed, next_sequence, more = self.store.changes(sequence)
+        self.assertEqual([e["filename"] for e in entries], ["c.gcode", "a.gcode"])
+        self.assertEqual(removed, ["b.gcode"])
+        self.assertGreater(next_sequence, sequence)
+
+        # A full listing has no removals
+        entries, removed, _, _ = self.store.changes()
+        self.assertEqual(sorted(e["filename"] for e in entries), ["a.gcode", "c.gcode"])
+        self.assertEqual(removed, [])
+
+    def test_changes_limit(self):
+        self.store.upsert([entry(name) for name in ("a.gcode", "b.gcode", "c.gcode")])
+
+        entries, _, sequence, more = self.store.changes(limit=2)
+        self.assertEqual(([e["filename"] for e in entries], more), (["a.gcode", "b.gcode"], True))
+
+        entries, _, _, more = self.store.changes(sequence, limit=2)
+        self.assertEqual(([e["filename"] for e in entries], more), (["c.gcode"], False))
+
+    def test_changes_folder(self):
+        self.store.upsert([entry("a.gcode"), entry("sub/b.gcode"), entry("subfolder/c.gcode")])
+        _, _, sequence, _ = self.store.changes()
+        self.store.remove(["/uploads/sub/b.gcode", "/uploads/a.gcode"])
+
+        entries, _, _, _ = self.store.changes(folder="/sub/")
+        self.assertEqual(entries, [])
+        _, removed, _, _ = self.store.changes(sequence, folder="sub")
+        self.assertEqual(removed, ["sub/b.gcode"])
+
+    def test_touch(self):
+        self.store.upsert([entry("a.gcode", "shared.png"), entry("b.gcode", "shared.png"), entry("c.gcode")])
+        _, _, sequence, _ = self.store.changes()
+
+        # An evicted preview changes the records that show it
+        self.store.touch(["shared.png", "unknown.png"])
+        entries, _, _, _ = self.store.changes(sequence)
+        self.assertEqual(sorted(e["filename"] for e in entries), ["a.gcode", "b.gcode"])
+
+    def test_forgotten_removals(self):
+        max_removed = previewstore.MAX_REMOVED
+        previewstore.MAX_REMOVED = 2
+
+        try:
+            self.store.upsert([entry(name) for name in ("a.gcode", "b.gcode", "c.gcode", "d.gcode")])
+            _, _, sequence, _ = self.store.changes()
+            self.store.remove(["/uploads/a.gcode"])
+            _, _, later, _ = self.store.changes(sequence)
+            self.store.remove(["/uploads/b.gcode", "/uploads/c.gcode"])
+        finally:
+            previewstore.MAX_REMOVED = max_removed
+
+        # The removal of a is forgotten, a client that didn't see it needs a full listing
+        self.assertIsNone(self.store.changes(sequence))
+        self.assertEqual(self.store.changes(later)[1], ["b.gcode", "c.gcode"])
+
+    def test_migrate(self):
+        json_path = os.path.join(self.folder, "previews.json")
+        with open(json_path, "w") as f:
+            json.dump({"_default": {"1": entry("a.gcode"), "2": entry("b.gcode"), "3": {"filename": "no path"}}}, f)
+
+        self.store.migrate(json_path)
+
+        self.assertEqual(sorted(e["filename"] for e in self.store.all()), ["a.gcode", "b.gcode"])
+        self.assertFalse(os.path.exists(json_path))
+        self.assertTrue(os.path.exists(json_path + ".migrated"))
+
+        # Only once
+        self.store.migrate(json_path)
+        self.assertEqual(len(self.store.all()), 2)
+
+    def test_migrate_schema(self):
+        # Databases of earlier versions have no previewViews column
+        self.store.close()
+        os.remove(self.path)
+        connection = sqlite3.connect(self.path)
+        connection.execute("CREATE TABLE previews (path TEXT PRIMARY KEY, filename TEXT, modtime INTEGER, hash TEXT, "
+                           "previewUrl TEXT, previewFilename TEXT, previewPath TEXT)")
+        connection.execute("INSERT INTO previews VALUES ('/uploads/a.gcode', 'a.gcode', 1, 'h', 'url', 'a.png', '/previews/a.png')")
+        connection.commit()
+        connection.close()
+
+        self.store = PreviewStore(self.path, plugin.logger)
+        self.assertEqual(self.store.get_by_filename("a.gcode")["previewViews"], dict())
+
+    def test_folders(self):
+        self.store.set_folders({"": dict(mtime=1, files={"a.gcode": (10, 2)}, folders=["sub"]),
+                                "sub": dict(mtime=3, files={}, folders=[])})
+        self.reopen()
+
+        folders = self.store.get_folders()
+        self.assertEqual(folders[""], dict(mtime=1, files={"a.gcode": (10, 2)}, folders=["sub"]))
+
+        self.store.remove_folders(["sub"])
+        self.assertEqual(list(self.store.get_folders()), [""])
+
+
+if __name__ == "__main__":
+    unittest.main()
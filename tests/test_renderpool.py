@@ -0,0 +1,108 @@
+"""
+The render pool hands jobs to worker processes, each with a drawing context of its own. These tests run real
+workers with the software backend, so they need the gcodeparser extension.
+"""
+
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+import native
+
+TIMEOUT = 60
+
+
+def wait_for(condition, timeout=TIMEOUT):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.05)
+
+
+@native.requires_gcodeparser
+class RenderPoolTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        cls.gcode = native.generate(os.path.join(cls.workdir, "part.gcode"), 1048576, "cura", "absolute")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir)
+
+    def setUp(self):
+        # Imported here, the pool needs the extension
+        import Queue
+        from renderpool import RenderPool
+
+        self.jobs = Queue.Queue()
+        self.events = Queue.Queue()
+        self.pool = RenderPool(self.jobs, native.SETTINGS, logging.getLogger("gcoderender.tests"),
+                               on_started=self.on_started, on_finished=self.on_finished)
+        self.pool.start()
+
+        # Until the worker is ready
+        wait_for(lambda: self.pool.workers[0].idle)
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def on_started(self, job):
+        self.events.put(("started", job["filename"]))
+
+        if job.get("cancelWhenStarted"):
+            self.pool.cancel(lambda other: other is job, "removed")
+
+    def on_finished(self, job, success, duration):
+        self.events.put(("finished", job["filename"], success, job.get("cancelled")))
+
+    def job(self, filename, **kwargs):
+        return dict(kwargs, filename=filename, path=self.gcode, imagePath=os.path.join(self.workdir, filename + ".png"))
+
+    def next_events(self, n):
+        return [self.events.get(timeout=TIMEOUT) for _ in range(n)]
+
+    def test_render(self):
+        self.jobs.put(self.job("a"))
+
+        self.assertEqual(self.next_events(2), [("started", "a"), ("finished", "a", True, None)])
+        self.assertTrue(os.path.exists(os.path.join(self.workdir, "a.png")))
+
+    def test_cancel_when_dispatched(self):
+        # Cancelled before the worker took the job, no images are published
+        for _ in range(5):
+            self.jobs.put(self.job("cancelled", cancelWhenStarted=True))
+
+            self.assertEqual(self.next_events(2), [("started", "cancelled"), ("finished", "cancelled", False, "removed")])
+            self.assertFalse(os.path.exists(os.path.join(self.workdir, "cancelled.png")))
+
+        # A cancel doesn't carry over to the next job
+        self.jobs.put(self.job("a"))
+        self.assertEqual(self.next_events(2), [("started", "a"), ("finished", "a", True, None)])
+
+    def test_crash_while_idle(self):
+        # The restarted worker is queued once, it renders one job at a time
+        worker = self.pool.workers[0]
+        os.kill(worker._process.pid, signal.SIGKILL)
+        wait_for(lambda: worker.restarts == 1 and worker.is_alive())
+        time.sleep(1)
+
+        self.jobs.put(self.job("a"))
+        self.jobs.put(self.job("b"))
+
+        self.assertEqual(self.next_events(4), [("started", "a"), ("finished", "a", True, None),
+                                               ("started", "b"), ("finished", "b", True, None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+from __future__ import absolute_import, division
+
+__author__ = "Erik Heidstra <ErikHeidstra@live.nl>"
+
+import threading
+import unittest
+
+import plugin
+from renderqueue import RenderQueue, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+
+
+def job(path, modtime=1):
+    return dict(path=path, modtime=modtime)
+
+
+def drain(queue):
+    paths = []
+    while queue.depth():
+        paths.append(queue.get()["path"])
+    return paths
+
+
+@plugin.requires_python2
+class RenderQueueTest(unittest.TestCase):
+
+    def test_priority(self):
+        queue = RenderQueue()
+        queue.put(job("low"), PRIORITY_LOW)
+        queue.put(job("normal1"))
+        queue.put(job("high"), PRIORITY_HIGH)
+        queue.put(job("normal2"))
+
+        # Same priority: first in, first out
+        self.assertEqual(drain(queue), ["high", "normal1", "normal2", "low"])
+
+    def test_dedup(self):
+        queue = RenderQueue()
+        self.assertTrue(queue.put(job("a", modtime=2), PRIORITY_LOW))
+
+        # Nothing new, or an older version of the file
+        self.assertFalse(queue.put(job("a", modtime=2), PRIORITY_LOW))
+        self.assertFalse(queue.put(job("a", modtime=1), PRIORITY_HIGH))
+        self.assertEqual(queue.depth(), 1)
+
+        # A newer version keeps the highest priority
+        queue.put(job("b"), PRIORITY_NORMAL)
+        self.assertTrue(queue.put(job("a", modtime=3), PRIORITY_LOW))
+        self.assertEqual(queue.depth(), 2)
+        self.assertEqual(queue.position("a"), 1)
+
+        # A higher priority moves it forward
+        self.assertTrue(queue.put(job("a", modtime=3), PRIORITY_HIGH))
+        self.assertEqual(queue.position("a"), 0)
+
+        first = queue.get()
+        self.assertEqual((first["path"], first["modtime"]), ("a", 3))
+        self.assertEqual(drain(queue), ["b"])
+
+    def test_queue_key(self):
+        # A job with a queueKey is queued alongside the preview of its gcode file
+        queue = RenderQueue()
+        queue.put(job("a"))
+        queue.put(dict(job("a"), queueKey="a:layers"))
+        self.assertEqual(queue.depth(), 2)
+
+    def test_prioritize(self):
+        queue = RenderQueue()
+        for path in ("a", "b", "c"):
+            queue.put(job(path))
+
+        self.assertTrue(queue.prioritize("c"))
+        self.assertFalse(queue.prioritize("d"))
+        self.assertEqual([queue.position(path) for path in ("a", "b", "c", "d")], [1, 2, 0, None])
+        self.assertEqual(drain(queue), ["c", "a", "b"])
+
+    def test_cancel(self):
+        queue = RenderQueue()
+        for path in ("a", "b", "c"):
+            queue.put(job(path))
+
+        self.assertTrue(queue.cancel("b"))
+        self.assertFalse(queue.cancel("b"))
+        self.assertEqual(queue.depth(), 2)
+        self.assertIsNone(queue.position("b"))
+        self.assertEqual(queue.position("c"), 1)
+        self.assertEqual(drain(queue), ["a", "c"])
+
+        # Cancelled and queued again
+        queue.put(job("a"))
+        queue.cancel("a")
+        queue.put(job("a"))
+        self.assertEqual(drain(queue), ["a"])
+
+    def test_stale(self):
+        queue = RenderQueue(is_stale=lambda job: job["path"] == "gone")
+        queue.put(job("gone"), PRIORITY_HIGH)
+        queue.put(job("a"))
+
+        self.assertEqual(queue.get()["path"], "a")
+
+    def test_stop(self):
+        queue = RenderQueue()
+        results = []
+
+        consumer = threading.Thread(target=lambda: results.append(queue.get()))
+        consumer.start()
+
+        queue.put(None)
+        consumer.join(5)
+
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(results, [None])
+
+
+if __name__ == "__main__":
+    unittest.main()